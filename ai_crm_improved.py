@@ -1,44 +1,54 @@
 # ai_crm_improved.py - AI CRM 改进版主应用程序
 # 基于改进方案的完整实现，集成多AI模型、拖拽功能、智能分析等
 
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, WebSocket, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, WebSocket, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse, StreamingResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any, Union
 import httpx
 import json
 import os
 from datetime import datetime, timedelta
+from collections import Counter
 import pytz
 import asyncio
 from contextlib import asynccontextmanager
 import redis
-from celery import Celery
 import logging
-from sqlalchemy import create_engine, Column, Integer, String, JSON, Float, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, JSON, Float, DateTime, Text, Boolean, or_, func, select, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 import base64
 import io
-from PIL import Image
-import pytesseract
+import zipfile
 import uuid
 import yaml
-import redis
-from celery import Celery
 import bcrypt
 import jwt
 from passlib.context import CryptContext
+from job_queue import job_queue
+from single_flight import ai_async_single_flight, request_fingerprint
+from rate_limiter import rate_limiter, estimate_tokens, RateLimitTimeout, COMPLETION_RESERVE_TOKENS
+from ai_telemetry import ai_telemetry, AICallRecord
+from structured_output import structured_output, StructuredOutputError
+from ocr_service import ocr_service
+from db_engine import DatabaseEngines
+from loop_monitor import loop_lag_monitor
+from serialization import FastJSONResponse
+from response_compression import CompressionMiddleware
+from urllib.parse import urlparse
 
 # 数据库配置 - 使用SQLite进行开发
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./crm_db.sqlite")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 同步引擎用于建表和线程池中的批量写入；接口使用异步会话（get_async_db），查询期间不阻塞事件循环
+db_engines = DatabaseEngines(DATABASE_URL)
+engine = db_engines.engine
+SessionLocal = db_engines.SessionLocal
+AsyncSessionLocal = db_engines.AsyncSessionLocal
 Base = declarative_base()
 
 # 密码加密配置
@@ -197,6 +207,14 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def count_rows(db: AsyncSession, model, *conditions) -> int:
+    """SELECT COUNT(*)，相当于 db.query(model).filter(*conditions).count()"""
+    return await db.scalar(select(func.count()).select_from(model).where(*conditions))
+
 # 加载环境变量
 load_dotenv()
 
@@ -215,13 +233,6 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
-# Celery配置
-celery_app = Celery(
-    "ai_crm_tasks",
-    broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"),
-    backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
-)
-
 # AI模型配置 - 更新为2025年最新模型
 AI_MODELS = {
     "grok-4": {
@@ -256,6 +267,12 @@ AI_MODELS = {
     }
 }
 
+# 压测时把所有模型请求指向本地模拟服务，见 benchmarks/mock_llm_server.py
+if os.getenv("AI_MOCK_BASE_URL"):
+    for _model_config in AI_MODELS.values():
+        _model_config["base_url"] = os.getenv("AI_MOCK_BASE_URL").rstrip("/")
+        _model_config["api_key"] = _model_config["api_key"] or "mock"
+
 # 销售方法论配置
 SALES_METHODOLOGIES = {
     "straight_line": {
@@ -450,19 +467,19 @@ async def lifespan(app: FastAPI):
     """应用程序启动和关闭时的处理"""
     # 启动时
     logger.info("AI CRM 改进版启动中...")
+    loop_lag_monitor.start()
     
     # 初始化数据库表
-    Base.metadata.create_all(bind=engine)
+    async with db_engines.async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     
     # 初始化默认文件夹
-    db = next(get_db())
-    try:
-        init_default_folders_improved(db)
-        logger.info("默认文件夹初始化完成")
-    except Exception as e:
-        logger.error(f"初始化默认文件夹失败: {e}")
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        try:
+            await init_default_folders_improved(db)
+            logger.info("默认文件夹初始化完成")
+        except Exception as e:
+            logger.error(f"初始化默认文件夹失败: {e}")
     
     # 测试AI模型连接
     for model_name, config in AI_MODELS.items():
@@ -473,18 +490,25 @@ async def lifespan(app: FastAPI):
             except Exception as e:
                 logger.warning(f"AI模型 {model_name} 连接失败: {e}")
     
+    # 启动后台任务队列
+    job_queue.start()
+    
     yield
     
     # 关闭时
     logger.info("AI CRM 改进版关闭中...")
+    job_queue.stop()
     redis_client.close()
+    await loop_lag_monitor.stop()
+    await db_engines.dispose()
 
 # 创建FastAPI应用
 app = FastAPI(
     title="AI CRM 改进版系统",
     description="基于FastAPI的智能客户关系管理系统 - 改进版，集成多个AI模型、拖拽功能、智能分析",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # 中间件配置
@@ -501,6 +525,28 @@ app.add_middleware(
     allowed_hosts=["localhost", "127.0.0.1", "*.example.com"]
 )
 
+# 响应压缩（gzip/brotli/zstd），名片批量识别的NDJSON进度逐条压缩刷出
+app.add_middleware(CompressionMiddleware)
+
+# 上传接口的请求体大小上限：Content-Length 超限时不读取请求体直接拒绝
+OCR_MAX_IMAGE_BYTES = int(os.getenv("OCR_MAX_IMAGE_BYTES", 10 * 1024 * 1024))
+# 批量名片导入一次上传的图片和压缩包总大小
+OCR_BATCH_MAX_BYTES = int(os.getenv("OCR_BATCH_MAX_BYTES", 100 * 1024 * 1024))
+UPLOAD_BODY_LIMITS = {
+    "/api/ocr/upload": OCR_MAX_IMAGE_BYTES + 64 * 1024,
+    # base64编码后体积增加约三分之一
+    "/api/ocr/process": OCR_MAX_IMAGE_BYTES * 4 // 3 + 64 * 1024,
+    "/api/ocr/batch": OCR_BATCH_MAX_BYTES + 64 * 1024,
+}
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    limit = UPLOAD_BODY_LIMITS.get(request.url.path)
+    content_length = request.headers.get("content-length")
+    if limit and content_length and content_length.isdigit() and int(content_length) > limit:
+        return JSONResponse(status_code=413, content={"detail": "上传内容超过大小限制"})
+    return await call_next(request)
+
 # 安全配置
 security = HTTPBearer()
 
@@ -523,7 +569,7 @@ def verify_token(token: str):
         return None
 
 # 依赖函数
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_async_db)):
     """验证JWT token并获取当前用户"""
     token = credentials.credentials
     payload = verify_token(token)
@@ -535,15 +581,16 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user_id = payload.get("sub")
-    if user_id is None:
+    try:
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="无效的认证令牌",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if user is None or not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -559,8 +606,16 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     }
 
 # AI模型调用函数
-async def call_ai_model(model_name: str, prompt: str, context: Optional[str] = None, system_prompt: Optional[str] = None, temperature: float = 0.7, max_tokens: int = 2000) -> Dict[str, Any]:
-    """调用指定的AI模型"""
+async def call_ai_model(model_name: str, prompt: str, context: Optional[str] = None, system_prompt: Optional[str] = None, temperature: float = 0.7, max_tokens: int = 2000, purpose: str = "general", json_mode: bool = False) -> Dict[str, Any]:
+    """调用指定的AI模型，参数相同的并发请求合并为一次调用；purpose 用于遥测统计，json_mode 要求只输出JSON"""
+    key = request_fingerprint(model_name, prompt, context, system_prompt, temperature, max_tokens, json_mode)
+    return await ai_async_single_flight.do(
+        key,
+        lambda: _call_ai_model(model_name, prompt, context, system_prompt, temperature, max_tokens, purpose, json_mode),
+        label="call_ai_model"
+    )
+
+async def _call_ai_model(model_name: str, prompt: str, context: Optional[str], system_prompt: Optional[str], temperature: float, max_tokens: int, purpose: str = "general", json_mode: bool = False) -> Dict[str, Any]:
     if model_name not in AI_MODELS:
         raise HTTPException(status_code=400, detail=f"不支持的AI模型: {model_name}")
     
@@ -576,6 +631,28 @@ async def call_ai_model(model_name: str, prompt: str, context: Optional[str] = N
         messages.append({"role": "user", "content": f"上下文信息：{context}"})
     messages.append({"role": "user", "content": prompt})
     
+    with ai_telemetry.track(model_name, purpose, messages) as call:
+        result = await _request_ai_model(model_name, config, messages, prompt, temperature, max_tokens, call, json_mode)
+        if not result["success"]:
+            call.status = "error"
+        return result
+
+async def _request_ai_model(model_name: str, config: Dict[str, Any], messages: List[Dict[str, str]], prompt: str, temperature: float, max_tokens: int, call: AICallRecord, json_mode: bool = False) -> Dict[str, Any]:
+    """限流排队、请求服务商并结算配额，耗时和用量记录在 call 上"""
+    # 按服务商/模型限流，配额不足时异步排队等待
+    limit_key = f"{urlparse(config['base_url']).netloc}/{config['model']}"
+    reserved_tokens = estimate_tokens("".join(m["content"] for m in messages)) + min(max_tokens, COMPLETION_RESERVE_TOKENS)
+    try:
+        call.queue_wait = await rate_limiter.acquire_async(limit_key, reserved_tokens)
+    except RateLimitTimeout as e:
+        logger.warning(f"AI模型调用排队超时 {model_name}: {e}")
+        return {
+            "success": False,
+            "error": str(e),
+            "model": model_name,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    
     # 调用API
     async with httpx.AsyncClient(timeout=60.0) as client:
         try:
@@ -584,6 +661,7 @@ async def call_ai_model(model_name: str, prompt: str, context: Optional[str] = N
                 response = await client.post(
                     f"{config['base_url']}/models/{config['model']}:generateContent?key={config['api_key']}",
                     headers={"Content-Type": "application/json"},
+                    extensions={"trace": ai_telemetry.httpx_trace},
                     json={
                         "contents": [{"parts": [{"text": prompt}]}],
                         "generationConfig": {
@@ -596,23 +674,35 @@ async def call_ai_model(model_name: str, prompt: str, context: Optional[str] = N
                 result = response.json()
                 content = result["candidates"][0]["content"]["parts"][0]["text"]
             else:
+                payload = {
+                    "model": config["model"],
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens
+                }
+                # 推理模型不支持JSON输出模式
+                if json_mode and "reasoner" not in config["model"]:
+                    payload["response_format"] = {"type": "json_object"}
                 response = await client.post(
                     f"{config['base_url']}/chat/completions",
                     headers={
                         "Authorization": f"Bearer {config['api_key']}",
                         "Content-Type": "application/json"
                     },
-                    json={
-                        "model": config["model"],
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens
-                    }
+                    extensions={"trace": ai_telemetry.httpx_trace},
+                    json=payload
                 )
                 response.raise_for_status()
                 result = response.json()
                 content = result["choices"][0]["message"]["content"]
             
+            usage = result.get("usage") or {"total_tokens": result.get("usageMetadata", {}).get("totalTokenCount")}
+            call.set_usage(result.get("usage") or {
+                "prompt_tokens": result.get("usageMetadata", {}).get("promptTokenCount"),
+                "completion_tokens": result.get("usageMetadata", {}).get("candidatesTokenCount")
+            })
+            await asyncio.to_thread(rate_limiter.settle, limit_key, reserved_tokens, usage.get("total_tokens"))
+            
             return {
                 "success": True,
                 "content": content,
@@ -621,6 +711,10 @@ async def call_ai_model(model_name: str, prompt: str, context: Optional[str] = N
                 "timestamp": datetime.utcnow().isoformat()
             }
         except Exception as e:
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+                retry_after = e.response.headers.get("Retry-After")
+                await asyncio.to_thread(rate_limiter.penalize, limit_key,
+                                        float(retry_after) if retry_after and retry_after.isdigit() else None)
             logger.error(f"AI模型调用失败 {model_name}: {e}")
             return {
                 "success": False,
@@ -632,11 +726,11 @@ async def call_ai_model(model_name: str, prompt: str, context: Optional[str] = N
 # 测试AI模型连接
 async def test_ai_model_connection(model_name: str) -> bool:
     """测试AI模型连接"""
-    result = await call_ai_model(model_name, "Hello, this is a connection test.")
+    result = await call_ai_model(model_name, "Hello, this is a connection test.", purpose="connection_test")
     return result.get("success", False)
 
 # 初始化默认文件夹
-def init_default_folders_improved(db: Session):
+async def init_default_folders_improved(db: AsyncSession):
     """初始化改进版默认文件夹结构"""
     default_folders = [
         # 行业分类
@@ -663,25 +757,28 @@ def init_default_folders_improved(db: Session):
         {"name": "已成交", "folder_type": "custom", "color": "#4caf50", "icon": "check_circle", "order": 32},
     ]
     
+    existing = set(await db.scalars(select(Folder.name).where(Folder.name.in_([f["name"] for f in default_folders]))))
     for folder_data in default_folders:
-        existing = db.query(Folder).filter(Folder.name == folder_data["name"]).first()
-        if not existing:
+        if folder_data["name"] not in existing:
             folder = Folder(**folder_data)
             db.add(folder)
     
-    db.commit()
+    await db.commit()
 
-# Celery任务
-@celery_app.task
-def send_reminder_task(customer_id: int, message: str, reminder_time: str):
+# 后台任务（SQLite任务队列）
+@job_queue.handler("send_reminder")
+def send_reminder_task(payload: Dict[str, Any], job) -> Dict[str, Any]:
     """发送提醒任务"""
-    logger.info(f"发送提醒给客户 {customer_id}: {message} at {reminder_time}")
+    customer_id = payload["customer_id"]
+    message = payload["message"]
+    logger.info(f"发送提醒给客户 {customer_id}: {message} at {payload['reminder_time']}")
     # 这里可以集成邮件、短信、微信等通知方式
     return {"status": "sent", "customer_id": customer_id, "message": message}
 
-@celery_app.task
-def analyze_customer_background(customer_id: int):
+@job_queue.handler("analyze_customer_background")
+def analyze_customer_background(payload: Dict[str, Any], job) -> Dict[str, Any]:
     """后台分析客户信息"""
+    customer_id = payload["customer_id"]
     logger.info(f"开始分析客户 {customer_id} 的背景信息")
     # 这里可以集成天眼查API、百度搜索等
     return {"status": "completed", "customer_id": customer_id}
@@ -689,11 +786,12 @@ def analyze_customer_background(customer_id: int):
 # API路由
 # 认证相关API
 @app.post("/api/auth/login", response_model=Token)
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
+async def login(user_data: UserLogin, db: AsyncSession = Depends(get_async_db)):
     """用户登录"""
-    user = db.query(User).filter(User.email == user_data.email).first()
+    user = await db.scalar(select(User).where(User.email == user_data.email))
     
-    if not user or not user.verify_password(user_data.password):
+    # bcrypt校验耗时几百毫秒，放到线程池执行
+    if not user or not await asyncio.to_thread(user.verify_password, user_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="邮箱或密码错误",
@@ -721,10 +819,10 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     }
 
 @app.post("/api/auth/register", response_model=Token)
-async def register(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register(user_data: UserRegister, db: AsyncSession = Depends(get_async_db)):
     """用户注册"""
     # 检查邮箱是否已存在
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == user_data.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -735,14 +833,14 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     new_user = User(
         email=user_data.email,
         name=user_data.name,
-        password_hash=User.hash_password(user_data.password),
+        password_hash=await asyncio.to_thread(User.hash_password, user_data.password),
         role="user",
         is_active=True
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     access_token = create_access_token(data={"sub": str(new_user.id)})
     
@@ -766,20 +864,48 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
 async def root():
     return {"message": "AI CRM 改进版系统 v2.0", "status": "running"}
 
+@app.get("/api/ai/single-flight")
+async def get_ai_single_flight_stats():
+    """AI请求合并统计"""
+    return ai_async_single_flight.stats()
+
+@app.get("/api/ai/rate-limits")
+async def get_ai_rate_limits():
+    """AI调用限流指标"""
+    return await asyncio.to_thread(rate_limiter.get_metrics)
+
+@app.get("/api/ai/telemetry")
+async def get_ai_telemetry():
+    """AI调用遥测汇总"""
+    return ai_telemetry.summary()
+
+@app.get("/api/metrics/event-loop")
+async def get_event_loop_stats(reset: bool = False):
+    """事件循环延迟和数据库连接池状态；reset=true 时返回后清空延迟样本（分阶段压测用）"""
+    stats = {"event_loop": loop_lag_monitor.stats(), "database": db_engines.pool_status()}
+    if reset:
+        loop_lag_monitor.reset()
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus 抓取接口"""
+    return PlainTextResponse(ai_telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
     """健康检查"""
     # 检查数据库连接
     try:
-        db = next(get_db())
-        db.execute("SELECT 1")
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
         db_status = "healthy"
     except Exception as e:
         db_status = f"error: {e}"
     
-    # 检查Redis连接
+    # 检查Redis连接（同步客户端，放到线程池执行）
     try:
-        redis_client.ping()
+        await asyncio.to_thread(redis_client.ping)
         redis_status = "healthy"
     except Exception as e:
         redis_status = f"error: {e}"
@@ -807,17 +933,17 @@ async def health_check():
 @app.post("/api/customers/", response_model=Dict[str, Any])
 async def create_customer_improved(
     customer: CustomerCreateImproved,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建客户 - 改进版"""
     db_customer = Customer(**customer.dict())
     db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
+    await db.commit()
+    await db.refresh(db_customer)
     
-    # 异步启动背景分析
-    analyze_customer_background.delay(db_customer.id)
+    # 异步启动背景分析（任务队列写入SQLite，放到线程池执行）
+    await asyncio.to_thread(job_queue.enqueue, "analyze_customer_background", {"customer_id": db_customer.id})
     
     return {
         "success": True,
@@ -840,26 +966,24 @@ async def create_customer_improved(
 @app.post("/api/customers/drag-drop")
 async def drag_drop_customers(
     request: DragDropRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """拖拽客户到文件夹"""
     try:
         # 验证目标文件夹存在
-        target_folder = db.query(Folder).filter(Folder.id == request.target_folder_id).first()
+        target_folder = await db.get(Folder, request.target_folder_id)
         if not target_folder:
             raise HTTPException(status_code=404, detail="目标文件夹不存在")
         
         # 批量更新客户文件夹
-        updated_count = 0
-        for customer_id in request.customer_ids:
-            customer = db.query(Customer).filter(Customer.id == customer_id).first()
-            if customer:
-                customer.folder_id = request.target_folder_id
-                customer.updated_at = datetime.utcnow()
-                updated_count += 1
+        customers = (await db.scalars(select(Customer).where(Customer.id.in_(request.customer_ids)))).all()
+        for customer in customers:
+            customer.folder_id = request.target_folder_id
+            customer.updated_at = datetime.utcnow()
+        updated_count = len(customers)
         
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -868,7 +992,7 @@ async def drag_drop_customers(
             "message": f"成功移动 {updated_count} 个客户到 {target_folder.name}"
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"拖拽操作失败: {str(e)}")
 
 # 进度更新API
@@ -876,11 +1000,11 @@ async def drag_drop_customers(
 async def update_customer_progress(
     customer_id: int,
     request: ProgressUpdateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """更新客户进度"""
-    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -920,7 +1044,7 @@ async def update_customer_progress(
             )
             db.add(task)
     
-    db.commit()
+    await db.commit()
     
     return {
         "success": True,
@@ -934,11 +1058,11 @@ async def update_customer_progress(
 @app.post("/api/ai/analyze-customer")
 async def analyze_customer_improved(
     request: AIAnalysisRequestImproved,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """AI客户分析 - 改进版"""
-    customer = db.query(Customer).filter(Customer.id == request.customer_id).first()
+    customer = await db.get(Customer, request.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -960,9 +1084,9 @@ async def analyze_customer_improved(
     
     # 如果包含历史记录
     if request.include_history:
-        interactions = db.query(Interaction).filter(
+        interactions = (await db.scalars(select(Interaction).where(
             Interaction.customer_id == request.customer_id
-        ).order_by(Interaction.interaction_date.desc()).limit(5).all()
+        ).order_by(Interaction.interaction_date.desc()).limit(5))).all()
         
         if interactions:
             context += "\n\n最近互动记录：\n"
@@ -983,12 +1107,16 @@ async def analyze_customer_improved(
     if request.context:
         prompt += f"\n\n额外上下文：{request.context}"
     
+    # 结束只读事务，等待AI响应期间把连接还给连接池
+    await db.commit()
+    
     # 调用AI模型
     ai_result = await call_ai_model(
         model_name=model_name,
         prompt=prompt,
         context=context,
-        system_prompt="你是一个专业的销售顾问和客户分析专家，擅长分析客户心理和制定销售策略。请提供专业、实用的分析和建议。"
+        system_prompt="你是一个专业的销售顾问和客户分析专家，擅长分析客户心理和制定销售策略。请提供专业、实用的分析和建议。",
+        purpose="customer_analysis"
     )
     
     if ai_result["success"]:
@@ -1014,7 +1142,7 @@ async def analyze_customer_improved(
         customer.ai_profile["last_analysis"] = datetime.utcnow().isoformat()
         customer.ai_profile["model_used"] = model_name
         
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -1033,11 +1161,11 @@ async def analyze_customer_improved(
 @app.post("/api/ai/generate-script")
 async def generate_sales_script(
     request: AIScriptGenerateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """生成销售话术"""
-    customer = db.query(Customer).filter(Customer.id == request.customer_id).first()
+    customer = await db.get(Customer, request.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -1091,11 +1219,15 @@ async def generate_sales_script(
     if request.context:
         prompt += f"\n\n额外上下文：{request.context}"
     
+    # 结束只读事务，等待AI响应期间把连接还给连接池
+    await db.commit()
+    
     # 调用AI模型
     ai_result = await call_ai_model(
         model_name=model_name,
         prompt=prompt,
-        system_prompt=system_prompt
+        system_prompt=system_prompt,
+        purpose="sales_script"
     )
     
     if ai_result["success"]:
@@ -1112,7 +1244,7 @@ async def generate_sales_script(
             confidence_score=0.85
         )
         db.add(script)
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -1127,21 +1259,14 @@ async def generate_sales_script(
     else:
         raise HTTPException(status_code=500, detail=f"话术生成失败: {ai_result['error']}")
 
-# OCR名片识别API
-@app.post("/api/ocr/process")
-async def process_ocr(
-    request: OCRProcessRequest,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
-):
-    """OCR图片处理"""
+async def _recognize_card(image, auto_create_contact: bool, db: AsyncSession) -> Dict[str, Any]:
+    """识别一张名片并解析信息，可自动创建联系人"""
+    # 识别和AI解析耗时较长，先结束认证查询的事务，把连接还给连接池
+    await db.commit()
+    
     try:
-        # 解码base64图片
-        image_data = base64.b64decode(request.image_data)
-        image = Image.open(io.BytesIO(image_data))
-        
-        # OCR识别
-        ocr_text = pytesseract.image_to_string(image, lang='chi_sim+eng')
+        # OCR识别：常驻引擎在线程中执行，不阻塞事件循环
+        ocr_text = await asyncio.to_thread(ocr_service.recognize, image)
         
         if not ocr_text.strip():
             raise HTTPException(status_code=400, detail="未能识别到文字内容")
@@ -1168,16 +1293,18 @@ async def process_ocr(
         ai_result = await call_ai_model(
             model_name="grok-4",
             prompt=parse_prompt,
-            system_prompt="你是一个专业的名片信息提取专家，擅长从OCR文字中准确提取结构化信息。"
+            system_prompt="你是一个专业的名片信息提取专家，擅长从OCR文字中准确提取结构化信息。",
+            purpose="card_parsing",
+            json_mode=True
         )
         
         if ai_result["success"]:
             try:
-                # 解析AI返回的JSON
-                parsed_info = json.loads(ai_result["content"])
+                # 解析AI返回的JSON，代码块和前后说明文字在本地去除
+                parsed_info = structured_output.parse(ai_result["content"], "business_card")
                 
                 # 自动创建联系人
-                if request.auto_create_contact and parsed_info.get("name"):
+                if auto_create_contact and parsed_info.get("name"):
                     customer = Customer(
                         name=parsed_info.get("name"),
                         email=parsed_info.get("email"),
@@ -1191,8 +1318,8 @@ async def process_ocr(
                         priority=2
                     )
                     db.add(customer)
-                    db.commit()
-                    db.refresh(customer)
+                    await db.commit()
+                    await db.refresh(customer)
                     
                     return {
                         "success": True,
@@ -1210,7 +1337,7 @@ async def process_ocr(
                         "customer_created": False,
                         "message": "名片识别成功"
                     }
-            except json.JSONDecodeError:
+            except StructuredOutputError:
                 # AI返回的不是有效JSON，返回原始文本
                 return {
                     "success": True,
@@ -1231,16 +1358,350 @@ async def process_ocr(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR处理失败: {str(e)}")
 
+# OCR名片识别API
+@app.post("/api/ocr/process")
+async def process_ocr(
+    request: OCRProcessRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """OCR图片处理（base64图片，保留兼容；新客户端请使用 /api/ocr/upload）"""
+    try:
+        # 解码base64图片
+        image_data = base64.b64decode(request.image_data)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"图片数据无效: {str(e)}")
+    return await _recognize_card(image_data, request.auto_create_contact, db)
+
+@app.post("/api/ocr/upload")
+async def process_ocr_upload(
+    image: UploadFile = File(...),
+    auto_create_contact: bool = Form(True),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """OCR图片处理（multipart二进制上传）
+    
+    图片超过1MB时由表单解析器写入磁盘临时文件，OCR直接读取该文件，不在内存中缓存上传内容。
+    """
+    image.file.seek(0, os.SEEK_END)
+    if image.file.tell() > OCR_MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"图片大小超过{OCR_MAX_IMAGE_BYTES // (1024 * 1024)}MB限制")
+    image.file.seek(0)
+    return await _recognize_card(image.file, auto_create_contact, db)
+
+# 批量名片导入
+OCR_BATCH_MAX_IMAGES = int(os.getenv("OCR_BATCH_MAX_IMAGES", 500))
+# 每次AI解析调用打包的名片数
+OCR_CARDS_PER_AI_CALL = int(os.getenv("OCR_CARDS_PER_AI_CALL", 10))
+OCR_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+# 压缩包解压后的总大小上限，防止解压炸弹
+OCR_ZIP_MAX_BYTES = int(os.getenv("OCR_ZIP_MAX_BYTES", 200 * 1024 * 1024))
+
+CARD_BATCH_PROMPT = """
+下面是{count}张名片的OCR识别文字，每张以 "### 名片 序号" 开头：
+
+{cards}
+
+请分别提取每张名片的信息（不存在的字段填null）：
+- index: 名片序号（与上面的序号一致）
+- name: 姓名
+- company: 公司名称
+- position: 职位
+- phone: 电话号码
+- email: 邮箱地址
+- wechat: 微信号
+- address: 地址
+- industry: 行业（推测）
+
+返回JSON对象 {{"cards": [...]}}，每张名片一个元素，不要包含其他文字。
+"""
+
+def _read_card_images(filename: str, file) -> List[Dict[str, Any]]:
+    """展开上传文件：图片引用上传的临时文件，zip压缩包只列出其中的图片条目
+    
+    图片内容在识别时才由 _load_card_image 读取（zip条目此时才解压），不在内存中同时保存整批图片。
+    """
+    file.seek(0)
+    if not (filename.lower().endswith('.zip') or zipfile.is_zipfile(file)):
+        file.seek(0)
+        return [{"filename": filename, "file": file}]
+    
+    images = []
+    total = 0
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail=f"无法解析压缩包: {filename}")
+    for entry in archive.infolist():
+        name = entry.filename
+        if entry.is_dir() or not name.lower().endswith(OCR_IMAGE_EXTENSIONS) or '__MACOSX' in name:
+            continue
+        total += entry.file_size
+        if total > OCR_ZIP_MAX_BYTES:
+            raise HTTPException(status_code=400, detail="压缩包解压后过大")
+        image = {"filename": f"{filename}/{name}", "archive": archive, "entry": entry}
+        if entry.file_size > OCR_MAX_IMAGE_BYTES:
+            image["error"] = f"图片大小超过{OCR_MAX_IMAGE_BYTES // (1024 * 1024)}MB限制"
+        images.append(image)
+    return images
+
+def _load_card_image(image: Dict[str, Any]):
+    """识别前读取一张图片：zip条目解压为字节（不超过 OCR_MAX_IMAGE_BYTES），上传的图片直接读取临时文件"""
+    if "entry" in image:
+        return image["archive"].read(image["entry"])
+    image["file"].seek(0)
+    return image["file"]
+
+def _normalize_phone(phone: Optional[str]) -> Optional[str]:
+    digits = ''.join(ch for ch in str(phone or '') if ch.isdigit())
+    if len(digits) == 13 and digits.startswith('86'):
+        digits = digits[2:]
+    return digits or None
+
+def _normalize_email(email: Optional[str]) -> Optional[str]:
+    return str(email).strip().lower() or None if email else None
+
+def _card_keys(phone: Optional[str], email: Optional[str], name: Optional[str], company: Optional[str]) -> List[tuple]:
+    """名片去重键：电话、邮箱、姓名+公司，任一相同视为同一联系人"""
+    keys = []
+    if _normalize_phone(phone):
+        keys.append(("phone", _normalize_phone(phone)))
+    if _normalize_email(email):
+        keys.append(("email", _normalize_email(email)))
+    if name and company:
+        keys.append(("name_company", name.strip(), company.strip()))
+    return keys
+
+async def _parse_card_chunk(chunk: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """一次AI调用解析多张名片，返回 {名片序号: 解析结果}"""
+    cards_text = "\n\n".join(f"### 名片 {card['index']}\n{card['ocr_text'].strip()}" for card in chunk)
+    ai_result = await call_ai_model(
+        model_name="grok-4",
+        prompt=CARD_BATCH_PROMPT.format(count=len(chunk), cards=cards_text),
+        system_prompt="你是一个专业的名片信息提取专家，擅长从OCR文字中准确提取结构化信息。",
+        temperature=0.1,
+        max_tokens=300 * len(chunk) + 200,
+        purpose="card_parsing_batch",
+        json_mode=True
+    )
+    if not ai_result["success"]:
+        raise ValueError(ai_result.get("error") or "AI解析失败")
+    
+    parsed = structured_output.parse(ai_result["content"], "business_cards")["cards"]
+    indexes = [card["index"] for card in chunk]
+    results = {}
+    for position, info in enumerate(parsed):
+        # 模型漏写序号时按返回顺序对应
+        index = info.pop("index", None)
+        if index not in indexes:
+            index = indexes[position] if position < len(indexes) else None
+        if index is not None:
+            results[index] = info
+    return results
+
+def _save_parsed_cards(cards: List[Dict[str, Any]], auto_create_contact: bool) -> None:
+    """按电话/邮箱/姓名+公司与已有客户及本批次去重，新联系人在一个事务中批量创建"""
+    db = SessionLocal()
+    try:
+        candidates = [card for card in cards if card.get("parsed_info", {}).get("name")]
+        phones = {_normalize_phone(card["parsed_info"].get("phone")) for card in candidates} - {None}
+        emails = {_normalize_email(card["parsed_info"].get("email")) for card in candidates} - {None}
+        names = {card["parsed_info"]["name"].strip() for card in candidates}
+        
+        existing_keys = {}
+        if candidates:
+            conditions = [Customer.name.in_(names)]
+            if emails:
+                conditions.append(Customer.email.in_(emails))
+            if phones:
+                # 已有号码可能带空格、横线或+86，在数据库中去掉分隔符后比较，最终按规范化后的键比对
+                stripped_phone = Customer.phone
+                for separator in (" ", "-", "+", "(", ")"):
+                    stripped_phone = func.replace(stripped_phone, separator, "")
+                conditions.append(stripped_phone.in_(phones | {f"86{phone}" for phone in phones}))
+            for customer in db.query(Customer).filter(or_(*conditions)).all():
+                for key in _card_keys(customer.phone, customer.email, customer.name, customer.company):
+                    existing_keys.setdefault(key, customer.id)
+        
+        new_customers = []
+        for card in cards:
+            info = card.get("parsed_info")
+            if card["status"] != "parsed":
+                continue
+            if not info.get("name"):
+                card["status"] = "skipped"
+                card["message"] = "未识别到姓名"
+                continue
+            keys = _card_keys(info.get("phone"), info.get("email"), info["name"], info.get("company"))
+            duplicate_of = next((existing_keys[key] for key in keys if key in existing_keys), None)
+            if duplicate_of is not None:
+                card["status"] = "duplicate"
+                card["customer_id"] = duplicate_of
+                continue
+            if not auto_create_contact:
+                card["status"] = "recognized"
+                continue
+            
+            customer = Customer(
+                name=info.get("name"),
+                email=info.get("email"),
+                phone=info.get("phone"),
+                wechat_id=info.get("wechat"),
+                company=info.get("company"),
+                position=info.get("position"),
+                industry=info.get("industry"),
+                tags=["OCR导入"],
+                progress=0.0,
+                priority=2
+            )
+            new_customers.append((card, customer))
+            # 同一批次中的重复名片只创建一次
+            for key in keys:
+                existing_keys.setdefault(key, customer)
+        
+        if new_customers:
+            db.add_all([customer for _, customer in new_customers])
+            db.commit()
+        for card, customer in new_customers:
+            card["status"] = "created"
+            card["customer_id"] = customer.id
+        for card in cards:
+            if isinstance(card.get("customer_id"), Customer):
+                card["customer_id"] = card["customer_id"].id
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+@app.post("/api/ocr/batch")
+async def process_ocr_batch(
+    files: List[UploadFile] = File(...),
+    auto_create_contact: bool = Form(True),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """批量名片导入：上传多张图片或zip压缩包
+    
+    以NDJSON流式返回进度：每张图片识别完成、每批AI解析完成时各输出一行，
+    最后一行为汇总（event=done）。
+    """
+    images = []
+    total_bytes = 0
+    for upload in files:
+        # 分块上传没有 Content-Length，中间件无法提前拒绝，这里按实际大小再检查一次
+        upload.file.seek(0, os.SEEK_END)
+        total_bytes += upload.file.tell()
+        if total_bytes > OCR_BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"上传内容超过{OCR_BATCH_MAX_BYTES // (1024 * 1024)}MB限制")
+        # 读取zip目录可能较慢，放到线程池执行；上传文件在响应流结束后才关闭
+        images.extend(await asyncio.to_thread(_read_card_images, upload.filename or "upload", upload.file))
+    if not images:
+        raise HTTPException(status_code=400, detail="没有可识别的图片")
+    if len(images) > OCR_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"一次最多导入{OCR_BATCH_MAX_IMAGES}张名片")
+    if not ocr_service.available:
+        raise HTTPException(status_code=503, detail="OCR不可用")
+    # 认证使用的会话在响应流结束后才由依赖关闭，这里提前结束其读事务并归还连接，
+    # 避免整个导入期间占用连接池；保存联系人时另开会话
+    await db.close()
+    
+    def event(payload: Dict[str, Any]) -> bytes:
+        return (json.dumps(payload, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    
+    async def run_batch():
+        cards = [{"index": index, "filename": image["filename"], "status": "pending"}
+                 for index, image in enumerate(images)]
+        yield event({"event": "started", "total": len(cards)})
+        
+        # 1. 并行OCR，并发数与常驻引擎数一致
+        semaphore = asyncio.Semaphore(ocr_service.max_engines)
+        
+        def load_and_recognize(image: Dict[str, Any]) -> str:
+            # 图片字节只在识别期间保留，同时在内存中的图片数不超过引擎数
+            return ocr_service.recognize(_load_card_image(image))
+        
+        async def recognize(index: int):
+            if images[index].get("error"):
+                return index, "", images[index]["error"]
+            async with semaphore:
+                try:
+                    return index, await asyncio.to_thread(load_and_recognize, images[index]), None
+                except Exception as e:
+                    return index, "", str(e)
+        
+        done = 0
+        for next_result in asyncio.as_completed([recognize(index) for index in range(len(cards))]):
+            index, text, error = await next_result
+            card = cards[index]
+            card["ocr_text"] = text
+            if error or not text.strip():
+                card["status"] = "failed"
+                card["message"] = error or "未能识别到文字内容"
+            done += 1
+            yield event({"event": "ocr", "index": index, "filename": card["filename"],
+                         "success": card["status"] != "failed", "error": card.get("message"),
+                         "completed": done, "total": len(cards)})
+        
+        # 2. 多张名片打包成一次AI调用，各批并发（由限流器控制实际速率）
+        recognized = [card for card in cards if card["status"] == "pending"]
+        chunks = [recognized[i:i + OCR_CARDS_PER_AI_CALL]
+                  for i in range(0, len(recognized), OCR_CARDS_PER_AI_CALL)]
+        
+        async def parse(chunk):
+            try:
+                return chunk, await _parse_card_chunk(chunk), None
+            except Exception as e:
+                # 任何一批解析失败都不能中断响应流：其余名片照常保存，最后的done事件照常输出
+                if not isinstance(e, (StructuredOutputError, ValueError, HTTPException)):
+                    logger.error(f"名片批量解析失败: {e}")
+                return chunk, {}, getattr(e, "detail", None) or str(e)
+        
+        parsed_count = 0
+        for next_result in asyncio.as_completed([parse(chunk) for chunk in chunks]):
+            chunk, results, error = await next_result
+            for card in chunk:
+                info = results.get(card["index"])
+                if info is None:
+                    card["status"] = "failed"
+                    card["message"] = error or "AI未返回该名片的解析结果"
+                else:
+                    card["status"] = "parsed"
+                    card["parsed_info"] = info
+            parsed_count += len(chunk)
+            yield event({"event": "parsed", "indexes": [card["index"] for card in chunk],
+                         "success": error is None, "error": error,
+                         "completed": parsed_count, "total": len(recognized)})
+        
+        # 3. 去重并在一个事务中批量创建联系人
+        try:
+            await asyncio.to_thread(_save_parsed_cards, cards, auto_create_contact)
+        except Exception as e:
+            logger.error(f"批量创建联系人失败: {e}")
+            yield event({"event": "error", "message": f"创建联系人失败: {e}"})
+        
+        summary = {}
+        for card in cards:
+            summary[card["status"]] = summary.get(card["status"], 0) + 1
+            yield event({"event": "card", "index": card["index"], "filename": card["filename"],
+                         "status": card["status"], "customer_id": card.get("customer_id"),
+                         "parsed_info": card.get("parsed_info"), "ocr_text": card.get("ocr_text"),
+                         "message": card.get("message")})
+        yield event({"event": "done", "total": len(cards), "summary": summary})
+    
+    return StreamingResponse(run_batch(), media_type="application/x-ndjson")
+
 # 提醒系统API
 @app.post("/api/reminders/")
 async def create_reminder_improved(
     reminder: ReminderCreateImproved,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建提醒 - 改进版"""
-    customer = db.query(Customer).filter(Customer.id == reminder.customer_id).first()
+    customer = await db.get(Customer, reminder.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -1251,18 +1712,18 @@ async def create_reminder_improved(
         "type": reminder.reminder_type,
         "auto_generated": reminder.auto_generated
     }
-    db.commit()
+    await db.commit()
     
     # 计算延迟时间
     delay_seconds = (reminder.reminder_time - datetime.utcnow()).total_seconds()
     
     if delay_seconds > 0:
-        # 安排后台任务
-        background_tasks.add_task(
-            send_reminder_task.apply_async,
-            args=[reminder.customer_id, reminder.message, reminder.reminder_time.isoformat()],
-            countdown=int(delay_seconds)
-        )
+        # 安排延迟任务
+        await asyncio.to_thread(job_queue.enqueue, "send_reminder", {
+            "customer_id": reminder.customer_id,
+            "message": reminder.message,
+            "reminder_time": reminder.reminder_time.isoformat()
+        }, run_after=datetime.now() + timedelta(seconds=delay_seconds))
     
     return {
         "success": True,
@@ -1276,27 +1737,28 @@ async def create_reminder_improved(
 # 统计仪表板API
 @app.get("/api/dashboard/stats")
 async def get_dashboard_stats_improved(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取仪表板统计数据 - 改进版"""
     # 基础统计
-    total_customers = db.query(Customer).count()
-    high_priority = db.query(Customer).filter(Customer.priority == 1).count()
+    total_customers = await count_rows(db, Customer)
+    high_priority = await count_rows(db, Customer, Customer.priority == 1)
     
     # 进度统计
     progress_stats = {
-        "0-25": db.query(Customer).filter(Customer.progress >= 0, Customer.progress < 25).count(),
-        "25-50": db.query(Customer).filter(Customer.progress >= 25, Customer.progress < 50).count(),
-        "50-75": db.query(Customer).filter(Customer.progress >= 50, Customer.progress < 75).count(),
-        "75-100": db.query(Customer).filter(Customer.progress >= 75, Customer.progress <= 100).count()
+        "0-25": await count_rows(db, Customer, Customer.progress >= 0, Customer.progress < 25),
+        "25-50": await count_rows(db, Customer, Customer.progress >= 25, Customer.progress < 50),
+        "50-75": await count_rows(db, Customer, Customer.progress >= 50, Customer.progress < 75),
+        "75-100": await count_rows(db, Customer, Customer.progress >= 75, Customer.progress <= 100)
     }
     
-    # 文件夹分布
+    # 文件夹分布（各文件夹客户数用一次分组查询统计）
     folder_stats = []
-    folders = db.query(Folder).all()
+    folder_counts = dict((await db.execute(select(Customer.folder_id, func.count()).group_by(Customer.folder_id))).all())
+    folders = (await db.scalars(select(Folder))).all()
     for folder in folders:
-        customer_count = db.query(Customer).filter(Customer.folder_id == folder.id).count()
+        customer_count = folder_counts.get(folder.id, 0)
         folder_stats.append({
             "folder_name": folder.name,
             "folder_type": folder.folder_type,
@@ -1305,12 +1767,12 @@ async def get_dashboard_stats_improved(
         })
     
     # AI使用统计
-    ai_scripts_count = db.query(AIScript).count()
-    ai_insights_count = db.query(AIInsight).count()
+    ai_scripts_count = await count_rows(db, AIScript)
+    ai_insights_count = await count_rows(db, AIInsight)
     
     # 任务统计
-    pending_tasks = db.query(Task).filter(Task.status == 'pending').count()
-    completed_tasks = db.query(Task).filter(Task.status == 'completed').count()
+    pending_tasks = await count_rows(db, Task, Task.status == 'pending')
+    completed_tasks = await count_rows(db, Task, Task.status == 'completed')
     
     return {
         "total_customers": total_customers,
@@ -1332,11 +1794,11 @@ async def get_dashboard_stats_improved(
 @app.post("/api/ai/sales-assistant")
 async def ai_sales_assistant(
     request: AIRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """AI销售助手 - 生成销售回应和发送消息"""
-    customer = db.query(Customer).filter(Customer.id == request.customer_id).first()
+    customer = await db.get(Customer, request.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -1372,6 +1834,9 @@ async def ai_sales_assistant(
 - 包含具体的行动建议
 """
     
+    # 结束只读事务，等待AI响应期间把连接还给连接池
+    await db.commit()
+    
     # 调用AI模型
     ai_result = await call_ai_model(
         model_name=request.model,
@@ -1379,7 +1844,8 @@ async def ai_sales_assistant(
         context=customer_context,
         system_prompt=system_prompt,
         temperature=request.temperature,
-        max_tokens=request.max_tokens
+        max_tokens=request.max_tokens,
+        purpose="sales_assistant"
     )
     
     if not ai_result["success"]:
@@ -1411,7 +1877,7 @@ async def ai_sales_assistant(
                 content=ai_result["content"]
             )
             db.add(interaction)
-            db.commit()
+            await db.commit()
             
         except Exception as e:
             logger.error(f"发送消息失败: {e}")
@@ -1455,18 +1921,21 @@ async def compare_ai_models(
     prompt: str,
     customer_id: int,
     models: List[str] = ["grok-4", "deepseek-reasoner", "gemini-pro"],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """比较多个AI模型的回应"""
     try:
-        customer = db.query(Customer).filter(Customer.id == customer_id).first()
+        customer = await db.get(Customer, customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="客户不存在")
         
         # 构建客户上下文
         context = f"客户信息：{customer.name}，公司：{customer.company or '未知'}，职位：{customer.position or '未知'}，行业：{customer.industry or '未知'}"
         
+        # 结束只读事务，等待AI响应期间把连接还给连接池
+        await db.commit()
+        
         results = []
         for model in models:
             try:
@@ -1475,7 +1944,8 @@ async def compare_ai_models(
                     prompt=prompt,
                     context=context,
                     temperature=0.7,
-                    max_tokens=1000
+                    max_tokens=1000,
+                    purpose="model_comparison"
                 )
                 
                 results.append({
@@ -1510,12 +1980,12 @@ async def compare_ai_models(
 @app.put("/api/folders/update")
 async def update_folder(
     update: FolderUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """更新文件夹（拖拽排序、合并等）"""
     try:
-        folder = db.query(Folder).filter(Folder.id == update.id).first()
+        folder = await db.get(Folder, update.id)
         if not folder:
             raise HTTPException(status_code=404, detail="文件夹不存在")
         
@@ -1532,20 +2002,20 @@ async def update_folder(
         
         # 处理合并操作
         if update.merge_with:
-            merge_folder = db.query(Folder).filter(Folder.id == update.merge_with).first()
+            merge_folder = await db.get(Folder, update.merge_with)
             if not merge_folder:
                 raise HTTPException(status_code=404, detail="目标合并文件夹不存在")
             
             # 将当前文件夹的所有客户移动到目标文件夹
-            customers = db.query(Customer).filter(Customer.folder_id == folder.id).all()
+            customers = (await db.scalars(select(Customer).where(Customer.folder_id == folder.id))).all()
             for customer in customers:
                 customer.folder_id = merge_folder.id
                 customer.updated_at = datetime.utcnow()
             
             # 删除当前文件夹
             folder_name = folder.name
-            db.delete(folder)
-            db.commit()
+            await db.delete(folder)
+            await db.commit()
             
             return {
                 "success": True,
@@ -1554,7 +2024,7 @@ async def update_folder(
                 "target_folder": merge_folder.name
             }
         
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -1569,25 +2039,25 @@ async def update_folder(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"文件夹更新失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"文件夹更新失败: {str(e)}")
 
 @app.post("/api/folders/merge")
 async def merge_folders(
     request: FolderMergeRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """合并多个文件夹"""
     try:
         # 验证目标文件夹存在
-        target_folder = db.query(Folder).filter(Folder.id == request.target_folder_id).first()
+        target_folder = await db.get(Folder, request.target_folder_id)
         if not target_folder:
             raise HTTPException(status_code=404, detail="目标文件夹不存在")
         
         # 验证源文件夹存在
-        source_folders = db.query(Folder).filter(Folder.id.in_(request.source_folder_ids)).all()
+        source_folders = (await db.scalars(select(Folder).where(Folder.id.in_(request.source_folder_ids)))).all()
         if len(source_folders) != len(request.source_folder_ids):
             raise HTTPException(status_code=404, detail="部分源文件夹不存在")
         
@@ -1596,7 +2066,7 @@ async def merge_folders(
         
         # 移动所有客户到目标文件夹
         for folder in source_folders:
-            customers = db.query(Customer).filter(Customer.folder_id == folder.id).all()
+            customers = (await db.scalars(select(Customer).where(Customer.folder_id == folder.id))).all()
             for customer in customers:
                 customer.folder_id = request.target_folder_id
                 customer.updated_at = datetime.utcnow()
@@ -1605,13 +2075,13 @@ async def merge_folders(
             merged_folder_names.append(folder.name)
             
             # 删除源文件夹
-            db.delete(folder)
+            await db.delete(folder)
         
         # 如果提供了新名称，更新目标文件夹名称
         if request.new_folder_name:
             target_folder.name = request.new_folder_name
         
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -1622,7 +2092,7 @@ async def merge_folders(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"文件夹合并失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"文件夹合并失败: {str(e)}")
 
@@ -1630,12 +2100,12 @@ async def merge_folders(
 @app.post("/api/customers/add-tags")
 async def add_tags(
     request: TagRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """为客户添加标签"""
     try:
-        customer = db.query(Customer).filter(Customer.id == request.customer_id).first()
+        customer = await db.get(Customer, request.customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="客户不存在")
         
@@ -1647,7 +2117,7 @@ async def add_tags(
         customer.tags = new_tags
         customer.updated_at = datetime.utcnow()
         
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -1657,19 +2127,19 @@ async def add_tags(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"添加标签失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"添加标签失败: {str(e)}")
 
 @app.post("/api/customers/batch-tags")
 async def batch_manage_tags(
     request: BatchTagRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """批量管理客户标签"""
     try:
-        customers = db.query(Customer).filter(Customer.id.in_(request.customer_ids)).all()
+        customers = (await db.scalars(select(Customer).where(Customer.id.in_(request.customer_ids)))).all()
         if len(customers) != len(request.customer_ids):
             raise HTTPException(status_code=404, detail="部分客户不存在")
         
@@ -1698,7 +2168,7 @@ async def batch_manage_tags(
                 "tags": new_tags
             })
         
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -1708,7 +2178,7 @@ async def batch_manage_tags(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"批量标签管理失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"批量标签管理失败: {str(e)}")
 
@@ -1717,18 +2187,14 @@ async def search_tags(
     query: str = "",
     sort: str = "alpha",
     limit: int = 50,
-    db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
     """搜索和排序标签"""
     try:
-        # 获取所有客户的标签
-        customers = db.query(Customer).all()
-        all_tags = set()
-        
-        for customer in customers:
-            if customer.tags:
-                all_tags.update(customer.tags)
+        # 获取所有客户的标签（只查询标签列）
+        # 要读取全部客户的标签，行处理和JSON解析都在线程池中进行，客户多时不占用事件循环
+        tag_counts = await asyncio.to_thread(_count_tags)
+        all_tags = set(tag_counts)
         
         # 过滤标签
         if query:
@@ -1741,13 +2207,7 @@ async def search_tags(
             filtered_tags.sort()
         elif sort == "frequency":
             # 按使用频率排序
-            tag_counts = {}
-            for customer in customers:
-                if customer.tags:
-                    for tag in customer.tags:
-                        tag_counts[tag] = tag_counts.get(tag, 0) + 1
-            
-            filtered_tags.sort(key=lambda x: tag_counts.get(x, 0), reverse=True)
+            filtered_tags.sort(key=lambda x: tag_counts[x], reverse=True)
         
         # 限制结果数量
         filtered_tags = filtered_tags[:limit]
@@ -1755,10 +2215,9 @@ async def search_tags(
         # 获取每个标签的使用统计
         tag_stats = []
         for tag in filtered_tags:
-            count = sum(1 for customer in customers if customer.tags and tag in customer.tags)
             tag_stats.append({
                 "name": tag,
-                "count": count,
+                "count": tag_counts[tag],
                 "category": get_tag_category(tag)  # 分类标签
             })
         
@@ -1775,6 +2234,15 @@ async def search_tags(
         logger.error(f"标签搜索失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"标签搜索失败: {str(e)}")
 
+def _count_tags() -> Counter:
+    """统计每个标签的使用客户数（同一客户重复的标签只算一次），在线程池中执行"""
+    tag_counts = Counter()
+    with engine.connect() as conn:
+        for tags in conn.scalars(select(Customer.tags)):
+            if tags:
+                tag_counts.update(set(tags))
+    return tag_counts
+
 def get_tag_category(tag: str) -> str:
     """根据标签内容判断分类"""
     education_tags = ["MBA", "暨南大学", "清华", "北大", "复旦", "交大"]
@@ -1798,19 +2266,19 @@ def get_tag_category(tag: str) -> str:
 async def update_customer_notes(
     customer_id: int, 
     request: NoteRequest, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """更新客户备注"""
     try:
-        customer = db.query(Customer).filter(Customer.id == customer_id).first()
+        customer = await db.get(Customer, customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="客户不存在")
         
         # 更新客户备注
         customer.latest_notes = request.notes
         customer.updated_at = datetime.utcnow()
-        db.commit()
+        await db.commit()
         
         return {
             "status": "success", 
@@ -1822,19 +2290,19 @@ async def update_customer_notes(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"更新客户备注失败: {str(e)}")
 
 @app.post("/api/customers/{customer_id}/reminders", response_model=dict)
 async def set_customer_reminder(
     customer_id: int, 
     request: ReminderRequest, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """为客户设置提醒"""
     try:
-        customer = db.query(Customer).filter(Customer.id == customer_id).first()
+        customer = await db.get(Customer, customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="客户不存在")
         
@@ -1867,14 +2335,14 @@ async def set_customer_reminder(
         # 更新客户提醒信息
         customer.reminder = json.dumps(reminder_data)
         customer.updated_at = datetime.utcnow()
-        db.commit()
+        await db.commit()
         
-        # 发送异步任务到Celery
-        send_reminder_task.delay(
-            customer_id, 
-            request.term, 
-            reminder_time.isoformat()
-        )
+        # 提交到后台任务队列
+        await asyncio.to_thread(job_queue.enqueue, "send_reminder", {
+            "customer_id": customer_id,
+            "message": request.term,
+            "reminder_time": reminder_time.isoformat()
+        })
         
         return {
             "status": "success", 
@@ -1889,18 +2357,18 @@ async def set_customer_reminder(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"设置提醒失败: {str(e)}")
 
 @app.get("/api/customers/{customer_id}/reminders", response_model=dict)
 async def get_customer_reminders(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取客户提醒信息"""
     try:
-        customer = db.query(Customer).filter(Customer.id == customer_id).first()
+        customer = await db.get(Customer, customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="客户不存在")
         
@@ -1924,18 +2392,18 @@ async def get_customer_reminders(
 @app.delete("/api/customers/{customer_id}/reminders", response_model=dict)
 async def delete_customer_reminder(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """删除客户提醒"""
     try:
-        customer = db.query(Customer).filter(Customer.id == customer_id).first()
+        customer = await db.get(Customer, customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="客户不存在")
         
         customer.reminder = None
         customer.updated_at = datetime.utcnow()
-        db.commit()
+        await db.commit()
         
         return {
             "status": "success",
@@ -1945,29 +2413,32 @@ async def delete_customer_reminder(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"删除提醒失败: {str(e)}")
 
 # 获客流程与优化模块API
+def _load_gain_templates() -> Dict[str, Any]:
+    with open('gain_templates.yaml', 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
 @app.get("/api/gain-steps")
 async def get_gain_steps(
     circle: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取指定圈子的获客步骤模板"""
     try:
-        # 从YAML文件加载模板
-        with open('gain_templates.yaml', 'r', encoding='utf-8') as f:
-            templates = yaml.safe_load(f)
+        # 从YAML文件加载模板（文件读取放到线程池执行）
+        templates = await asyncio.to_thread(_load_gain_templates)
         
         # 获取指定圈子的步骤，如果不存在则使用默认步骤
         steps = templates.get(circle, templates.get('default', []))
         
         # 查询数据库中是否有该圈子的自定义步骤
-        db_steps = db.query(GainStep).filter(
+        db_steps = (await db.scalars(select(GainStep).where(
             GainStep.circle == circle
-        ).order_by(GainStep.step_order).all()
+        ).order_by(GainStep.step_order))).all()
         
         if db_steps:
             # 如果数据库中有自定义步骤，使用数据库中的步骤
@@ -2004,7 +2475,7 @@ async def get_gain_steps(
 @app.post("/api/optimize-gain")
 async def optimize_gain(
     request: GainOptimizeRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """基于报告数据优化获客流程"""
@@ -2037,6 +2508,9 @@ async def optimize_gain(
             optimization_suggestions.append("成功率偏低，建议优化沟通话术")
             optimized_steps.append("优化建议: 优化沟通话术")
         
+        # 结束只读事务，等待AI响应期间把连接还给连接池
+        await db.commit()
+        
         # 使用AI生成更详细的优化建议
         ai_prompt = f"""
         基于以下获客数据为{request.circle}圈子提供优化建议：
@@ -2053,7 +2527,8 @@ async def optimize_gain(
                 model_name="grok-4",
                 prompt=ai_prompt,
                 temperature=0.7,
-                max_tokens=1000
+                max_tokens=1000,
+                purpose="gain_optimization"
             )
             
             if ai_response.get("success"):
@@ -2074,7 +2549,7 @@ async def optimize_gain(
             optimization_suggestions=optimization_suggestions
         )
         db.add(gain_report)
-        db.commit()
+        await db.commit()
         
         return {
             "status": "success",
@@ -2091,13 +2566,13 @@ async def optimize_gain(
             "report_id": gain_report.id
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"优化获客流程失败: {str(e)}")
 
 @app.post("/api/gain-reports")
 async def upload_gain_report(
     request: GainReportUpload,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """上传获客报告数据"""
@@ -2119,7 +2594,7 @@ async def upload_gain_report(
         )
         
         db.add(gain_report)
-        db.commit()
+        await db.commit()
         
         return {
             "status": "success",
@@ -2133,21 +2608,21 @@ async def upload_gain_report(
             }
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"上传获客报告失败: {str(e)}")
 
 @app.get("/api/gain-reports/{circle}")
 async def get_gain_reports(
     circle: str,
     limit: int = 10,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取指定圈子的获客报告历史"""
     try:
-        reports = db.query(GainReport).filter(
+        reports = (await db.scalars(select(GainReport).where(
             GainReport.circle == circle
-        ).order_by(GainReport.created_at.desc()).limit(limit).all()
+        ).order_by(GainReport.created_at.desc()).limit(limit))).all()
         
         report_data = []
         for report in reports:
@@ -0,0 +1,306 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from rate_limiter import estimate_tokens
+from request_profiler import request_profiler
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 直方图分桶
+SECONDS_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+CHAR_BUCKETS = (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+# 指标名 -> (说明, 分桶)
+HISTOGRAMS = {
+    'ai_request_duration_seconds': ('AI调用总耗时（含排队）', SECONDS_BUCKETS),
+    'ai_queue_wait_seconds': ('限流排队耗时', SECONDS_BUCKETS),
+    'ai_connect_seconds': ('建立连接耗时（含TLS握手），复用连接时为0', SECONDS_BUCKETS),
+    'ai_time_to_first_byte_seconds': ('发出请求到收到响应头的耗时', SECONDS_BUCKETS),
+    'ai_prompt_chars': ('提示词字符数', CHAR_BUCKETS),
+    'ai_prompt_tokens': ('提示词令牌数', TOKEN_BUCKETS),
+    'ai_completion_tokens': ('输出令牌数', TOKEN_BUCKETS)
+}
+
+_current_call: contextvars.ContextVar = contextvars.ContextVar('ai_call', default=None)
+
+
+class AICallRecord:
+    """单次AI调用的计时和用量，由 AITelemetry.track 创建"""
+
+    def __init__(self, model: str, purpose: str, prompt_chars: int, prompt_tokens: int):
+        self.model = model
+        self.purpose = purpose
+        self.prompt_chars = prompt_chars
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens: Optional[int] = None
+        self.queue_wait = 0.0
+        self.connect_seconds = 0.0
+        self.ttfb: Optional[float] = None
+        self.status = 'ok'
+        self.started = time.perf_counter()
+        self.request_started: Optional[float] = None
+        self._trace_marks: Dict[str, float] = {}
+
+    def set_usage(self, usage: Optional[Dict[str, Any]]):
+        """记录服务商返回的用量，缺失时保留估算值"""
+        usage = usage or {}
+        if usage.get('prompt_tokens'):
+            self.prompt_tokens = usage['prompt_tokens']
+        if usage.get('completion_tokens') is not None:
+            self.completion_tokens = usage['completion_tokens']
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按分桶估算分位数（返回所在桶的上界）"""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+
+class AITelemetry:
+    """AI调用遥测：按 模型/用途 聚合耗时、令牌和提示词大小
+
+    每个进程单独统计；/metrics 以Prometheus文本格式输出，由Prometheus按实例抓取后汇总。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str, str], _Histogram] = {}
+        self._requests: Dict[Tuple[str, str, str], int] = {}
+        self.enabled = os.getenv('AI_TELEMETRY_ENABLED', 'true').lower() == 'true'
+
+    @staticmethod
+    def current_call() -> Optional[AICallRecord]:
+        return _current_call.get()
+
+    @contextmanager
+    def track(self, model: str, purpose: str, messages: List[Dict[str, str]]):
+        """记录一次AI调用；块内抛出异常时状态记为error"""
+        prompt = ''.join(str(m.get('content', '')) for m in messages)
+        call = AICallRecord(model, purpose or 'general', len(prompt), estimate_tokens(prompt))
+        token = _current_call.set(call)
+        try:
+            yield call
+        except BaseException:
+            call.status = 'error'
+            raise
+        finally:
+            _current_call.reset(token)
+            duration = time.perf_counter() - call.started
+            self.observe(call, duration)
+            # 同时记入所在请求的耗时分解
+            request_profiler.record('ai', duration)
+
+    def observe(self, call: AICallRecord, duration: float):
+        if not self.enabled:
+            return
+        labels = (call.model, call.purpose)
+        values = {
+            'ai_request_duration_seconds': duration,
+            'ai_queue_wait_seconds': call.queue_wait,
+            'ai_connect_seconds': call.connect_seconds if call.request_started is not None else None,
+            'ai_time_to_first_byte_seconds': call.ttfb,
+            'ai_prompt_chars': call.prompt_chars,
+            'ai_prompt_tokens': call.prompt_tokens,
+            'ai_completion_tokens': call.completion_tokens
+        }
+        with self._lock:
+            request_key = (*labels, call.status)
+            self._requests[request_key] = self._requests.get(request_key, 0) + 1
+            for name, value in values.items():
+                if value is None:
+                    continue
+                key = (name, *labels)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = _Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    # ------------------------------------------------------------------
+    # httpx 异步调用的计时钩子
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    async def httpx_trace(event_name: str, info: Dict[str, Any]):
+        """作为 httpx 请求的 extensions={'trace': ...} 传入，记录连接和首字节耗时"""
+        call = _current_call.get()
+        if call is None:
+            return
+        now = time.perf_counter()
+        if call.request_started is None:
+            call.request_started = now
+        step, _, phase = event_name.rpartition('.')
+        if phase == 'started':
+            call._trace_marks[step] = now
+        elif phase == 'complete':
+            started = call._trace_marks.pop(step, now)
+            if step in ('connection.connect_tcp', 'connection.start_tls'):
+                call.connect_seconds += now - started
+            elif step.endswith('receive_response_headers') and call.ttfb is None:
+                call.ttfb = now - call.request_started
+
+    # ------------------------------------------------------------------
+    # 输出
+    # ------------------------------------------------------------------
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            requests_snapshot = dict(self._requests)
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+
+        lines = ['# HELP ai_requests_total AI调用次数', '# TYPE ai_requests_total counter']
+        for (model, purpose, status), count in sorted(requests_snapshot.items()):
+            lines.append(f'ai_requests_total{{model="{_escape(model)}",purpose="{_escape(purpose)}",'
+                         f'status="{status}"}} {count}')
+
+        for name, (description, buckets) in HISTOGRAMS.items():
+            series = sorted((key[1:], value) for key, value in histograms.items() if key[0] == name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (model, purpose), (counts, total, count) in series:
+                labels = f'model="{_escape(model)}",purpose="{_escape(purpose)}"'
+                cumulative = 0
+                for bound, bucket_count in zip([*map(_format_bound, buckets), '+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {total:g}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> Dict[str, Any]:
+        """按 模型/用途 汇总，按总耗时降序，便于找出拖慢调用的提示词构建方"""
+        with self._lock:
+            groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+            for (model, purpose, status), count in self._requests.items():
+                group = groups.setdefault((model, purpose), {'model': model, 'purpose': purpose,
+                                                             'calls': 0, 'errors': 0})
+                group['calls'] += count
+                if status != 'ok':
+                    group['errors'] += count
+
+            for (name, model, purpose), histogram in self._histograms.items():
+                group = groups.get((model, purpose))
+                if group is None or not histogram.count:
+                    continue
+                short_name = name[3:]
+                group[f'{short_name}_avg'] = round(histogram.sum / histogram.count, 4)
+                if name.endswith('_seconds'):
+                    group[f'{short_name}_p50'] = histogram.quantile(0.5)
+                    group[f'{short_name}_p95'] = histogram.quantile(0.95)
+                if name == 'ai_request_duration_seconds':
+                    group['total_seconds'] = round(histogram.sum, 3)
+
+        calls = sorted(groups.values(), key=lambda g: g.get('total_seconds', 0), reverse=True)
+        return {'enabled': self.enabled, 'pid': os.getpid(), 'calls': calls}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._requests.clear()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound) -> str:
+    return f'{bound:g}'
+
+
+# ----------------------------------------------------------------------
+# requests 同步调用：记录建立连接耗时和首字节耗时
+# ----------------------------------------------------------------------
+
+class _TimedConnectMixin:
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            call = _current_call.get()
+            if call is not None:
+                call.connect_seconds += time.perf_counter() - started
+
+
+class _TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimingHTTPAdapter(HTTPAdapter):
+    """为当前AI调用记录连接耗时（含TLS）和首字节耗时"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                   'https': _TimedHTTPSConnectionPool}
+
+    def send(self, request, **kwargs):
+        call = _current_call.get()
+        started = time.perf_counter()
+        if call is not None and call.request_started is None:
+            call.request_started = started
+        response = super().send(request, **kwargs)
+        if call is not None:
+            # 适配器在解析完响应头后返回，响应体由 Session 随后读取
+            call.ttfb = time.perf_counter() - started
+        return response
+
+
+def instrumented_session() -> requests.Session:
+    """创建带计时的会话，同时复用到各服务商的连接"""
+    session = requests.Session()
+    adapter = TimingHTTPAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# 创建全局实例
+ai_telemetry = AITelemetry()
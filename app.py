@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, render_template, request, jsonify, session, send_from_directory, Response
 from flask_cors import CORS
 from datetime import datetime
 import json
@@ -9,14 +9,34 @@ from collections import defaultdict
 import logging
 import ssl
 import subprocess
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import api_config
 from ai_service_manager import ai_service
 from file_content_extractor import file_extractor
+from streaming_upload import UploadRequest, upload_limit, sweep_stale_uploads
+from blob_store import blob_store
+from image_derivatives import image_derivatives
+from static_delivery import static_delivery
+from serialization import init_flask_json, negotiated_jsonify, dumps as json_dumps
+from response_compression import response_compression
+from resource_versions import resource_versions, accept_variant
+from request_profiler import request_profiler
+from conversation_summary import summary_store
+from rate_limiter import rate_limiter
+from ai_telemetry import ai_telemetry
+from structured_output import structured_output, StructuredOutputError
+from single_flight import ai_single_flight
+from job_queue import job_queue, PermanentJobError, PRIORITY_HIGH, PRIORITY_LOW, STATUS_QUEUED, STATUS_RUNNING, STATUS_FAILED, STATUS_CANCELLED
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 后台任务与业务数据使用同一个数据库（设置 JOB_QUEUE_DB 时使用独立的任务数据库）
+job_queue.use_database(api_config.database['sqlite_path'])
+
 def get_methodology_fallback_content(sales_method, customer_data):
     """根据销售方法论生成不同的fallback内容"""
     name = customer_data.get('name', '客户')
@@ -83,6 +103,8 @@ def get_methodology_fallback_content(sales_method, customer_data):
         }
 
 app = Flask(__name__)
+# 上传文件流式写入临时文件，边接收边计算指纹和检查大小
+app.request_class = UploadRequest
 
 # 配置
 app.secret_key = api_config.app['secret_key']
@@ -93,14 +115,62 @@ app.config['DEBUG'] = api_config.app['debug']
 # 启用CORS
 CORS(app, origins=api_config.app['cors_origins'])
 
+# 按路由统计耗时、SQL、AI调用和文件提取，记录慢请求；在压缩等钩子之前注册，统计包含它们的耗时
+request_profiler.init_app(app)
+
+# jsonify 使用 orjson；列表接口另外支持 MessagePack 和流式编码
+init_flask_json(app)
+
+# 动态响应压缩；导出文件和后台任务的导出结果下载用最高压缩级别
+response_compression.init_app(app)
+response_compression.configure_route('/api/customers/export', preset='best')
+response_compression.configure_route('/api/jobs/', preset='best', files=True)
+
+# 静态文件：带版本号的资源和按内容寻址的上传文件永久缓存，支持304、Range和预压缩
+static_delivery.init_app(app)
+
 # 静态文件路由
 @app.route('/static/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory('static/uploads', filename)
+    return static_delivery.send('static/uploads', filename)
 
 @app.route('/static/images/<path:filename>')
 def static_images(filename):
-    return send_from_directory('static/images', filename)
+    return static_delivery.send('static/images', filename)
+
+@app.route('/static/thumbs/<size>/<path:filename>')
+def image_derivative(size, filename):
+    """图片缩略图和WebP版本：首次请求时生成并缓存到磁盘"""
+    relpath = image_derivatives.get_or_create(size, filename)
+    if relpath is None:
+        return jsonify({'success': False, 'message': '图片不存在'}), 404
+    return static_delivery.send(image_derivatives.root, relpath)
+
+# 异步任务响应
+def wants_async_response():
+    """客户端通过 Prefer: respond-async 请求头或 async=1 参数要求异步执行"""
+    if 'respond-async' in request.headers.get('Prefer', '').lower():
+        return True
+    return request.args.get('async', '').lower() in ('1', 'true')
+
+@app.before_request
+def ensure_job_workers():
+    """确保当前进程的任务调度线程已启动（gunicorn等多进程部署下按进程启动）"""
+    job_queue.start()
+
+def job_accepted_response(job_id):
+    """返回202和任务ID，客户端轮询任务状态接口获取结果"""
+    status_url = f'/api/jobs/{job_id}'
+    response = jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': STATUS_QUEUED,
+        'status_url': status_url,
+        'result_url': f'{status_url}/result'
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
 
 # 确保必要的文件夹存在
 for folder in [api_config.upload['upload_folder'], api_config.upload['temp_folder'], 'static/uploads', 'static/css', 'static/js', 'templates']:
@@ -236,6 +306,15 @@ def init_db():
         )
     ''')
     
+    # 客户分组表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS folders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
     # 项目背景表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS customer_backgrounds (
@@ -258,8 +337,34 @@ def init_db():
         else:
             logger.error(f"添加company字段时出错: {e}")
     
+    # 数据库迁移：AI分析记录输入指纹，用于批量分析时跳过未变化的客户
+    try:
+        cursor.execute('ALTER TABLE ai_analysis ADD COLUMN input_fingerprint TEXT')
+        logger.info("已为ai_analysis表添加input_fingerprint字段")
+    except sqlite3.OperationalError as e:
+        if "duplicate column name" not in str(e).lower():
+            logger.error(f"添加input_fingerprint字段时出错: {e}")
+    
+    # 客户沟通摘要表
+    summary_store.init_table(conn)
+    
+    # 后台任务表
+    job_queue.init_table(conn)
+    
+    # 项目文件提取结果缓存表
+    file_extractor.init_table(conn)
+    
+    # 上传文件的内容寻址存储（引用计数）
+    blob_store.init_table(conn)
+    
+    # 读接口ETag使用的资源版本号（由触发器在写入时递增）
+    resource_versions.init_table(conn)
+    
     conn.commit()
     conn.close()
+    
+    # 清理上次运行残留的上传临时文件
+    sweep_stale_uploads()
 
 # 智能解析AI响应
 def parse_ai_response_intelligently(ai_response, customer_data, interactions):
@@ -353,8 +458,37 @@ def generate_default_analysis_data(customer_data, interactions):
         'recommended_approach': '基于客户特点的个性化销售方法'
     }
 
-# 使用AI服务生成分析
-def generate_ai_analysis(customer_id, background_text=None):
+# 计算客户分析的输入指纹
+def compute_analysis_fingerprint(cursor, customer_id, background_text=None, model_name=None):
+    """根据参与分析的客户信息、沟通记录、项目文件、背景和模型计算指纹"""
+    digest = hashlib.sha256()
+    
+    cursor.execute('''
+        SELECT name, industry, position, age_group, phone, wechat, email, priority, company
+        FROM customers WHERE id = ?
+    ''', (customer_id,))
+    digest.update(json.dumps(cursor.fetchone(), ensure_ascii=False).encode('utf-8'))
+    
+    cursor.execute('''
+        SELECT id, content, communication_type FROM communications
+        WHERE customer_id = ? ORDER BY id
+    ''', (customer_id,))
+    for row in cursor.fetchall():
+        digest.update(json.dumps(row, ensure_ascii=False).encode('utf-8'))
+    
+    try:
+        cursor.execute('SELECT id, file_path FROM project_files WHERE customer_id = ? ORDER BY id', (customer_id,))
+        digest.update(json.dumps(cursor.fetchall(), ensure_ascii=False).encode('utf-8'))
+    except sqlite3.OperationalError:
+        # project_files表在首次上传文件时才创建
+        pass
+    
+    digest.update(json.dumps([background_text or '', model_name or ai_service.get_default_model()],
+                             ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_analysis_inputs(customer_id, background_text=None, model_name=None):
+    """查询生成客户分析所需的客户信息、沟通记录、文件内容、沟通摘要和输入指纹"""
     conn = sqlite3.connect(api_config.database['sqlite_path'])
     cursor = conn.cursor()
     
@@ -365,74 +499,86 @@ def generate_ai_analysis(customer_id, background_text=None):
     cursor.execute('SELECT * FROM communications WHERE customer_id = ? ORDER BY created_at DESC', (customer_id,))
     communications = cursor.fetchall()
     
-    try:
-        # 准备客户数据
-        customer_data = {
-            'name': customer[1],
-            'industry': customer[2],
-            'position': customer[3],
-            'age_group': customer[4],
-            'phone': customer[5],
-            'priority': customer[9]
-        }
-        
-        # 如果有项目背景信息，将其整合到客户数据中
-        if background_text:
-            customer_data['project_background'] = background_text
-        
-        # 获取客户上传的文件内容
-        file_contents = file_extractor.get_customer_file_contents(customer_id)
-        formatted_file_content = file_extractor.format_file_contents_for_ai(file_contents)
-        
-        # 如果有文件内容，将其添加到客户数据中
-        if formatted_file_content:
-            customer_data['uploaded_files_content'] = formatted_file_content
-        
-        # 准备互动历史
-        interactions = []
-        for comm in communications:
-            interactions.append({
-                'created_at': comm[6],
-                'content': comm[2],
-                'type': comm[3]
-            })
-        
-        # 调用AI服务生成分析，传递包含背景信息的客户数据
-        result = ai_service.generate_customer_analysis(customer_data, interactions)
-        
-        if result.get('success'):
-            # 解析AI返回的分析结果
-            ai_response = result.get('message', '')
-            
-            # 尝试解析结构化的AI响应
-            try:
-                # 使用AI生成详细的四个分析部分
-                # 构建更详细的提示，充分利用项目背景信息
-                background_section = ""
-                if background_text:
-                    background_section = f"""
+    fingerprint = compute_analysis_fingerprint(cursor, customer_id, background_text, model_name)
+    conn.close()
+    
+    # 准备客户数据
+    customer_data = {
+        'name': customer[1],
+        'industry': customer[2],
+        'position': customer[3],
+        'age_group': customer[4],
+        'phone': customer[5],
+        'priority': customer[9]
+    }
+    
+    # 如果有项目背景信息，将其整合到客户数据中
+    if background_text:
+        customer_data['project_background'] = background_text
+    
+    # 获取客户上传的文件内容
+    file_contents = file_extractor.get_customer_file_contents(customer_id)
+    formatted_file_content = file_extractor.format_file_contents_for_ai(file_contents)
+    
+    # 如果有文件内容，将其添加到客户数据中
+    if formatted_file_content:
+        customer_data['uploaded_files_content'] = formatted_file_content
+    
+    # 准备互动历史
+    interactions = []
+    for comm in communications:
+        interactions.append({
+            'created_at': comm[6],
+            'content': comm[2],
+            'type': comm[3]
+        })
+    
+    return {
+        'customer': customer,
+        'communications': communications,
+        'customer_data': customer_data,
+        'interactions': interactions,
+        # 沟通历史使用增量维护的滚动摘要，而不是全部原始记录
+        'history_context': summary_store.get_history_context(customer_id),
+        'formatted_file_content': formatted_file_content,
+        'background_text': background_text,
+        'fingerprint': fingerprint
+    }
+
+def build_detailed_analysis_prompt(inputs):
+    """第二轮分析的提示词，要求按JSON结构返回四个分析部分"""
+    customer_data = inputs['customer_data']
+    history_context = inputs['history_context']
+    background_text = inputs['background_text']
+    formatted_file_content = inputs['formatted_file_content']
+    
+    # 使用AI生成详细的四个分析部分
+    # 构建更详细的提示，充分利用项目背景信息
+    background_section = ""
+    if background_text:
+        background_section = f"""
                 
                 **重要项目背景信息**：
                 {background_text}
                 
                 请特别注意：以上项目背景信息是客户分析的核心依据，必须在所有分析中充分体现和运用。
                 """
-                
-                # 添加文件内容部分
-                file_content_section = ""
-                if formatted_file_content:
-                    file_content_section = f"""
+    
+    # 添加文件内容部分
+    file_content_section = ""
+    if formatted_file_content:
+        file_content_section = f"""
                 
                 {formatted_file_content}
                 
                 **重要提示**：以上是客户上传的项目相关文件内容，包含了客户的具体需求、项目细节、预算信息等关键数据。请在分析时重点参考这些文件内容，它们比基本信息更准确、更具体。
                 """
-                
-                detailed_prompt = f"""
+    
+    detailed_prompt = f"""
                 请基于以下信息生成详细的客户分析：
                 
                 **客户基本信息**：{customer_data}
-                **沟通记录**：{interactions}{background_section}{file_content_section}
+                **沟通记录**：{history_context}{background_section}{file_content_section}
                 
                 **重要提示**：
                 1. 如果项目背景信息中包含年龄、职位、公司等具体信息，请优先使用项目背景中的信息，忽略客户基本信息中可能过时的数据。
@@ -476,125 +622,213 @@ def generate_ai_analysis(customer_id, background_text=None):
                 
                 请确保返回标准的JSON格式，所有字符串都用双引号包围。
                 """
+    
+    return detailed_prompt
+
+def interpret_ai_analysis(inputs, result, detailed_result):
+    """把两轮AI调用的结果整理为分析数据，返回 (分析, AI是否成功)"""
+    customer = inputs['customer']
+    customer_data = inputs['customer_data']
+    interactions = inputs['interactions']
+    
+    if result.get('success'):
+        # 解析AI返回的分析结果
+        ai_response = result.get('message', '')
+        
+        # 尝试解析结构化的AI响应
+        try:
+            if detailed_result.get('raw'):
+                detailed_response = detailed_result['raw']
+                parsed_analysis = detailed_result.get('data')
                 
-                detailed_result = ai_service.chat(detailed_prompt)
-                if detailed_result.get('success'):
-                    detailed_response = detailed_result.get('message', '')
+                if parsed_analysis:
+                    # 处理新的结构化profile_analysis
+                    profile_data = parsed_analysis.get('profile_analysis', {})
                     
-                    # 尝试解析JSON响应
-                    import re
-                    import json
-                    
-                    # 尝试多种JSON提取方法
-                    json_patterns = [
-                        r'\{[^{}]*"profile_analysis"[^{}]*"success_probability"[^{}]*\}',  # 完整JSON
-                        r'\{.*?"profile_analysis".*?"success_probability".*?\}',  # 贪婪匹配
-                        r'```json\s*({.*?})\s*```',  # markdown代码块
-                        r'({.*?"profile_analysis".*?})'  # 最宽泛匹配
-                    ]
+                    # 如果profile_analysis是字符串，保持向后兼容
+                    if isinstance(profile_data, str):
+                        profile_analysis = profile_data
+                        profile_details = {}
+                    else:
+                        # 新的结构化格式
+                        profile_analysis = str(profile_data.get('content', '客户画像分析中...'))
+                        profile_details = {
+                            'time': str(profile_data.get('time', '工作日上午9-11点')),
+                            'method': str(profile_data.get('method', '电话+邮件跟进')),
+                            'topics': profile_data.get('topics', ['产品需求', '预算情况', '决策流程']),
+                            'opportunities': profile_data.get('opportunities', ['明确需求', '预算充足', '决策权限']),
+                            'strategies': profile_data.get('strategies', ['需求挖掘', '价值展示', '关系建立']),
+                            'competition_analysis': str(profile_data.get('competition_analysis', '需要进一步了解竞争情况'))
+                        }
                     
-                    parsed_analysis = None
-                    for pattern in json_patterns:
-                        json_match = re.search(pattern, detailed_response, re.DOTALL)
-                        if json_match:
-                            try:
-                                json_str = json_match.group(1) if '```json' in pattern else json_match.group()
-                                parsed_analysis = json.loads(json_str)
-                                break
-                            except (json.JSONDecodeError, ValueError, IndexError):
-                                continue
+                    # 获取并验证成交概率
+                    raw_probability = parsed_analysis.get('success_probability', 0.45)
+                    try:
+                        probability = float(raw_probability)
+                        # 确保概率在合理范围内
+                        if probability > 0.85:
+                            logger.warning(f"AI返回过高概率 {probability}，调整为0.75")
+                            probability = 0.75
+                        elif probability < 0.1:
+                            logger.warning(f"AI返回过低概率 {probability}，调整为0.25")
+                            probability = 0.25
+                        elif probability > 1.0:
+                            logger.warning(f"AI返回概率超过1.0: {probability}，调整为0.65")
+                            probability = 0.65
+                    except (ValueError, TypeError):
+                        logger.warning(f"AI返回无效概率值: {raw_probability}，使用默认值0.45")
+                        probability = 0.45
                     
-                    if parsed_analysis:
-                        # 处理新的结构化profile_analysis
-                        profile_data = parsed_analysis.get('profile_analysis', {})
-                        
-                        # 如果profile_analysis是字符串，保持向后兼容
-                        if isinstance(profile_data, str):
-                            profile_analysis = profile_data
-                            profile_details = {}
-                        else:
-                            # 新的结构化格式
-                            profile_analysis = str(profile_data.get('content', '客户画像分析中...'))
-                            profile_details = {
-                                'time': str(profile_data.get('time', '工作日上午9-11点')),
-                                'method': str(profile_data.get('method', '电话+邮件跟进')),
-                                'topics': profile_data.get('topics', ['产品需求', '预算情况', '决策流程']),
-                                'opportunities': profile_data.get('opportunities', ['明确需求', '预算充足', '决策权限']),
-                                'strategies': profile_data.get('strategies', ['需求挖掘', '价值展示', '关系建立']),
-                                'competition_analysis': str(profile_data.get('competition_analysis', '需要进一步了解竞争情况'))
-                            }
-                        
-                        # 获取并验证成交概率
-                        raw_probability = parsed_analysis.get('success_probability', 0.45)
-                        try:
-                            probability = float(raw_probability)
-                            # 确保概率在合理范围内
-                            if probability > 0.85:
-                                logger.warning(f"AI返回过高概率 {probability}，调整为0.75")
-                                probability = 0.75
-                            elif probability < 0.1:
-                                logger.warning(f"AI返回过低概率 {probability}，调整为0.25")
-                                probability = 0.25
-                            elif probability > 1.0:
-                                logger.warning(f"AI返回概率超过1.0: {probability}，调整为0.65")
-                                probability = 0.65
-                        except (ValueError, TypeError):
-                            logger.warning(f"AI返回无效概率值: {raw_probability}，使用默认值0.45")
-                            probability = 0.45
-                        
-                        # 确保所有字段都是正确类型
-                        analysis = {
-                            'profile_analysis': profile_analysis,
-                            'profile_details': profile_details,
-                            'next_contact_suggestion': str(parsed_analysis.get('next_contact_suggestion', '建议在1-2周内进行跟进，通过电话或邮件了解项目进展。')),
-                            'sales_opportunity': str(parsed_analysis.get('sales_opportunity', '客户显示出明确的购买意向，建议重点跟进。')),
-                            'success_probability': probability,
-                            'recommended_approach': '基于AI分析的个性化销售方法',
-                            'full_analysis': detailed_response
-                        }
-                    else:
-                        # JSON解析失败，使用智能分割
-                        analysis = parse_ai_response_intelligently(detailed_response, customer_data, interactions)
+                    # 确保所有字段都是正确类型
+                    analysis = {
+                        'profile_analysis': profile_analysis,
+                        'profile_details': profile_details,
+                        'next_contact_suggestion': str(parsed_analysis.get('next_contact_suggestion', '建议在1-2周内进行跟进，通过电话或邮件了解项目进展。')),
+                        'sales_opportunity': str(parsed_analysis.get('sales_opportunity', '客户显示出明确的购买意向，建议重点跟进。')),
+                        'success_probability': probability,
+                        'recommended_approach': '基于AI分析的个性化销售方法',
+                        'full_analysis': detailed_response
+                    }
                 else:
-                    # 详细分析失败，使用原始响应
-                    analysis = parse_ai_response_intelligently(ai_response, customer_data, interactions)
-            except Exception as parse_error:
-                logger.warning(f"解析AI响应时出错: {str(parse_error)}，使用智能分割")
+                    # JSON解析失败，使用智能分割
+                    analysis = parse_ai_response_intelligently(detailed_response, customer_data, interactions)
+            else:
+                # 详细分析失败，使用原始响应
                 analysis = parse_ai_response_intelligently(ai_response, customer_data, interactions)
-            
-            logger.info(f"为客户 {customer[1]} 生成AI分析成功")
-        else:
-            logger.error(f"AI分析生成失败: {result.get('error')}")
-            # 返回默认分析
-            analysis = generate_default_analysis(customer, communications)
-    
-    except Exception as e:
-        logger.error(f"生成AI分析时发生错误: {str(e)}")
+        except Exception as parse_error:
+            logger.warning(f"解析AI响应时出错: {str(parse_error)}，使用智能分割")
+            analysis = parse_ai_response_intelligently(ai_response, customer_data, interactions)
+        
+        logger.info(f"为客户 {customer[1]} 生成AI分析成功")
+        return analysis, True
+    else:
+        logger.error(f"AI分析生成失败: {result.get('error')}")
         # 返回默认分析
-        analysis = {
-            'profile_analysis': f'客户{customer[1]}的基本信息已记录，建议进一步了解其具体需求。',
-            'next_contact_suggestion': '建议安排初步沟通，了解客户的具体需求和决策流程。',
-            'sales_opportunity': '待进一步评估。',
-            'success_probability': 0.5,
-            'recommended_approach': '采用标准销售流程。'
-        }
+        return generate_default_analysis(customer, inputs['communications']), False
+
+def basic_ai_analysis(customer):
+    """生成分析过程出错时返回的基本分析"""
+    return {
+        'profile_analysis': f'客户{customer[1]}的基本信息已记录，建议进一步了解其具体需求。',
+        'next_contact_suggestion': '建议安排初步沟通，了解客户的具体需求和决策流程。',
+        'sales_opportunity': '待进一步评估。',
+        'success_probability': 0.5,
+        'recommended_approach': '采用标准销售流程。'
+    }
+
+def save_ai_analysis(customer_id, analysis, fingerprint=None):
+    """保存分析结果；只有AI分析成功时才记录输入指纹，回退的默认分析在下次批量分析时会重新生成"""
+    conn = sqlite3.connect(api_config.database['sqlite_path'])
+    cursor = conn.cursor()
     
     # 删除旧的AI分析结果（如果存在）
     cursor.execute('DELETE FROM ai_analysis WHERE customer_id = ?', (customer_id,))
     
     # 保存新的AI分析结果
     cursor.execute('''
-        INSERT INTO ai_analysis (customer_id, profile_analysis, next_contact_suggestion, 
-                                sales_opportunity, success_probability, recommended_approach)
-        VALUES (?, ?, ?, ?, ?, ?)
+        INSERT INTO ai_analysis (customer_id, profile_analysis, next_contact_suggestion,
+                                sales_opportunity, success_probability, recommended_approach,
+                                input_fingerprint)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
     ''', (customer_id, analysis['profile_analysis'], analysis['next_contact_suggestion'],
-          analysis['sales_opportunity'], analysis['success_probability'], analysis['recommended_approach']))
+          analysis['sales_opportunity'], analysis['success_probability'], analysis['recommended_approach'],
+          fingerprint))
     
     conn.commit()
     conn.close()
+
+# 使用AI服务生成分析（asgi_app.py 中有相同流程的异步实现）
+def generate_ai_analysis(customer_id, background_text=None, model_name=None):
+    inputs = load_analysis_inputs(customer_id, background_text, model_name)
+    
+    try:
+        # 调用AI服务生成分析，传递包含背景信息的客户数据
+        result = ai_service.generate_customer_analysis(inputs['customer_data'], inputs['interactions'],
+                                                       model_name=model_name,
+                                                       conversation_summary=inputs['history_context'])
+        
+        detailed_result = None
+        if result.get('success'):
+            # 请求JSON模式并按结构校验，本地修复失败后才重新请求一次
+            detailed_result = structured_output.generate(
+                'customer_analysis', [{'role': 'user', 'content': build_detailed_analysis_prompt(inputs)}],
+                model_name=model_name, temperature=0.7, purpose='customer_analysis_detail')
+        analysis, ai_succeeded = interpret_ai_analysis(inputs, result, detailed_result)
     
+    except Exception as e:
+        logger.error(f"生成AI分析时发生错误: {str(e)}")
+        # 返回默认分析
+        analysis, ai_succeeded = basic_ai_analysis(inputs['customer']), False
+    
+    save_ai_analysis(customer_id, analysis, inputs['fingerprint'] if ai_succeeded else None)
     return analysis
 
+# 批量分析并发控制
+BATCH_ANALYSIS_WORKERS = int(os.getenv('BATCH_ANALYSIS_WORKERS', 4))
+BATCH_PROVIDER_CONCURRENCY = int(os.getenv('BATCH_PROVIDER_CONCURRENCY', 2))
+_provider_slots = {}
+_provider_slots_lock = threading.Lock()
+
+def get_provider_slot(model_name):
+    """同一AI服务商共享一个并发信号量，多个批量任务同时运行时也不会超限"""
+    provider = ai_service.get_provider_key(model_name)
+    with _provider_slots_lock:
+        if provider not in _provider_slots:
+            _provider_slots[provider] = threading.BoundedSemaphore(BATCH_PROVIDER_CONCURRENCY)
+        return _provider_slots[provider]
+
+def select_batch_customer_ids(folder=None, priority=None, customer_ids=None):
+    """按分组、优先级或ID列表筛选需要分析的客户"""
+    conditions, params = [], []
+    if folder:
+        conditions.append('folder = ?')
+        params.append(folder)
+    if priority is not None:
+        conditions.append('priority = ?')
+        params.append(int(priority))
+    if customer_ids:
+        conditions.append(f"id IN ({','.join('?' * len(customer_ids))})")
+        params.extend(int(cid) for cid in customer_ids)
+    
+    conn = sqlite3.connect(api_config.database['sqlite_path'])
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id FROM customers WHERE {' AND '.join(conditions)} ORDER BY priority DESC, id",
+                   params)
+    ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return ids
+
+def _latest_analysis_fingerprint(cursor, customer_id):
+    cursor.execute('SELECT input_fingerprint FROM ai_analysis WHERE customer_id = ? ORDER BY id DESC LIMIT 1',
+                   (customer_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def analyze_customer_if_changed(customer_id, model_name, force=False):
+    """输入未变化时跳过分析，返回 analyzed / skipped / fallback"""
+    conn = sqlite3.connect(api_config.database['sqlite_path'])
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT background FROM customer_backgrounds WHERE customer_id = ?', (customer_id,))
+        row = cursor.fetchone()
+        background_text = row[0] if row and row[0] else None
+        
+        if not force:
+            fingerprint = compute_analysis_fingerprint(cursor, customer_id, background_text, model_name)
+            if _latest_analysis_fingerprint(cursor, customer_id) == fingerprint:
+                return 'skipped'
+    finally:
+        conn.close()
+    
+    with get_provider_slot(model_name):
+        generate_ai_analysis(customer_id, background_text, model_name)
+    
+    conn = sqlite3.connect(api_config.database['sqlite_path'])
+    try:
+        return 'analyzed' if _latest_analysis_fingerprint(conn.cursor(), customer_id) else 'fallback'
+    finally:
+        conn.close()
+
 # 生成销售话术
 def generate_sales_script(customer_id, script_type='opening', methodology='straightLine'):
     """使用AI服务生成销售话术"""
@@ -622,7 +856,8 @@ def generate_sales_script(customer_id, script_type='opening', methodology='strai
             'position': customer[3],
             'industry': customer[4],
             'priority': customer[9] if len(customer) > 9 else 2,
-            'project_background': project_background
+            'project_background': project_background,
+            'communication_summary': summary_store.get_history_context(customer_id)
         }
         
         # 调用AI服务生成话术
@@ -635,9 +870,9 @@ def generate_sales_script(customer_id, script_type='opening', methodology='strai
         if result.get('success'):
             ai_response = result.get('message', '')
             try:
-                # 解析JSON响应
-                scripts = json.loads(ai_response)
-            except json.JSONDecodeError:
+                # 解析JSON响应，代码块、尾逗号、截断等缺陷在本地修复
+                scripts = structured_output.parse(ai_response, 'sales_script')
+            except StructuredOutputError:
                 logger.error("AI响应不是有效的JSON")
                 scripts = {
                     'opening': ai_response,
@@ -680,6 +915,7 @@ def index():
     return render_template('index.html')
 
 @app.route('/api/customers', methods=['GET', 'POST'])
+@resource_versions.etag('customers', variant=accept_variant, vary=['Accept'])
 def handle_customers():
     if request.method == 'GET':
         conn = sqlite3.connect(api_config.database['sqlite_path'])
@@ -744,6 +980,8 @@ def handle_customers():
                 'wechat': customer[6],
                 'email': customer[7],
                 'photo_url': customer[8],
+                # 列表卡片使用最小的缩略图，外部链接等无法生成缩略图时使用原图
+                'photo_thumb_url': image_derivatives.url_for(customer[8]) or customer[8],
                 'priority': customer[9],
                 'folder': customer[10],
                 'sort_order': sort_order,
@@ -758,7 +996,7 @@ def handle_customers():
         # 计算分页信息
         total_pages = (total_count + per_page - 1) // per_page
         
-        return jsonify({
+        return negotiated_jsonify({
             'customers': customer_list,
             'pagination': {
                 'page': page,
@@ -768,7 +1006,7 @@ def handle_customers():
                 'has_next': page < total_pages,
                 'has_prev': page > 1
             }
-        })
+        }, list_key='customers')
     
     elif request.method == 'POST':
         try:
@@ -814,6 +1052,7 @@ def handle_customers():
 
 @app.route('/api/customer/<int:customer_id>')
 @app.route('/api/customers/<int:customer_id>', methods=['GET'])
+@resource_versions.etag('customer:{customer_id}')
 def get_customer_detail(customer_id):
     conn = sqlite3.connect(api_config.database['sqlite_path'])
     cursor = conn.cursor()
@@ -861,6 +1100,8 @@ def get_customer_detail(customer_id):
         'wechat': customer[6],
         'email': customer[7],
         'photo_url': customer[8],
+        'photo_thumb_url': image_derivatives.url_for(customer[8]) or customer[8],
+        'photo_variants': image_derivatives.variant_urls(customer[8]),
         'priority': customer[9],
         'folder': customer[10],
         'communications': [{
@@ -929,12 +1170,36 @@ def delete_customer(customer_id):
         # 删除相关的AI分析记录
         cursor.execute('DELETE FROM ai_analysis WHERE customer_id = ?', (customer_id,))
         
+        # 释放客户的头像、项目图片和项目文件（project_images/project_files表在首次上传时才创建）
+        cursor.execute('SELECT photo_url FROM customers WHERE id = ?', (customer_id,))
+        blob_paths = [cursor.fetchone()[0]]
+        for table in ('project_images', 'project_files'):
+            try:
+                cursor.execute(f'SELECT file_path FROM {table} WHERE customer_id = ?', (customer_id,))
+            except sqlite3.OperationalError:
+                continue
+            blob_paths.extend(row[0] for row in cursor.fetchall())
+            cursor.execute(f'DELETE FROM {table} WHERE customer_id = ?', (customer_id,))
+            if table == 'project_files':
+                file_extractor.purge_unreferenced(conn)
+        released = [(path, blob_store.release(conn, path)) for path in blob_paths]
+        
         # 删除客户
         cursor.execute('DELETE FROM customers WHERE id = ?', (customer_id,))
         
         conn.commit()
+        for path, released_path in released:
+            if released_path:
+                blob_store.remove(conn, released_path)
         conn.close()
         
+        for path, released_path in released:
+            if released_path:
+                image_derivatives.remove(path)
+        
+        # 删除客户的沟通摘要
+        summary_store.delete_customer(customer_id)
+        
         logger.info(f"删除客户成功: {customer_name} (ID: {customer_id})")
         return jsonify({'message': '客户删除成功'})
         
@@ -1031,6 +1296,9 @@ def add_communication():
     conn.commit()
     conn.close()
     
+    # 将新记录折叠进沟通摘要
+    summary_store.on_record_added(data.get('customer_id'))
+    
     # 重新生成AI分析
     generate_ai_analysis(data.get('customer_id'))
     
@@ -1039,61 +1307,151 @@ def add_communication():
 @app.route('/api/sales-script/<int:customer_id>', methods=['GET', 'POST'])
 def get_sales_script(customer_id):
     """获取/生成销售话术"""
-    try:
-        if request.method == 'GET':
-            situation = request.args.get('situation', 'initial_contact')
-            ai_model = None
-            sales_method = None
-        else:
-            data = request.get_json()
-            situation = data.get('situation', 'initial_contact')
-            ai_model = data.get('ai_model')
-            sales_method = data.get('sales_method')
-            advanced_settings = data.get('advanced_settings')
-        
-        # 获取客户信息
-        conn = sqlite3.connect(api_config.database['sqlite_path'])
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM customers WHERE id = ?', (customer_id,))
-        customer = cursor.fetchone()
-        
-        if not customer:
-            conn.close()
-            return jsonify({'success': False, 'message': '客户不存在'})
-        
-        # 获取客户的沟通记录
-        cursor.execute("""
-            SELECT content, created_at FROM communications 
-            WHERE customer_id = ? 
-            ORDER BY created_at DESC LIMIT 5
-        """, (customer_id,))
-        records = cursor.fetchall()
+    if request.method == 'GET':
+        situation = request.args.get('situation', 'initial_contact')
+        ai_model = None
+        sales_method = None
+        advanced_settings = None
+    else:
+        data = request.get_json() or {}
+        situation = data.get('situation', 'initial_contact')
+        ai_model = data.get('ai_model')
+        sales_method = data.get('sales_method')
+        advanced_settings = data.get('advanced_settings')
+    
+    if wants_async_response():
+        job_id = job_queue.enqueue('sales_script', {
+            'customer_id': customer_id,
+            'situation': situation,
+            'ai_model': ai_model,
+            'sales_method': sales_method,
+            'advanced_settings': advanced_settings
+        }, priority=PRIORITY_HIGH)
+        return job_accepted_response(job_id)
+    
+    return jsonify(build_sales_script(customer_id, situation, ai_model, sales_method, advanced_settings))
+
+def load_sales_script_customer(customer_id):
+    """查询生成销售话术所需的客户数据和沟通摘要，客户不存在时返回None"""
+    # 获取客户信息
+    conn = sqlite3.connect(api_config.database['sqlite_path'])
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM customers WHERE id = ?', (customer_id,))
+    customer = cursor.fetchone()
+    
+    if not customer:
         conn.close()
+        return None
+    
+    conn.close()
+    
+    # 构建提示词
+    communication_history = summary_store.get_history_context(customer_id)
+    
+    # 准备客户数据
+    customer_data = {
+        'name': customer[1],
+        'company': customer[2],
+        'position': customer[3],
+        'industry': customer[4],
+        'phone': customer[5],
+        'email': customer[7],
+        'priority': customer[9] if len(customer) > 9 else 2,
+        'communication_summary': communication_history
+    }
+    return customer_data
+
+def parse_sales_script_result(result, sales_method, customer_data):
+    """解析AI生成的销售话术，无法解析为JSON时按段落填充到默认话术中"""
+    logger.info(f"AI服务返回结果: {result}")
+    
+    if result.get('success'):
+        ai_response = result.get('message', '')
+        logger.info(f"AI原始响应: {ai_response[:300]}...")
         
-        # 构建销售方法提示
-        sales_method_prompts = {
-            'straight_line': '使用直线销售法：直接、高效、目标导向的销售方式',
-            'spin': '使用SPIN销售法：通过情况(Situation)、问题(Problem)、影响(Implication)、需求回报(Need-payoff)问题来引导',
-            'challenger': '使用挑战者销售法：教育客户、定制解决方案、控制销售过程',
-            'consultative': '使用顾问式销售法：深入了解客户需求，提供专业建议',
-            'solution': '使用解决方案销售法：专注于解决客户的具体业务问题',
-            'value': '使用价值销售法：强调产品/服务为客户带来的价值和ROI'
-        }
-        
-        # 构建提示词
-        communication_history = "\n".join([f"- {record[0][:100]}..." for record in records]) if records else "暂无沟通记录"
-        sales_prompt = sales_method_prompts.get(sales_method, '') if sales_method else ''
-        
-        # 准备客户数据
-        customer_data = {
-            'name': customer[1],
-            'company': customer[2],
-            'position': customer[3],
-            'industry': customer[4],
-            'phone': customer[5],
-            'email': customer[7],
-            'priority': customer[9] if len(customer) > 9 else 2
-        }
+        # 尝试解析JSON格式的响应
+        try:
+            # 去除代码块标记和说明文字，修复尾逗号、截断等缺陷
+            parsed_response = structured_output.parse(ai_response, 'sales_script')
+            logger.info(f"成功解析JSON: {parsed_response}")
+            
+            # 动态处理字段，不再强制要求固定字段名
+            # 直接返回AI生成的所有字段，让前端灵活处理
+            if parsed_response and isinstance(parsed_response, dict):
+                # 确保至少有一些内容
+                if len(parsed_response) == 0:
+                    logger.warning("AI返回空的JSON对象，使用默认内容")
+                    default_content = get_methodology_fallback_content(sales_method, customer_data)
+                    return {
+                        'success': True,
+                        **default_content
+                    }
+                
+                # 验证字段内容长度（针对动态字段）
+                for field_name, content in parsed_response.items():
+                    if not content or len(str(content).strip()) < 10:
+                        logger.warning(f"字段 {field_name} 内容不足: {len(str(content).strip())}字符")
+                
+                return {
+                    'success': True,
+                    **parsed_response  # 直接返回所有动态生成的字段
+                }
+            else:
+                logger.warning("解析的JSON不是有效的字典格式")
+                default_content = get_methodology_fallback_content(sales_method, customer_data)
+                return {
+                    'success': True,
+                    **default_content
+                }
+            
+        except StructuredOutputError as e:
+            logger.warning(f"JSON解析失败: {e}, 使用文本分割方式")
+            
+            # 如果AI没有返回JSON，尝试智能分割文本
+            response_text = ai_response.strip()
+            
+            # 尝试多种分割方式
+            sections = []
+            if '\n\n' in response_text:
+                sections = [s.strip() for s in response_text.split('\n\n') if s.strip()]
+            elif '\n' in response_text:
+                sections = [s.strip() for s in response_text.split('\n') if s.strip() and len(s.strip()) > 20]
+            else:
+                # 如果没有明显分割，按句号分割
+                sections = [s.strip() + '。' for s in response_text.split('。') if s.strip() and len(s.strip()) > 20]
+            
+            # 构造完整的5个部分
+            default_sections = get_methodology_fallback_content(sales_method, customer_data)
+            
+            # 用分割的内容替换默认内容
+            field_names = ['opening', 'pain_point', 'solution', 'social_proof', 'next_step']
+            for i, field in enumerate(field_names):
+                if i < len(sections) and len(sections[i]) > 10:
+                    default_sections[field] = sections[i]
+            
+            # 如果只有一段内容，将其作为解决方案
+            if len(sections) == 1 and len(sections[0]) > 50:
+                default_sections['solution'] = sections[0]
+            
+            return {
+                'success': True,
+                'opening': default_sections['opening'],
+                'pain_point': default_sections['pain_point'],
+                'solution': default_sections['solution'],
+                'social_proof': default_sections['social_proof'],
+                'next_step': default_sections['next_step']
+            }
+    else:
+        error_msg = result.get('error', '生成失败')
+        logger.error(f"AI服务返回错误: {error_msg}")
+        return {'success': False, 'message': error_msg}
+
+def build_sales_script(customer_id, situation, ai_model=None, sales_method=None, advanced_settings=None):
+    """生成销售话术，返回响应数据"""
+    try:
+        customer_data = load_sales_script_customer(customer_id)
+        if customer_data is None:
+            return {'success': False, 'message': '客户不存在'}
         
         # 调用AI服务生成话术
         try:
@@ -1106,106 +1464,19 @@ def get_sales_script(customer_id):
                 model_name=ai_model,
                 advanced_settings=advanced_settings
             )
-            
-            logger.info(f"AI服务返回结果: {result}")
-            
-            if result.get('success'):
-                ai_response = result.get('message', '')
-                logger.info(f"AI原始响应: {ai_response[:300]}...")
-                
-                # 尝试解析JSON格式的响应
-                try:
-                    # 清理响应文本，移除可能的markdown标记
-                    cleaned_response = ai_response.strip()
-                    if cleaned_response.startswith('```json'):
-                        cleaned_response = cleaned_response[7:]
-                    if cleaned_response.endswith('```'):
-                        cleaned_response = cleaned_response[:-3]
-                    cleaned_response = cleaned_response.strip()
-                    
-                    parsed_response = json.loads(cleaned_response)
-                    logger.info(f"成功解析JSON: {parsed_response}")
-                    
-                    # 动态处理字段，不再强制要求固定字段名
-                    # 直接返回AI生成的所有字段，让前端灵活处理
-                    if parsed_response and isinstance(parsed_response, dict):
-                        # 确保至少有一些内容
-                        if len(parsed_response) == 0:
-                            logger.warning("AI返回空的JSON对象，使用默认内容")
-                            default_content = get_methodology_fallback_content(sales_method, customer_data)
-                            return jsonify({
-                                'success': True,
-                                **default_content
-                            })
-                        
-                        # 验证字段内容长度（针对动态字段）
-                        for field_name, content in parsed_response.items():
-                            if not content or len(str(content).strip()) < 10:
-                                logger.warning(f"字段 {field_name} 内容不足: {len(str(content).strip())}字符")
-                        
-                        return jsonify({
-                            'success': True,
-                            **parsed_response  # 直接返回所有动态生成的字段
-                        })
-                    else:
-                        logger.warning("解析的JSON不是有效的字典格式")
-                        default_content = get_methodology_fallback_content(sales_method, customer_data)
-                        return jsonify({
-                            'success': True,
-                            **default_content
-                        })
-                    
-                except json.JSONDecodeError as e:
-                    logger.warning(f"JSON解析失败: {e}, 使用文本分割方式")
-                    
-                    # 如果AI没有返回JSON，尝试智能分割文本
-                    response_text = ai_response.strip()
-                    
-                    # 尝试多种分割方式
-                    sections = []
-                    if '\n\n' in response_text:
-                        sections = [s.strip() for s in response_text.split('\n\n') if s.strip()]
-                    elif '\n' in response_text:
-                        sections = [s.strip() for s in response_text.split('\n') if s.strip() and len(s.strip()) > 20]
-                    else:
-                        # 如果没有明显分割，按句号分割
-                        sections = [s.strip() + '。' for s in response_text.split('。') if s.strip() and len(s.strip()) > 20]
-                    
-                    # 构造完整的5个部分
-                    default_sections = get_methodology_fallback_content(sales_method, customer_data)
-                    
-                    # 用分割的内容替换默认内容
-                    field_names = ['opening', 'pain_point', 'solution', 'social_proof', 'next_step']
-                    for i, field in enumerate(field_names):
-                        if i < len(sections) and len(sections[i]) > 10:
-                            default_sections[field] = sections[i]
-                    
-                    # 如果只有一段内容，将其作为解决方案
-                    if len(sections) == 1 and len(sections[0]) > 50:
-                        default_sections['solution'] = sections[0]
-                    
-                    return jsonify({
-                        'success': True,
-                        'opening': default_sections['opening'],
-                        'pain_point': default_sections['pain_point'],
-                        'solution': default_sections['solution'],
-                        'social_proof': default_sections['social_proof'],
-                        'next_step': default_sections['next_step']
-                    })
-            else:
-                error_msg = result.get('error', '生成失败')
-                logger.error(f"AI服务返回错误: {error_msg}")
-                return jsonify({'success': False, 'message': error_msg})
+            return parse_sales_script_result(result, sales_method, customer_data)
                 
         except Exception as e:
             logger.error(f"话术生成过程中发生异常: {str(e)}")
-            return jsonify({'success': False, 'message': f'生成话术时发生错误: {str(e)}'})
+            return {'success': False, 'message': f'生成话术时发生错误: {str(e)}'}
             
     except Exception as e:
         logger.error(f"生成销售话术失败: {str(e)}")
-        return jsonify({'success': False, 'message': '生成销售话术失败'})
+        return {'success': False, 'message': '生成销售话术失败'}
 
 @app.route('/api/folders')
+# 分组表为空时从客户表中收集分组，所以客户变化时也要重新验证
+@resource_versions.etag('folders', 'customers')
 def get_folders():
     db_path = api_config.database['sqlite_path']
     conn = sqlite3.connect(db_path)
@@ -1348,6 +1619,9 @@ def dissolve_folder(folder_id):
 def get_customer_analysis(customer_id):
     """获取或重新生成客户AI分析"""
     if request.method == 'GET':
+        if wants_async_response():
+            return job_accepted_response(job_queue.enqueue('customer_analysis', {'customer_id': customer_id},
+                                                           priority=PRIORITY_HIGH))
         analysis = generate_ai_analysis(customer_id)
         return jsonify(analysis)
     
@@ -1358,6 +1632,13 @@ def get_customer_analysis(customer_id):
             include_background = data.get('includeBackground', False)
             background_text = data.get('background', '')
             
+            if wants_async_response():
+                job_id = job_queue.enqueue('customer_analysis', {
+                    'customer_id': customer_id,
+                    'background': background_text if include_background else None
+                }, priority=PRIORITY_HIGH)
+                return job_accepted_response(job_id)
+            
             # 如果包含背景信息，将其传递给AI分析函数
             if include_background and background_text:
                 analysis = generate_ai_analysis(customer_id, background_text)
@@ -1370,6 +1651,32 @@ def get_customer_analysis(customer_id):
             logger.error(f"重新生成AI分析错误: {str(e)}")
             return jsonify({'error': '分析失败'}), 500
 
+@app.route('/api/customers/analysis/batch', methods=['POST'])
+def batch_customer_analysis():
+    """批量重新生成客户AI分析，按分组、优先级或客户ID列表筛选，后台执行"""
+    try:
+        data = request.get_json() or {}
+        folder = data.get('folder')
+        priority = data.get('priority')
+        customer_ids = data.get('customer_ids') or []
+        
+        if not folder and priority is None and not customer_ids:
+            return jsonify({'success': False, 'message': '请指定分组、优先级或客户ID列表'}), 400
+        
+        job_id = job_queue.enqueue('batch_analysis', {
+            'folder': folder,
+            'priority': priority,
+            'customer_ids': customer_ids,
+            'force': bool(data.get('force', False)),
+            # 在请求上下文中确定模型，后台线程读取不到session中的默认模型
+            'ai_model': data.get('ai_model') or ai_service.get_default_model()
+        })
+        return job_accepted_response(job_id)
+    
+    except Exception as e:
+        logger.error(f"提交批量分析失败: {str(e)}")
+        return jsonify({'success': False, 'message': '提交批量分析失败'}), 500
+
 @app.route('/api/customers/<int:customer_id>/background', methods=['GET', 'POST'])
 def handle_customer_background(customer_id):
     """处理客户项目背景信息"""
@@ -1467,88 +1774,109 @@ def get_available_models():
         logger.error(f"获取AI模型列表错误: {str(e)}")
         return jsonify({'error': '获取模型列表失败'}), 500
 
-# AI聊天API
-@app.route('/api/ai/chat', methods=['POST'])
-def ai_chat():
-    """AI聊天接口"""
+@app.route('/api/ai/single-flight')
+def get_ai_single_flight_stats():
+    """获取AI请求合并统计：实际发起的调用数和被合并的重复请求数"""
+    return jsonify({'success': True, **ai_single_flight.stats()})
+
+@app.route('/api/ai/rate-limits')
+def get_ai_rate_limits():
+    """获取AI调用限流指标：本进程的排队深度、等待时间，以及各服务商共享的剩余配额"""
     try:
-        data = request.get_json()
-        message = data.get('message')
-        customer_id = data.get('customer_id')
-        ai_model = data.get('ai_model')
-        sales_method = data.get('sales_method')
-        context = data.get('context', 'general')
-        
-        if not message:
-            return jsonify({'success': False, 'message': '消息不能为空'})
-        
-        # 获取客户信息
-        conn = sqlite3.connect(api_config.database['sqlite_path'])
-        cursor = conn.cursor()
-        
-        customer_info = ""
-        project_background = ""
-        if customer_id:
-            cursor.execute('SELECT * FROM customers WHERE id = ?', (customer_id,))
-            customer = cursor.fetchone()
-            if customer:
-                customer_info = f"""
+        return jsonify({'success': True, **rate_limiter.get_metrics()})
+    except Exception as e:
+        logger.error(f"获取限流指标错误: {str(e)}")
+        return jsonify({'success': False, 'message': '获取限流指标失败'}), 500
+
+@app.route('/api/ai/telemetry')
+def get_ai_telemetry():
+    """获取AI调用遥测汇总：按模型和用途统计耗时、排队、首字节时间和令牌数"""
+    return jsonify({'success': True, **ai_telemetry.summary(), 'structured_output': structured_output.stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 抓取接口"""
+    metrics = ai_telemetry.render_prometheus() + request_profiler.render_prometheus()
+    return Response(metrics, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/debug/requests')
+def debug_requests():
+    """各路由的耗时分布，以及最近慢请求中耗时最长的请求（SQL语句列表和调用栈采样）"""
+    if not request_profiler.debug_access_allowed(request, app.debug):
+        return jsonify({'success': False, 'message': '接口不存在'}), 404
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({'success': True, **request_profiler.summary(limit)})
+
+@app.route('/debug/requests/reset', methods=['POST'])
+def reset_debug_requests():
+    """清空路由统计和慢请求记录"""
+    if not request_profiler.debug_access_allowed(request, app.debug):
+        return jsonify({'success': False, 'message': '接口不存在'}), 404
+    request_profiler.reset()
+    return jsonify({'success': True})
+
+def build_chat_prompt(message, customer_id=None, sales_method=None):
+    """查询客户信息、项目背景、沟通摘要和销售方法，构建AI聊天的提示词"""
+    # 获取客户信息
+    conn = sqlite3.connect(api_config.database['sqlite_path'])
+    cursor = conn.cursor()
+    
+    customer_info = ""
+    project_background = ""
+    if customer_id:
+        cursor.execute('SELECT * FROM customers WHERE id = ?', (customer_id,))
+        customer = cursor.fetchone()
+        if customer:
+            customer_info = f"""
                 当前客户信息：
                 - 姓名：{customer[1]}
                 - 公司：{customer[2] or '未知'}
                 - 职位：{customer[3] or '未知'}
                 - 行业：{customer[4] or '未知'}
                 """
-                
-                # 获取项目背景信息
-                cursor.execute('SELECT background FROM customer_backgrounds WHERE customer_id = ?', (customer_id,))
-                background_result = cursor.fetchone()
-                if background_result and background_result[0]:
-                    project_background = f"""
+            
+            # 获取项目背景信息
+            cursor.execute('SELECT background FROM customer_backgrounds WHERE customer_id = ?', (customer_id,))
+            background_result = cursor.fetchone()
+            if background_result and background_result[0]:
+                project_background = f"""
                 **重要项目背景信息**：
                 {background_result[0]}
                 
                 请特别注意：以上项目背景信息是分析和建议的核心依据，必须在回答中充分体现和运用。
                 """
-        
-        # 获取最近的沟通记录
-        communication_history = ""
-        if customer_id:
-            cursor.execute("""
-                SELECT content, created_at FROM communications 
-                WHERE customer_id = ? 
-                ORDER BY created_at DESC LIMIT 3
-            """, (customer_id,))
-            records = cursor.fetchall()
-            if records:
-                communication_history = "\n最近沟通记录：\n" + "\n".join([f"- {record[0][:100]}..." for record in records])
-        
-        # 构建销售方法指导
-        sales_guidance = ""
-        if sales_method:
-            # 首先尝试从数据库获取自定义prompt
-            cursor.execute('SELECT prompt FROM sales_prompts WHERE method = ?', (sales_method,))
-            custom_prompt = cursor.fetchone()
-            
-            if custom_prompt:
-                sales_guidance = f"请使用{sales_method}销售法：{custom_prompt[0]}"
-            else:
-                # 如果没有自定义prompt，使用默认的
-                default_sales_methods = {
-                    'straight_line': '请使用直线销售法：直接、高效、目标导向的方式回答',
-                    'SPIN': '请使用SPIN销售法：通过提问来了解情况、问题、影响和需求',
-                    'Challenger': '请使用挑战者销售法：提供新见解，挑战客户现有想法',
-                    'Consultative': '请使用顾问式销售法：作为专业顾问提供建议',
-                    'Solution': '请使用解决方案销售法：专注于解决具体业务问题',
-                    'BANT': '请使用BANT销售法：关注预算、决策权、需求和时间线',
-                    'value': '请使用价值销售法：强调价值和投资回报率'
-                }
-                sales_guidance = default_sales_methods.get(sales_method, '')
-        
-        conn.close()
-        
-        # 构建完整的提示词
-        full_prompt = f"""
+    
+    # 获取沟通历史摘要
+    communication_history = ""
+    if customer_id:
+        communication_history = "\n" + summary_store.get_history_context(customer_id)
+    
+    # 构建销售方法指导
+    sales_guidance = ""
+    if sales_method:
+        # 首先尝试从数据库获取自定义prompt
+        cursor.execute('SELECT prompt FROM sales_prompts WHERE method = ?', (sales_method,))
+        custom_prompt = cursor.fetchone()
+        
+        if custom_prompt:
+            sales_guidance = f"请使用{sales_method}销售法：{custom_prompt[0]}"
+        else:
+            # 如果没有自定义prompt，使用默认的
+            default_sales_methods = {
+                'straight_line': '请使用直线销售法：直接、高效、目标导向的方式回答',
+                'SPIN': '请使用SPIN销售法：通过提问来了解情况、问题、影响和需求',
+                'Challenger': '请使用挑战者销售法：提供新见解，挑战客户现有想法',
+                'Consultative': '请使用顾问式销售法：作为专业顾问提供建议',
+                'Solution': '请使用解决方案销售法：专注于解决具体业务问题',
+                'BANT': '请使用BANT销售法：关注预算、决策权、需求和时间线',
+                'value': '请使用价值销售法：强调价值和投资回报率'
+            }
+            sales_guidance = default_sales_methods.get(sales_method, '')
+    
+    conn.close()
+    
+    # 构建完整的提示词
+    full_prompt = f"""
         你是一个专业的销售顾问AI助手。请根据以下信息回答用户的问题：
         
         {customer_info}
@@ -1561,6 +1889,40 @@ def ai_chat():
         
         请提供专业、实用的销售建议，回答要简洁明了，重点突出。特别注意要结合项目背景信息来提供针对性的建议。
         """
+    return full_prompt
+
+def chat_response(ai_response):
+    """把AI调用结果转换为聊天接口的响应数据"""
+    # 确保返回正确的数据结构
+    if ai_response.get('success'):
+        return {
+            'success': True,
+            'response': ai_response.get('message', ''),
+            'message': ai_response.get('message', ''),
+            'model': ai_response.get('model', '')
+        }
+    else:
+        return {
+            'success': False,
+            'message': ai_response.get('error', 'AI服务暂时不可用')
+        }
+
+# AI聊天API（asgi_app.py 中有相同的异步实现）
+@app.route('/api/ai/chat', methods=['POST'])
+def ai_chat():
+    """AI聊天接口"""
+    try:
+        data = request.get_json()
+        message = data.get('message')
+        customer_id = data.get('customer_id')
+        ai_model = data.get('ai_model')
+        sales_method = data.get('sales_method')
+        context = data.get('context', 'general')
+        
+        if not message:
+            return jsonify({'success': False, 'message': '消息不能为空'})
+        
+        full_prompt = build_chat_prompt(message, customer_id, sales_method)
         
         # 调用AI服务
         if ai_model:
@@ -1568,19 +1930,7 @@ def ai_chat():
         else:
             ai_response = ai_service.chat(full_prompt)
         
-        # 确保返回正确的数据结构
-        if ai_response.get('success'):
-            return jsonify({
-                'success': True,
-                'response': ai_response.get('message', ''),
-                'message': ai_response.get('message', ''),
-                'model': ai_response.get('model', '')
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': ai_response.get('error', 'AI服务暂时不可用')
-            })
+        return jsonify(chat_response(ai_response))
         
     except Exception as e:
         logger.error(f"AI聊天失败: {str(e)}")
@@ -1588,6 +1938,7 @@ def ai_chat():
 
 # 沟通记录API
 @app.route('/api/sales-prompts', methods=['GET', 'POST'])
+@resource_versions.etag('sales_prompts')
 def handle_sales_prompts():
     """处理销售方法prompt的保存和获取"""
     conn = sqlite3.connect(api_config.database['sqlite_path'])
@@ -1671,6 +2022,9 @@ def save_communication_record():
         conn.commit()
         conn.close()
         
+        # 将新记录折叠进沟通摘要
+        summary_store.on_record_added(customer_id)
+        
         return jsonify({'success': True, 'message': '沟通记录保存成功'})
         
     except Exception as e:
@@ -1706,7 +2060,7 @@ def get_customer_communications(customer_id):
                 'created_at': record[4]
             })
         
-        return jsonify(communications)
+        return negotiated_jsonify(communications)
         
     except Exception as e:
         logger.error(f"获取沟通记录失败: {str(e)}")
@@ -1859,12 +2213,20 @@ def reorder_customers_by_number():
         logger.error(f"按编号排序失败: {str(e)}")
         return jsonify({'success': False, 'message': '排序编号更新失败'})
 
+# 可在设置中自定义prompt的销售方法
+PROMPT_METHODS = ['SPIN', 'BANT', 'Challenger', 'Solution', 'Consultative']
+
+def session_prompts_variant():
+    """prompt配置保存在会话中，不在数据库里，直接用会话中的内容区分版本"""
+    return repr([session.get(f'prompt_{method}', '') for method in PROMPT_METHODS])
+
 @app.route('/api/settings/prompts', methods=['GET', 'POST'])
+@resource_versions.etag(variant=session_prompts_variant, vary=['Cookie'])
 def handle_prompts():
     if request.method == 'GET':
         # 返回所有prompt配置
         prompts = {}
-        for method in ['SPIN', 'BANT', 'Challenger', 'Solution', 'Consultative']:
+        for method in PROMPT_METHODS:
             prompts[method] = session.get(f'prompt_{method}', '')
         return jsonify({'success': True, 'prompts': prompts})
     
@@ -1881,6 +2243,7 @@ def handle_prompts():
             return jsonify({'success': False, 'error': '参数不完整'}), 400
 
 @app.route('/api/ai-models', methods=['GET', 'POST'])
+@resource_versions.etag('ai_models')
 def handle_ai_models():
     """处理AI模型列表的保存和获取"""
     conn = sqlite3.connect(api_config.database['sqlite_path'])
@@ -1965,6 +2328,9 @@ def manage_communication_record(comm_id):
             if not content:
                 return jsonify({'success': False, 'message': '内容不能为空'})
             
+            cursor.execute("SELECT customer_id FROM communications WHERE id = ?", (comm_id,))
+            owner = cursor.fetchone()
+            
             cursor.execute("""
                 UPDATE communications 
                 SET content = ?, communication_type = ?, topics = ?, created_at = ?
@@ -1976,10 +2342,16 @@ def manage_communication_record(comm_id):
             
             conn.commit()
             conn.close()
+            
+            # 将修改后的记录折叠进沟通摘要
+            summary_store.on_record_edited(owner[0], comm_id)
             return jsonify({'success': True, 'message': '记录更新成功'})
             
         elif request.method == 'DELETE':
             # 删除沟通记录
+            cursor.execute("SELECT customer_id FROM communications WHERE id = ?", (comm_id,))
+            owner = cursor.fetchone()
+            
             cursor.execute("DELETE FROM communications WHERE id = ?", (comm_id,))
             
             if cursor.rowcount == 0:
@@ -1987,6 +2359,9 @@ def manage_communication_record(comm_id):
             
             conn.commit()
             conn.close()
+            
+            # 已删除的内容无法从摘要中剔除，标记摘要在下次使用时重建
+            summary_store.on_record_deleted(owner[0])
             return jsonify({'success': True, 'message': '记录删除成功'})
             
     except Exception as e:
@@ -2015,35 +2390,43 @@ def upload_avatar():
         if not ('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
             return jsonify({'success': False, 'message': '不支持的文件类型'})
         
-        # 生成安全的文件名
-        filename = secure_filename(f"avatar_{customer_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}")
+        conn = sqlite3.connect(api_config.database['sqlite_path'])
+        cursor = conn.cursor()
         
-        # 确保上传目录存在
-        upload_dir = os.path.join('static', 'uploads', 'avatars')
-        if not os.path.exists(upload_dir):
-            os.makedirs(upload_dir)
+        cursor.execute("SELECT photo_url FROM customers WHERE id = ?", (customer_id,))
+        row = cursor.fetchone()
+        if not row:
+            conn.close()
+            return jsonify({'success': False, 'message': '客户不存在'}), 404
+        old_avatar_url = row[0]
         
-        # 保存文件
-        file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
+        # 按内容保存文件，相同图片只存一份
+        stored = blob_store.store(conn, file, file.filename.rsplit('.', 1)[1])
+        avatar_url = stored['url']
         
         # 更新数据库中的头像URL
-        avatar_url = f"/static/uploads/avatars/{filename}"
-        
-        conn = sqlite3.connect(api_config.database['sqlite_path'])
-        cursor = conn.cursor()
-        
         cursor.execute("""
             UPDATE customers SET photo_url = ? WHERE id = ?
         """, (avatar_url, customer_id))
         
+        # 释放被替换的旧头像；重新上传同一张图片时 store() 已多加了一个引用，这里抵消
+        released_path = blob_store.release(conn, old_avatar_url)
+        
         conn.commit()
+        if released_path:
+            blob_store.remove(conn, released_path)
         conn.close()
         
+        if released_path:
+            image_derivatives.remove(old_avatar_url)
+        if not stored['deduplicated']:
+            enqueue_image_derivatives(stored['file_path'])
+        
         return jsonify({
             'success': True, 
             'message': '头像上传成功',
-            'avatar_url': avatar_url
+            'avatar_url': avatar_url,
+            'thumb_url': image_derivatives.url_for(avatar_url) or avatar_url
         })
         
     except Exception as e:
@@ -2052,6 +2435,7 @@ def upload_avatar():
 
 # 项目图片管理API
 @app.route('/api/customers/<int:customer_id>/images', methods=['POST'])
+@upload_limit(5 * 1024 * 1024)
 def upload_project_image(customer_id):
     """上传项目图片"""
     try:
@@ -2068,23 +2452,7 @@ def upload_project_image(customer_id):
         if not ('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
             return jsonify({'success': False, 'message': '不支持的文件类型'}), 400
         
-        # 检查文件大小 (5MB)
-        if len(file.read()) > 5 * 1024 * 1024:
-            return jsonify({'success': False, 'message': '文件大小超过5MB限制'}), 400
-        
-        file.seek(0)  # 重置文件指针
-        
-        # 生成安全的文件名
-        filename = secure_filename(f"project_{customer_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}")
-        
-        # 确保上传目录存在
-        upload_dir = os.path.join('static', 'uploads', 'projects')
-        if not os.path.exists(upload_dir):
-            os.makedirs(upload_dir)
-        
-        # 保存文件
-        file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
+        # 文件大小 (5MB) 在接收时由 upload_limit 检查
         
         # 保存到数据库
         conn = sqlite3.connect(api_config.database['sqlite_path'])
@@ -2103,22 +2471,28 @@ def upload_project_image(customer_id):
             )
         ''')
         
-        image_url = f"/static/uploads/projects/{filename}"
+        # 按内容保存文件，相同图片只存一份
+        stored = blob_store.store(conn, file, file.filename.rsplit('.', 1)[1])
+        image_url = stored['url']
         cursor.execute('''
             INSERT INTO project_images (customer_id, filename, file_path, url)
             VALUES (?, ?, ?, ?)
-        ''', (customer_id, file.filename, file_path, image_url))
+        ''', (customer_id, file.filename, stored['file_path'], image_url))
         
         image_id = cursor.lastrowid
         conn.commit()
         conn.close()
         
-        logger.info(f"项目图片上传成功: {filename}")
+        if not stored['deduplicated']:
+            enqueue_image_derivatives(stored['file_path'])
+        
+        logger.info(f"项目图片上传成功: {stored['file_path']}")
         return jsonify({
             'success': True,
             'image_id': image_id,
             'filename': file.filename,
             'url': image_url,
+            'thumb_url': image_derivatives.url_for(image_url) or image_url,
             'message': '图片上传成功'
         })
         
@@ -2127,6 +2501,7 @@ def upload_project_image(customer_id):
         return jsonify({'success': False, 'message': f'上传失败: {str(e)}'}), 500
 
 @app.route('/api/customers/<int:customer_id>/files', methods=['POST'])
+@upload_limit(2 * 1024 * 1024)
 def upload_project_file(customer_id):
     """上传项目文件（图片和文档）"""
     try:
@@ -2145,28 +2520,11 @@ def upload_project_file(customer_id):
         if not file_extension or file_extension not in allowed_extensions:
             return jsonify({'success': False, 'message': '不支持的文件类型'}), 400
         
-        # 检查文件大小 (2MB)
-        file_content = file.read()
-        if len(file_content) > 2 * 1024 * 1024:
-            return jsonify({'success': False, 'message': '文件大小超过2MB限制'}), 400
-        
-        file.seek(0)  # 重置文件指针
+        # 文件大小 (2MB) 在接收时由 upload_limit 检查
         
         # 确定文件类型
         file_type = 'image' if file_extension in {'png', 'jpg', 'jpeg', 'gif', 'webp'} else 'document'
         
-        # 生成安全的文件名
-        filename = secure_filename(f"project_{customer_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_extension}")
-        
-        # 确保上传目录存在
-        upload_dir = os.path.join('static', 'uploads', 'projects')
-        if not os.path.exists(upload_dir):
-            os.makedirs(upload_dir)
-        
-        # 保存文件
-        file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
-        
         # 保存到数据库
         conn = sqlite3.connect(api_config.database['sqlite_path'])
         cursor = conn.cursor()
@@ -2182,21 +2540,35 @@ def upload_project_file(customer_id):
                 file_type TEXT NOT NULL,
                 file_extension TEXT NOT NULL,
                 upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                content_hash TEXT,
+                content_size INTEGER,
+                content_mtime REAL,
+                extraction_status TEXT,
+                extraction_error TEXT,
                 FOREIGN KEY (customer_id) REFERENCES customers (id)
             )
         ''')
         
-        file_url = f"/static/uploads/projects/{filename}"
+        # 按内容保存文件，相同文件只存一份；内容指纹在接收时已计算
+        stored = blob_store.store(conn, file, file_extension)
+        file_path, file_url, content_hash = stored['file_path'], stored['url'], stored['content_hash']
         cursor.execute('''
             INSERT INTO project_files (customer_id, filename, file_path, url, file_type, file_extension)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (customer_id, file.filename, file_path, file_url, file_type, file_extension))
         
         file_id = cursor.lastrowid
+        # 记录内容指纹，提取结果按指纹缓存
+        file_extractor.record_file_hash(conn, file_id, file_path, content_hash)
         conn.commit()
         conn.close()
         
-        logger.info(f"项目文件上传成功: {filename}")
+        # 在后台进程池中提取文件内容，AI分析时直接读取缓存；相同内容已提取过时直接复用
+        file_extractor.submit_extraction(file_id, file_path, file_extension, content_hash)
+        if file_type == 'image' and not stored['deduplicated']:
+            enqueue_image_derivatives(file_path)
+        
+        logger.info(f"项目文件上传成功: {file_path}")
         return jsonify({
             'success': True,
             'file_id': file_id,
@@ -2231,6 +2603,7 @@ def get_project_images(customer_id):
                 'filename': row[1],
                 'file_path': row[2],
                 'url': row[3],
+                'thumb_url': image_derivatives.url_for(row[3]) or row[3],
                 'upload_time': row[4]
             })
         
@@ -2253,7 +2626,8 @@ def get_project_files(customer_id):
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT id, filename, file_path, url, file_type, file_extension, upload_time
+            SELECT id, filename, file_path, url, file_type, file_extension, upload_time,
+                   extraction_status, extraction_error
             FROM project_files
             WHERE customer_id = ?
             ORDER BY upload_time DESC
@@ -2266,9 +2640,13 @@ def get_project_files(customer_id):
                 'filename': row[1],
                 'file_path': row[2],
                 'url': row[3],
+                'thumb_url': image_derivatives.url_for(row[3]) if row[4] == 'image' else None,
                 'file_type': row[4],
                 'file_extension': row[5],
-                'upload_time': row[6]
+                'upload_time': row[6],
+                # 上传前的旧文件没有状态，在首次分析时提取
+                'extraction_status': row[7] or 'pending',
+                'extraction_error': row[8]
             })
         
         conn.close()
@@ -2302,21 +2680,20 @@ def delete_project_image(customer_id, image_id):
         
         file_path = result[0]
         
-        # 删除数据库记录
+        # 删除数据库记录，文件在最后一个引用释放时删除
         cursor.execute('''
             DELETE FROM project_images
             WHERE id = ? AND customer_id = ?
         ''', (image_id, customer_id))
+        released_path = blob_store.release(conn, file_path)
         
         conn.commit()
+        if released_path:
+            blob_store.remove(conn, released_path)
         conn.close()
         
-        # 删除文件
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as file_error:
-            logger.warning(f"删除文件失败: {file_error}")
+        if released_path:
+            image_derivatives.remove(file_path)
         
         logger.info(f"项目图片删除成功: {image_id}")
         return jsonify({
@@ -2348,21 +2725,21 @@ def delete_project_file(customer_id, file_id):
         
         file_path = result[0]
         
-        # 删除数据库记录
+        # 删除数据库记录，文件在最后一个引用释放时删除
         cursor.execute('''
             DELETE FROM project_files
             WHERE id = ? AND customer_id = ?
         ''', (file_id, customer_id))
+        released_path = blob_store.release(conn, file_path)
+        file_extractor.purge_unreferenced(conn)
         
         conn.commit()
+        if released_path:
+            blob_store.remove(conn, released_path)
         conn.close()
         
-        # 删除文件
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as file_error:
-            logger.warning(f"删除文件失败: {file_error}")
+        if released_path:
+            image_derivatives.remove(file_path)
         
         logger.info(f"项目文件删除成功: {file_id}")
         return jsonify({
@@ -2383,7 +2760,7 @@ def get_file_content(customer_id):
             return jsonify({'success': False, 'message': '缺少文件路径参数'}), 400
         
         # 安全检查：确保文件路径在允许的目录内
-        if not file_path.startswith('/static/uploads/projects/') and not file_path.startswith('static/uploads/projects/'):
+        if not file_path.lstrip('/').startswith(('static/uploads/projects/', 'static/uploads/blobs/')) or '..' in file_path:
             return jsonify({'success': False, 'message': '无效的文件路径'}), 400
         
         # 转换为绝对路径
@@ -2413,14 +2790,24 @@ def get_file_content(customer_id):
         
         file_id, filename, file_extension = file_record
         
+        if wants_async_response():
+            job_id = job_queue.enqueue('extract_file_content', {
+                'file_path': abs_file_path,
+                'file_extension': file_extension,
+                'file_id': file_id,
+                'filename': filename
+            })
+            return job_accepted_response(job_id)
+        
         # 使用文件内容提取器获取内容
         try:
-            content = file_extractor.extract_content(abs_file_path)
+            result = extract_project_file_content(abs_file_path, file_extension)
             
-            if content:
+            if result['content']:
                 return jsonify({
                     'success': True,
-                    'content': content,
+                    'content': result['content'],
+                    'truncated': result['truncated'],
                     'filename': filename,
                     'file_extension': file_extension,
                     'file_id': file_id
@@ -2451,105 +2838,32 @@ def get_file_content(customer_id):
 def export_customers():
     """导出客户数据"""
     try:
-        import pandas as pd
-        from io import BytesIO, StringIO
-        
         # 获取请求参数
         export_format = request.args.get('format', 'csv')
-        scope = request.args.get('scope', 'all')
         include_contacts = request.args.get('include_contacts', 'true').lower() == 'true'
         include_communications = request.args.get('include_communications', 'true').lower() == 'true'
         include_analysis = request.args.get('include_analysis', 'true').lower() == 'true'
         
-        conn = sqlite3.connect(api_config.database['sqlite_path'])
-        
-        # 构建基础查询
-        base_fields = ['c.id', 'c.name', 'c.industry', 'c.position', 'c.age_group', 'c.priority', 'c.folder', 'c.created_at', 'c.updated_at']
-        
-        # 根据选项添加字段
-        if include_contacts:
-            base_fields.extend(['c.phone', 'c.wechat', 'c.email'])
-        
-        query = f"""
-            SELECT {', '.join(base_fields)}
-            FROM customers c
-            ORDER BY c.created_at DESC
-        """
-        
-        df = pd.read_sql_query(query, conn)
-        
-        # 如果需要包含沟通记录
-        if include_communications:
-            comm_query = """
-                SELECT customer_id, COUNT(*) as communication_count,
-                       MAX(created_at) as last_communication
-                FROM communications
-                GROUP BY customer_id
-            """
-            comm_df = pd.read_sql_query(comm_query, conn)
-            df = df.merge(comm_df, left_on='id', right_on='customer_id', how='left')
-            df['communication_count'] = df['communication_count'].fillna(0)
-        
-        # 如果需要包含AI分析
-        if include_analysis:
-            analysis_query = """
-                SELECT customer_id, COUNT(*) as analysis_count,
-                       MAX(created_at) as last_analysis
-                FROM ai_analysis
-                GROUP BY customer_id
-            """
-            analysis_df = pd.read_sql_query(analysis_query, conn)
-            df = df.merge(analysis_df, left_on='id', right_on='customer_id', how='left')
-            df['analysis_count'] = df['analysis_count'].fillna(0)
-        
-        conn.close()
+        if wants_async_response():
+            job_id = job_queue.enqueue('export_customers', {
+                'export_format': export_format,
+                'include_contacts': include_contacts,
+                'include_communications': include_communications,
+                'include_analysis': include_analysis
+            })
+            return job_accepted_response(job_id)
         
-        # 根据格式返回数据
-        if export_format == 'csv':
-            output = StringIO()
-            df.to_csv(output, index=False, encoding='utf-8-sig')
-            output.seek(0)
-            
-            from flask import Response
-            return Response(
-                output.getvalue(),
-                mimetype='text/csv',
-                headers={
-                    'Content-Disposition': f'attachment; filename=customers_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-                }
-            )
+        content, mimetype, filename = build_customer_export(export_format, include_contacts,
+                                                            include_communications, include_analysis)
         
-        elif export_format == 'json':
-            data = {
-                'export_time': datetime.now().isoformat(),
-                'total_records': len(df),
-                'customers': df.to_dict('records')
+        from flask import Response
+        return Response(
+            content,
+            mimetype=mimetype,
+            headers={
+                'Content-Disposition': f'attachment; filename={filename}'
             }
-            
-            from flask import Response
-            return Response(
-                json.dumps(data, ensure_ascii=False, indent=2),
-                mimetype='application/json',
-                headers={
-                    'Content-Disposition': f'attachment; filename=customers_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-                }
-            )
-        
-        else:  # Excel格式
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='客户数据', index=False)
-            
-            output.seek(0)
-            
-            from flask import Response
-            return Response(
-                output.getvalue(),
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                headers={
-                    'Content-Disposition': f'attachment; filename=customers_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-                }
-            )
+        )
         
     except ImportError:
         return jsonify({'success': False, 'message': '缺少pandas或openpyxl库，请安装后重试'})
@@ -2557,6 +2871,78 @@ def export_customers():
         logger.error(f"导出客户数据失败: {str(e)}")
         return jsonify({'success': False, 'message': '导出失败'})
 
+def build_customer_export(export_format, include_contacts=True, include_communications=True, include_analysis=True):
+    """生成客户导出文件，返回 (内容, MIME类型, 文件名)"""
+    import pandas as pd
+    from io import BytesIO, StringIO
+    
+    conn = sqlite3.connect(api_config.database['sqlite_path'])
+    
+    # 构建基础查询
+    base_fields = ['c.id', 'c.name', 'c.industry', 'c.position', 'c.age_group', 'c.priority', 'c.folder', 'c.created_at', 'c.updated_at']
+    
+    # 根据选项添加字段
+    if include_contacts:
+        base_fields.extend(['c.phone', 'c.wechat', 'c.email'])
+    
+    query = f"""
+        SELECT {', '.join(base_fields)}
+        FROM customers c
+        ORDER BY c.created_at DESC
+    """
+    
+    df = pd.read_sql_query(query, conn)
+    
+    # 如果需要包含沟通记录
+    if include_communications:
+        comm_query = """
+            SELECT customer_id, COUNT(*) as communication_count,
+                   MAX(created_at) as last_communication
+            FROM communications
+            GROUP BY customer_id
+        """
+        comm_df = pd.read_sql_query(comm_query, conn)
+        df = df.merge(comm_df, left_on='id', right_on='customer_id', how='left')
+        df['communication_count'] = df['communication_count'].fillna(0)
+    
+    # 如果需要包含AI分析
+    if include_analysis:
+        analysis_query = """
+            SELECT customer_id, COUNT(*) as analysis_count,
+                   MAX(created_at) as last_analysis
+            FROM ai_analysis
+            GROUP BY customer_id
+        """
+        analysis_df = pd.read_sql_query(analysis_query, conn)
+        df = df.merge(analysis_df, left_on='id', right_on='customer_id', how='left')
+        df['analysis_count'] = df['analysis_count'].fillna(0)
+    
+    conn.close()
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    # 根据格式生成数据
+    if export_format == 'csv':
+        output = StringIO()
+        df.to_csv(output, index=False, encoding='utf-8-sig')
+        return output.getvalue(), 'text/csv', f'customers_export_{timestamp}.csv'
+    
+    elif export_format == 'json':
+        data = {
+            'export_time': datetime.now().isoformat(),
+            'total_records': len(df),
+            'customers': df.to_dict('records')
+        }
+        return json_dumps(data, pretty=True), 'application/json', f'customers_export_{timestamp}.json'
+    
+    else:  # Excel格式
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            df.to_excel(writer, sheet_name='客户数据', index=False)
+        return (output.getvalue(),
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                f'customers_export_{timestamp}.xlsx')
+
 # 批量导入预览API
 @app.route('/api/customers/import/preview', methods=['POST'])
 def preview_import_customers():
@@ -3248,7 +3634,7 @@ def handle_lead_statistics():
                 stats_list.append(stat_dict)
             
             conn.close()
-            return jsonify(stats_list)
+            return negotiated_jsonify(stats_list)
             
         except Exception as e:
             logger.error(f"获取获客统计失败: {str(e)}")
@@ -3839,6 +4225,155 @@ def create_default_tasks():
         logger.error(f"创建默认任务失败: {str(e)}")
         return jsonify({'error': '创建默认任务失败'}), 500
 
+# 后台任务处理函数
+def extract_project_file_content(file_path, file_extension):
+    """提取项目文件的文本内容（按内容指纹缓存），返回含 content/truncated 的结果，失败时抛出异常"""
+    result = file_extractor.extract_file_content_cached(file_path, file_extension)
+    if not result['success']:
+        raise ValueError(result['error'])
+    return result
+
+def enqueue_image_derivatives(file_path):
+    """新图片上传后在后台预先生成缩略图；失败时不影响上传，首次请求时会再生成"""
+    if not image_derivatives.available:
+        return
+    try:
+        job_queue.enqueue('image_derivatives', {'file_path': file_path}, priority=PRIORITY_LOW)
+    except Exception as e:
+        logger.warning(f"提交缩略图任务失败: {e}")
+
+@job_queue.handler('customer_analysis')
+def run_customer_analysis_job(payload, job):
+    return generate_ai_analysis(payload['customer_id'], payload.get('background'))
+
+@job_queue.handler('batch_analysis', max_attempts=1)
+def run_batch_analysis_job(payload, job):
+    customer_ids = select_batch_customer_ids(payload.get('folder'), payload.get('priority'),
+                                             payload.get('customer_ids'))
+    model_name = payload.get('ai_model')
+    force = payload.get('force', False)
+    total = len(customer_ids)
+    counts = {'analyzed': 0, 'skipped': 0, 'fallback': 0, 'failed': 0}
+    failed_ids = []
+    job.report_progress(0, f'0/{total}')
+    
+    with ThreadPoolExecutor(max_workers=BATCH_ANALYSIS_WORKERS) as executor:
+        futures = {executor.submit(analyze_customer_if_changed, cid, model_name, force): cid
+                   for cid in customer_ids}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                logger.error(f"批量分析客户 {futures[future]} 失败: {str(e)}")
+                counts['failed'] += 1
+                failed_ids.append(futures[future])
+            job.report_progress(done / total, f"{done}/{total}，已分析{counts['analyzed']}，"
+                                              f"跳过{counts['skipped']}，失败{counts['failed'] + counts['fallback']}")
+    
+    return {'success': True, 'total': total, **counts, 'failed_ids': failed_ids}
+
+@job_queue.handler('sales_script')
+def run_sales_script_job(payload, job):
+    return build_sales_script(payload['customer_id'], payload.get('situation', 'initial_contact'),
+                              payload.get('ai_model'), payload.get('sales_method'),
+                              payload.get('advanced_settings'))
+
+@job_queue.handler('export_customers', cpu_bound=True)
+def run_export_customers_job(payload, job):
+    try:
+        content, mimetype, filename = build_customer_export(
+            payload.get('export_format', 'csv'),
+            payload.get('include_contacts', True),
+            payload.get('include_communications', True),
+            payload.get('include_analysis', True)
+        )
+    except ImportError:
+        raise PermanentJobError('缺少pandas或openpyxl库，请安装后重试')
+    
+    export_folder = os.path.join(api_config.upload['temp_folder'], 'exports')
+    os.makedirs(export_folder, exist_ok=True)
+    file_path = os.path.join(export_folder, f'{job.job_id}_{filename}')
+    if isinstance(content, bytes):
+        with open(file_path, 'wb') as f:
+            f.write(content)
+    else:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    
+    return {'success': True, 'file_path': file_path, 'filename': filename, 'mimetype': mimetype}
+
+@job_queue.handler('extract_file_content', cpu_bound=True)
+def run_extract_file_content_job(payload, job):
+    if not os.path.exists(payload['file_path']):
+        raise PermanentJobError('文件不存在')
+    result = file_extractor.extract_file_content_cached(payload['file_path'], payload['file_extension'])
+    return {
+        'success': result['success'] and bool(result['content']),
+        'content': result['content'],
+        'truncated': result.get('truncated', False),
+        'message': result['error'] or ('' if result['content'] else '无法提取文件内容或文件为空'),
+        'filename': payload.get('filename'),
+        'file_extension': payload['file_extension'],
+        'file_id': payload.get('file_id')
+    }
+
+@job_queue.handler('image_derivatives', max_attempts=1, cpu_bound=True)
+def run_image_derivatives_job(payload, job):
+    if not os.path.exists(payload['file_path']):
+        raise PermanentJobError('文件不存在')
+    return {'success': True, 'generated': image_derivatives.generate_all(payload['file_path'])}
+
+# 后台任务API
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """列出最近的后台任务"""
+    try:
+        jobs = job_queue.list_jobs(
+            status=request.args.get('status'),
+            job_type=request.args.get('type'),
+            limit=min(int(request.args.get('limit', 50)), 200)
+        )
+        return jsonify({'success': True, 'jobs': jobs})
+    except Exception as e:
+        logger.error(f"获取任务列表失败: {str(e)}")
+        return jsonify({'success': False, 'message': '获取任务列表失败'}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def handle_job(job_id):
+    """查询或取消后台任务"""
+    if request.method == 'DELETE':
+        if job_queue.cancel(job_id):
+            return jsonify({'success': True, 'message': '任务已取消'})
+        return jsonify({'success': False, 'message': '任务不存在或已开始执行'}), 409
+    
+    job = job_queue.get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """获取后台任务结果；导出类任务直接返回文件"""
+    job = job_queue.get_job(job_id, include_result=True)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    if job['status'] in (STATUS_QUEUED, STATUS_RUNNING):
+        response = jsonify({'success': True, 'job': job})
+        response.status_code = 202
+        return response
+    if job['status'] in (STATUS_FAILED, STATUS_CANCELLED):
+        return jsonify({'success': False, 'message': job['error'] or '任务已取消', 'job': job}), 500
+    
+    result = job['result']
+    if isinstance(result, dict) and result.get('file_path'):
+        from flask import send_file
+        if not os.path.exists(result['file_path']):
+            return jsonify({'success': False, 'message': '导出文件已过期'}), 410
+        return send_file(result['file_path'], mimetype=result.get('mimetype'),
+                         as_attachment=True, download_name=result['filename'])
+    return jsonify(result)
+
 def generate_ssl_certificate():
     """生成自签名SSL证书"""
     cert_dir = 'ssl_certs'
@@ -3889,6 +4424,7 @@ def create_ssl_context():
 
 if __name__ == '__main__':
     init_db()
+    job_queue.start()
     
     # 获取配置
     host = api_config.app.get('host', '0.0.0.0')
@@ -3912,6 +4448,7 @@ if __name__ == '__main__':
     
     if not enable_https or ssl_context is None:
         logger.info(f"启动HTTP服务器，地址: http://{host}:{port}")
+    logger.info("当前为开发服务器，生产环境请使用: python serve.py")
     
     # 启动服务器
     try:
@@ -0,0 +1,238 @@
+"""
+ASGI入口：AI接口以协程方式执行，其余接口仍由Flask处理
+
+    python serve.py --asgi                       # gunicorn + uvicorn 工作进程（推荐）
+    uvicorn asgi_app:application --port 5004     # 单进程调试
+
+WSGI部署下，AI聊天、销售话术、客户分析和连接测试在等待AI服务商响应期间（最长120秒）一直占用一个线程，
+几个并发的分析请求就能占满工作进程的线程池。这里把这几个接口改为协程：
+- 数据库查询和结果解析复用 app.py 中的函数，在线程池中执行（耗时很短）
+- AI调用使用 AIServiceManager 的异步客户端，等待期间只占用一个连接，不占用线程
+- 要求后台执行的请求（Prefer: respond-async 或 async=1）仍交给Flask入队
+其余请求通过 a2wsgi 在线程池中交给Flask，行为与WSGI部署相同。
+"""
+
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.routing import Route, Mount
+
+from config import api_config
+from ai_service_manager import ai_service
+from structured_output import structured_output
+from serialization import FastJSONResponse as JSONResponse, loads as json_loads
+from response_compression import CompressionMiddleware
+from app import (app as flask_app, build_chat_prompt, chat_response, load_sales_script_customer,
+                 parse_sales_script_result, load_analysis_inputs, build_detailed_analysis_prompt,
+                 interpret_ai_analysis, basic_ai_analysis, save_ai_analysis)
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 执行Flask请求的线程数（与 serve.py 的 --threads 一致）
+WSGI_THREADS = int(os.getenv('WEB_THREADS', 8))
+
+flask_wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+
+
+def wants_async_job(request: Request) -> bool:
+    """与 app.wants_async_response 相同：Prefer: respond-async 请求头或 async=1 参数"""
+    if 'respond-async' in request.headers.get('prefer', '').lower():
+        return True
+    return request.query_params.get('async', '').lower() in ('1', 'true')
+
+
+async def read_json(request: Request):
+    """读取JSON请求体，为空或无法解析时返回None"""
+    body = await request.body()
+    if not body:
+        return None
+    try:
+        return json_loads(body)
+    except ValueError:
+        return None
+
+
+def resolve_model(request: Request, model_name=None) -> str:
+    """请求指定的模型，否则使用Flask session中用户设置的默认模型（与 get_default_model 一致）"""
+    if model_name:
+        return model_name
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if cookie and serializer:
+        try:
+            session = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+            if session.get('default_ai_model'):
+                return session['default_ai_model']
+        except BadSignature:
+            pass
+    return ai_service.default_model
+
+
+class AsyncView:
+    """协程实现的接口，响应头中的CORS设置与Flask-CORS一致（预检请求由Flask处理）"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        origins = api_config.app['cors_origins']
+        self.cors = CORSMiddleware(self._respond, allow_origins=[origins] if isinstance(origins, str) else origins,
+                                   allow_methods=['*'], allow_headers=['*'])
+
+    async def __call__(self, scope, receive, send):
+        if wants_async_job(Request(scope)):
+            await flask_wsgi(scope, receive, send)
+            return
+        await self.cors(scope, receive, send)
+
+    async def _respond(self, scope, receive, send):
+        response = await self.handler(Request(scope, receive))
+        await response(scope, receive, send)
+
+
+async def ai_chat(request: Request):
+    """AI聊天接口"""
+    try:
+        data = await read_json(request)
+        message = data.get('message')
+        if not message:
+            return JSONResponse({'success': False, 'message': '消息不能为空'})
+
+        full_prompt = await asyncio.to_thread(build_chat_prompt, message, data.get('customer_id'),
+                                              data.get('sales_method'))
+        ai_response = await ai_service.achat_with_model(full_prompt, resolve_model(request, data.get('ai_model')))
+        return JSONResponse(chat_response(ai_response))
+
+    except Exception as e:
+        logger.error(f"AI聊天失败: {str(e)}")
+        return JSONResponse({'success': False, 'message': 'AI服务暂时不可用'})
+
+
+async def sales_script(request: Request):
+    """获取/生成销售话术"""
+    customer_id = request.path_params['customer_id']
+    if request.method == 'GET':
+        situation = request.query_params.get('situation', 'initial_contact')
+        ai_model = sales_method = advanced_settings = None
+    else:
+        data = await read_json(request) or {}
+        situation = data.get('situation', 'initial_contact')
+        ai_model = data.get('ai_model')
+        sales_method = data.get('sales_method')
+        advanced_settings = data.get('advanced_settings')
+
+    try:
+        customer_data = await asyncio.to_thread(load_sales_script_customer, customer_id)
+        if customer_data is None:
+            return JSONResponse({'success': False, 'message': '客户不存在'})
+
+        try:
+            logger.info(f"开始生成话术 - 客户: {customer_data['name']}, 方法: {sales_method}, 情况: {situation}")
+            result = await ai_service.agenerate_sales_script(
+                customer_data,
+                script_type=situation,
+                methodology=sales_method or 'straightLine',
+                model_name=resolve_model(request, ai_model),
+                advanced_settings=advanced_settings
+            )
+            return JSONResponse(parse_sales_script_result(result, sales_method, customer_data))
+
+        except Exception as e:
+            logger.error(f"话术生成过程中发生异常: {str(e)}")
+            return JSONResponse({'success': False, 'message': f'生成话术时发生错误: {str(e)}'})
+
+    except Exception as e:
+        logger.error(f"生成销售话术失败: {str(e)}")
+        return JSONResponse({'success': False, 'message': '生成销售话术失败'})
+
+
+async def agenerate_ai_analysis(customer_id, background_text=None, model_name=None):
+    """app.generate_ai_analysis 的异步版本"""
+    inputs = await asyncio.to_thread(load_analysis_inputs, customer_id, background_text, model_name)
+
+    try:
+        result = await ai_service.agenerate_customer_analysis(inputs['customer_data'], inputs['interactions'],
+                                                              model_name=model_name,
+                                                              conversation_summary=inputs['history_context'])
+
+        detailed_result = None
+        if result.get('success'):
+            detailed_result = await structured_output.agenerate(
+                'customer_analysis', [{'role': 'user', 'content': build_detailed_analysis_prompt(inputs)}],
+                model_name=model_name, temperature=0.7, purpose='customer_analysis_detail')
+        analysis, ai_succeeded = interpret_ai_analysis(inputs, result, detailed_result)
+
+    except Exception as e:
+        logger.error(f"生成AI分析时发生错误: {str(e)}")
+        analysis, ai_succeeded = basic_ai_analysis(inputs['customer']), False
+
+    await asyncio.to_thread(save_ai_analysis, customer_id, analysis, inputs['fingerprint'] if ai_succeeded else None)
+    return analysis
+
+
+async def customer_analysis(request: Request):
+    """获取或重新生成客户AI分析"""
+    background_text = None
+    if request.method == 'POST':
+        data = await read_json(request) or {}
+        if data.get('includeBackground', False) and data.get('background', ''):
+            background_text = data['background']
+
+    try:
+        analysis = await agenerate_ai_analysis(request.path_params['customer_id'], background_text,
+                                               resolve_model(request))
+        return JSONResponse(analysis)
+
+    except Exception as e:
+        logger.error(f"重新生成AI分析错误: {str(e)}")
+        return JSONResponse({'error': '分析失败'}, status_code=500)
+
+
+async def test_ai_connection(request: Request):
+    """测试AI API连接"""
+    try:
+        data = await read_json(request)
+        provider = data.get('provider')
+        model = data.get('model')
+        api_key = data.get('api_key')
+        base_url = data.get('base_url')
+
+        if not all([provider, model, api_key]):
+            return JSONResponse({'success': False, 'error': '缺少必要参数'})
+
+        result = await ai_service.atest_connection(provider, model, api_key, base_url)
+        if result.get('success'):
+            return JSONResponse({'success': True, 'message': 'API连接成功'})
+        else:
+            return JSONResponse({'success': False, 'error': result.get('error', '连接失败')})
+
+    except Exception as e:
+        logger.error(f"测试AI连接失败: {str(e)}")
+        return JSONResponse({'success': False, 'error': '连接测试失败'})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # 关闭AI服务的异步连接池
+    await ai_service.aclose()
+
+
+# 路径和方法与 app.py 中的Flask路由一致；方法不匹配的请求（如CORS预检）落到Flask
+application = Starlette(routes=[
+    Route('/api/ai/chat', AsyncView(ai_chat), methods=['POST']),
+    Route('/api/sales-script/{customer_id:int}', AsyncView(sales_script), methods=['GET', 'POST']),
+    Route('/api/customers/{customer_id:int}/analysis', AsyncView(customer_analysis), methods=['GET', 'POST']),
+    Route('/api/test-ai-connection', AsyncView(test_ai_connection), methods=['POST']),
+    Mount('/', app=flask_wsgi),
+], middleware=[
+    # 压缩异步AI接口的响应；Flask接口已由 after_request 压缩（带 Content-Encoding），这里直接跳过
+    Middleware(CompressionMiddleware),
+], lifespan=lifespan)
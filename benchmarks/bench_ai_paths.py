@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI相关接口端到端压测
+
+对运行中的Flask应用发起并发请求，覆盖三条AI路径：
+- chat: POST /api/ai/chat
+- script: POST /api/sales-script/<id>
+- analysis: POST /api/customers/<id>/analysis
+
+应用需以 AI_MOCK_BASE_URL 指向模拟服务启动，避免消耗真实配额：
+    python benchmarks/mock_llm_server.py --port 8900 --latency-ms 800
+    AI_MOCK_BASE_URL=http://127.0.0.1:8900/v1 python app.py
+    python benchmarks/bench_ai_paths.py --base-url http://127.0.0.1:5000 --concurrency 1,4,16
+
+也可以加 --start-mock 在本进程内启动模拟服务（应用仍需按上面的方式指向它）。
+对比线程模式和异步模式时分别以 python serve.py 和 python serve.py --asgi 启动应用，
+线程数相同（如 --threads 4）时，异步模式下并发数超过线程数后延迟不再随并发增长。
+每个并发级别输出吞吐量、p50/p95/p99 延迟和错误数。
+"""
+
+import argparse
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+SCENARIOS = ('chat', 'script', 'analysis')
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    """每个线程一个会话，复用连接"""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def create_customers(base_url, count):
+    """创建压测用客户，返回客户ID列表"""
+    ids = []
+    for i in range(count):
+        response = requests.post(f'{base_url}/api/customer', json={
+            'name': f'压测客户{i + 1}',
+            'industry': '制造业',
+            'position': '采购总监',
+            'folder': '压测'
+        }, timeout=30)
+        response.raise_for_status()
+        ids.append(response.json()['id'])
+    return ids
+
+
+def build_request(scenario, base_url, customer_id, ai_model):
+    """返回 (url, json)；消息带随机后缀，避免被请求合并"""
+    nonce = uuid.uuid4().hex[:8]
+    if scenario == 'chat':
+        return f'{base_url}/api/ai/chat', {
+            'message': f'这个客户下一步应该怎么跟进？({nonce})',
+            'customer_id': customer_id,
+            'ai_model': ai_model
+        }
+    if scenario == 'script':
+        return f'{base_url}/api/sales-script/{customer_id}', {
+            'situation': 'initial_contact',
+            'ai_model': ai_model,
+            'advanced_settings': {'personalSignature': nonce}
+        }
+    return f'{base_url}/api/customers/{customer_id}/analysis', {
+        'includeBackground': True,
+        'background': f'客户计划下季度采购，预算待定。批次{nonce}'
+    }
+
+
+def run_level(scenario, base_url, customer_ids, ai_model, concurrency, requests_per_worker, timeout):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(worker_index):
+        session = _session()
+        for i in range(requests_per_worker):
+            customer_id = customer_ids[(worker_index * requests_per_worker + i) % len(customer_ids)]
+            url, body = build_request(scenario, base_url, customer_id, ai_model)
+            started = time.perf_counter()
+            try:
+                response = session.post(url, json=body, timeout=timeout)
+                elapsed = time.perf_counter() - started
+                payload = response.json() if response.content else {}
+                failed = response.status_code >= 400 or payload.get('success') is False
+                error = f'HTTP {response.status_code}' if response.status_code >= 400 else payload.get('message')
+            except (requests.RequestException, ValueError) as e:
+                elapsed = time.perf_counter() - started
+                failed, error = True, type(e).__name__
+            with lock:
+                if failed:
+                    errors.append(error)
+                else:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'error_sample': errors[0] if errors else '',
+        'throughput': len(latencies) / wall if wall else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99)
+    }
+
+
+def main():
+    from mock_llm_server import start_mock_server, add_settings_arguments, settings_from_args
+
+    parser = argparse.ArgumentParser(description='AI相关接口端到端压测')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000', help='被测应用地址')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'逗号分隔，可选 {",".join(SCENARIOS)}')
+    parser.add_argument('--concurrency', default='1,4,16', help='逗号分隔的并发级别')
+    parser.add_argument('--requests', type=int, default=10, help='每个并发线程发送的请求数')
+    parser.add_argument('--customers', type=int, default=8, help='创建的压测客户数')
+    parser.add_argument('--ai-model', default='deepseek-chat')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--start-mock', action='store_true', help='在本进程内启动模拟AI服务')
+    parser.add_argument('--mock-port', type=int, default=8900)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    mock_stats = None
+    if args.start_mock:
+        _, mock_stats = start_mock_server(port=args.mock_port, settings=settings_from_args(args))
+        print(f"模拟AI服务: http://127.0.0.1:{args.mock_port}/v1")
+
+    base_url = args.base_url.rstrip('/')
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    customer_ids = create_customers(base_url, args.customers)
+    print(f"已创建 {len(customer_ids)} 个压测客户（分组: 压测）")
+
+    header = f"{'场景':<10}{'并发':>6}{'成功':>8}{'错误':>6}{'吞吐(req/s)':>14}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+    print(header)
+    print('-' * len(header))
+    for scenario in scenarios:
+        for concurrency in levels:
+            result = run_level(scenario, base_url, customer_ids, args.ai_model, concurrency,
+                               args.requests, args.timeout)
+            print(f"{result['scenario']:<10}{result['concurrency']:>6}{result['ok']:>8}{result['errors']:>6}"
+                  f"{result['throughput']:>14.2f}{result['p50'] * 1000:>10.0f}{result['p95'] * 1000:>10.0f}"
+                  f"{result['p99'] * 1000:>10.0f}")
+            if result['error_sample']:
+                print(f"  错误示例: {result['error_sample']}")
+
+    if mock_stats:
+        print(f"模拟服务统计: {mock_stats.snapshot()}")
+
+
+if __name__ == '__main__':
+    main()
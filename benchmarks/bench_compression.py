@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应压缩基准测试：典型响应在 gzip / brotli / zstd 各压缩级别下的大小、压缩耗时和传输时间
+
+负载：客户列表（一页20条、500条）、AI分析结果JSON（中文长文本）、CSV导出（5000行）、小于阈值的短响应。
+输出每种编码和级别预设（response_compression.LEVEL_PRESETS）的压缩后大小、压缩/解压耗时，
+并按 --bandwidth 列出的带宽估算端到端耗时（压缩 + 传输 + 解压，不含RTT），最后对比流式逐块刷出的开销：
+
+    python benchmarks/bench_compression.py --bandwidth 2 10 100
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from response_compression import (LEVEL_PRESETS, COMPRESSION_MIN_SIZE, StreamCompressor, compress_bytes,
+                                  encoding_available)
+from serialization import dumps, iter_json
+
+INDUSTRIES = ['金融', '科技', '制造业', '教育培训', '医疗健康', '房地产']
+POSITIONS = ['总经理', '采购总监', '技术负责人', '市场经理', '创始人']
+ANALYSIS_PHRASES = [
+    '客户对交付周期非常关注，多次询问项目上线时间', '预算审批需要经过财务总监和CEO两级签字',
+    '目前使用竞品系统三年，对数据迁移的风险有顾虑', '决策链较长，建议先争取技术负责人的支持',
+    '上次沟通中表现出对AI自动化功能的强烈兴趣', '公司正处于快速扩张期，明年计划新增两个区域分公司',
+    '建议在下次拜访时安排产品演示，并准备同行业案例', '客户更看重长期服务能力而非一次性价格优惠',
+    '可以从降低人工成本和提升客户留存两个角度切入', '注意避免过度承诺定制开发的时间表',
+]
+
+
+def customer_page(count):
+    return dumps({
+        'customers': [{
+            'id': i + 1, 'name': f'客户{i}', 'industry': random.choice(INDUSTRIES),
+            'position': random.choice(POSITIONS), 'age_group': '35-45岁', 'phone': f'138{random.randint(0, 10**8):08d}',
+            'wechat': f'wx_{random.randint(0, 10**6)}', 'email': f'customer{i}@example.com',
+            'photo_url': f'/static/uploads/blobs/{random.getrandbits(256):064x}.jpg',
+            'priority': random.randint(1, 3), 'folder': '默认分组', 'sort_order': i + 1,
+            'created_at': f'2024-0{random.randint(1, 9)}-1{random.randint(0, 9)} 10:00:00',
+            'company': f'示例科技有限公司{random.randint(0, 500)}'
+        } for i in range(count)],
+        'pagination': {'page': 1, 'per_page': count, 'total': 12000, 'total_pages': 12000 // count}
+    })
+
+
+def analysis_json():
+    paragraphs = ['。'.join(random.sample(ANALYSIS_PHRASES, 6)) + '。' for _ in range(12)]
+    return dumps({
+        'customer_id': 42,
+        'analysis': {
+            'personality_traits': paragraphs[:3], 'business_needs': paragraphs[3:6],
+            'communication_style': paragraphs[6], 'decision_factors': paragraphs[7:9],
+            'risk_assessment': paragraphs[9], 'recommendations': paragraphs[10:],
+        },
+        'confidence_score': 0.87, 'model': 'deepseek-chat', 'created_at': '2024-06-01T10:00:00'
+    })
+
+
+def export_csv(rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['id', 'name', 'industry', 'position', 'priority', 'folder', 'phone', 'email',
+                     'communication_count', 'last_communication'])
+    for i in range(rows):
+        writer.writerow([i + 1, f'客户{i}', random.choice(INDUSTRIES), random.choice(POSITIONS), random.randint(1, 3),
+                         '默认分组', f'138{random.randint(0, 10**8):08d}', f'customer{i}@example.com',
+                         random.randint(0, 30), f'2024-05-{random.randint(10, 28)} 15:30:00'])
+    return output.getvalue().encode('utf-8-sig')
+
+
+def decompress(data, encoding):
+    if encoding == 'br':
+        import brotli
+        return brotli.decompress(data)
+    if encoding == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+def timed(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='响应压缩基准测试')
+    parser.add_argument('--bandwidth', type=float, nargs='+', default=[2, 10, 100], help='带宽（Mbps）')
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复次数（取中位数）')
+    args = parser.parse_args()
+
+    random.seed(7)
+    payloads = [
+        ('客户列表 20条', customer_page(20)),
+        ('客户列表 500条', customer_page(500)),
+        ('AI分析JSON', analysis_json()),
+        ('CSV导出 5000行', export_csv(5000)),
+        ('短响应', dumps({'success': True, 'message': '客户信息更新成功'})),
+    ]
+    encodings = [encoding for encoding in ('gzip', 'br', 'zstd') if encoding_available(encoding)]
+    print(f"可用编码: {', '.join(encodings)}，最小压缩大小: {COMPRESSION_MIN_SIZE} 字节")
+
+    defaults = {}
+    for name, data in payloads:
+        print(f"\n== {name}: {len(data) / 1024:.1f}KB")
+        if len(data) < COMPRESSION_MIN_SIZE:
+            print(f"   小于 {COMPRESSION_MIN_SIZE} 字节，不压缩")
+            continue
+        print(f"   {'编码':<6}{'预设':<9}{'大小(KB)':>10}{'压缩比':>8}{'压缩(ms)':>10}{'解压(ms)':>10}")
+        for encoding in encodings:
+            for preset, levels in LEVEL_PRESETS.items():
+                level = levels[encoding]
+                compress_ms, compressed = timed(lambda: compress_bytes(data, encoding, level), args.repeat)
+                decompress_ms, _ = timed(lambda: decompress(compressed, encoding), args.repeat)
+                print(f"   {encoding:<6}{preset:<9}{len(compressed) / 1024:>10.1f}{len(data) / len(compressed):>8.1f}"
+                      f"{compress_ms:>10.2f}{decompress_ms:>10.2f}")
+                if preset == 'default':
+                    defaults[(name, encoding)] = (len(compressed), compress_ms + decompress_ms)
+
+    print("\n== 端到端耗时估算（default预设：压缩 + 传输 + 解压，ms）")
+    header = ''.join(f"{f'{bandwidth:g}Mbps':>22}" for bandwidth in args.bandwidth)
+    print(f"   {'负载':<16}{'编码':<6}{header}")
+    for name, data in payloads:
+        if len(data) < COMPRESSION_MIN_SIZE:
+            continue
+        for encoding in ['identity'] + encodings:
+            size, cpu_ms = (len(data), 0.0) if encoding == 'identity' else defaults[(name, encoding)]
+            cells = ''.join(f"{cpu_ms + size * 8 / (bandwidth * 1000):>22.1f}" for bandwidth in args.bandwidth)
+            print(f"   {name:<16}{encoding:<6}{cells}")
+
+    # 流式响应逐块刷出（每500条一块）相对一次性压缩的大小开销
+    payload = {'customers': [{'id': i, 'name': f'客户{i}', 'industry': random.choice(INDUSTRIES),
+                              'email': f'customer{i}@example.com'} for i in range(10000)]}
+    chunks = list(iter_json(payload, 'customers'))
+    whole = b''.join(chunks)
+    print(f"\n== 流式压缩（10000条，{len(chunks)}块，共 {len(whole) / 1024:.1f}KB，default预设）")
+    for encoding in encodings:
+        level = LEVEL_PRESETS['default'][encoding]
+        compressor = StreamCompressor(encoding, level)
+        streamed = b''.join(compressor.compress(chunk) for chunk in chunks) + compressor.finish()
+        assert decompress(streamed, encoding) == whole
+        one_shot = compress_bytes(whole, encoding, level)
+        print(f"   {encoding:<6}逐块刷出 {len(streamed) / 1024:.1f}KB，一次性 {len(one_shot) / 1024:.1f}KB"
+              f"（+{(len(streamed) / len(one_shot) - 1) * 100:.1f}%）")
+
+
+if __name__ == '__main__':
+    main()
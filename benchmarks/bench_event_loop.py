@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FastAPI应用（ai_crm_improved.py）并发负载下的事件循环延迟
+
+用临时SQLite数据库启动应用（uvicorn 单进程），写入 --customers 个客户后，
+--concurrency 个保持连接的客户端循环请求读写混合的接口，压测结束后读取应用内
+loop_lag_monitor 的统计（/api/metrics/event-loop），输出事件循环延迟和各接口的延迟：
+
+    python benchmarks/bench_event_loop.py --customers 5000 --concurrency 32 --duration 15
+
+接口中如有同步数据库查询或其他阻塞调用，事件循环延迟会随数据量和并发升高；
+全部改为异步会话/线程池后，延迟应保持在几毫秒以内（--max-lag-ms，默认以p99判断）。
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+TAGS = ["MBA", "港澳", "深圳", "金融", "科技", "商会", "决策者", "复旦", "俱乐部", "制造"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def call(conn, method, path, body=None, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def wait_ready(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            status, _ = call(conn, 'GET', '/')
+            conn.close()
+            if status == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def seed_customers(db_path, count):
+    """直接写入SQLite（不经过接口），表由应用启动时创建"""
+    now = datetime.utcnow().isoformat(sep=' ')
+    rows = []
+    for i in range(count):
+        tags = random.sample(TAGS, 3)
+        rows.append((f'客户{i}', f'公司{i % 200}', json.dumps(tags, ensure_ascii=False), random.uniform(0, 100),
+                     random.randint(1, 3), random.randint(1, 15), '{}', '{}', '{}', now, now))
+    conn = sqlite3.connect(db_path)
+    conn.executemany('''
+        INSERT INTO customers (name, company, tags, progress, priority, folder_id,
+                               social_profiles, business_info, ai_profile, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    account = {'email': 'bench@example.com', 'password': 'bench-password', 'name': 'bench'}
+    status, data = call(conn, 'POST', '/api/auth/register', account)
+    if status != 200:
+        status, data = call(conn, 'POST', '/api/auth/login', {k: account[k] for k in ('email', 'password')})
+    conn.close()
+    return json.loads(data)['access_token']
+
+
+def metrics(path, port):
+    # 压测期间这条连接一直空闲，会被服务端的 keep-alive 超时关闭，每次新建连接
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    _, data = call(conn, 'GET', path)
+    conn.close()
+    return data
+
+
+def request_mix(customers):
+    """读写混合：(名称, 方法, 地址, 请求体)"""
+    customer_id = random.randint(1, customers)
+    return random.choice([
+        ('dashboard', 'GET', '/api/dashboard/stats', None),
+        ('tags', 'GET', '/api/tags/search?sort=frequency&limit=20', None),
+        ('reminders', 'GET', f'/api/customers/{customer_id}/reminders', None),
+        ('gain-steps', 'GET', '/api/gain-steps?circle=MBA', None),
+        ('progress', 'PUT', f'/api/customers/{customer_id}/progress',
+         {'customer_id': customer_id, 'progress': random.uniform(0, 100), 'auto_tasks': False}),
+        ('notes', 'POST', f'/api/customers/{customer_id}/notes',
+         {'customer_id': customer_id, 'notes': f'跟进记录 {time.time()}'}),
+        ('drag-drop', 'POST', '/api/customers/drag-drop',
+         {'customer_ids': random.sample(range(1, customers + 1), 5), 'target_folder_id': random.randint(1, 15)}),
+    ])
+
+
+def run_load(port, token, customers, concurrency, duration):
+    latencies = {}
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local, failed = {}, 0
+        while time.perf_counter() < stop_at:
+            name, method, path, body = request_mix(customers)
+            started = time.perf_counter()
+            try:
+                status, _ = call(conn, method, path, body, token)
+                if status >= 400:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+            local.setdefault(name, []).append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            for name, values in local.items():
+                latencies.setdefault(name, []).extend(values)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FastAPI事件循环延迟压测')
+    parser.add_argument('--customers', type=int, default=5000, help='写入的客户数')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发客户端数')
+    parser.add_argument('--duration', type=float, default=15, help='压测时长（秒）')
+    parser.add_argument('--max-lag-ms', type=float, default=5.0, help='事件循环延迟p99上限')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_loop_')
+    db_path = os.path.join(workdir, 'bench.sqlite')
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', LOOP_LAG_WARN_MS='1000',
+               PYTHONPATH=os.pathsep.join(filter(None, [str(project_root), os.environ.get('PYTHONPATH')])))
+    command = [sys.executable, '-m', 'uvicorn', 'ai_crm_improved:app', '--host', '127.0.0.1',
+               '--port', str(port), '--log-level', 'warning', '--no-access-log']
+    process = subprocess.Popen(command, cwd=project_root, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        if not wait_ready(port):
+            print('应用启动失败')
+            return 1
+        seed_customers(db_path, args.customers)
+        token = login(port)
+        run_load(port, token, args.customers, args.concurrency, min(3, args.duration))  # 预热
+
+        metrics('/api/metrics/event-loop?reset=true', port)
+        latencies, errors = run_load(port, token, args.customers, args.concurrency, args.duration)
+        data = metrics('/api/metrics/event-loop', port)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    stats = json.loads(data)
+    lag = stats['event_loop']
+    total = sum(len(values) for values in latencies.values())
+    print(f"CPU: {os.cpu_count()}, 客户数: {args.customers}, 并发: {args.concurrency}, 时长: {args.duration}s")
+    print(f"{'接口':<14}{'请求数':>8}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for name, values in sorted(latencies.items()):
+        print(f"{name:<14}{len(values):>8}{percentile(values, 0.5):>10.1f}{percentile(values, 0.99):>10.1f}")
+    print(f"合计 {total} 个请求，{total / args.duration:.1f} req/s，错误 {errors}")
+    print(f"事件循环延迟: 样本 {lag['samples']}，p50 {lag['p50_ms']:.2f}ms，p99 {lag['p99_ms']:.2f}ms，"
+          f"最大 {lag['max_ms']:.2f}ms")
+    print(f"数据库连接池: {stats['database']['async_pool']}")
+    passed = lag['p99_ms'] <= args.max_lag_ms
+    print(f"p99 {'<=' if passed else '>'} {args.max_lag_ms}ms: {'通过' if passed else '未通过'}")
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
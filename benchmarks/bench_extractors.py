@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件内容提取压测
+
+在临时目录生成大文件，对比旧的“全部读取再截断”实现和按字符预算提前停止的实现：
+- TXT: UTF-8 和 GBK 编码的大文本
+- PDF: 多页文本PDF（需要PyPDF2）
+- DOCX: 大量段落的文档（需要python-docx）
+
+    python benchmarks/bench_extractors.py --txt-mb 50 --pdf-pages 300 --docx-paragraphs 20000
+
+每种格式输出耗时（多次取最好值）、峰值内存和是否截断。
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from file_content_extractor import file_extractor, PDF_AVAILABLE, DOCX_AVAILABLE, TEXT_MAX_CHARS
+
+if PDF_AVAILABLE:
+    import PyPDF2
+if DOCX_AVAILABLE:
+    import docx
+
+LINE = '第{0}行：客户计划在下季度采购一批生产设备，预算约200万元，关注交付周期和售后服务。\n'
+
+
+# ----------------------------------------------------------------------
+# 旧实现（全部读取后截断），作为对照
+# ----------------------------------------------------------------------
+
+def legacy_txt(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            text = file.read()
+    except UnicodeDecodeError:
+        with open(file_path, 'r', encoding='gbk') as file:
+            text = file.read()
+    return text[:5000]
+
+
+def legacy_pdf(file_path):
+    text = ""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_num in range(len(pdf_reader.pages)):
+            page = pdf_reader.pages[page_num]
+            text += page.extract_text() + "\n"
+    return text.strip()[:5000]
+
+
+def legacy_docx(file_path):
+    doc = docx.Document(file_path)
+    text = ""
+    for paragraph in doc.paragraphs:
+        text += paragraph.text + "\n"
+    return text[:5000]
+
+
+# ----------------------------------------------------------------------
+# 测试文件
+# ----------------------------------------------------------------------
+
+def write_txt(path, size_mb, encoding):
+    target = size_mb * 1024 * 1024
+    written = 0
+    index = 0
+    with open(path, 'wb') as f:
+        while written < target:
+            chunk = ''.join(LINE.format(index + i) for i in range(1000)).encode(encoding)
+            f.write(chunk)
+            written += len(chunk)
+            index += 1000
+
+
+def write_pdf(path, pages, lines_per_page=40):
+    """生成只含ASCII文本的多页PDF（标准Helvetica字体，不依赖第三方库）"""
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_refs = []
+    for page in range(pages):
+        body = ['BT /F1 10 Tf 40 800 Td 12 TL']
+        for line in range(lines_per_page):
+            body.append(f'(Page {page + 1} line {line + 1}: budget 2 million, delivery in Q3.) Tj T*')
+        body.append('ET')
+        stream = '\n'.join(body).encode('ascii')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                        f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>').encode('ascii'))
+        page_refs.append(f'{len(objects)} 0 R')
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {pages} >>".encode('ascii')
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n%s\nendobj\n' % (number, obj)
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        output += b'%010d 00000 n \n' % offset
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    Path(path).write_bytes(bytes(output))
+
+
+def write_docx(path, paragraphs):
+    document = docx.Document()
+    for index in range(paragraphs):
+        document.add_paragraph(LINE.format(index).strip())
+    document.save(path)
+
+
+# ----------------------------------------------------------------------
+# 计时
+# ----------------------------------------------------------------------
+
+def measure(func, repeat):
+    """返回 (最好耗时, 峰值内存字节, 返回值)"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文件内容提取压测')
+    parser.add_argument('--txt-mb', type=int, default=20, help='TXT测试文件大小（MB）')
+    parser.add_argument('--pdf-pages', type=int, default=300, help='PDF测试文件页数')
+    parser.add_argument('--docx-paragraphs', type=int, default=20000, help='DOCX测试文件段落数')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最好值')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_extractors_') as workdir:
+        cases = []
+
+        for encoding in ('utf-8', 'gbk'):
+            path = str(Path(workdir) / f'large_{encoding}.txt')
+            write_txt(path, args.txt_mb, encoding)
+            cases.append((f'txt/{encoding} {args.txt_mb}MB', path,
+                          lambda p=path: legacy_txt(p),
+                          lambda p=path: file_extractor.extract_txt_text(p)))
+
+        if PDF_AVAILABLE:
+            path = str(Path(workdir) / 'large.pdf')
+            write_pdf(path, args.pdf_pages)
+            cases.append((f'pdf {args.pdf_pages}页', path,
+                          lambda p=path: legacy_pdf(p),
+                          lambda p=path: file_extractor.extract_pdf_text(p)))
+        else:
+            print('跳过PDF: 未安装PyPDF2')
+
+        if DOCX_AVAILABLE:
+            path = str(Path(workdir) / 'large.docx')
+            write_docx(path, args.docx_paragraphs)
+            cases.append((f'docx {args.docx_paragraphs}段', path,
+                          lambda p=path: legacy_docx(p),
+                          lambda p=path: file_extractor.extract_docx_text(p)))
+        else:
+            print('跳过DOCX: 未安装python-docx')
+
+        header = f"{'文件':<22}{'旧(ms)':>10}{'新(ms)':>10}{'加速':>8}{'旧峰值(KB)':>14}{'新峰值(KB)':>14}{'截断':>6}{'内容一致':>10}"
+        print(f"字符预算: {TEXT_MAX_CHARS}")
+        print(header)
+        print('-' * len(header))
+        for name, _, legacy, bounded in cases:
+            legacy_time, legacy_peak, legacy_text = measure(legacy, args.repeat)
+            bounded_time, bounded_peak, (text, truncated) = measure(bounded, args.repeat)
+            same = legacy_text.strip() == text.strip()
+            print(f"{name:<22}{legacy_time * 1000:>10.1f}{bounded_time * 1000:>10.2f}"
+                  f"{legacy_time / bounded_time if bounded_time else 0:>8.0f}x"
+                  f"{legacy_peak / 1024:>14.0f}{bounded_peak / 1024:>14.0f}{str(truncated):>6}{str(same):>10}")
+
+
+if __name__ == '__main__':
+    main()
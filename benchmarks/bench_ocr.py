@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+名片OCR吞吐量压测
+
+生成一批名片图片（默认600DPI的大图，接近手机拍照/扫描件），对比：
+- 旧方式: 每张图片调用 pytesseract.image_to_string（启动tesseract进程并重新加载语言模型）；
+  未安装tesseract命令行时，用“每张图片新建一个 PyTessBaseAPI 引擎”模拟重新加载模型的开销
+- OCR服务: ocr_service.recognize_batch（常驻引擎池 + 预处理 + 并发）
+
+    python benchmarks/bench_ocr.py --images 32 --engines 4
+
+语言由 OCR_LANG 控制（默认 chi_sim+eng），需要对应的 traineddata。
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+import ocr_service as ocr_module
+from ocr_service import OCRService, OCR_LANG
+
+CARD_LINES = ('Zhang Wei', 'Sales Director', 'Huaxin Industrial Co., Ltd.',
+              'Tel: 138 0013 {0:04d}', 'zhang.wei{0}@huaxin.com', 'No.{0} Keji Road, Shenzhen')
+
+
+def make_cards(count, dpi):
+    """生成名片图片（3.5 x 2 英寸），返回PNG字节列表"""
+    from PIL import Image, ImageDraw, ImageFont
+    import io
+
+    width, height = int(3.5 * dpi), int(2 * dpi)
+    font = ImageFont.load_default(size=dpi // 10)
+    cards = []
+    for index in range(count):
+        image = Image.new('RGB', (width, height), (245, 242, 235))
+        draw = ImageDraw.Draw(image)
+        for line_index, line in enumerate(CARD_LINES):
+            draw.text((dpi // 5, dpi // 6 + line_index * dpi // 4), line.format(index),
+                      fill=(30, 30, 30), font=font)
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', dpi=(dpi, dpi))
+        cards.append(buffer.getvalue())
+    return cards
+
+
+def legacy_recognize(card):
+    """旧方式：未预处理，每张图片重新加载语言模型"""
+    import io
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(card))
+    if ocr_module.PYTESSERACT_AVAILABLE and _tesseract_cli_available():
+        return ocr_module.pytesseract.image_to_string(image, lang=OCR_LANG)
+    with ocr_module.PyTessBaseAPI(lang=OCR_LANG) as engine:
+        engine.SetImage(image)
+        return engine.GetUTF8Text()
+
+
+def _tesseract_cli_available():
+    try:
+        ocr_module.pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='名片OCR吞吐量压测')
+    parser.add_argument('--images', type=int, default=32, help='名片数量')
+    parser.add_argument('--dpi', type=int, default=600, help='生成图片的DPI')
+    parser.add_argument('--engines', type=int, default=os.cpu_count() or 2, help='OCR服务的常驻引擎数')
+    parser.add_argument('--skip-legacy', action='store_true', help='不跑旧方式对照')
+    args = parser.parse_args()
+
+    service = OCRService(engines=args.engines)
+    if not service.available:
+        print('OCR不可用：请安装PIL和tesserocr（或pytesseract）')
+        return 1
+
+    cards = make_cards(args.images, args.dpi)
+    print(f"后端: {service.backend}, 语言: {OCR_LANG}, 图片: {len(cards)} 张 @ {args.dpi}DPI, 引擎: {args.engines}")
+
+    if not args.skip_legacy:
+        if ocr_module.PYTESSERACT_AVAILABLE and _tesseract_cli_available():
+            legacy_name = 'pytesseract 每张一个进程'
+        elif ocr_module.TESSEROCR_AVAILABLE:
+            legacy_name = '每张新建引擎（模拟）'
+        else:
+            legacy_name = None
+        if legacy_name:
+            started = time.perf_counter()
+            for card in cards:
+                legacy_recognize(card)
+            legacy_seconds = time.perf_counter() - started
+            print(f"{legacy_name:<24}{legacy_seconds:>8.2f}s{len(cards) / legacy_seconds:>10.1f} 张/秒")
+
+    # 预热：创建常驻引擎
+    service.recognize_batch(cards[:args.engines])
+    started = time.perf_counter()
+    results = service.recognize_batch(cards)
+    service_seconds = time.perf_counter() - started
+    failures = sum(1 for result in results if not result['success'])
+    print(f"{'OCR服务（常驻引擎）':<24}{service_seconds:>8.2f}s{len(cards) / service_seconds:>10.1f} 张/秒"
+          f"  失败: {failures}")
+    print(f"识别示例: {results[0]['text'].strip()[:80]!r}")
+    print(f"统计: {service.stats()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+话术提示词构建微基准测试
+
+对比两种路径的单次调用耗时和内存分配：
+- cold: 每次调用前清空模板缓存，相当于每次重新拼装全部静态文本
+- warm: 模板已编译并缓存，只渲染客户相关槽位
+
+用法: python benchmarks/bench_prompt_templates.py [--iterations 20000]
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from prompt_templates import prompt_templates
+
+CUSTOMER = {
+    'name': '张三',
+    'company': '示例科技有限公司',
+    'position': '采购总监',
+    'industry': '制造业',
+    'project_background': '计划在下季度升级现有ERP系统，预算约80万',
+    'communication_summary': '沟通历史摘要（共6条记录）：\n- 关注交付周期和售后响应\n- 已约定下周演示'
+}
+
+ADVANCED_SETTINGS = {
+    'roleSettings': {
+        'professionalRole': 'business_consultant',
+        'educationBackground': 'mba',
+        'experienceYears': '5-10',
+        'services': {'strategyPlanning': True, 'marketAnalysis': True}
+    },
+    'languageStyle': 'consultative',
+    'scriptLength': 3,
+    'creativity': 0.6,
+    'channelOptimization': 'meeting'
+}
+
+COMBINATIONS = [
+    ('opening', 'straightLine', 'deepseek-reasoner'),
+    ('closing', 'spin', 'grok-4'),
+    ('objection_handling', 'challenger', None),
+    ('follow_up', 'value', 'openai-gpt4'),
+]
+
+
+def build(cold: bool, index: int) -> str:
+    script_type, methodology, model_name = COMBINATIONS[index % len(COMBINATIONS)]
+    if cold:
+        prompt_templates.clear_cache()
+    return prompt_templates.render_script_prompt(CUSTOMER, script_type, methodology,
+                                                 ADVANCED_SETTINGS, model_name)
+
+
+def measure_time(cold: bool, iterations: int) -> float:
+    # 预热
+    for i in range(len(COMBINATIONS)):
+        build(False, i)
+    start = time.perf_counter()
+    for i in range(iterations):
+        build(cold, i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def measure_allocations(cold: bool, iterations: int):
+    for i in range(len(COMBINATIONS)):
+        build(False, i)
+    tracemalloc.start()
+    peak_total = 0
+    blocks_total = 0
+    for i in range(iterations):
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot() if i == 0 else None
+        base, _ = tracemalloc.get_traced_memory()
+        build(cold, i)
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - base
+        if before is not None:
+            after = tracemalloc.take_snapshot()
+            blocks_total = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    tracemalloc.stop()
+    return peak_total / iterations, blocks_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='话术提示词构建微基准测试')
+    parser.add_argument('--iterations', type=int, default=20000, help='计时迭代次数')
+    parser.add_argument('--alloc-iterations', type=int, default=500, help='内存分配统计迭代次数')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("话术提示词构建微基准测试")
+    print("=" * 60)
+    print(f"{'路径':<8}{'耗时/次(μs)':>14}{'峰值分配/次(B)':>18}{'新增内存块(首次)':>18}")
+    for label, cold in (('cold', True), ('warm', False)):
+        per_call_us = measure_time(cold, args.iterations)
+        peak_bytes, blocks = measure_allocations(cold, args.alloc_iterations)
+        print(f"{label:<8}{per_call_us:>14.2f}{peak_bytes:>18.0f}{blocks:>18}")
+    print("-" * 60)
+    print(f"缓存统计: {prompt_templates.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
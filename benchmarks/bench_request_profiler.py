@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求性能分析（request_profiler.py）的开销
+
+1. 单条SQL语句：sqlite3 默认连接 vs ProfiledConnection（请求之外 / 请求之中）
+2. 钩子本身：before_request + after_request（创建记录、结束计时、计入路由直方图）
+3. 整个请求：最小Flask应用，每个请求执行 --queries 条主键查询并返回JSON，
+   对比未注册 request_profiler 和注册后的每请求耗时（Flask测试客户端，单线程，两者交替运行 --rounds 轮取最好一轮）；
+   未注册的应用没有任何钩子，差值还包括Flask调度钩子本身的开销（app.py 已有其他钩子，实际增加的更少）
+
+    python benchmarks/bench_request_profiler.py --requests 3000 --queries 10
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+import request_profiler as profiler_module
+from request_profiler import ProfiledConnection, RequestProfile, RequestProfiler
+
+
+def create_db(path, rows=1000):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT, folder TEXT)')
+    conn.executemany('INSERT INTO customers (name, folder) VALUES (?, ?)',
+                     [(f'客户{i}', '默认分组') for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+
+def per_statement(path, count):
+    """每条语句的平均耗时（微秒）"""
+    def run(conn):
+        started = time.perf_counter()
+        for i in range(count):
+            conn.execute('SELECT name FROM customers WHERE id = ?', (i % 1000 + 1,)).fetchone()
+        return (time.perf_counter() - started) / count * 1e6
+
+    plain = sqlite3.connect(path)
+    profiled = sqlite3.connect(path, factory=ProfiledConnection)
+    results = {'默认连接': run(plain), 'ProfiledConnection 请求之外': run(profiled)}
+    token = profiler_module._current_profile.set(RequestProfile('GET', '/bench', '/bench'))
+    try:
+        results['ProfiledConnection 请求之中'] = run(profiled)
+    finally:
+        profiler_module._current_profile.reset(token)
+    plain.close()
+    profiled.close()
+    return results
+
+
+def create_app(path, queries):
+    from flask import Flask, jsonify
+
+    app = Flask(__name__)
+
+    @app.route('/api/customers/<int:customer_id>')
+    def customer(customer_id):
+        conn = sqlite3.connect(path)
+        rows = [conn.execute('SELECT id, name, folder FROM customers WHERE id = ?', (customer_id + i,)).fetchone()
+                for i in range(queries)]
+        conn.close()
+        return jsonify({'customers': rows})
+
+    return app
+
+
+def per_hooks(app, count):
+    """一次 before_request + after_request 的耗时（微秒）"""
+    before = app.before_request_funcs[None][0]
+    after = app.after_request_funcs[None][0]
+    with app.test_request_context('/api/customers/1'):
+        response = app.make_response('ok')
+        started = time.perf_counter()
+        for _ in range(count):
+            before()
+            after(response)
+        return (time.perf_counter() - started) / count * 1e6
+
+
+def per_request(app, requests):
+    client = app.test_client()
+    timings = []
+    for i in range(requests):
+        started = time.perf_counter()
+        response = client.get(f'/api/customers/{i % 900 + 1}')
+        response.close()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return statistics.fmean(timings) * 1000, timings[len(timings) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='请求性能分析开销')
+    parser.add_argument('--requests', type=int, default=3000, help='每种配置的请求数')
+    parser.add_argument('--queries', type=int, default=10, help='每个请求的SQL语句数')
+    parser.add_argument('--statements', type=int, default=50000, help='单条语句测试的执行次数')
+    parser.add_argument('--rounds', type=int, default=5, help='轮数')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_profiler_')
+    path = os.path.join(workdir, 'bench.sqlite')
+    create_db(path)
+
+    print(f"== 单条主键查询（{args.statements}次，微秒/条）")
+    for name, value in per_statement(path, args.statements).items():
+        print(f"   {name:<28}{value:>8.2f}")
+
+    # 未注册的应用使用默认连接类，注册后 sqlite3.connect 被替换，这里分别保存两个 connect
+    plain_connect = sqlite3.connect
+    plain_app = create_app(path, args.queries)
+    profiled_app = create_app(path, args.queries)
+    RequestProfiler(enabled=True).init_app(profiled_app)
+    profiled_connect = sqlite3.connect
+
+    def measure(app, connect):
+        sqlite3.connect = connect
+        return per_request(app, args.requests)
+
+    measure(plain_app, plain_connect)  # 预热
+    measure(profiled_app, profiled_connect)
+    rounds = [(measure(plain_app, plain_connect), measure(profiled_app, profiled_connect))
+              for _ in range(args.rounds)]
+    plain = min(result[0] for result in rounds)
+    profiled = min(result[1] for result in rounds)
+
+    print(f"\n== request_profiler 钩子: {per_hooks(profiled_app, args.statements):.2f}µs/请求")
+
+    print(f"\n== 每请求耗时（{args.requests}个请求，每个 {args.queries} 条SQL，ms）")
+    print(f"   {'配置':<16}{'平均':>8}{'中位数':>8}")
+    print(f"   {'未注册':<16}{plain[0]:>8.3f}{plain[1]:>8.3f}")
+    print(f"   {'request_profiler':<16}{profiled[0]:>8.3f}{profiled[1]:>8.3f}")
+    print(f"   开销: 平均 +{(profiled[0] - plain[0]) * 1000:.0f}µs/请求（{(profiled[0] / plain[0] - 1) * 100:+.1f}%）")
+
+
+if __name__ == '__main__':
+    main()
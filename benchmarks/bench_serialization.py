@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列表接口响应编码微基准测试：标准库 json vs serialization.py（orjson / MessagePack）
+
+构造 --customers 个客户，分别按三种负载编码，输出编码耗时（多次取中位数）和负载大小：
+- Flask客户列表（/api/customers 的字段，时间为数据库中的字符串）：
+  Flask默认 jsonify（json，ensure_ascii=True、sort_keys=True）/ orjson / MessagePack / 流式分批编码
+- FastAPI客户列表（datetime、Decimal、标签列表）：
+  FastAPI默认（jsonable_encoder + JSONResponse）/ orjson（negotiated_response 跳过 jsonable_encoder）/ MessagePack
+- JSON导出（indent=2）：json.dumps / orjson OPT_INDENT_2
+
+用法: python benchmarks/bench_serialization.py [--customers 10000] [--repeat 7]
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+import serialization
+from serialization import dumps, packb, iter_json, encode_default
+
+INDUSTRIES = ['金融', '科技', '制造业', '教育培训', '医疗健康', '房地产']
+POSITIONS = ['总经理', '采购总监', '技术负责人', '市场经理', '创始人']
+TAGS = ['MBA', '港澳', '深圳', '决策者', '复旦', '商会', '高净值']
+
+
+def flask_customers(count):
+    """与 app.py handle_customers 返回的结构相同"""
+    customers = []
+    for i in range(count):
+        created = (datetime(2024, 1, 1) + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S')
+        customers.append({
+            'id': i + 1,
+            'name': f'客户{i}',
+            'industry': random.choice(INDUSTRIES),
+            'position': random.choice(POSITIONS),
+            'age_group': '35-45岁',
+            'phone': f'138{i:08d}',
+            'wechat': f'wx_{i}',
+            'email': f'customer{i}@example.com',
+            'photo_url': f'/static/uploads/blobs/{i:064x}.jpg',
+            'photo_thumb_url': f'/static/thumbs/sm/blobs/{i:064x}.webp',
+            'priority': random.randint(1, 3),
+            'folder': '默认分组',
+            'sort_order': i + 1,
+            'created_at': created,
+            'updated_at': created,
+            'company': f'示例科技有限公司{i % 500}'
+        })
+    return {
+        'customers': customers,
+        'pagination': {'page': 1, 'per_page': count, 'total': count, 'total_pages': 1,
+                       'has_next': False, 'has_prev': False}
+    }
+
+
+def fastapi_customers(count):
+    """与 main.py get_customers 返回的结构相同（ORM取出的 datetime、Decimal、JSON列）"""
+    now = datetime(2024, 1, 1, 9, 30)
+    return [
+        {
+            'id': i + 1,
+            'name': f'客户{i}',
+            'email': f'customer{i}@example.com',
+            'phone': f'138{i:08d}',
+            'company': f'示例科技有限公司{i % 500}',
+            'position': random.choice(POSITIONS),
+            'industry': random.choice(INDUSTRIES),
+            'tags': random.sample(TAGS, 3),
+            'progress': round(random.uniform(0, 100), 1),
+            'priority': random.randint(1, 3),
+            'ai_score': Decimal(f'{random.uniform(0, 100):.2f}'),
+            'created_at': now + timedelta(minutes=i),
+            'updated_at': now + timedelta(minutes=i, seconds=30)
+        }
+        for i in range(count)
+    ]
+
+
+def flask_default_dumps(obj):
+    # Flask DefaultJSONProvider 的默认参数
+    return json.dumps(obj, default=encode_default, ensure_ascii=True, sort_keys=True).encode('utf-8')
+
+
+def fastapi_default_render(obj):
+    # FastAPI 未声明 response_model 时：jsonable_encoder 逐个转换后由 JSONResponse 编码
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    return JSONResponse(jsonable_encoder(obj)).body
+
+
+def measure(func, payload, repeat):
+    timings = []
+    result = b''
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(payload)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='列表接口响应编码微基准测试')
+    parser.add_argument('--customers', type=int, default=10000, help='客户数')
+    parser.add_argument('--repeat', type=int, default=7, help='每项重复次数（取中位数）')
+    args = parser.parse_args()
+
+    random.seed(42)
+    flask_payload = flask_customers(args.customers)
+    fastapi_payload = fastapi_customers(args.customers)
+    export_payload = {'export_time': datetime.now().isoformat(), 'total_records': args.customers,
+                      'customers': flask_payload['customers']}
+
+    cases = [
+        ('Flask列表', 'jsonify 默认（json）', flask_default_dumps, flask_payload),
+        ('Flask列表', 'serialization.dumps', dumps, flask_payload),
+        ('Flask列表', '流式 iter_json', lambda p: b''.join(iter_json(p, 'customers')), flask_payload),
+        ('FastAPI列表', 'serialization.dumps', dumps, fastapi_payload),
+        ('JSON导出', 'json.dumps indent=2',
+         lambda p: json.dumps(p, ensure_ascii=False, indent=2).encode('utf-8'), export_payload),
+        ('JSON导出', 'dumps(pretty=True)', lambda p: dumps(p, pretty=True), export_payload),
+    ]
+    try:
+        import fastapi  # noqa: F401
+        cases.insert(3, ('FastAPI列表', 'FastAPI默认（jsonable_encoder）', fastapi_default_render, fastapi_payload))
+    except ImportError:
+        print('未安装fastapi，跳过FastAPI默认编码')
+    if serialization.MSGPACK_AVAILABLE:
+        cases.insert(3, ('Flask列表', 'MessagePack', packb, flask_payload))
+        cases.insert(-2, ('FastAPI列表', 'MessagePack', packb, fastapi_payload))
+    else:
+        print('未安装msgpack，跳过MessagePack')
+
+    print(f"客户数: {args.customers}，JSON编码: {'orjson' if serialization.ORJSON_AVAILABLE else 'json（未安装orjson）'}")
+    print(f"{'负载':<12}{'编码方式':<32}{'耗时(ms)':>10}{'大小(KB)':>12}")
+    for group, name, func, payload in cases:
+        elapsed, size = measure(func, payload, args.repeat)
+        print(f"{group:<12}{name:<32}{elapsed:>10.1f}{size / 1024:>12.1f}")
+
+    # 流式发送时客户端收到第一块数据前的编码耗时
+    started = time.perf_counter()
+    chunks = iter_json(flask_payload, 'customers')
+    next(chunks)
+    next(chunks)
+    print(f"流式编码首块（{serialization.JSON_STREAM_BATCH_SIZE}条）耗时: {(time.perf_counter() - started) * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Web服务吞吐量压测：Werkzeug开发服务器 vs serve.py（gunicorn 多进程 + 多线程）
+
+分别启动两种服务器（使用当前的 config.py 和数据库，只发送GET请求），
+用 --concurrency 个保持连接的客户端循环请求 --paths 中的地址，输出吞吐量、延迟和内存：
+
+    python benchmarks/bench_serving.py --workers 4 --threads 8 --concurrency 32 --duration 15
+
+内存一列为服务器所有进程的PSS之和（共享页面按进程数分摊），体现预加载后写时复制的效果。
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+DEFAULT_PATHS = ['/api/customers?per_page=50', '/api/ai/telemetry', '/static/css/style.css']
+DEV_SERVER = ("import logging; logging.disable(logging.INFO); import app; app.init_db(); "
+              "app.app.run(host='127.0.0.1', port={port}, threaded=True, use_reloader=False)")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port, path, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', path)
+            conn.getresponse().read()
+            conn.close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def process_tree_pss_kb(pid):
+    """进程及其子进程的PSS之和（KB），读取 /proc，非Linux时返回None"""
+    pids = [pid]
+    try:
+        children = subprocess.run(['pgrep', '-P', str(pid)], capture_output=True, text=True).stdout.split()
+        pids.extend(int(child) for child in children)
+        total = 0
+        for each in pids:
+            with open(f'/proc/{each}/smaps_rollup') as f:
+                for line in f:
+                    if line.startswith('Pss:'):
+                        total += int(line.split()[1])
+        return total
+    except (OSError, ValueError):
+        return None
+
+
+def run_load(port, paths, concurrency, duration):
+    """闭环压测：每个客户端一个长连接，收到响应后立即发送下一个请求"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def request(conn, path):
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response
+
+    def client(index):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local, failed, n = [], 0, index
+        while time.perf_counter() < stop_at:
+            path = paths[n % len(paths)]
+            n += 1
+            started = time.perf_counter()
+            try:
+                try:
+                    response = request(conn, path)
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # 服务器关闭了空闲的长连接（如工作进程按 max_requests 重启），与浏览器一样重连重试一次
+                    conn.close()
+                    response = request(conn, path)
+                if response.status >= 500:
+                    failed += 1
+                local.append(time.perf_counter() - started)
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        'errors': errors[0],
+    }
+
+
+def bench_server(name, command, port, args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(project_root),
+                                                                   os.environ.get('PYTHONPATH')])))
+    process = subprocess.Popen(command, cwd=project_root, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        if not wait_ready(port, args.paths[0]):
+            print(f"{name}: 启动失败")
+            return None
+        run_load(port, args.paths, args.concurrency, min(3, args.duration))  # 预热
+        result = run_load(port, args.paths, args.concurrency, args.duration)
+        result['pss_mb'] = (process_tree_pss_kb(process.pid) or 0) / 1024
+        return result
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=args.graceful_timeout + 5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Web服务吞吐量压测')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='serve.py 工作进程数')
+    parser.add_argument('--threads', type=int, default=8, help='serve.py 每个工作进程的线程数')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发客户端数')
+    parser.add_argument('--duration', type=float, default=15, help='每个服务器的压测时长（秒）')
+    parser.add_argument('--graceful-timeout', type=int, default=5)
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS, help='循环请求的地址（只用GET）')
+    args = parser.parse_args()
+
+    print(f"CPU: {os.cpu_count()}, 并发: {args.concurrency}, 时长: {args.duration}s, 地址: {args.paths}")
+    header = f"{'服务器':<28}{'请求数':>8}{'req/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'错误':>6}{'PSS(MB)':>10}"
+    print(header)
+    print('-' * len(header))
+
+    dev_port, prod_port = free_port(), free_port()
+    servers = [
+        ('Werkzeug 开发服务器', [sys.executable, '-c', DEV_SERVER.format(port=dev_port)], dev_port),
+        (f'serve.py {args.workers}进程x{args.threads}线程',
+         [sys.executable, 'serve.py', '--host', '127.0.0.1', '--port', str(prod_port),
+          '--workers', str(args.workers), '--threads', str(args.threads),
+          '--graceful-timeout', str(args.graceful_timeout)], prod_port),
+    ]
+    results = []
+    for name, command, port in servers:
+        result = bench_server(name, command, port, args)
+        if result:
+            results.append(result)
+            print(f"{name:<28}{result['requests']:>8}{result['rps']:>10.1f}{result['p50']:>10.1f}"
+                  f"{result['p99']:>10.1f}{result['errors']:>6}{result['pss_mb']:>10.1f}")
+    if len(results) == 2 and results[0]['rps']:
+        print(f"吞吐量提升: {results[1]['rps'] / results[0]['rps']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟AI服务商，用于压测AI相关接口而不消耗真实配额
+
+实现 AIServiceManager 调用的接口：
+- POST .../chat/completions            OpenAI兼容接口，支持 stream=true（SSE）
+- POST .../models/<model>:generateContent   Gemini接口
+- GET  .../models                      模型列表
+
+延迟、错误率、429比例和输出速度均可配置。应用通过环境变量
+AI_MOCK_BASE_URL=http://127.0.0.1:8900/v1 把所有模型请求指向本服务。
+
+用法: python benchmarks/mock_llm_server.py --port 8900 --latency-ms 800 --tokens-per-sec 60
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 分析和话术接口都要求返回JSON，模拟响应同时包含两类字段
+MOCK_FIELDS = {
+    'profile_analysis': '客户是制造业企业的采购负责人，决策谨慎，重视交付周期和售后响应，'
+                        '对数字化升级有明确预算，但需要看到同行案例才会推进。',
+    'next_contact_suggestion': '建议三天内电话跟进，准备两家同行业客户的实施案例，约定下周现场演示。',
+    'sales_opportunity': '客户已有明确预算和时间节点，主要障碍是对实施风险的担忧，机会评估为中高。',
+    'success_probability': 0.55,
+    'recommended_approach': '采用顾问式销售，先梳理现有流程痛点，再用量化的投资回报说明方案价值。',
+    'opening': '您好，上次您提到交付周期是今年的重点，我整理了几家同行的改进数据想和您分享。',
+    'pain_point': '现在订单波动大，排产靠人工经验，一旦插单就容易延误交付，售后也难以追溯。',
+    'solution': '我们的方案把排产和售后工单打通，插单时自动重排并提示风险，交付准时率平均提升两成。',
+    'social_proof': '同区域一家规模相近的企业上线三个月后，交付延误减少了四成，客服工单处理时间减半。',
+    'next_step': '我建议下周安排一次一小时的现场演示，用您的真实订单数据跑一遍，您看周二还是周四方便？'
+}
+
+
+class MockSettings:
+    """模拟服务的行为参数"""
+
+    def __init__(self, latency_ms=500.0, latency_dist='lognormal', jitter=0.3, error_rate=0.0,
+                 throttle_rate=0.0, tokens_per_sec=0.0, completion_tokens=300):
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.tokens_per_sec = tokens_per_sec
+        self.completion_tokens = completion_tokens
+
+    def first_token_delay(self) -> float:
+        """首个令牌前的延迟（秒），按配置的分布抽样"""
+        mean = self.latency_ms / 1000.0
+        if mean <= 0:
+            return 0.0
+        if self.latency_dist == 'fixed':
+            return mean
+        if self.latency_dist == 'normal':
+            return max(0.0, random.gauss(mean, mean * self.jitter))
+        if self.latency_dist == 'exponential':
+            return random.expovariate(1.0 / mean)
+        # lognormal：长尾分布，最接近真实服务商
+        sigma = self.jitter
+        return random.lognormvariate(0, sigma) * mean / (2.718281828 ** (sigma * sigma / 2))
+
+    def generation_time(self, tokens: int) -> float:
+        return tokens / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight
+            }
+
+
+def _mock_content(prompt: str) -> str:
+    if 'JSON' in prompt or 'json' in prompt:
+        return json.dumps(MOCK_FIELDS, ensure_ascii=False)
+    return '、'.join(str(value) for value in MOCK_FIELDS.values())
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 2)
+
+
+def make_handler(settings: MockSettings, stats: MockStats):
+
+    class MockLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b'{}'
+            try:
+                return json.loads(raw or b'{}')
+            except ValueError:
+                return {}
+
+        def _inject_failure(self) -> bool:
+            roll = random.random()
+            if roll < settings.throttle_rate:
+                with stats.lock:
+                    stats.throttled += 1
+                self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit'}},
+                                {'Retry-After': '1'})
+                return True
+            if roll < settings.throttle_rate + settings.error_rate:
+                with stats.lock:
+                    stats.errors += 1
+                self._send_json(500, {'error': {'message': 'Mock upstream error', 'type': 'server_error'}})
+                return True
+            return False
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/models'):
+                self._send_json(200, {'object': 'list', 'data': [
+                    {'id': name, 'object': 'model', 'owned_by': 'mock'}
+                    for name in ('deepseek-chat', 'deepseek-reasoner', 'gpt-4', 'grok-4', 'moonshot-v1-8k')
+                ], 'models': [{'name': 'models/gemini-pro'}]})
+            elif self.path.rstrip('/') == '/stats':
+                self._send_json(200, stats.snapshot())
+            else:
+                self._send_json(404, {'error': {'message': 'Not found'}})
+
+        def do_POST(self):
+            body = self._read_json()
+            with stats.lock:
+                stats.requests += 1
+                stats.in_flight += 1
+                stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+            try:
+                if self._inject_failure():
+                    return
+                path = self.path.split('?', 1)[0]
+                if path.endswith('/chat/completions'):
+                    self._chat_completions(body)
+                elif ':generateContent' in path:
+                    self._gemini_generate(body, path)
+                else:
+                    self._send_json(404, {'error': {'message': 'Not found'}})
+            finally:
+                with stats.lock:
+                    stats.in_flight -= 1
+
+        def _chat_completions(self, body):
+            prompt = ''.join(str(m.get('content', '')) for m in body.get('messages', []))
+            content = _mock_content(prompt)
+            prompt_tokens = _estimate_tokens(prompt)
+            completion_tokens = min(settings.completion_tokens, body.get('max_tokens') or settings.completion_tokens)
+            model = body.get('model', 'mock')
+
+            time.sleep(settings.first_token_delay())
+            if body.get('stream'):
+                self._stream_chat(model, content, completion_tokens)
+                return
+
+            time.sleep(settings.generation_time(completion_tokens))
+            self._send_json(200, {
+                'id': f'chatcmpl-{uuid.uuid4().hex[:12]}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens}
+            })
+
+        def _stream_chat(self, model, content, completion_tokens):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            chunk_id = f'chatcmpl-{uuid.uuid4().hex[:12]}'
+            pieces = [content[i:i + 8] for i in range(0, len(content), 8)] or ['']
+            delay = settings.generation_time(completion_tokens) / len(pieces)
+            for index, piece in enumerate(pieces):
+                delta = {'content': piece}
+                if index == 0:
+                    delta['role'] = 'assistant'
+                self._write_event({'id': chunk_id, 'object': 'chat.completion.chunk', 'model': model,
+                                   'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})
+                if delay:
+                    time.sleep(delay)
+            self._write_event({'id': chunk_id, 'object': 'chat.completion.chunk', 'model': model,
+                               'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+            self._write_chunk(b'data: [DONE]\n\n')
+            self._write_chunk(b'')
+
+        def _write_event(self, payload):
+            self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+        def _gemini_generate(self, body, path):
+            prompt = ''.join(part.get('text', '') for item in body.get('contents', [])
+                             for part in item.get('parts', []))
+            content = _mock_content(prompt)
+            prompt_tokens = _estimate_tokens(prompt)
+            max_tokens = body.get('generationConfig', {}).get('maxOutputTokens') or settings.completion_tokens
+            completion_tokens = min(settings.completion_tokens, max_tokens)
+
+            time.sleep(settings.first_token_delay() + settings.generation_time(completion_tokens))
+            self._send_json(200, {
+                'candidates': [{'content': {'parts': [{'text': content}], 'role': 'model'},
+                                'finishReason': 'STOP'}],
+                'usageMetadata': {'promptTokenCount': prompt_tokens,
+                                  'candidatesTokenCount': completion_tokens,
+                                  'totalTokenCount': prompt_tokens + completion_tokens},
+                'modelVersion': path.rsplit('/', 1)[-1].split(':', 1)[0]
+            })
+
+    return MockLLMHandler
+
+
+def start_mock_server(host='127.0.0.1', port=8900, settings=None):
+    """在后台线程启动模拟服务，返回 (server, stats)"""
+    stats = MockStats()
+    server = ThreadingHTTPServer((host, port), make_handler(settings or MockSettings(), stats))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server, stats
+
+
+def add_settings_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=500, help='首个令牌前的平均延迟（毫秒）')
+    parser.add_argument('--latency-dist', default='lognormal', choices=['fixed', 'normal', 'lognormal', 'exponential'],
+                        help='延迟分布')
+    parser.add_argument('--jitter', type=float, default=0.3, help='normal为相对标准差，lognormal为sigma')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回429的比例')
+    parser.add_argument('--tokens-per-sec', type=float, default=0.0, help='输出速度，0表示瞬间生成')
+    parser.add_argument('--completion-tokens', type=int, default=300, help='每次响应的输出令牌数')
+
+
+def settings_from_args(args) -> MockSettings:
+    return MockSettings(args.latency_ms, args.latency_dist, args.jitter, args.error_rate,
+                        args.throttle_rate, args.tokens_per_sec, args.completion_tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟AI服务商')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server, _ = start_mock_server(args.host, args.port, settings_from_args(args))
+    print(f"模拟AI服务已启动: http://{args.host}:{args.port}/v1")
+    print(f"启动应用前设置: AI_MOCK_BASE_URL=http://{args.host}:{args.port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
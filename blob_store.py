@@ -0,0 +1,180 @@
+import os
+import shutil
+import logging
+import tempfile
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from werkzeug.datastructures import FileStorage
+
+from streaming_upload import HashingUploadStream, UPLOAD_TEMP_DIR, save_upload
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 按内容寻址的上传文件目录：static/uploads/blobs/<哈希前两位>/<SHA-256>.<扩展名>
+BLOB_DIR = os.getenv('BLOB_DIR', os.path.join('static', 'uploads', 'blobs'))
+BLOB_URL_PREFIX = os.getenv('BLOB_URL_PREFIX', '/static/uploads/blobs')
+
+
+class BlobStore:
+    """内容寻址的上传文件存储：相同内容只保存一份，按引用计数释放
+
+    头像、项目图片和项目文件都通过 store() 保存，数据库记录只保存返回的路径和URL；
+    删除记录时调用 release()，最后一个引用释放后，在事务提交之后用 remove() 删除文件。
+    引用计数的增减和文件的写入在调用方的同一个事务中进行，
+    SQLite写锁保证了并发上传和删除同一内容时不会删掉刚被引用的文件。
+    """
+
+    def __init__(self, root: str = BLOB_DIR, url_prefix: str = BLOB_URL_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+        self._table_ready = False
+
+    def init_table(self, conn):
+        """创建blob引用计数表（如果不存在）"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                content_hash TEXT NOT NULL,
+                extension TEXT NOT NULL,
+                file_path TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP,
+                PRIMARY KEY (content_hash, extension)
+            )
+        ''')
+        self._table_ready = True
+
+    def _ensure_table(self, conn):
+        if not self._table_ready:
+            self.init_table(conn)
+
+    def blob_path(self, content_hash: str, extension: str) -> str:
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}.{extension.lower()}")
+
+    def blob_url(self, content_hash: str, extension: str) -> str:
+        return f"{self.url_prefix}/{content_hash[:2]}/{content_hash}.{extension.lower()}"
+
+    @staticmethod
+    def _hash_upload(file: FileStorage):
+        """返回 (临时文件路径, 字节数, SHA-256)；流式上传时内容已在接收过程中写入临时文件并计算指纹"""
+        stream = file.stream
+        if isinstance(stream, HashingUploadStream):
+            stream.flush()
+            return stream.path, stream.size, stream.sha256
+        os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='upload_', dir=UPLOAD_TEMP_DIR)
+        os.close(fd)
+        size, content_hash = save_upload(file, temp_path)
+        return temp_path, size, content_hash
+
+    def store(self, conn, file: FileStorage, extension: str) -> Dict[str, Any]:
+        """保存上传文件并增加引用计数，返回 file_path、url、content_hash、size 和 deduplicated
+
+        调用方负责提交事务；提交前失败时文件可能已写入但没有引用，
+        之后上传相同内容时会直接复用。
+        """
+        self._ensure_table(conn)
+        extension = extension.lower()
+        temp_path, size, content_hash = self._hash_upload(file)
+        file_path = self.blob_path(content_hash, extension)
+
+        cursor = conn.cursor()
+        # 先更新计数：同时取得写锁，之后的文件操作不会与其他请求的 release() 交错
+        cursor.execute('''
+            UPDATE blobs SET ref_count = ref_count + 1 WHERE content_hash = ? AND extension = ?
+        ''', (content_hash, extension))
+        if cursor.rowcount == 0:
+            cursor.execute('''
+                INSERT INTO blobs (content_hash, extension, file_path, size, ref_count, created_at)
+                VALUES (?, ?, ?, ?, 1, ?)
+            ''', (content_hash, extension, file_path, size, datetime.now().isoformat()))
+
+        deduplicated = os.path.exists(file_path)
+        if deduplicated:
+            # 内容已存在：丢弃这次上传的临时文件
+            file.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if isinstance(file.stream, HashingUploadStream):
+                save_upload(file, file_path)
+            else:
+                # UPLOAD_TEMP_DIR 被配置到其他文件系统时退回到复制
+                shutil.move(temp_path, file_path)
+                os.chmod(file_path, 0o644)
+
+        return {
+            'file_path': file_path,
+            'url': self.blob_url(content_hash, extension),
+            'content_hash': content_hash,
+            'size': size,
+            'deduplicated': deduplicated
+        }
+
+    def release(self, conn, file_path: Optional[str]) -> Optional[str]:
+        """释放一个引用；最后一个引用释放时返回应删除的文件路径，否则返回None
+
+        不在blob表中的旧文件（上传目录中按时间戳命名、没有共享）同样返回其路径。
+        调用方负责提交事务，提交成功后再调用 remove() 删除文件：
+        事务回滚时引用计数恢复，文件仍然存在。
+        """
+        if not file_path:
+            return None
+        self._ensure_table(conn)
+        file_path = file_path.lstrip('/')
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE blobs SET ref_count = ref_count - 1 WHERE file_path = ?
+        ''', (file_path,))
+        if cursor.rowcount:
+            cursor.execute('''
+                DELETE FROM blobs WHERE file_path = ? AND ref_count <= 0
+            ''', (file_path,))
+            if not cursor.rowcount:
+                return None
+        elif os.path.abspath(file_path).startswith(os.path.abspath(self.root) + os.sep):
+            # blob目录下却没有引用记录：可能仍被其他未提交的上传使用，保留文件
+            return None
+        elif not os.path.abspath(file_path).startswith(os.path.abspath(os.path.dirname(self.root)) + os.sep):
+            # 只删除上传目录中的文件（头像URL等可能是外部地址）
+            return None
+        return file_path
+
+    def remove(self, conn, file_path: Optional[str]) -> bool:
+        """删除 release() 返回的文件，在调用方提交事务之后调用
+
+        提交和删除之间可能有上传相同内容的请求重新引用了该文件：
+        重新取得写锁，确认仍没有引用记录后再删除（store() 先更新计数再检查文件，两者不会交错）。
+        """
+        if not file_path:
+            return False
+        self._ensure_table(conn)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT 1 FROM blobs WHERE file_path = ?', (file_path,)).fetchone()
+            if row:
+                return False
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return True
+        except OSError as e:
+            logger.warning(f"删除文件失败: {e}")
+            return False
+        finally:
+            conn.commit()
+
+    def stats(self, conn) -> Dict[str, Any]:
+        """blob数量、引用数和去重节省的磁盘空间"""
+        self._ensure_table(conn)
+        row = conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(ref_count), 0), COALESCE(SUM(size), 0),
+                   COALESCE(SUM(size * (ref_count - 1)), 0)
+            FROM blobs
+        ''').fetchone()
+        return {'blobs': row[0], 'references': row[1], 'stored_bytes': row[2], 'saved_bytes': row[3]}
+
+# 创建全局实例
+blob_store = BlobStore()
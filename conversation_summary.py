@@ -0,0 +1,309 @@
+import json
+import sqlite3
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+from config import api_config
+from ai_service_manager import ai_service
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 滚动摘要的最大长度（字符），保证提示词大小不随沟通历史增长
+SUMMARY_MAX_CHARS = 800
+# 单次折叠时每条记录参与合并的最大长度
+RECORD_MAX_CHARS = 1500
+# 重建摘要时每批折叠的记录总长度
+FOLD_BATCH_CHARS = 4000
+
+
+class ConversationSummaryStore:
+    """客户沟通摘要存储 - 为每个客户维护一份增量更新的滚动摘要
+
+    新增或编辑沟通记录时，只把该条记录折叠进已有摘要，
+    分析、聊天和话术生成统一使用摘要作为历史上下文。
+    """
+
+    def __init__(self, max_chars: int = SUMMARY_MAX_CHARS):
+        self.max_chars = max_chars
+        self._table_ready = False
+        self._locks: Dict[int, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        # 正在后台重建摘要的客户，避免重复启动
+        self._rebuilding = set()
+
+    def _connect(self):
+        conn = sqlite3.connect(api_config.database['sqlite_path'])
+        if not self._table_ready:
+            self.init_table(conn)
+        return conn
+
+    def init_table(self, conn=None):
+        """创建摘要表（如果不存在）"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(api_config.database['sqlite_path'])
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS customer_summaries (
+                    customer_id INTEGER PRIMARY KEY,
+                    summary TEXT DEFAULT '',
+                    record_count INTEGER DEFAULT 0,
+                    last_record_id INTEGER DEFAULT 0,
+                    pending_edit_ids TEXT DEFAULT '[]',
+                    stale BOOLEAN DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (customer_id) REFERENCES customers (id)
+                )
+            ''')
+            conn.commit()
+            self._table_ready = True
+        finally:
+            if own_conn:
+                conn.close()
+
+    def _customer_lock(self, customer_id: int) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(customer_id)
+            if lock is None:
+                lock = self._locks[customer_id] = threading.Lock()
+            return lock
+
+    def _load_row(self, cursor, customer_id: int) -> Dict[str, Any]:
+        cursor.execute('''
+            SELECT summary, record_count, last_record_id, pending_edit_ids, stale, updated_at
+            FROM customer_summaries WHERE customer_id = ?
+        ''', (customer_id,))
+        row = cursor.fetchone()
+        if not row:
+            return {
+                'summary': '',
+                'record_count': 0,
+                'last_record_id': 0,
+                'pending_edit_ids': [],
+                'stale': False,
+                'updated_at': None
+            }
+        return {
+            'summary': row[0] or '',
+            'record_count': row[1] or 0,
+            'last_record_id': row[2] or 0,
+            'pending_edit_ids': json.loads(row[3] or '[]'),
+            'stale': bool(row[4]),
+            'updated_at': row[5]
+        }
+
+    def _save_row(self, cursor, customer_id: int, state: Dict[str, Any]):
+        cursor.execute('''
+            REPLACE INTO customer_summaries
+                (customer_id, summary, record_count, last_record_id, pending_edit_ids, stale, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (customer_id, state['summary'], state['record_count'], state['last_record_id'],
+              json.dumps(state['pending_edit_ids']), 1 if state['stale'] else 0))
+
+    def _fetch_records(self, cursor, customer_id: int, after_id: int = 0,
+                       record_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        if record_ids:
+            placeholders = ','.join('?' * len(record_ids))
+            cursor.execute(f'''
+                SELECT id, content, communication_type, created_at FROM communications
+                WHERE customer_id = ? AND id IN ({placeholders})
+                ORDER BY id
+            ''', (customer_id, *record_ids))
+        else:
+            cursor.execute('''
+                SELECT id, content, communication_type, created_at FROM communications
+                WHERE customer_id = ? AND id > ?
+                ORDER BY id
+            ''', (customer_id, after_id))
+        return [{
+            'id': row[0],
+            'content': row[1] or '',
+            'type': row[2] or '',
+            'created_at': row[3] or ''
+        } for row in cursor.fetchall()]
+
+    def _format_record(self, record: Dict[str, Any], edited: bool = False) -> str:
+        prefix = '（更正，以此为准）' if edited else ''
+        content = record['content'].strip().replace('\n', ' ')[:RECORD_MAX_CHARS]
+        return f"- {prefix}{record['created_at']} [{record['type'] or '沟通'}] {content}"
+
+    def _fold(self, previous_summary: str, record_lines: List[str]) -> str:
+        """将新记录折叠进既有摘要，AI不可用时退回本地压缩"""
+        prompt = f"""请将以下新增沟通记录合并进客户的既有沟通摘要，输出一份新的摘要。
+
+既有摘要：
+{previous_summary or '（暂无）'}
+
+新增记录：
+{chr(10).join(record_lines)}
+
+要求：
+1. 总长度不超过{self.max_chars}字，使用简洁的要点式中文
+2. 保留关键事实：需求、痛点、预算、决策人、时间节点、承诺事项、异议和客户态度变化
+3. 标注为"更正"的记录代表对旧记录的修改，与既有摘要冲突时以更正内容为准
+4. 只输出摘要正文，不要添加任何说明"""
+
+        messages = [
+            {'role': 'system', 'content': '你是CRM沟通记录整理助手，擅长把零散的销售沟通压缩成准确、可检索的客户摘要。'},
+            {'role': 'user', 'content': prompt}
+        ]
+        result = ai_service.call_ai_model(ai_service.get_default_model(), messages,
+                                          temperature=0.2, max_tokens=1024, purpose='conversation_summary')
+        if result.get('success') and result.get('message', '').strip():
+            return result['message'].strip()[:self.max_chars]
+
+        logger.warning(f"AI摘要折叠失败，使用本地压缩: {result.get('error')}")
+        return self._fold_locally(previous_summary, record_lines)
+
+    def _fold_locally(self, previous_summary: str, record_lines: List[str]) -> str:
+        """本地压缩：保留最近的要点，直到达到长度上限"""
+        lines = [line for line in previous_summary.split('\n') if line.strip()]
+        lines.extend(line[:200] for line in record_lines)
+        kept = []
+        total = 0
+        for line in reversed(lines):
+            if total + len(line) + 1 > self.max_chars:
+                break
+            kept.append(line)
+            total += len(line) + 1
+        return '\n'.join(reversed(kept))
+
+    def _fold_in_batches(self, summary: str, record_lines: List[str]) -> str:
+        batch, batch_chars = [], 0
+        for line in record_lines:
+            if batch and batch_chars + len(line) > FOLD_BATCH_CHARS:
+                summary = self._fold(summary, batch)
+                batch, batch_chars = [], 0
+            batch.append(line)
+            batch_chars += len(line)
+        if batch:
+            summary = self._fold(summary, batch)
+        return summary
+
+    def refresh(self, customer_id: int) -> Dict[str, Any]:
+        """补齐尚未折叠的新增/编辑记录，摘要失效时从头重建"""
+        with self._customer_lock(customer_id):
+            conn = self._connect()
+            cursor = conn.cursor()
+            try:
+                state = self._load_row(cursor, customer_id)
+
+                if state['stale']:
+                    records = self._fetch_records(cursor, customer_id)
+                    state['summary'] = self._fold_in_batches('', [self._format_record(r) for r in records])
+                    state['record_count'] = len(records)
+                    state['last_record_id'] = records[-1]['id'] if records else 0
+                    state['pending_edit_ids'] = []
+                    state['stale'] = False
+                    self._save_row(cursor, customer_id, state)
+                    conn.commit()
+                    return state
+
+                new_records = self._fetch_records(cursor, customer_id, after_id=state['last_record_id'])
+                edited_ids = [i for i in state['pending_edit_ids'] if i <= state['last_record_id']]
+                edited_records = self._fetch_records(cursor, customer_id, record_ids=edited_ids) if edited_ids else []
+
+                if not new_records and not state['pending_edit_ids']:
+                    return state
+
+                record_lines = [self._format_record(r, edited=True) for r in edited_records]
+                record_lines.extend(self._format_record(r) for r in new_records)
+                if record_lines:
+                    state['summary'] = self._fold_in_batches(state['summary'], record_lines)
+                state['record_count'] += len(new_records)
+                if new_records:
+                    state['last_record_id'] = new_records[-1]['id']
+                state['pending_edit_ids'] = []
+                self._save_row(cursor, customer_id, state)
+                conn.commit()
+                return state
+            except Exception as e:
+                logger.error(f"更新客户 {customer_id} 沟通摘要失败: {e}")
+                return self._load_row(cursor, customer_id)
+            finally:
+                conn.close()
+
+    def _refresh_in_background(self, customer_id: int):
+        thread = threading.Thread(target=self.refresh, args=(customer_id,), daemon=True)
+        thread.start()
+
+    def _rebuild_in_background(self, customer_id: int):
+        """后台重建失效的摘要；同一客户同时只有一个重建线程"""
+        with self._locks_guard:
+            if customer_id in self._rebuilding:
+                return
+            self._rebuilding.add(customer_id)
+        
+        def run():
+            try:
+                self.refresh(customer_id)
+            finally:
+                with self._locks_guard:
+                    self._rebuilding.discard(customer_id)
+        
+        threading.Thread(target=run, daemon=True).start()
+
+    def _read_state(self, customer_id: int) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            return self._load_row(conn.cursor(), customer_id)
+        finally:
+            conn.close()
+
+    def on_record_added(self, customer_id: int):
+        """新增沟通记录后调用，后台折叠新记录"""
+        if customer_id:
+            self._refresh_in_background(int(customer_id))
+
+    def on_record_edited(self, customer_id: int, record_id: int):
+        """编辑沟通记录后调用，登记待更正记录并后台折叠"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            with self._customer_lock(customer_id):
+                state = self._load_row(cursor, customer_id)
+                if record_id not in state['pending_edit_ids']:
+                    state['pending_edit_ids'].append(record_id)
+                self._save_row(cursor, customer_id, state)
+                conn.commit()
+        finally:
+            conn.close()
+        self._refresh_in_background(customer_id)
+
+    def on_record_deleted(self, customer_id: int):
+        """删除沟通记录后调用，摘要标记为失效并在后台重建"""
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE customer_summaries SET stale = 1 WHERE customer_id = ?', (customer_id,))
+            conn.commit()
+        finally:
+            conn.close()
+        self._rebuild_in_background(int(customer_id))
+
+    def delete_customer(self, customer_id: int):
+        """删除客户时清理其摘要"""
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM customer_summaries WHERE customer_id = ?', (customer_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_history_context(self, customer_id: int) -> str:
+        """获取用于提示词的沟通历史上下文"""
+        if not customer_id:
+            return ''
+        customer_id = int(customer_id)
+        state = self._read_state(customer_id)
+        if state['stale']:
+            # 重建需要多次AI调用，不在请求中等待：重建完成前继续使用失效前的摘要
+            self._rebuild_in_background(customer_id)
+        else:
+            state = self.refresh(customer_id)
+        if not state['summary']:
+            return '暂无沟通记录'
+        return f"沟通历史摘要（共{state['record_count']}条记录）：\n{state['summary']}"
+
+# 创建全局实例
+summary_store = ConversationSummaryStore()
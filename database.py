@@ -1,16 +1,21 @@
 # database.py (ORM Setup)
-from sqlalchemy import create_engine, Column, Integer, String, JSON, Float, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, JSON, Float, DateTime, Boolean, Text, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
 from datetime import datetime
 import os
 from dotenv import load_dotenv
+from db_engine import DatabaseEngines
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./crm_database.db")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 同步引擎用于建表和初始化数据；FastAPI接口使用异步会话（get_async_db），不阻塞事件循环
+db_engines = DatabaseEngines(DATABASE_URL)
+engine = db_engines.engine
+async_engine = db_engines.async_engine
+SessionLocal = db_engines.SessionLocal
+AsyncSessionLocal = db_engines.AsyncSessionLocal
 Base = declarative_base()
 
 class Customer(Base):
@@ -292,6 +297,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """获取异步数据库会话（FastAPI依赖）"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # 初始化默认文件夹
 def init_default_folders(db):
     """初始化默认文件夹结构"""
@@ -0,0 +1,132 @@
+"""
+数据库引擎：同一个数据库URL同时提供同步引擎和异步引擎
+
+FastAPI 应用的接口都是 async def，如果在其中执行同步 Session 查询，查询期间整个事件循环停顿，
+其他请求和 WebSocket 连接都要等待。接口中改用异步会话（await 查询），驱动对应关系：
+    sqlite -> aiosqlite    postgresql -> asyncpg    mysql -> aiomysql
+同步引擎只留给建表、初始化数据以及已经放到线程池中执行的批量写入。
+
+连接池参数可通过环境变量调整：
+    DB_POOL_SIZE=10         常驻连接数
+    DB_MAX_OVERFLOW=20      高峰时额外允许的连接数
+    DB_POOL_TIMEOUT=30      等待空闲连接的最长秒数
+    DB_POOL_RECYCLE=1800    连接最长使用秒数（MySQL/PostgreSQL，避开服务端空闲断开）
+    DB_BUSY_TIMEOUT_MS=5000 SQLite 写锁等待毫秒数
+"""
+
+import os
+import logging
+from typing import AsyncIterator, Iterator
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+
+# 同步数据库类型 -> 异步驱动
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+ASYNC_DRIVER_NAMES = {'aiosqlite', 'asyncpg', 'aiomysql', 'asyncmy'}
+
+
+def async_database_url(url: str) -> str:
+    """把同步数据库URL换成对应的异步驱动，已经是异步驱动时原样返回"""
+    parsed = make_url(url)
+    if parsed.get_driver_name() in ASYNC_DRIVER_NAMES:
+        return url
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"数据库 {backend} 没有可用的异步驱动")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def is_sqlite_file(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == 'sqlite' and parsed.database not in (None, '', ':memory:')
+
+
+def pool_options(url: str, is_async: bool) -> dict:
+    """按数据库类型生成连接池参数"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != 'sqlite':
+        return {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': True,
+        }
+    if not is_sqlite_file(url):
+        # 内存数据库只能共用一个连接，使用方言默认的连接池
+        return {}
+    options = {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW, 'pool_timeout': DB_POOL_TIMEOUT}
+    if is_async:
+        # aiosqlite 默认 NullPool：每个会话都新建连接和一个后台线程，改为连接池复用
+        options['poolclass'] = AsyncAdaptedQueuePool
+    else:
+        options['connect_args'] = {'check_same_thread': False}
+    return options
+
+
+def _tune_sqlite(dbapi_connection, connection_record):
+    """WAL模式下读写互不阻塞；写锁冲突时等待而不是立即报 database is locked"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+class DatabaseEngines:
+    """同一数据库的同步/异步引擎及会话工厂"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.async_url = async_database_url(url)
+        self.engine = create_engine(url, **pool_options(url, is_async=False))
+        self.async_engine = create_async_engine(self.async_url, **pool_options(url, is_async=True))
+        if is_sqlite_file(url):
+            event.listen(self.engine, 'connect', _tune_sqlite)
+            event.listen(self.async_engine.sync_engine, 'connect', _tune_sqlite)
+
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # 异步会话中访问已过期的属性会触发隐式IO而报错，提交后保留对象属性
+        self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+
+    def get_db(self) -> Iterator[Session]:
+        """同步会话（只在线程池或启动阶段使用）"""
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db(self) -> AsyncIterator[AsyncSession]:
+        """FastAPI依赖：每个请求一个异步会话，请求结束时归还连接"""
+        async with self.AsyncSessionLocal() as db:
+            yield db
+
+    def pool_status(self) -> dict:
+        return {
+            'url': make_url(self.async_url).render_as_string(hide_password=True),
+            'sync_pool': self.engine.pool.status(),
+            'async_pool': self.async_engine.pool.status(),
+        }
+
+    async def dispose(self):
+        """关闭两个连接池（应用关闭时调用）"""
+        await self.async_engine.dispose()
+        self.engine.dispose()
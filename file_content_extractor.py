@@ -1,8 +1,17 @@
 import os
+import queue
+import multiprocessing
+import codecs
+import hashlib
 import logging
-from typing import List, Dict, Optional
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import List, Dict, Optional, Any, Tuple
 import sqlite3
 from config import api_config
+from request_profiler import request_profiler
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -14,13 +23,11 @@ except ImportError:
     PDF_AVAILABLE = False
     logger.warning("PyPDF2 not available. PDF text extraction will be disabled.")
 
-try:
-    from PIL import Image
-    import pytesseract
-    OCR_AVAILABLE = True
-except ImportError:
-    OCR_AVAILABLE = False
-    logger.warning("PIL or pytesseract not available. OCR functionality will be disabled.")
+from ocr_service import ocr_service
+
+OCR_AVAILABLE = ocr_service.available
+if not OCR_AVAILABLE:
+    logger.warning("PIL or tesserocr/pytesseract not available. OCR functionality will be disabled.")
 
 try:
     import docx
@@ -29,6 +36,61 @@ except ImportError:
     DOCX_AVAILABLE = False
     logger.warning("python-docx not available. DOCX text extraction will be disabled.")
 
+# 提取逻辑变化时递增，旧版本的缓存随之失效（版本4起不再缓存提取失败的结果）
+EXTRACTOR_VERSION = 4
+
+def extractor_version() -> str:
+    """缓存版本：提取逻辑版本加上可选依赖的可用情况，安装PyPDF2等库后会重新提取"""
+    return f"{EXTRACTOR_VERSION}:{int(PDF_AVAILABLE)}{int(OCR_AVAILABLE)}{int(DOCX_AVAILABLE)}"
+
+# 提取进程数：PDF解析和OCR是CPU密集型任务，放到独立进程中并行执行，不占用Web进程的GIL
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', min(4, os.cpu_count() or 2)))
+# 提取进程的启动方式：Web工作进程中有多个后台线程（采样、任务调度、结果写入），
+# 直接 fork 可能复制其他线程持有的锁导致子进程死锁，改由 forkserver（不支持时 spawn）创建
+EXTRACTION_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# 提取结果的字符预算：达到预算后停止解析，不再读取文件的剩余部分
+TEXT_MAX_CHARS = 5000
+OCR_MAX_CHARS = 3000
+TXT_READ_CHUNK = 64 * 1024
+
+# 项目文件的提取状态
+EXTRACTION_PENDING = 'pending'
+EXTRACTION_DONE = 'done'
+EXTRACTION_FAILED = 'failed'
+
+def compute_file_hash(file_path: str) -> str:
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ExtractionError(Exception):
+    """提取失败（依赖库不可用、文件损坏等）；失败结果不写入缓存，之后会重新提取"""
+    pass
+
+class TextBudget:
+    """按字符预算收集文本片段，用列表拼接代替逐段字符串相加"""
+    
+    def __init__(self, max_chars: int, separator: str = '\n'):
+        self.max_chars = max_chars
+        self.separator = separator
+        self.parts: List[str] = []
+        self.size = 0
+    
+    def add(self, text: str) -> bool:
+        """加入一段文本，返回是否还需要继续读取"""
+        self.parts.append(text)
+        self.size += len(text) + len(self.separator)
+        return self.size <= self.max_chars
+    
+    def result(self) -> Tuple[str, bool]:
+        """返回 (不超过预算的文本, 是否截断)"""
+        text = self.separator.join(self.parts).strip()
+        return text[:self.max_chars], len(text) > self.max_chars
+
 class FileContentExtractor:
     """文件内容提取器，支持PDF、图片OCR、DOCX等格式"""
     
@@ -44,103 +106,130 @@ class FileContentExtractor:
             'gif': self.extract_image_text,
             'webp': self.extract_image_text
         }
+        self._table_ready = False
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._inflight: Dict[Tuple[str, str], Future] = {}
+        self._writer = None
+        self._writer_pid = None
+        self._writer_lock = threading.Lock()
+        self._results: queue.Queue = queue.Queue()
     
-    def extract_pdf_text(self, file_path: str) -> str:
-        """提取PDF文件的文本内容"""
+    def extract_pdf_text(self, file_path: str, max_chars: int = TEXT_MAX_CHARS) -> Tuple[str, bool]:
+        """提取PDF文件的文本内容，返回 (文本, 是否截断)；达到字符预算后不再解析后续页面"""
         if not PDF_AVAILABLE:
-            return "PDF文本提取功能不可用，请安装PyPDF2库"
+            raise ExtractionError("PDF文本提取功能不可用，请安装PyPDF2库")
         
         try:
-            text = ""
+            budget = TextBudget(max_chars)
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
+                # 页面按需解析，提前停止时后面的页面不会被读取
+                for page in pdf_reader.pages:
+                    if not budget.add(page.extract_text() or ''):
+                        break
             
-            # 清理文本
-            text = text.strip()
+            text, truncated = budget.result()
             if not text:
-                return "PDF文件中未找到可提取的文本内容"
+                return "PDF文件中未找到可提取的文本内容", False
             
-            return text[:5000]  # 限制文本长度
+            return text, truncated
         except Exception as e:
-            logger.error(f"PDF文本提取失败: {e}")
-            return f"PDF文本提取失败: {str(e)}"
+            raise ExtractionError(f"PDF文本提取失败: {str(e)}") from e
     
-    def extract_image_text(self, file_path: str) -> str:
-        """使用OCR提取图片中的文本"""
+    def extract_image_text(self, file_path: str, max_chars: int = OCR_MAX_CHARS) -> Tuple[str, bool]:
+        """使用OCR提取图片中的文本，返回 (文本, 是否截断)"""
         if not OCR_AVAILABLE:
-            return "图片OCR功能不可用，请安装PIL和pytesseract库"
+            raise ExtractionError("图片OCR功能不可用，请安装PIL和tesserocr（或pytesseract）库")
         
         try:
-            # 打开图片
-            image = Image.open(file_path)
-            
-            # 使用OCR提取文本
-            text = pytesseract.image_to_string(image, lang='chi_sim+eng')
+            # 使用常驻OCR引擎识别（含灰度、缩放和二值化预处理）
+            text = ocr_service.recognize(file_path)
             
             # 清理文本
             text = text.strip()
             if not text:
-                return "图片中未识别到文本内容"
+                return "图片中未识别到文本内容", False
             
-            return text[:3000]  # 限制文本长度
+            return text[:max_chars], len(text) > max_chars
         except Exception as e:
-            logger.error(f"图片OCR提取失败: {e}")
-            return f"图片OCR提取失败: {str(e)}"
+            raise ExtractionError(f"图片OCR提取失败: {str(e)}") from e
     
-    def extract_txt_text(self, file_path: str) -> str:
-        """提取TXT文件内容"""
+    def extract_txt_text(self, file_path: str, max_chars: int = TEXT_MAX_CHARS) -> Tuple[str, bool]:
+        """提取TXT文件内容，返回 (文本, 是否截断)
+        
+        分块读取并增量解码，读够字符预算即停止；已读部分不是合法UTF-8时改用GBK重新读取。
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                text = file.read()
+            for encoding in ('utf-8', 'gbk'):
+                try:
+                    text, truncated = self._read_text_prefix(file_path, encoding, max_chars)
+                    break
+                except UnicodeDecodeError:
+                    if encoding == 'gbk':
+                        raise
             
             if not text.strip():
-                return "TXT文件为空"
+                return "TXT文件为空", False
             
-            return text[:5000]  # 限制文本长度
-        except UnicodeDecodeError:
-            try:
-                with open(file_path, 'r', encoding='gbk') as file:
-                    text = file.read()
-                return text[:5000]
-            except Exception as e:
-                logger.error(f"TXT文件读取失败: {e}")
-                return f"TXT文件读取失败: {str(e)}"
+            return text, truncated
         except Exception as e:
-            logger.error(f"TXT文件读取失败: {e}")
-            return f"TXT文件读取失败: {str(e)}"
+            raise ExtractionError(f"TXT文件读取失败: {str(e)}") from e
     
-    def extract_docx_text(self, file_path: str) -> str:
-        """提取DOCX文件内容"""
+    @staticmethod
+    def _read_text_prefix(file_path: str, encoding: str, max_chars: int) -> Tuple[str, bool]:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        parts = []
+        size = 0
+        with open(file_path, 'rb') as file:
+            while size <= max_chars:
+                chunk = file.read(TXT_READ_CHUNK)
+                text = decoder.decode(chunk, final=not chunk)
+                parts.append(text)
+                size += len(text)
+                if not chunk:
+                    break
+        text = ''.join(parts)
+        return text[:max_chars], len(text) > max_chars
+    
+    def extract_docx_text(self, file_path: str, max_chars: int = TEXT_MAX_CHARS) -> Tuple[str, bool]:
+        """提取DOCX文件内容，返回 (文本, 是否截断)
+        
+        python-docx 打开文档时会解析整个XML，这里只在达到字符预算后停止遍历段落。
+        """
         if not DOCX_AVAILABLE:
-            return "DOCX文本提取功能不可用，请安装python-docx库"
+            raise ExtractionError("DOCX文本提取功能不可用，请安装python-docx库")
         
         try:
             doc = docx.Document(file_path)
-            text = ""
+            budget = TextBudget(max_chars)
             for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
+                if not budget.add(paragraph.text):
+                    break
             
-            if not text.strip():
-                return "DOCX文件中未找到文本内容"
+            text, truncated = budget.result()
+            if not text:
+                return "DOCX文件中未找到文本内容", False
             
-            return text[:5000]  # 限制文本长度
+            return text, truncated
         except Exception as e:
-            logger.error(f"DOCX文本提取失败: {e}")
-            return f"DOCX文本提取失败: {str(e)}"
+            raise ExtractionError(f"DOCX文本提取失败: {str(e)}") from e
     
-    def extract_doc_text(self, file_path: str) -> str:
+    def extract_doc_text(self, file_path: str, max_chars: int = TEXT_MAX_CHARS) -> Tuple[str, bool]:
         """提取DOC文件内容（简单处理）"""
-        return "DOC格式文件需要转换为DOCX格式才能提取文本内容"
+        raise ExtractionError("DOC格式文件需要转换为DOCX格式才能提取文本内容")
     
-    def extract_file_content(self, file_path: str, file_extension: str) -> Dict[str, str]:
-        """提取文件内容"""
+    def extract_file_content(self, file_path: str, file_extension: str) -> Dict[str, Any]:
+        """提取文件内容，truncated 表示内容超出字符预算被截断
+        
+        提取函数抛出异常（ExtractionError）时返回 success=False，调用方不缓存该结果。
+        """
         if not os.path.exists(file_path):
             return {
                 'success': False,
                 'content': '',
+                'truncated': False,
                 'error': '文件不存在'
             }
         
@@ -149,16 +238,19 @@ class FileContentExtractor:
             return {
                 'success': False,
                 'content': '',
+                'truncated': False,
                 'error': f'不支持的文件格式: {file_extension}'
             }
         
         try:
             extract_func = self.supported_formats[file_extension]
-            content = extract_func(file_path)
+            with request_profiler.timed('extract'):
+                content, truncated = extract_func(file_path)
             
             return {
                 'success': True,
                 'content': content,
+                'truncated': truncated,
                 'error': ''
             }
         except Exception as e:
@@ -166,38 +258,288 @@ class FileContentExtractor:
             return {
                 'success': False,
                 'content': '',
+                'truncated': False,
                 'error': str(e)
             }
     
+    def init_table(self, conn):
+        """创建提取结果缓存表，并为项目文件表补充内容指纹字段"""
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_extractions (
+                content_hash TEXT NOT NULL,
+                file_extension TEXT NOT NULL,
+                extractor_version TEXT NOT NULL,
+                content TEXT,
+                truncated INTEGER DEFAULT 0,
+                created_at TIMESTAMP,
+                PRIMARY KEY (content_hash, file_extension, extractor_version)
+            )
+        ''')
+        
+        try:
+            cursor.execute('ALTER TABLE file_extractions ADD COLUMN truncated INTEGER DEFAULT 0')
+        except sqlite3.OperationalError as e:
+            if 'duplicate column name' not in str(e).lower():
+                logger.error(f"添加file_extractions.truncated字段时出错: {e}")
+        
+        # project_files 在首次上传文件时才创建，表不存在时跳过
+        for column, column_type in (('content_hash', 'TEXT'), ('content_size', 'INTEGER'),
+                                    ('content_mtime', 'REAL'), ('extraction_status', 'TEXT'),
+                                    ('extraction_error', 'TEXT')):
+            try:
+                cursor.execute(f'ALTER TABLE project_files ADD COLUMN {column} {column_type}')
+            except sqlite3.OperationalError as e:
+                message = str(e).lower()
+                if 'duplicate column name' not in message and 'no such table' not in message:
+                    logger.error(f"添加project_files.{column}字段时出错: {e}")
+    
+    def _ensure_table(self, conn):
+        if not self._table_ready:
+            self.init_table(conn)
+            self._table_ready = True
+    
+    def _cached_content(self, cursor, content_hash: str, file_extension: str) -> Optional[Dict[str, Any]]:
+        """返回缓存的提取结果，未命中时返回None"""
+        cursor.execute('''
+            SELECT content, truncated FROM file_extractions
+            WHERE content_hash = ? AND file_extension = ? AND extractor_version = ?
+        ''', (content_hash, file_extension.lower(), extractor_version()))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {'success': True, 'content': row[0], 'truncated': bool(row[1]), 'error': ''}
+    
+    def _store_content(self, cursor, content_hash: str, file_extension: str, result: Dict[str, Any]):
+        # 只缓存成功的结果：依赖库不可用、文件读取失败等都应在之后重新提取
+        if not result['success']:
+            return
+        cursor.execute('''
+            INSERT OR REPLACE INTO file_extractions
+                (content_hash, file_extension, extractor_version, content, truncated, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (content_hash, file_extension.lower(), extractor_version(), result['content'],
+              int(result.get('truncated', False)), datetime.now().isoformat()))
+    
+    def extract_file_content_cached(self, file_path: str, file_extension: str,
+                                    content_hash: Optional[str] = None) -> Dict[str, Any]:
+        """提取文件内容，相同内容的文件只解析一次"""
+        if not os.path.exists(file_path):
+            return self.extract_file_content(file_path, file_extension)
+        
+        content_hash = content_hash or compute_file_hash(file_path)
+        conn = sqlite3.connect(api_config.database['sqlite_path'], timeout=30)
+        try:
+            self._ensure_table(conn)
+            cursor = conn.cursor()
+            cached = self._cached_content(cursor, content_hash, file_extension)
+            if cached is not None:
+                return {**cached, 'cached': True}
+            
+            result = self.extract_file_content(file_path, file_extension)
+            if result['success']:
+                self._store_content(cursor, content_hash, file_extension, result)
+                conn.commit()
+            return {**result, 'cached': False}
+        finally:
+            conn.close()
+    
+    def _current_file_hash(self, cursor, file_id: int, file_path: str, stored_hash: Optional[str],
+                           stored_size: Optional[int], stored_mtime: Optional[float]) -> Optional[str]:
+        """返回文件当前的内容指纹；文件大小或修改时间变化（被替换）时重新计算并保存"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if stored_hash and stored_size == stat.st_size and stored_mtime == stat.st_mtime:
+            return stored_hash
+        
+        content_hash = compute_file_hash(file_path)
+        cursor.execute('''
+            UPDATE project_files SET content_hash = ?, content_size = ?, content_mtime = ?
+            WHERE id = ?
+        ''', (content_hash, stat.st_size, stat.st_mtime, file_id))
+        return content_hash
+    
+    def record_file_hash(self, conn, file_id: int, file_path: str, content_hash: Optional[str] = None):
+        """上传时记录文件的内容指纹"""
+        stat = os.stat(file_path)
+        conn.execute('''
+            UPDATE project_files SET content_hash = ?, content_size = ?, content_mtime = ?
+            WHERE id = ?
+        ''', (content_hash or compute_file_hash(file_path), stat.st_size, stat.st_mtime, file_id))
+    
+    def purge_unreferenced(self, conn) -> int:
+        """删除已没有项目文件引用的提取缓存"""
+        cursor = conn.execute('''
+            DELETE FROM file_extractions
+            WHERE content_hash NOT IN (SELECT content_hash FROM project_files WHERE content_hash IS NOT NULL)
+        ''')
+        return cursor.rowcount
+    
+    # ------------------------------------------------------------------
+    # 进程池提取
+    # ------------------------------------------------------------------
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # 调用方需持有 _pool_lock；fork出的子进程（如gunicorn worker）不能复用父进程的进程池
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS,
+                                             mp_context=multiprocessing.get_context(EXTRACTION_START_METHOD))
+            self._pool_pid = os.getpid()
+            self._inflight = {}
+        return self._pool
+    
+    def _submit(self, file_path: str, file_extension: str, content_hash: str) -> Future:
+        """提交提取任务；相同内容的文件正在提取时复用同一个任务"""
+        key = (content_hash, file_extension.lower())
+        with self._pool_lock:
+            pool = self._get_pool()
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            try:
+                future = pool.submit(_extract_in_worker, file_path, file_extension)
+            except BrokenProcessPool:
+                # 工作进程异常退出（如OCR崩溃）后进程池不可再用，重建一次
+                logger.warning("文件提取进程池已损坏，重新创建")
+                self._pool = None
+                future = self._get_pool().submit(_extract_in_worker, file_path, file_extension)
+            self._inflight[key] = future
+        # 在锁外注册回调：任务已完成时回调会在当前线程中立即执行
+        future.add_done_callback(lambda done: self._on_extracted(key, done))
+        return future
+    
+    def _on_extracted(self, key: Tuple[str, str], future: Future):
+        """提取完成（在进程池的结果线程中调用）：交给写入线程保存，不在这里等待SQLite写锁"""
+        self._ensure_writer()
+        self._results.put((key, future))
+    
+    def _ensure_writer(self):
+        with self._writer_lock:
+            if self._writer is None or self._writer_pid != os.getpid() or not self._writer.is_alive():
+                if self._writer_pid != os.getpid():
+                    self._results = queue.Queue()
+                self._writer = threading.Thread(target=self._write_results, name='file-extraction-writer',
+                                                daemon=True)
+                self._writer_pid = os.getpid()
+                self._writer.start()
+    
+    def _write_results(self):
+        while True:
+            key, future = self._results.get()
+            try:
+                self._save_result(key, future)
+            finally:
+                # 写入缓存后再移除：期间的请求复用已完成的任务，不会重新提取
+                with self._pool_lock:
+                    if self._inflight.get(key) is future:
+                        del self._inflight[key]
+    
+    def _save_result(self, key: Tuple[str, str], future: Future):
+        """写入缓存，并更新引用该内容的项目文件的提取状态"""
+        content_hash, file_extension = key
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'success': False, 'content': '', 'truncated': False, 'error': f'提取进程异常: {e}'}
+        
+        conn = sqlite3.connect(api_config.database['sqlite_path'], timeout=30)
+        try:
+            self._store_content(conn.cursor(), content_hash, file_extension, result)
+            conn.execute('''
+                UPDATE project_files SET extraction_status = ?, extraction_error = ?
+                WHERE content_hash = ? AND lower(file_extension) = ?
+            ''', (EXTRACTION_DONE if result['success'] else EXTRACTION_FAILED,
+                  result.get('error') or None, content_hash, file_extension))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"保存文件提取结果失败: {e}")
+        finally:
+            conn.close()
+    
+    def submit_extraction(self, file_id: int, file_path: str, file_extension: str, content_hash: str):
+        """上传后在进程池中提取文件内容；已有相同内容的缓存时直接标记为完成"""
+        conn = sqlite3.connect(api_config.database['sqlite_path'], timeout=30)
+        try:
+            self._ensure_table(conn)
+            cached = self._cached_content(conn.cursor(), content_hash, file_extension) is not None
+            conn.execute('''
+                UPDATE project_files SET extraction_status = ?, extraction_error = NULL WHERE id = ?
+            ''', (EXTRACTION_DONE if cached else EXTRACTION_PENDING, file_id))
+            conn.commit()
+        finally:
+            conn.close()
+        if not cached:
+            self._submit(file_path, file_extension, content_hash)
+    
     def get_customer_file_contents(self, customer_id: int) -> List[Dict[str, str]]:
-        """获取客户所有上传文件的内容"""
-        conn = sqlite3.connect(api_config.database['sqlite_path'])
+        """获取客户所有上传文件的内容
+        
+        提取结果按 文件内容SHA-256 + 提取器版本 缓存在 file_extractions 表中，
+        文件未变化时直接读取缓存；未命中的文件（包括上传后仍在提取中的）
+        在进程池中并行提取，相同内容只提取一次。
+        """
+        conn = sqlite3.connect(api_config.database['sqlite_path'], timeout=30)
         cursor = conn.cursor()
         
         try:
+            self._ensure_table(conn)
+            
             # 获取客户的所有项目文件
             cursor.execute('''
-                SELECT id, filename, file_path, file_extension, file_type
+                SELECT id, filename, file_path, file_extension, file_type,
+                       content_hash, content_size, content_mtime, extraction_status
                 FROM project_files
                 WHERE customer_id = ?
                 ORDER BY upload_time DESC
             ''', (customer_id,))
             
             files = cursor.fetchall()
-            file_contents = []
+            results = {}
+            pending = {}
             
             for file_record in files:
-                file_id, filename, file_path, file_extension, file_type = file_record
-                
-                # 提取文件内容
-                result = self.extract_file_content(file_path, file_extension)
+                (file_id, filename, file_path, file_extension, file_type,
+                 stored_hash, stored_size, stored_mtime, status) = file_record
                 
+                # 优先读取缓存，未命中时提交到进程池
+                content_hash = self._current_file_hash(cursor, file_id, file_path,
+                                                       stored_hash, stored_size, stored_mtime)
+                cached = self._cached_content(cursor, content_hash, file_extension) if content_hash else None
+                if cached is not None:
+                    results[file_id] = cached
+                    if status != EXTRACTION_DONE:
+                        cursor.execute('''
+                            UPDATE project_files SET extraction_status = ?, extraction_error = NULL WHERE id = ?
+                        ''', (EXTRACTION_DONE, file_id))
+                elif content_hash:
+                    pending[file_id] = self._submit(file_path, file_extension, content_hash)
+                else:
+                    results[file_id] = self.extract_file_content(file_path, file_extension)
+            
+            # 先提交指纹更新再等待，提取完成的回调要按指纹更新文件状态
+            conn.commit()
+            
+            # 等待进程池提取的时间记为所在请求的文件提取耗时
+            with request_profiler.timed('extract'):
+                for file_id, future in pending.items():
+                    try:
+                        results[file_id] = future.result()
+                    except Exception as e:
+                        logger.error(f"文件内容提取失败: {e}")
+                        results[file_id] = {'success': False, 'content': '', 'truncated': False, 'error': str(e)}
+            
+            file_contents = []
+            for file_id, filename, file_path, file_extension, file_type, *_ in files:
+                result = results[file_id]
                 file_contents.append({
                     'file_id': file_id,
                     'filename': filename,
                     'file_type': file_type,
                     'file_extension': file_extension,
                     'content': result['content'],
+                    'truncated': result.get('truncated', False),
                     'success': result['success'],
                     'error': result.get('error', '')
                 })
@@ -221,6 +563,8 @@ class FileContentExtractor:
             if file_info['success'] and file_info['content']:
                 formatted_content += f"\n--- {file_info['filename']} ({file_info['file_type']}) ---\n"
                 formatted_content += file_info['content'][:2000]  # 限制每个文件的内容长度
+                if file_info.get('truncated') or len(file_info['content']) > 2000:
+                    formatted_content += "\n（内容过长，已截断）"
                 formatted_content += "\n"
             elif not file_info['success']:
                 formatted_content += f"\n--- {file_info['filename']} (提取失败: {file_info['error']}) ---\n"
@@ -229,5 +573,9 @@ class FileContentExtractor:
         
         return formatted_content
 
+def _extract_in_worker(file_path: str, file_extension: str) -> Dict[str, Any]:
+    """进程池入口"""
+    return file_extractor.extract_file_content(file_path, file_extension)
+
 # 创建全局实例
 file_extractor = FileContentExtractor()
\ No newline at end of file
@@ -0,0 +1,166 @@
+import os
+import logging
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    logger.warning("PIL not available. Image thumbnails will be disabled.")
+
+# 原图所在目录，以及缩略图缓存目录
+UPLOAD_ROOT = os.path.join('static', 'uploads')
+DERIVATIVE_ROOT = os.getenv('DERIVATIVE_ROOT', os.path.join('static', 'thumbs'))
+DERIVATIVE_URL_PREFIX = '/static/thumbs'
+
+# 预设尺寸（最长边像素），不放大小于预设尺寸的原图
+DERIVATIVE_SIZES = {'thumb': 96, 'small': 320, 'medium': 800}
+# 输出格式：WebP体积最小；jpg供不支持WebP的客户端使用
+DERIVATIVE_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+DERIVATIVE_QUALITY = int(os.getenv('DERIVATIVE_QUALITY', 80))
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+# 生成衍生图的锁按路径哈希分片：锁的数量固定，不同图片偶尔共用一把锁只会让生成排队
+LOCK_STRIPES = 64
+
+
+class ImageDerivativeService:
+    """图片衍生版本（缩略图、WebP）服务
+
+    衍生图的URL和磁盘路径一一对应：
+        /static/thumbs/<预设尺寸>/<原图相对static/uploads的路径>.<格式>
+    首次请求时生成并写入磁盘，之后直接返回文件（前置的静态文件服务器也可以直接命中）。
+    原图按内容寻址保存，相同图片的衍生版本在所有客户之间共享。
+    """
+
+    def __init__(self, root: str = DERIVATIVE_ROOT, upload_root: str = UPLOAD_ROOT):
+        self.root = root
+        self.upload_root = upload_root
+        self._locks: List[threading.Lock] = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    @property
+    def available(self) -> bool:
+        return PIL_AVAILABLE
+
+    def source_relpath(self, url_or_path: Optional[str]) -> Optional[str]:
+        """把原图URL或路径转换为相对上传目录的路径；不是本地上传的图片时返回None"""
+        if not url_or_path:
+            return None
+        path = url_or_path.split('?', 1)[0].lstrip('/')
+        prefix = self.upload_root.replace(os.sep, '/') + '/'
+        if not path.startswith(prefix):
+            return None
+        relpath = path[len(prefix):]
+        if '..' in relpath.split('/') or not relpath.lower().endswith(SOURCE_EXTENSIONS):
+            return None
+        return relpath
+
+    def url_for(self, url_or_path: Optional[str], size: str = 'thumb', fmt: str = 'webp') -> Optional[str]:
+        """衍生图的URL；原图不是本地上传的图片（如外部链接）时返回None"""
+        relpath = self.source_relpath(url_or_path)
+        if relpath is None or not self.available:
+            return None
+        return f"{DERIVATIVE_URL_PREFIX}/{size}/{relpath}.{fmt}"
+
+    def variant_urls(self, url_or_path: Optional[str], fmt: str = 'webp') -> Dict[str, str]:
+        """所有预设尺寸的衍生图URL"""
+        if self.url_for(url_or_path) is None:
+            return {}
+        return {size: self.url_for(url_or_path, size, fmt) for size in DERIVATIVE_SIZES}
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        return self._locks[hash(key) % LOCK_STRIPES]
+
+    def get_or_create(self, size: str, filename: str) -> Optional[str]:
+        """返回衍生图相对缓存目录的路径，不存在时生成；参数无效或原图不存在时返回None
+
+        filename 为URL中预设尺寸之后的部分，即 <原图相对路径>.<格式>。
+        """
+        if size not in DERIVATIVE_SIZES or '.' not in filename or not self.available:
+            return None
+        source_rel, fmt = filename.rsplit('.', 1)
+        if fmt not in DERIVATIVE_FORMATS or self.source_relpath(f"{self.upload_root}/{source_rel}") is None:
+            return None
+
+        relpath = os.path.join(size, filename)
+        target = os.path.join(self.root, relpath)
+        if os.path.exists(target):
+            return relpath
+        source = os.path.join(self.upload_root, source_rel)
+        if not os.path.exists(source):
+            return None
+
+        # 同一衍生图只生成一次；多进程同时生成时原子替换保证不会读到半个文件
+        with self._lock_for(target):
+            if not os.path.exists(target):
+                self._render(source, target, DERIVATIVE_SIZES[size], DERIVATIVE_FORMATS[fmt])
+        return relpath
+
+    @staticmethod
+    def _render(source: str, target: str, max_side: int, image_format: str):
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                # JPEG不支持透明通道，透明部分填充白色
+                rgba = image.convert('RGBA')
+                image = Image.new('RGB', rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.split()[3])
+            elif image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGBA')
+
+            options = {'quality': DERIVATIVE_QUALITY}
+            if image_format == 'WEBP':
+                options['method'] = 4
+            else:
+                options['optimize'] = True
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.thumb_', dir=os.path.dirname(target))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, format=image_format, **options)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, target)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+    def generate_all(self, url_or_path: str) -> int:
+        """上传后预先生成所有尺寸和格式的衍生图，返回生成的数量"""
+        relpath = self.source_relpath(url_or_path)
+        if relpath is None:
+            return 0
+        count = 0
+        for size in DERIVATIVE_SIZES:
+            for fmt in DERIVATIVE_FORMATS:
+                if self.get_or_create(size, f"{relpath}.{fmt}"):
+                    count += 1
+        return count
+
+    def remove(self, url_or_path: str) -> int:
+        """原图删除后清理其所有衍生图，返回删除的数量"""
+        relpath = self.source_relpath(url_or_path)
+        if relpath is None:
+            return 0
+        count = 0
+        for size in DERIVATIVE_SIZES:
+            for fmt in DERIVATIVE_FORMATS:
+                target = os.path.join(self.root, size, f"{relpath}.{fmt}")
+                try:
+                    os.remove(target)
+                    count += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"删除缩略图失败: {e}")
+        return count
+
+# 创建全局实例
+image_derivatives = ImageDerivativeService()
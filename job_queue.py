@@ -0,0 +1,517 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 任务状态
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+# 任务优先级，数值越大越先执行
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 5
+PRIORITY_HIGH = 10
+
+# 调度线程空闲时的轮询间隔（秒），用于拾取延迟任务和其他进程写入的任务
+POLL_INTERVAL = 1.0
+# 运行中的任务超过该时间没有心跳，视为所在进程已退出，重新入队
+STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', 900))
+# 执行中的任务刷新心跳的间隔（秒），需明显小于 STALE_SECONDS
+HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', max(1, min(60, STALE_SECONDS // 3))))
+# 已结束任务的保留天数
+RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', 7))
+# 任务数据库：JOB_QUEUE_DB 优先，其次是使用方通过 use_database() 指定的数据库（Flask应用使用主数据库），
+# 都未设置时使用独立的SQLite文件
+DEFAULT_JOB_QUEUE_DB = 'job_queue.sqlite'
+# 进程池的启动方式：调度线程和心跳线程运行时fork可能复制其他线程持有的锁导致子进程死锁，
+# 因此使用 forkserver（不支持时使用 spawn）
+PROCESS_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+class PermanentJobError(Exception):
+    """不可重试的任务错误，抛出后任务直接标记为失败"""
+
+
+class JobContext:
+    """传给任务处理函数的上下文，可在线程或子进程中上报进度"""
+
+    def __init__(self, job_id: str, db_path: str, attempt: int):
+        self.job_id = job_id
+        self.db_path = db_path
+        self.attempt = attempt
+
+    def report_progress(self, progress: float, message: str = ''):
+        """上报进度（0~1），同时刷新心跳"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('''
+                UPDATE jobs SET progress = ?, progress_message = ?, heartbeat_at = ?
+                WHERE id = ? AND status = ?
+            ''', (max(0.0, min(1.0, float(progress))), message, time.time(), self.job_id, STATUS_RUNNING))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _run_handler(func: Callable, payload: Dict[str, Any], context: JobContext):
+    """子进程入口：在进程池中执行处理函数"""
+    return func(payload, context)
+
+
+class JobQueue:
+    """基于SQLite的持久化任务队列
+
+    任务写入jobs表，由进程内的调度线程按优先级领取执行，
+    失败按指数退避重试，无需外部消息中间件，服务重启后未完成的任务会继续执行。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self._db_path = db_path
+        self._default_db_path = None
+        self.workers = int(os.getenv('JOB_WORKERS', 4))
+        # thread: 全部在调度线程中执行；process: 计算密集型任务交给进程池
+        self.executor = os.getenv('JOB_EXECUTOR', 'thread').lower()
+        self.process_workers = int(os.getenv('JOB_PROCESS_WORKERS', os.cpu_count() or 2))
+        self._handlers: Dict[str, Dict[str, Any]] = {}
+        self._table_ready = False
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._process_pool = None
+        self._last_recovery = 0.0
+        # 本进程正在执行的任务，停止时放回队列
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._running_lock = threading.Lock()
+
+    @property
+    def db_path(self) -> str:
+        return self._db_path or os.getenv('JOB_QUEUE_DB') or self._default_db_path or DEFAULT_JOB_QUEUE_DB
+
+    def use_database(self, db_path: str):
+        """未设置 JOB_QUEUE_DB 时使用的数据库，需在启动调度线程前调用"""
+        self._default_db_path = db_path
+        self._table_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._table_ready:
+            self.init_table(conn)
+        return conn
+
+    def init_table(self, conn=None):
+        """创建任务表（如果不存在）"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    job_type TEXT NOT NULL,
+                    payload TEXT DEFAULT '{}',
+                    priority INTEGER DEFAULT 5,
+                    status TEXT DEFAULT 'queued',
+                    attempts INTEGER DEFAULT 0,
+                    max_attempts INTEGER DEFAULT 3,
+                    run_after REAL DEFAULT 0,
+                    heartbeat_at REAL,
+                    progress REAL DEFAULT 0,
+                    progress_message TEXT DEFAULT '',
+                    result TEXT,
+                    error TEXT,
+                    created_at TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    lease_id TEXT
+                )
+            ''')
+            # 数据库迁移：每次领取生成的租约ID，用于区分同一任务的不同次执行
+            try:
+                conn.execute('ALTER TABLE jobs ADD COLUMN lease_id TEXT')
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e).lower():
+                    raise
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_jobs_dispatch
+                ON jobs (status, priority DESC, run_after, created_at)
+            ''')
+            conn.commit()
+            self._table_ready = True
+        finally:
+            if own_conn:
+                conn.close()
+
+    # ------------------------------------------------------------------
+    # 处理函数注册
+    # ------------------------------------------------------------------
+
+    def handler(self, job_type: str, max_attempts: int = 3, backoff_seconds: float = 5.0,
+                cpu_bound: bool = False):
+        """注册任务处理函数的装饰器
+
+        处理函数签名为 func(payload, job)，返回值需可JSON序列化，作为任务结果保存。
+        cpu_bound=True 的任务在 JOB_EXECUTOR=process 时交给进程池执行，
+        此时处理函数必须是模块级函数。
+        """
+        def decorator(func: Callable):
+            self._handlers[job_type] = {
+                'func': func,
+                'max_attempts': max_attempts,
+                'backoff_seconds': backoff_seconds,
+                'cpu_bound': cpu_bound
+            }
+            return func
+        return decorator
+
+    # ------------------------------------------------------------------
+    # 提交与查询
+    # ------------------------------------------------------------------
+
+    def enqueue(self, job_type: str, payload: Optional[Dict[str, Any]] = None,
+                priority: int = PRIORITY_NORMAL, run_after: Optional[datetime] = None,
+                max_attempts: Optional[int] = None) -> str:
+        """提交任务，返回任务ID；run_after 为延迟执行的时间点"""
+        if job_type not in self._handlers:
+            raise ValueError(f'未注册的任务类型: {job_type}')
+        if max_attempts is None:
+            max_attempts = self._handlers[job_type]['max_attempts']
+
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT INTO jobs (id, job_type, payload, priority, status, max_attempts, run_after, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, job_type, json.dumps(payload or {}, ensure_ascii=False), priority,
+                  STATUS_QUEUED, max_attempts, run_after.timestamp() if run_after else 0,
+                  datetime.now().isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        logger.info(f"任务已入队: {job_type} ({job_id})")
+        return job_id
+
+    def _row_to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'id': row['id'],
+            'job_type': row['job_type'],
+            'status': row['status'],
+            'priority': row['priority'],
+            'attempts': row['attempts'],
+            'max_attempts': row['max_attempts'],
+            'progress': row['progress'],
+            'progress_message': row['progress_message'],
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'run_after': datetime.fromtimestamp(row['run_after']).isoformat() if row['run_after'] else None
+        }
+
+    def get_job(self, job_id: str, include_result: bool = False) -> Optional[Dict[str, Any]]:
+        """获取任务状态，include_result=True 时附带结果"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        job = self._row_to_dict(row)
+        if include_result:
+            job['result'] = json.loads(row['result']) if row['result'] else None
+        return job
+
+    def list_jobs(self, status: Optional[str] = None, job_type: Optional[str] = None,
+                  limit: int = 50) -> List[Dict[str, Any]]:
+        """按创建时间倒序列出任务"""
+        conditions, params = [], []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if job_type:
+            conditions.append('job_type = ?')
+            params.append(job_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(f'SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?',
+                                (*params, limit)).fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_dict(row) for row in rows]
+
+    def cancel(self, job_id: str) -> bool:
+        """取消尚未开始执行的任务"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?
+            ''', (STATUS_CANCELLED, datetime.now().isoformat(), job_id, STATUS_QUEUED))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # 调度
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """启动调度线程；按进程幂等，fork出的子进程会重新启动自己的线程"""
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._threads = []
+            self._process_pool = None
+            self._recover_stale_jobs()
+            self._purge_finished_jobs()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._dispatch_loop, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started_pid = os.getpid()
+            logger.info(f"任务队列已启动: {self.workers}个调度线程, 执行器={self.executor}")
+
+    def stop(self, timeout: float = 5.0):
+        """停止调度线程：最多等待 timeout 秒让正在执行的任务完成，仍未完成的任务放回队列
+        
+        进程随后退出时这些任务不会停留在 running 状态等到心跳超时才重新执行，其他进程可以立即领取。
+        """
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+        self._requeue_running()
+        if self._process_pool:
+            # 未完成的任务已放回队列，取消排队中的调用；进程退出时解释器本身也会等待进程池，
+            # wait=False 只会让 forkserver 进程池在退出时与管理线程竞争已关闭的管道
+            self._process_pool.shutdown(wait=True, cancel_futures=True)
+        self._started_pid = None
+
+    def _requeue_running(self):
+        with self._running_lock:
+            jobs = list(self._running.values())
+        if not jobs:
+            return
+        conn = self._connect()
+        try:
+            requeued = 0
+            for job in jobs:
+                # 被停止打断的执行不计入重试次数；租约条件：任务已被其他进程重新领取时不再改动
+                requeued += conn.execute('''
+                    UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), run_after = 0,
+                                    lease_id = NULL, error = '执行进程已停止，任务重新入队'
+                    WHERE id = ? AND status = ? AND lease_id = ?
+                ''', (STATUS_QUEUED, job['id'], STATUS_RUNNING, job['lease_id'])).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if requeued:
+            logger.warning(f"进程停止，{requeued} 个未完成的任务已重新入队")
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        with self._start_lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context(PROCESS_START_METHOD))
+            return self._process_pool
+
+    def _recover_stale_jobs(self):
+        """把心跳超时的运行中任务重新放回队列，重试次数已用完的标记为失败"""
+        self._last_recovery = time.time()
+        cutoff = time.time() - STALE_SECONDS
+        conn = self._connect()
+        try:
+            failed = conn.execute('''
+                UPDATE jobs SET status = ?, error = '执行进程已退出，重试次数已用完', finished_at = ?
+                WHERE status = ? AND heartbeat_at < ? AND attempts >= max_attempts
+            ''', (STATUS_FAILED, datetime.now().isoformat(), STATUS_RUNNING, cutoff)).rowcount
+            requeued = conn.execute('''
+                UPDATE jobs SET status = ?, error = '执行进程已退出，任务重新入队'
+                WHERE status = ? AND heartbeat_at < ?
+            ''', (STATUS_QUEUED, STATUS_RUNNING, cutoff)).rowcount
+            conn.commit()
+            if requeued:
+                logger.warning(f"重新入队 {requeued} 个中断的任务")
+            if failed:
+                logger.error(f"{failed} 个中断的任务已达到最大重试次数，标记为失败")
+        finally:
+            conn.close()
+
+    def _purge_finished_jobs(self):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?
+            ''', (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED,
+                  datetime.fromtimestamp(time.time() - RETENTION_DAYS * 86400).isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """原子地领取一个可执行的任务，只领取本进程注册过的任务类型"""
+        job_types = list(self._handlers)
+        if not job_types:
+            return None
+        now = time.time()
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            placeholders = ','.join('?' * len(job_types))
+            row = conn.execute(f'''
+                SELECT * FROM jobs
+                WHERE status = ? AND run_after <= ? AND job_type IN ({placeholders})
+                ORDER BY priority DESC, run_after, created_at
+                LIMIT 1
+            ''', (STATUS_QUEUED, now, *job_types)).fetchone()
+            if not row:
+                conn.execute('COMMIT')
+                return None
+            lease_id = uuid.uuid4().hex
+            conn.execute('''
+                UPDATE jobs SET status = ?, attempts = attempts + 1, heartbeat_at = ?,
+                                started_at = ?, error = NULL, lease_id = ?
+                WHERE id = ?
+            ''', (STATUS_RUNNING, now, datetime.now().isoformat(), lease_id, row['id']))
+            conn.execute('COMMIT')
+            return {
+                'id': row['id'],
+                'job_type': row['job_type'],
+                'payload': json.loads(row['payload'] or '{}'),
+                'attempts': row['attempts'] + 1,
+                'max_attempts': row['max_attempts'],
+                'lease_id': lease_id
+            }
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            try:
+                if time.time() - self._last_recovery > 60:
+                    self._recover_stale_jobs()
+                job = self._claim_next()
+            except Exception as e:
+                logger.error(f"领取任务失败: {e}")
+                job = None
+
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(POLL_INTERVAL)
+                continue
+
+            self._execute(job)
+
+    def _execute(self, job: Dict[str, Any]):
+        spec = self._handlers[job['job_type']]
+        context = JobContext(job['id'], self.db_path, job['attempts'])
+        started = time.time()
+        # 执行期间定时刷新心跳，不上报进度的长任务不会被误判为中断而重复执行
+        heartbeat_stopped = threading.Event()
+        with self._running_lock:
+            self._running[job['id']] = job
+        threading.Thread(target=self._heartbeat_loop, args=(job, heartbeat_stopped),
+                         name=f"job-heartbeat-{job['id'][:8]}", daemon=True).start()
+        try:
+            try:
+                if spec['cpu_bound'] and self.executor == 'process':
+                    future = self._get_process_pool().submit(_run_handler, spec['func'], job['payload'], context)
+                    result = future.result()
+                else:
+                    result = spec['func'](job['payload'], context)
+            except Exception as e:
+                retry = not isinstance(e, PermanentJobError) and job['attempts'] < job['max_attempts']
+                self._finish_failed(job, spec, str(e), retry)
+                return
+
+            self._finish_succeeded(job, result)
+            logger.info(f"任务完成: {job['job_type']} ({job['id']})，耗时 {time.time() - started:.2f}s")
+        finally:
+            heartbeat_stopped.set()
+            with self._running_lock:
+                self._running.pop(job['id'], None)
+
+    def _heartbeat_loop(self, job: Dict[str, Any], stopped: threading.Event):
+        while not stopped.wait(HEARTBEAT_SECONDS):
+            try:
+                conn = sqlite3.connect(self.db_path, timeout=30)
+                try:
+                    conn.execute('''
+                        UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ? AND lease_id = ?
+                    ''', (time.time(), job['id'], STATUS_RUNNING, job['lease_id']))
+                    conn.commit()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"刷新任务心跳失败 ({job['id']}): {e}")
+
+    def _finish_succeeded(self, job: Dict[str, Any], result: Any):
+        # 只更新本次领取的执行：停止时已放回队列并被其他进程重新领取的任务由新的执行写入结果
+        conn = self._connect()
+        try:
+            conn.execute('''
+                UPDATE jobs SET status = ?, progress = 1, result = ?, finished_at = ?
+                WHERE id = ? AND status = ? AND lease_id = ?
+            ''', (STATUS_SUCCEEDED, json.dumps(result, ensure_ascii=False, default=str),
+                  datetime.now().isoformat(), job['id'], STATUS_RUNNING, job['lease_id']))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _finish_failed(self, job: Dict[str, Any], spec: Dict[str, Any], error: str, retry: bool):
+        conn = self._connect()
+        try:
+            if retry:
+                delay = spec['backoff_seconds'] * (2 ** (job['attempts'] - 1))
+                conn.execute('''
+                    UPDATE jobs SET status = ?, run_after = ?, error = ?
+                    WHERE id = ? AND status = ? AND lease_id = ?
+                ''', (STATUS_QUEUED, time.time() + delay, error, job['id'], STATUS_RUNNING, job['lease_id']))
+                logger.warning(f"任务失败，{delay:.1f}秒后重试 "
+                               f"({job['attempts']}/{job['max_attempts']}): {job['job_type']} ({job['id']}): {error}")
+            else:
+                conn.execute('''
+                    UPDATE jobs SET status = ?, error = ?, finished_at = ?
+                    WHERE id = ? AND status = ? AND lease_id = ?
+                ''', (STATUS_FAILED, error, datetime.now().isoformat(), job['id'], STATUS_RUNNING, job['lease_id']))
+                logger.error(f"任务失败: {job['job_type']} ({job['id']}): {error}")
+            conn.commit()
+        finally:
+            conn.close()
+
+# 创建全局实例
+job_queue = JobQueue()
@@ -0,0 +1,80 @@
+"""
+事件循环延迟监测
+
+后台协程每隔 interval 秒 sleep 一次，实际醒来的时间比预期晚了多少，就是这段时间事件循环被占用的时长。
+协程中出现同步阻塞调用（同步数据库查询、bcrypt、文件读写等）时延迟会明显升高，
+超过 warn_ms 时记录警告日志。FastAPI 应用启动时调用 loop_lag_monitor.start()。
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+from collections import deque
+from typing import Any, Dict, Optional
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """采样事件循环延迟，保留最近 window 个样本"""
+
+    def __init__(self, interval: float = 0.01, window: int = 6000, warn_ms: float = 100.0):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self._samples = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+        self.max_lag_ms = 0.0
+        self.slow_count = 0
+
+    def start(self):
+        """在当前事件循环中启动采样（重复调用无效）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self):
+        self._samples.clear()
+        self.max_lag_ms = 0.0
+        self.slow_count = 0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (loop.time() - started - self.interval) * 1000)
+            self._samples.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            if lag_ms >= self.warn_ms:
+                self.slow_count += 1
+                logger.warning(f"事件循环被阻塞 {lag_ms:.0f}ms")
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self._samples)
+        if not samples:
+            return {'running': self._task is not None, 'samples': 0}
+        return {
+            'running': self._task is not None and not self._task.done(),
+            'samples': len(samples),
+            'interval_ms': self.interval * 1000,
+            'mean_ms': round(statistics.fmean(samples), 3),
+            'p50_ms': round(samples[len(samples) // 2], 3),
+            'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+            'max_ms': round(self.max_lag_ms, 3),
+            'slow_count': self.slow_count,
+            'warn_ms': self.warn_ms,
+        }
+
+
+# 创建全局实例
+loop_lag_monitor = LoopLagMonitor(warn_ms=float(os.getenv('LOOP_LAG_WARN_MS', 100)))
@@ -1,8 +1,9 @@
 # main.py - FastAPI主应用
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
@@ -14,7 +15,12 @@ import asyncio
 from celery import Celery
 import redis
 
-from database import get_db, Customer, Folder, Interaction, AIScript, AIInsight, Task, init_default_folders
+from single_flight import ai_async_single_flight, request_fingerprint
+from loop_monitor import loop_lag_monitor
+from serialization import FastJSONResponse, negotiated_response
+from response_compression import CompressionMiddleware
+from database import (get_async_db, SessionLocal, AsyncSessionLocal, db_engines, Customer, Folder, Interaction,
+                      AIScript, AIInsight, Task, init_default_folders)
 
 load_dotenv()
 
@@ -22,7 +28,8 @@ load_dotenv()
 app = FastAPI(
     title="AI-Driven CRM API",
     description="智能客户关系管理系统API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # CORS配置
@@ -34,6 +41,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩（gzip/brotli/zstd），流式响应逐块压缩
+app.add_middleware(CompressionMiddleware)
+
 # Redis连接
 redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
 
@@ -135,6 +145,21 @@ class AIService:
         self.deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
         self.grok_api_key = os.getenv("GROK_API_KEY")
     
+    async def _chat_completion(self, payload: Dict[str, Any]) -> httpx.Response:
+        """调用OpenAI对话接口，请求体相同的并发调用合并为一次"""
+        async def post():
+            async with httpx.AsyncClient() as client:
+                return await client.post(
+                    "https://api.openai.com/v1/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {self.openai_api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json=payload
+                )
+        
+        return await ai_async_single_flight.do(request_fingerprint(payload), post, label=payload["model"])
+    
     async def analyze_customer_profile(self, customer: Customer, interactions: List[Interaction]) -> Dict[str, Any]:
         """分析客户画像"""
         # 构建分析提示
@@ -169,37 +194,29 @@ class AIService:
         
         # 调用AI API（这里使用OpenAI作为示例）
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.openai_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "gpt-4",
-                        "messages": [
-                            {"role": "system", "content": "你是一个专业的客户分析师，擅长从互动记录中分析客户特征。"},
-                            {"role": "user", "content": prompt}
-                        ],
-                        "temperature": 0.7,
-                        "max_tokens": 1000
-                    }
-                )
+            response = await self._chat_completion({
+                "model": "gpt-4",
+                "messages": [
+                    {"role": "system", "content": "你是一个专业的客户分析师，擅长从互动记录中分析客户特征。"},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": 0.7,
+                "max_tokens": 1000
+            })
+            
+            if response.status_code == 200:
+                result = response.json()
+                content = result['choices'][0]['message']['content']
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result['choices'][0]['message']['content']
-                    
-                    # 尝试解析JSON
-                    try:
-                        analysis = json.loads(content)
-                        return analysis
-                    except json.JSONDecodeError:
-                        # 如果不是有效JSON，返回文本分析
-                        return {"analysis": content}
-                else:
-                    raise HTTPException(status_code=500, detail="AI分析服务暂时不可用")
+                # 尝试解析JSON
+                try:
+                    analysis = json.loads(content)
+                    return analysis
+                except json.JSONDecodeError:
+                    # 如果不是有效JSON，返回文本分析
+                    return {"analysis": content}
+            else:
+                raise HTTPException(status_code=500, detail="AI分析服务暂时不可用")
                     
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"AI分析失败: {str(e)}")
@@ -231,29 +248,21 @@ class AIService:
         """
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.openai_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "gpt-4",
-                        "messages": [
-                            {"role": "system", "content": "你是一个专业的销售培训师，擅长根据客户特征生成个性化销售话术。"},
-                            {"role": "user", "content": prompt}
-                        ],
-                        "temperature": 0.8,
-                        "max_tokens": 800
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result['choices'][0]['message']['content']
-                else:
-                    raise HTTPException(status_code=500, detail="话术生成服务暂时不可用")
+            response = await self._chat_completion({
+                "model": "gpt-4",
+                "messages": [
+                    {"role": "system", "content": "你是一个专业的销售培训师，擅长根据客户特征生成个性化销售话术。"},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": 0.8,
+                "max_tokens": 800
+            })
+            
+            if response.status_code == 200:
+                result = response.json()
+                return result['choices'][0]['message']['content']
+            else:
+                raise HTTPException(status_code=500, detail="话术生成服务暂时不可用")
                     
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"话术生成失败: {str(e)}")
@@ -275,33 +284,25 @@ class AIService:
         """
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.openai_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "gpt-3.5-turbo",
-                        "messages": [
-                            {"role": "system", "content": "你是一个情感分析专家。"},
-                            {"role": "user", "content": prompt}
-                        ],
-                        "temperature": 0.3,
-                        "max_tokens": 300
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result['choices'][0]['message']['content']
-                    try:
-                        return json.loads(content)
-                    except json.JSONDecodeError:
-                        return {"sentiment": "neutral", "score": 0.0, "analysis": content}
-                else:
-                    return {"sentiment": "neutral", "score": 0.0}
+            response = await self._chat_completion({
+                "model": "gpt-3.5-turbo",
+                "messages": [
+                    {"role": "system", "content": "你是一个情感分析专家。"},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": 0.3,
+                "max_tokens": 300
+            })
+            
+            if response.status_code == 200:
+                result = response.json()
+                content = result['choices'][0]['message']['content']
+                try:
+                    return json.loads(content)
+                except json.JSONDecodeError:
+                    return {"sentiment": "neutral", "score": 0.0, "analysis": content}
+            else:
+                return {"sentiment": "neutral", "score": 0.0}
                     
         except Exception as e:
             return {"sentiment": "neutral", "score": 0.0, "error": str(e)}
@@ -322,32 +323,46 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 async def root():
     return {"message": "AI-Driven CRM API", "version": "1.0.0"}
 
+@app.get("/ai/single-flight")
+async def get_ai_single_flight_stats():
+    """AI请求合并统计"""
+    return ai_async_single_flight.stats()
+
+@app.get("/metrics/event-loop")
+async def get_event_loop_stats(reset: bool = False):
+    """事件循环延迟和数据库连接池状态；reset=true 时返回后清空延迟样本（分阶段压测用）"""
+    stats = {"event_loop": loop_lag_monitor.stats(), "database": db_engines.pool_status()}
+    if reset:
+        loop_lag_monitor.reset()
+    return stats
+
 # 客户管理API
 @app.get("/api/customers", response_model=List[Dict[str, Any]])
 async def get_customers(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     folder_id: Optional[int] = None,
     search: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取客户列表"""
-    query = db.query(Customer)
+    query = select(Customer)
     
     if folder_id:
-        query = query.filter(Customer.folder_id == folder_id)
+        query = query.where(Customer.folder_id == folder_id)
     
     if search:
-        query = query.filter(
+        query = query.where(
             Customer.name.contains(search) |
             Customer.company.contains(search) |
             Customer.email.contains(search)
         )
     
-    customers = query.offset(skip).limit(limit).all()
+    customers = (await db.scalars(query.offset(skip).limit(limit))).all()
     
-    return [
+    return negotiated_response(request, [
         {
             "id": c.id,
             "name": c.name,
@@ -364,12 +379,12 @@ async def get_customers(
             "updated_at": c.updated_at
         }
         for c in customers
-    ]
+    ])
 
 @app.post("/api/customers", response_model=Dict[str, Any])
 async def create_customer(
     customer_data: CustomerCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建新客户"""
@@ -390,8 +405,8 @@ async def create_customer(
     )
     
     db.add(customer)
-    db.commit()
-    db.refresh(customer)
+    await db.commit()
+    await db.refresh(customer)
     
     return {
         "id": customer.id,
@@ -402,16 +417,16 @@ async def create_customer(
 @app.get("/api/customers/{customer_id}", response_model=Dict[str, Any])
 async def get_customer(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取客户详情"""
-    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
     # 获取互动记录
-    interactions = db.query(Interaction).filter(Interaction.customer_id == customer_id).order_by(Interaction.interaction_date.desc()).limit(10).all()
+    interactions = (await db.scalars(select(Interaction).where(Interaction.customer_id == customer_id).order_by(Interaction.interaction_date.desc()).limit(10))).all()
     
     return {
         "id": customer.id,
@@ -452,11 +467,11 @@ async def get_customer(
 async def update_customer(
     customer_id: int,
     customer_data: CustomerUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """更新客户信息"""
-    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -465,19 +480,21 @@ async def update_customer(
         setattr(customer, field, value)
     
     customer.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(customer)
+    await db.commit()
+    await db.refresh(customer)
     
     return {"message": "客户信息更新成功"}
 
 # 文件夹管理API
 @app.get("/api/folders", response_model=List[Dict[str, Any]])
 async def get_folders(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取文件夹列表"""
-    folders = db.query(Folder).order_by(Folder.order).all()
+    # 客户数用一次分组查询统计，不逐个加载文件夹下的客户
+    customer_counts = dict((await db.execute(select(Customer.folder_id, func.count()).group_by(Customer.folder_id))).all())
+    folders = (await db.scalars(select(Folder).order_by(Folder.order))).all()
     
     return [
         {
@@ -488,7 +505,7 @@ async def get_folders(
             "folder_type": f.folder_type,
             "color": f.color,
             "icon": f.icon,
-            "customer_count": len(f.customers)
+            "customer_count": customer_counts.get(f.id, 0)
         }
         for f in folders
     ]
@@ -496,7 +513,7 @@ async def get_folders(
 @app.post("/api/folders", response_model=Dict[str, Any])
 async def create_folder(
     folder_data: FolderCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建新文件夹"""
@@ -509,8 +526,8 @@ async def create_folder(
     )
     
     db.add(folder)
-    db.commit()
-    db.refresh(folder)
+    await db.commit()
+    await db.refresh(folder)
     
     return {
         "id": folder.id,
@@ -523,7 +540,7 @@ async def create_folder(
 async def create_interaction(
     interaction_data: InteractionCreate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建互动记录"""
@@ -538,8 +555,8 @@ async def create_interaction(
     )
     
     db.add(interaction)
-    db.commit()
-    db.refresh(interaction)
+    await db.commit()
+    await db.refresh(interaction)
     
     # 异步分析情感
     background_tasks.add_task(analyze_interaction_async, interaction.id, interaction_data.content)
@@ -551,38 +568,39 @@ async def create_interaction(
 
 async def analyze_interaction_async(interaction_id: int, content: str):
     """异步分析互动情感"""
-    db = next(get_db())
     try:
-        # 分析情感
+        # 分析情感（等待AI期间不占用数据库连接）
         sentiment_result = await ai_service.analyze_interaction_sentiment(content)
         
         # 更新互动记录
-        interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
-        if interaction:
-            interaction.sentiment = sentiment_result.get('sentiment', 'neutral')
-            interaction.sentiment_score = sentiment_result.get('score', 0.0)
-            interaction.summary = sentiment_result.get('analysis', '')[:500]  # 限制长度
-            db.commit()
+        async with AsyncSessionLocal() as db:
+            interaction = await db.get(Interaction, interaction_id)
+            if interaction:
+                interaction.sentiment = sentiment_result.get('sentiment', 'neutral')
+                interaction.sentiment_score = sentiment_result.get('score', 0.0)
+                interaction.summary = sentiment_result.get('analysis', '')[:500]  # 限制长度
+                await db.commit()
     
     except Exception as e:
         print(f"情感分析失败: {e}")
-    finally:
-        db.close()
 
 # AI功能API
 @app.post("/api/ai/analyze-profile/{customer_id}", response_model=Dict[str, Any])
 async def analyze_customer_profile(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """AI分析客户画像"""
-    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
     # 获取互动记录
-    interactions = db.query(Interaction).filter(Interaction.customer_id == customer_id).order_by(Interaction.interaction_date.desc()).all()
+    interactions = (await db.scalars(select(Interaction).where(Interaction.customer_id == customer_id).order_by(Interaction.interaction_date.desc()))).all()
+    
+    # 结束只读事务，等待AI响应期间把连接还给连接池
+    await db.commit()
     
     # AI分析
     analysis = await ai_service.analyze_customer_profile(customer, interactions)
@@ -591,7 +609,7 @@ async def analyze_customer_profile(
     customer.ai_profile = analysis
     customer.ai_score = analysis.get('opportunity_score', 0)
     customer.updated_at = datetime.utcnow()
-    db.commit()
+    await db.commit()
     
     return {
         "customer_id": customer_id,
@@ -602,14 +620,17 @@ async def analyze_customer_profile(
 @app.post("/api/ai/generate-script", response_model=Dict[str, Any])
 async def generate_sales_script(
     script_request: AIScriptRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """生成销售话术"""
-    customer = db.query(Customer).filter(Customer.id == script_request.customer_id).first()
+    customer = await db.get(Customer, script_request.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
+    # 结束只读事务，等待AI响应期间把连接还给连接池
+    await db.commit()
+    
     # 生成话术
     script_content = await ai_service.generate_sales_script(customer, script_request)
     
@@ -627,8 +648,8 @@ async def generate_sales_script(
     )
     
     db.add(script)
-    db.commit()
-    db.refresh(script)
+    await db.commit()
+    await db.refresh(script)
     
     return {
         "script_id": script.id,
@@ -640,7 +661,7 @@ async def generate_sales_script(
 @app.post("/api/tasks", response_model=Dict[str, Any])
 async def create_task(
     task_data: TaskCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建任务"""
@@ -655,8 +676,8 @@ async def create_task(
     )
     
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    await db.commit()
+    await db.refresh(task)
     
     return {
         "id": task.id,
@@ -666,23 +687,24 @@ async def create_task(
 
 @app.get("/api/tasks", response_model=List[Dict[str, Any]])
 async def get_tasks(
+    request: Request,
     customer_id: Optional[int] = None,
     status: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取任务列表"""
-    query = db.query(Task)
+    query = select(Task)
     
     if customer_id:
-        query = query.filter(Task.customer_id == customer_id)
+        query = query.where(Task.customer_id == customer_id)
     
     if status:
-        query = query.filter(Task.status == status)
+        query = query.where(Task.status == status)
     
-    tasks = query.order_by(Task.due_date.asc()).all()
+    tasks = (await db.scalars(query.order_by(Task.due_date.asc()))).all()
     
-    return [
+    return negotiated_response(request, [
         {
             "id": t.id,
             "customer_id": t.customer_id,
@@ -697,17 +719,17 @@ async def get_tasks(
             "created_at": t.created_at
         }
         for t in tasks
-    ]
+    ])
 
 @app.put("/api/tasks/{task_id}", response_model=Dict[str, Any])
 async def update_task(
     task_id: int,
     task_data: TaskCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """更新任务"""
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     
@@ -717,8 +739,8 @@ async def update_task(
         setattr(task, field, value)
     
     task.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(task)
+    await db.commit()
+    await db.refresh(task)
     
     return {
         "id": task.id,
@@ -729,17 +751,17 @@ async def update_task(
 @app.delete("/api/tasks/{task_id}")
 async def delete_task(
     task_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """删除任务"""
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     
     task_title = task.title
-    db.delete(task)
-    db.commit()
+    await db.delete(task)
+    await db.commit()
     
     return {"message": f"任务 '{task_title}' 删除成功"}
 
@@ -748,11 +770,11 @@ async def delete_task(
 async def upload_avatar(
     customer_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """上传客户头像"""
-    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -763,19 +785,16 @@ async def upload_avatar(
     # 保存文件（这里简化处理，实际应该使用云存储）
     file_path = f"uploads/avatars/{customer_id}_{file.filename}"
     
-    # 更新客户照片信息
-    if not customer.photos:
-        customer.photos = []
-    
-    customer.photos.append({
+    # 更新客户照片信息（JSON列整体赋值才会被识别为修改）
+    customer.photos = (customer.photos or []) + [{
         "url": file_path,
         "type": "profile",
         "source": "upload",
         "uploadedAt": datetime.utcnow().isoformat()
-    })
+    }]
     
     customer.updated_at = datetime.utcnow()
-    db.commit()
+    await db.commit()
     
     return {
         "message": "头像上传成功",
@@ -907,10 +926,8 @@ async def save_ai_settings(
         return {"success": False, "error": f"保存失败: {str(e)}"}
 
 # 初始化数据
-@app.on_event("startup")
-async def startup_event():
-    """应用启动时初始化数据"""
-    db = next(get_db())
+def _init_default_data():
+    db = SessionLocal()
     try:
         init_default_folders(db)
         print("默认文件夹初始化完成")
@@ -919,6 +936,17 @@ async def startup_event():
     finally:
         db.close()
 
+@app.on_event("startup")
+async def startup_event():
+    """应用启动时初始化数据"""
+    loop_lag_monitor.start()
+    await asyncio.to_thread(_init_default_data)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await loop_lag_monitor.stop()
+    await db_engines.dispose()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
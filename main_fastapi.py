@@ -1,10 +1,11 @@
 # main_fastapi.py - FastAPI CRM 主应用程序
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, WebSocket
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, WebSocket, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, update, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import httpx
@@ -16,7 +17,11 @@ from contextlib import asynccontextmanager
 import redis
 from celery import Celery
 import logging
-from database import get_db, Customer, Folder, engine, Base
+from database import get_async_db, AsyncSessionLocal, Customer, Folder, async_engine, db_engines, Base
+from single_flight import ai_async_single_flight, request_fingerprint
+from loop_monitor import loop_lag_monitor
+from serialization import FastJSONResponse, negotiated_response
+from response_compression import CompressionMiddleware
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -139,45 +144,47 @@ class ReminderCreate(BaseModel):
 async def lifespan(app: FastAPI):
     # 启动时初始化
     logger.info("启动 FastAPI CRM 应用程序")
+    loop_lag_monitor.start()
     
     # 创建数据库表
-    Base.metadata.create_all(bind=engine)
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     
     # 初始化默认文件夹
-    db = next(get_db())
-    try:
-        default_folders = [
-            {"name": "潜在客户", "order": 1},
-            {"name": "活跃客户", "order": 2},
-            {"name": "已成交", "order": 3},
-            {"name": "已流失", "order": 4}
-        ]
-        
-        for folder_data in default_folders:
-            existing = db.query(Folder).filter(Folder.name == folder_data["name"]).first()
-            if not existing:
-                folder = Folder(**folder_data)
-                db.add(folder)
-        
-        db.commit()
-        logger.info("默认文件夹初始化完成")
-    except Exception as e:
-        logger.error(f"初始化默认文件夹失败: {e}")
-        db.rollback()
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        try:
+            default_folders = [
+                {"name": "潜在客户", "order": 1},
+                {"name": "活跃客户", "order": 2},
+                {"name": "已成交", "order": 3},
+                {"name": "已流失", "order": 4}
+            ]
+            
+            existing = set(await db.scalars(select(Folder.name).where(Folder.name.in_([f["name"] for f in default_folders]))))
+            for folder_data in default_folders:
+                if folder_data["name"] not in existing:
+                    db.add(Folder(**folder_data))
+            
+            await db.commit()
+            logger.info("默认文件夹初始化完成")
+        except Exception as e:
+            logger.error(f"初始化默认文件夹失败: {e}")
+            await db.rollback()
     
     yield
     
     # 关闭时清理
     logger.info("关闭 FastAPI CRM 应用程序")
+    await loop_lag_monitor.stop()
+    await db_engines.dispose()
 
 # 创建FastAPI应用
 app = FastAPI(
     title="AI CRM 系统",
     description="基于FastAPI的智能客户关系管理系统，集成多个AI模型",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # 中间件配置
@@ -194,6 +201,9 @@ app.add_middleware(
     allowed_hosts=["localhost", "127.0.0.1", "*.example.com"]
 )
 
+# 响应压缩（gzip/brotli/zstd），流式响应逐块压缩
+app.add_middleware(CompressionMiddleware)
+
 # 安全配置
 security = HTTPBearer()
 
@@ -211,7 +221,12 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
 # AI服务函数
 async def call_ai_model(model_name: str, prompt: str, context: Optional[str] = None) -> Dict[str, Any]:
-    """调用指定的AI模型"""
+    """调用指定的AI模型，参数相同的并发请求合并为一次调用"""
+    key = request_fingerprint(model_name, prompt, context)
+    return await ai_async_single_flight.do(key, lambda: _call_ai_model(model_name, prompt, context),
+                                           label="call_ai_model")
+
+async def _call_ai_model(model_name: str, prompt: str, context: Optional[str] = None) -> Dict[str, Any]:
     if model_name not in AI_MODELS:
         raise HTTPException(status_code=400, detail=f"不支持的AI模型: {model_name}")
     
@@ -276,12 +291,11 @@ async def health_check():
     """健康检查"""
     try:
         # 检查数据库连接
-        db = next(get_db())
-        db.execute("SELECT 1")
-        db.close()
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
         
-        # 检查Redis连接
-        redis_client.ping()
+        # 检查Redis连接（同步客户端，放到线程池执行）
+        await asyncio.to_thread(redis_client.ping)
         
         return {
             "status": "healthy",
@@ -300,51 +314,52 @@ async def health_check():
 @app.post("/customers/", response_model=CustomerResponse)
 async def create_customer(
     customer: CustomerCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建新客户"""
     db_customer = Customer(**customer.dict())
     db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
+    await db.commit()
+    await db.refresh(db_customer)
     
     logger.info(f"用户 {current_user['username']} 创建了客户: {db_customer.name}")
     return db_customer
 
 @app.get("/customers/", response_model=List[CustomerResponse])
 async def list_customers(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     folder_id: Optional[int] = None,
     search: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取客户列表"""
-    query = db.query(Customer)
+    query = select(Customer)
     
     if folder_id:
-        query = query.filter(Customer.folder_id == folder_id)
+        query = query.where(Customer.folder_id == folder_id)
     
     if search:
-        query = query.filter(
+        query = query.where(
             Customer.name.contains(search) |
             Customer.email.contains(search) |
             Customer.phone.contains(search)
         )
     
-    customers = query.offset(skip).limit(limit).all()
-    return customers
+    customers = (await db.scalars(query.offset(skip).limit(limit))).all()
+    return negotiated_response(request, [CustomerResponse.model_validate(c).model_dump() for c in customers])
 
 @app.get("/customers/{customer_id}", response_model=CustomerResponse)
 async def get_customer(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取单个客户详情"""
-    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     return customer
@@ -353,11 +368,11 @@ async def get_customer(
 async def update_customer(
     customer_id: int,
     customer_update: CustomerUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """更新客户信息"""
-    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -365,8 +380,8 @@ async def update_customer(
     for field, value in update_data.items():
         setattr(customer, field, value)
     
-    db.commit()
-    db.refresh(customer)
+    await db.commit()
+    await db.refresh(customer)
     
     logger.info(f"用户 {current_user['username']} 更新了客户: {customer.name}")
     return customer
@@ -374,17 +389,17 @@ async def update_customer(
 @app.delete("/customers/{customer_id}")
 async def delete_customer(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """删除客户"""
-    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
     customer_name = customer.name
-    db.delete(customer)
-    db.commit()
+    await db.delete(customer)
+    await db.commit()
     
     logger.info(f"用户 {current_user['username']} 删除了客户: {customer_name}")
     return {"message": "客户删除成功"}
@@ -394,36 +409,36 @@ async def delete_customer(
 @app.post("/folders/", response_model=FolderResponse)
 async def create_folder(
     folder: FolderCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建新文件夹"""
     db_folder = Folder(**folder.dict())
     db.add(db_folder)
-    db.commit()
-    db.refresh(db_folder)
+    await db.commit()
+    await db.refresh(db_folder)
     
     logger.info(f"用户 {current_user['username']} 创建了文件夹: {db_folder.name}")
     return db_folder
 
 @app.get("/folders/", response_model=List[FolderResponse])
 async def list_folders(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取文件夹列表"""
-    folders = db.query(Folder).order_by(Folder.order).all()
+    folders = (await db.scalars(select(Folder).order_by(Folder.order))).all()
     return folders
 
 @app.put("/folders/{folder_id}", response_model=FolderResponse)
 async def update_folder(
     folder_id: int,
     folder_update: FolderUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """更新文件夹"""
-    folder = db.query(Folder).filter(Folder.id == folder_id).first()
+    folder = await db.get(Folder, folder_id)
     if not folder:
         raise HTTPException(status_code=404, detail="文件夹不存在")
     
@@ -431,8 +446,8 @@ async def update_folder(
     for field, value in update_data.items():
         setattr(folder, field, value)
     
-    db.commit()
-    db.refresh(folder)
+    await db.commit()
+    await db.refresh(folder)
     
     logger.info(f"用户 {current_user['username']} 更新了文件夹: {folder.name}")
     return folder
@@ -440,22 +455,22 @@ async def update_folder(
 @app.delete("/folders/{folder_id}")
 async def delete_folder(
     folder_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """删除文件夹"""
-    folder = db.query(Folder).filter(Folder.id == folder_id).first()
+    folder = await db.get(Folder, folder_id)
     if not folder:
         raise HTTPException(status_code=404, detail="文件夹不存在")
     
     # 检查是否有客户在此文件夹中
-    customers_count = db.query(Customer).filter(Customer.folder_id == folder_id).count()
+    customers_count = await db.scalar(select(func.count()).select_from(Customer).where(Customer.folder_id == folder_id))
     if customers_count > 0:
         raise HTTPException(status_code=400, detail=f"文件夹中还有 {customers_count} 个客户，无法删除")
     
     folder_name = folder.name
-    db.delete(folder)
-    db.commit()
+    await db.delete(folder)
+    await db.commit()
     
     logger.info(f"用户 {current_user['username']} 删除了文件夹: {folder_name}")
     return {"message": "文件夹删除成功"}
@@ -463,16 +478,16 @@ async def delete_folder(
 @app.post("/folders/{folder_id}/dissolve")
 async def dissolve_folder(
     folder_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """解散文件夹 - 将组内所有客户移动到默认分组"""
-    folder = db.query(Folder).filter(Folder.id == folder_id).first()
+    folder = await db.get(Folder, folder_id)
     if not folder:
         raise HTTPException(status_code=404, detail="文件夹不存在")
     
     # 获取默认分组（第一个分组）
-    default_folder = db.query(Folder).order_by(Folder.order).first()
+    default_folder = await db.scalar(select(Folder).order_by(Folder.order).limit(1))
     if not default_folder:
         raise HTTPException(status_code=500, detail="系统中没有可用的默认分组")
     
@@ -481,7 +496,7 @@ async def dissolve_folder(
         raise HTTPException(status_code=400, detail="不能解散默认分组")
     
     # 获取该分组中的所有客户
-    customers_in_folder = db.query(Customer).filter(Customer.folder_id == folder_id).all()
+    customers_in_folder = (await db.scalars(select(Customer).where(Customer.folder_id == folder_id))).all()
     customers_count = len(customers_in_folder)
     
     # 将所有客户移动到默认分组
@@ -490,8 +505,8 @@ async def dissolve_folder(
     
     # 删除空的分组
     folder_name = folder.name
-    db.delete(folder)
-    db.commit()
+    await db.delete(folder)
+    await db.commit()
     
     logger.info(f"用户 {current_user['username']} 解散了文件夹 '{folder_name}'，将 {customers_count} 个客户移动到默认分组 '{default_folder.name}'")
     
@@ -507,11 +522,11 @@ async def dissolve_folder(
 @app.post("/ai/analyze", response_model=AIAnalysisResponse)
 async def analyze_customer(
     analysis_request: AIAnalysisRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """AI客户分析"""
-    customer = db.query(Customer).filter(Customer.id == analysis_request.customer_id).first()
+    customer = await db.get(Customer, analysis_request.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -533,6 +548,9 @@ async def analyze_customer(
     if analysis_request.analysis_type in ["personality", "communication"]:
         model_name = "deepseek-reasoner"  # 使用推理能力更强的模型
     
+    # 结束只读事务，等待AI响应期间把连接还给连接池
+    await db.commit()
+    
     try:
         ai_result = await call_ai_model(model_name, prompt, analysis_request.context)
         
@@ -549,7 +567,7 @@ async def analyze_customer(
         
         # 缓存结果
         cache_key = f"ai_analysis:{customer.id}:{analysis_request.analysis_type}"
-        redis_client.setex(cache_key, 3600, json.dumps(result))  # 缓存1小时
+        await asyncio.to_thread(redis_client.setex, cache_key, 3600, json.dumps(result))  # 缓存1小时
         
         logger.info(f"用户 {current_user['username']} 对客户 {customer.name} 进行了 {analysis_request.analysis_type} 分析")
         
@@ -580,17 +598,30 @@ async def list_ai_models(current_user: dict = Depends(get_current_user)):
         ]
     }
 
+@app.get("/ai/single-flight")
+async def get_ai_single_flight_stats():
+    """AI请求合并统计"""
+    return ai_async_single_flight.stats()
+
+@app.get("/metrics/event-loop")
+async def get_event_loop_stats(reset: bool = False):
+    """事件循环延迟和数据库连接池状态；reset=true 时返回后清空延迟样本（分阶段压测用）"""
+    stats = {"event_loop": loop_lag_monitor.stats(), "database": db_engines.pool_status()}
+    if reset:
+        loop_lag_monitor.reset()
+    return stats
+
 # 提醒系统API
 
 @app.post("/reminders/")
 async def create_reminder(
     reminder: ReminderCreate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建客户提醒"""
-    customer = db.query(Customer).filter(Customer.id == reminder.customer_id).first()
+    customer = await db.get(Customer, reminder.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="客户不存在")
     
@@ -601,7 +632,8 @@ async def create_reminder(
         raise HTTPException(status_code=400, detail="提醒时间必须是未来时间")
     
     # 添加到Celery任务队列
-    task = send_reminder_task.apply_async(
+    task = await asyncio.to_thread(
+        send_reminder_task.apply_async,
         args=[reminder.customer_id, reminder.message, reminder.reminder_time.isoformat()],
         countdown=delay_seconds
     )
@@ -613,7 +645,7 @@ async def create_reminder(
         "type": reminder.reminder_type,
         "task_id": task.id
     }
-    db.commit()
+    await db.commit()
     
     logger.info(f"用户 {current_user['username']} 为客户 {customer.name} 设置了提醒")
     
@@ -661,20 +693,20 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
 
 @app.get("/stats/dashboard")
 async def get_dashboard_stats(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取仪表板统计数据"""
-    total_customers = db.query(Customer).count()
+    total_customers = await db.scalar(select(func.count()).select_from(Customer))
     
     # 按文件夹统计
-    folder_stats = db.query(Folder.name, db.func.count(Customer.id).label('count')).outerjoin(Customer, Folder.id == Customer.folder_id).group_by(Folder.id, Folder.name).all()
+    folder_stats = (await db.execute(select(Folder.name, func.count(Customer.id).label('count')).outerjoin(Customer, Folder.id == Customer.folder_id).group_by(Folder.id, Folder.name))).all()
     
     # 进度统计
-    avg_progress = db.query(db.func.avg(Customer.progress)).scalar() or 0
+    avg_progress = await db.scalar(select(func.avg(Customer.progress))) or 0
     
     # 最近活动
-    recent_customers = db.query(Customer).order_by(Customer.updated_at.desc()).limit(5).all()
+    recent_customers = (await db.scalars(select(Customer).order_by(Customer.updated_at.desc()).limit(5))).all()
     
     return {
         "total_customers": total_customers,
@@ -700,19 +732,20 @@ async def get_dashboard_stats(
 async def batch_move_customers(
     customer_ids: List[int],
     target_folder_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """批量移动客户到指定文件夹"""
     # 验证文件夹存在
-    folder = db.query(Folder).filter(Folder.id == target_folder_id).first()
+    folder = await db.get(Folder, target_folder_id)
     if not folder:
         raise HTTPException(status_code=404, detail="目标文件夹不存在")
     
     # 批量更新
-    updated_count = db.query(Customer).filter(Customer.id.in_(customer_ids)).update({Customer.folder_id: target_folder_id}, synchronize_session=False)
+    result = await db.execute(update(Customer).where(Customer.id.in_(customer_ids)).values(folder_id=target_folder_id).execution_options(synchronize_session=False))
+    updated_count = result.rowcount
     
-    db.commit()
+    await db.commit()
     
     logger.info(f"用户 {current_user['username']} 批量移动了 {updated_count} 个客户到文件夹 {folder.name}")
     
@@ -727,14 +760,14 @@ async def batch_update_tags(
     customer_ids: List[int],
     tags: List[str],
     operation: str = "add",  # add, remove, replace
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """批量更新客户标签"""
     if operation not in ["add", "remove", "replace"]:
         raise HTTPException(status_code=400, detail="操作类型必须是 add, remove 或 replace")
     
-    customers = db.query(Customer).filter(Customer.id.in_(customer_ids)).all()
+    customers = (await db.scalars(select(Customer).where(Customer.id.in_(customer_ids)))).all()
     updated_count = 0
     
     for customer in customers:
@@ -750,7 +783,7 @@ async def batch_update_tags(
         customer.tags = new_tags
         updated_count += 1
     
-    db.commit()
+    await db.commit()
     
     logger.info(f"用户 {current_user['username']} 批量更新了 {updated_count} 个客户的标签")
     
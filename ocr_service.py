@@ -0,0 +1,235 @@
+import os
+import io
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Union, BinaryIO
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    logger.warning("PIL not available. OCR functionality will be disabled.")
+
+# 优先使用 Tesseract C API 绑定：引擎常驻内存，语言模型只加载一次
+try:
+    from tesserocr import PyTessBaseAPI
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+# 退回到 pytesseract：每张图片启动一次 tesseract 进程
+try:
+    import pytesseract
+    PYTESSERACT_AVAILABLE = True
+except ImportError:
+    PYTESSERACT_AVAILABLE = False
+
+OCR_LANG = os.getenv('OCR_LANG', 'chi_sim+eng')
+# 常驻引擎数，每个引擎同一时间只能识别一张图片
+OCR_ENGINES = int(os.getenv('OCR_ENGINES', min(4, os.cpu_count() or 2)))
+# 预处理：缩放到目标DPI（图片没有DPI信息时按最长边限制），灰度化后二值化
+OCR_TARGET_DPI = int(os.getenv('OCR_TARGET_DPI', 300))
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', 2000))
+OCR_BINARIZE = os.getenv('OCR_BINARIZE', 'true').lower() == 'true'
+
+ImageInput = Union[str, bytes, BinaryIO, 'Image.Image']
+
+
+def otsu_threshold(histogram: List[int]) -> int:
+    """按灰度直方图计算Otsu阈值"""
+    total = sum(histogram)
+    if not total:
+        return 128
+    weighted_total = sum(i * count for i, count in enumerate(histogram))
+    background = weighted_sum = 0
+    best_threshold, best_variance = 128, -1.0
+    for threshold, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_sum += threshold * count
+        mean_background = weighted_sum / background
+        mean_foreground = (weighted_total - weighted_sum) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+
+def preprocess_image(image: 'Image.Image') -> 'Image.Image':
+    """OCR前的预处理：按EXIF方向摆正、灰度化、缩小到目标DPI、二值化"""
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('L')
+
+    dpi = image.info.get('dpi')
+    scale = 1.0
+    if dpi and dpi[0] and dpi[0] > OCR_TARGET_DPI:
+        scale = OCR_TARGET_DPI / float(dpi[0])
+    elif max(image.size) > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / float(max(image.size))
+    if scale < 1.0:
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+
+    if OCR_BINARIZE:
+        threshold = otsu_threshold(image.histogram())
+        image = image.point(lambda value: 255 if value > threshold else 0)
+    return image
+
+
+class OCRService:
+    """OCR服务：常驻的Tesseract引擎池，图片预处理后识别，支持批量
+
+    安装了 tesserocr 时每个引擎是一个 PyTessBaseAPI 实例，语言模型只在创建时加载一次；
+    否则退回 pytesseract（每张图片一个 tesseract 进程），预处理和批量并发仍然有效。
+    引擎按进程创建，在文件提取进程池中每个工作进程各自保留一组常驻引擎。
+    """
+
+    def __init__(self, lang: str = OCR_LANG, engines: int = OCR_ENGINES):
+        self.lang = lang
+        self.max_engines = max(1, engines)
+        self._engines: queue.Queue = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = os.getpid()
+        self._stats = {'images': 0, 'failures': 0, 'preprocess_seconds': 0.0, 'recognize_seconds': 0.0}
+
+    @property
+    def backend(self) -> Optional[str]:
+        if not PIL_AVAILABLE:
+            return None
+        if TESSEROCR_AVAILABLE:
+            return 'tesserocr'
+        if PYTESSERACT_AVAILABLE:
+            return 'pytesseract'
+        return None
+
+    @property
+    def available(self) -> bool:
+        return self.backend is not None
+
+    # ------------------------------------------------------------------
+    # 引擎池
+    # ------------------------------------------------------------------
+
+    def _check_fork(self):
+        """fork出的子进程不能使用父进程创建的引擎和线程池"""
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._engines = queue.Queue()
+            self._created = 0
+            self._executor = None
+            self._pid = os.getpid()
+
+    def _acquire_engine(self):
+        self._check_fork()
+        try:
+            return self._engines.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.max_engines
+            if create:
+                self._created += 1
+        if not create:
+            return self._engines.get()
+        try:
+            logger.info(f"创建OCR引擎（{self.lang}）")
+            return PyTessBaseAPI(lang=self.lang)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _release_engine(self, engine):
+        engine.Clear()
+        self._engines.put(engine)
+
+    def _recognize_prepared(self, image: 'Image.Image') -> str:
+        if self.backend == 'tesserocr':
+            engine = self._acquire_engine()
+            try:
+                engine.SetImage(image)
+                return engine.GetUTF8Text()
+            finally:
+                self._release_engine(engine)
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+    # ------------------------------------------------------------------
+    # 识别
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _open(image: ImageInput) -> 'Image.Image':
+        if isinstance(image, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(image))
+        elif isinstance(image, str) or hasattr(image, 'read'):
+            # 文件路径或已打开的文件（如上传的临时文件），由PIL按需读取
+            image = Image.open(image)
+        image.load()
+        return image
+
+    def recognize(self, image: ImageInput, preprocess: bool = True) -> str:
+        """识别一张图片（文件路径、图片字节、文件对象或PIL图片），返回识别出的文本"""
+        if not self.available:
+            raise RuntimeError('OCR不可用，请安装PIL和tesserocr（或pytesseract）')
+
+        started = time.perf_counter()
+        try:
+            prepared = self._open(image)
+            if preprocess:
+                prepared = preprocess_image(prepared)
+            prepared_at = time.perf_counter()
+            text = self._recognize_prepared(prepared)
+        except Exception:
+            with self._lock:
+                self._stats['failures'] += 1
+            raise
+
+        finished = time.perf_counter()
+        with self._lock:
+            self._stats['images'] += 1
+            self._stats['preprocess_seconds'] += prepared_at - started
+            self._stats['recognize_seconds'] += finished - prepared_at
+        return text
+
+    def recognize_batch(self, images: List[ImageInput], preprocess: bool = True) -> List[Dict[str, Any]]:
+        """批量识别，按引擎数并发；返回与输入顺序一致的 {'success', 'text', 'error'} 列表"""
+        def run(image):
+            try:
+                return {'success': True, 'text': self.recognize(image, preprocess), 'error': ''}
+            except Exception as e:
+                logger.error(f"OCR识别失败: {e}")
+                return {'success': False, 'text': '', 'error': str(e)}
+
+        if len(images) <= 1:
+            return [run(image) for image in images]
+        self._check_fork()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_engines, thread_name_prefix='ocr')
+        return list(self._executor.map(run, images))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'backend': self.backend, 'lang': self.lang, 'engines': self._created,
+                          'max_engines': self.max_engines})
+        if stats['images']:
+            stats['avg_seconds'] = round((stats['preprocess_seconds'] + stats['recognize_seconds'])
+                                         / stats['images'], 4)
+        return stats
+
+# 创建全局实例
+ocr_service = OCRService()
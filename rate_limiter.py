@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import tempfile
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 默认限额，可通过 AI_RATE_LIMITS 按服务商或服务商/模型覆盖，例如
+# {"api.deepseek.com": {"rpm": 60, "tpm": 120000}, "api.x.ai/grok-4": {"rpm": 30}}
+DEFAULT_RPM = float(os.getenv('AI_DEFAULT_RPM', 60))
+DEFAULT_TPM = float(os.getenv('AI_DEFAULT_TPM', 200000))
+# 调用方最长排队时间（秒）
+DEFAULT_MAX_WAIT = float(os.getenv('AI_RATE_LIMIT_WAIT', 30))
+# 预留给模型输出的令牌数，调用完成后按实际用量结算
+COMPLETION_RESERVE_TOKENS = 1024
+# 等待耗时直方图分桶（秒）
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+
+
+class RateLimitTimeout(Exception):
+    """在截止时间前未能获得配额"""
+
+
+class ProviderRateLimited(Exception):
+    """服务商返回429，retry_after 为建议的等待秒数"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算令牌数：中文约每字1个令牌，其他字符约每4个1个令牌"""
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class RateLimiter:
+    """按服务商/模型的令牌桶限流器
+
+    每个键有两个桶：每分钟请求数(RPM)和每分钟令牌数(TPM)。
+    桶状态保存在本机SQLite文件中，gunicorn的多个worker进程共享同一份配额；
+    配额不足时调用方排队等待，直到截止时间。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv('RATE_LIMIT_DB') or os.path.join(tempfile.gettempdir(),
+                                                                               'ai_crm_rate_limits.db')
+        self.enabled = os.getenv('AI_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+        self.limits = self._load_limits()
+        self._table_ready = False
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._metrics_lock = threading.Lock()
+
+    def _load_limits(self) -> Dict[str, Dict[str, float]]:
+        raw = os.getenv('AI_RATE_LIMITS')
+        if not raw:
+            return {}
+        try:
+            return json.loads(raw)
+        except ValueError as e:
+            logger.error(f"AI_RATE_LIMITS 配置无效，使用默认限额: {e}")
+            return {}
+
+    def get_limits(self, key: str) -> Tuple[float, float]:
+        """返回 (rpm, tpm)，优先匹配 服务商/模型，其次匹配服务商；0 表示不限制"""
+        provider = key.split('/', 1)[0]
+        config = self.limits.get(key) or self.limits.get(provider) or {}
+        return float(config.get('rpm', DEFAULT_RPM)), float(config.get('tpm', DEFAULT_TPM))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._table_ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    key TEXT PRIMARY KEY,
+                    request_tokens REAL,
+                    token_tokens REAL,
+                    updated_at REAL
+                )
+            ''')
+            self._table_ready = True
+        conn.execute('PRAGMA synchronous=OFF')
+        return conn
+
+    def _refill(self, row, rpm: float, tpm: float, now: float) -> Tuple[float, float]:
+        if row is None:
+            return rpm, tpm
+        request_tokens, token_tokens, updated_at = row
+        elapsed = max(0.0, now - updated_at)
+        request_tokens = min(rpm, request_tokens + elapsed * rpm / 60.0)
+        token_tokens = min(tpm, token_tokens + elapsed * tpm / 60.0)
+        return request_tokens, token_tokens
+
+    def try_acquire(self, key: str, tokens: int = 0) -> float:
+        """尝试扣减配额；成功返回0，否则返回还需等待的秒数（不扣减）"""
+        rpm, tpm = self.get_limits(key)
+        if tpm:
+            tokens = min(tokens, tpm)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT request_tokens, token_tokens, updated_at FROM rate_limit_buckets WHERE key = ?',
+                               (key,)).fetchone()
+            request_tokens, token_tokens = self._refill(row, rpm, tpm, now)
+
+            wait = 0.0
+            if rpm and request_tokens < 1:
+                wait = max(wait, (1 - request_tokens) * 60.0 / rpm)
+            if tpm and token_tokens < tokens:
+                wait = max(wait, (tokens - token_tokens) * 60.0 / tpm)
+
+            if wait == 0:
+                if rpm:
+                    request_tokens -= 1
+                if tpm:
+                    token_tokens -= tokens
+            conn.execute('REPLACE INTO rate_limit_buckets (key, request_tokens, token_tokens, updated_at) '
+                         'VALUES (?, ?, ?, ?)', (key, request_tokens, token_tokens, now))
+            conn.execute('COMMIT')
+            return wait
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def acquire(self, key: str, tokens: int = 0, max_wait: Optional[float] = None) -> float:
+        """阻塞等待配额，返回实际等待秒数；超过 max_wait 抛出 RateLimitTimeout"""
+        if not self.enabled:
+            return 0.0
+        max_wait = DEFAULT_MAX_WAIT if max_wait is None else max_wait
+        started = time.monotonic()
+        self._enter_queue(key)
+        try:
+            while True:
+                wait = self.try_acquire(key, tokens)
+                waited = time.monotonic() - started
+                if wait == 0:
+                    self._record_wait(key, waited)
+                    return waited
+                if waited + wait > max_wait:
+                    self._record_timeout(key)
+                    raise RateLimitTimeout(f'{key} 请求过多，排队超过{max_wait:g}秒')
+                time.sleep(wait)
+        finally:
+            self._leave_queue(key)
+
+    async def acquire_async(self, key: str, tokens: int = 0, max_wait: Optional[float] = None) -> float:
+        """acquire 的异步版本，等待期间不阻塞事件循环"""
+        if not self.enabled:
+            return 0.0
+        max_wait = DEFAULT_MAX_WAIT if max_wait is None else max_wait
+        started = time.monotonic()
+        self._enter_queue(key)
+        try:
+            while True:
+                wait = await asyncio.to_thread(self.try_acquire, key, tokens)
+                waited = time.monotonic() - started
+                if wait == 0:
+                    self._record_wait(key, waited)
+                    return waited
+                if waited + wait > max_wait:
+                    self._record_timeout(key)
+                    raise RateLimitTimeout(f'{key} 请求过多，排队超过{max_wait:g}秒')
+                await asyncio.sleep(wait)
+        finally:
+            self._leave_queue(key)
+
+    def settle(self, key: str, reserved_tokens: int, actual_tokens: Optional[int]):
+        """调用完成后按实际令牌用量结算，多退少补"""
+        if not self.enabled or not actual_tokens:
+            return
+        rpm, tpm = self.get_limits(key)
+        if not tpm:
+            return
+        delta = min(reserved_tokens, tpm) - actual_tokens
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE rate_limit_buckets SET token_tokens = MIN(?, token_tokens + ?) WHERE key = ?',
+                         (tpm, delta, key))
+        finally:
+            conn.close()
+
+    def penalize(self, key: str, retry_after: Optional[float] = None):
+        """服务商返回429时清空请求桶，让所有进程的调用方一起退避"""
+        if not self.enabled:
+            return
+        rpm, tpm = self.get_limits(key)
+        retry_after = retry_after or 5.0
+        request_tokens = 1 - retry_after * rpm / 60.0 if rpm else 0
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT INTO rate_limit_buckets (key, request_tokens, token_tokens, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET request_tokens = MIN(request_tokens, excluded.request_tokens),
+                                               updated_at = excluded.updated_at
+            ''', (key, request_tokens, tpm, time.time()))
+        finally:
+            conn.close()
+        with self._metrics_lock:
+            self._key_metrics(key)['throttled'] += 1
+        logger.warning(f"{key} 返回429，暂停约{retry_after:.0f}秒")
+
+    # ------------------------------------------------------------------
+    # 指标
+    # ------------------------------------------------------------------
+
+    def _key_metrics(self, key: str) -> Dict[str, Any]:
+        metrics = self._metrics.get(key)
+        if metrics is None:
+            metrics = self._metrics[key] = {
+                'queue_depth': 0,
+                'max_queue_depth': 0,
+                'acquired': 0,
+                'timeouts': 0,
+                'throttled': 0,
+                'wait_seconds_sum': 0.0,
+                'wait_seconds_max': 0.0,
+                'wait_buckets': [0] * (len(WAIT_BUCKETS) + 1)
+            }
+        return metrics
+
+    def _enter_queue(self, key: str):
+        with self._metrics_lock:
+            metrics = self._key_metrics(key)
+            metrics['queue_depth'] += 1
+            metrics['max_queue_depth'] = max(metrics['max_queue_depth'], metrics['queue_depth'])
+
+    def _leave_queue(self, key: str):
+        with self._metrics_lock:
+            self._key_metrics(key)['queue_depth'] -= 1
+
+    def _record_wait(self, key: str, waited: float):
+        with self._metrics_lock:
+            metrics = self._key_metrics(key)
+            metrics['acquired'] += 1
+            metrics['wait_seconds_sum'] += waited
+            metrics['wait_seconds_max'] = max(metrics['wait_seconds_max'], waited)
+            index = next((i for i, bound in enumerate(WAIT_BUCKETS) if waited <= bound), len(WAIT_BUCKETS))
+            metrics['wait_buckets'][index] += 1
+
+    def _record_timeout(self, key: str):
+        with self._metrics_lock:
+            self._key_metrics(key)['timeouts'] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """返回本进程的排队指标和共享的桶状态"""
+        with self._metrics_lock:
+            metrics = {key: {**value, 'wait_buckets': dict(zip([*map(str, WAIT_BUCKETS), '+Inf'],
+                                                               value['wait_buckets']))}
+                       for key, value in self._metrics.items()}
+
+        buckets = {}
+        now = time.time()
+        conn = self._connect()
+        try:
+            for key, request_tokens, token_tokens, updated_at in conn.execute(
+                    'SELECT key, request_tokens, token_tokens, updated_at FROM rate_limit_buckets'):
+                rpm, tpm = self.get_limits(key)
+                available_requests, available_tokens = self._refill((request_tokens, token_tokens, updated_at),
+                                                                    rpm, tpm, now)
+                buckets[key] = {
+                    'rpm': rpm,
+                    'tpm': tpm,
+                    'available_requests': round(available_requests, 2),
+                    'available_tokens': round(available_tokens)
+                }
+        finally:
+            conn.close()
+
+        return {'enabled': self.enabled, 'pid': os.getpid(), 'queues': metrics, 'buckets': buckets}
+
+# 创建全局实例
+rate_limiter = RateLimiter()
@@ -0,0 +1,481 @@
+"""
+请求级性能分析：按路由统计耗时、SQL、AI调用和文件提取，记录慢请求
+
+    request_profiler.init_app(app)
+
+- 每个请求记录总耗时、SQL语句条数和执行耗时（相同语句合并计数，不记录参数）、AI调用耗时、文件提取耗时，
+  按 方法/路由规则 聚合为直方图，/metrics 以Prometheus格式输出
+- 超过 SLOW_REQUEST_MS 的请求记为慢请求：写警告日志，并保留最近 SLOW_REQUEST_HISTORY 条，
+  包括语句列表和调用栈采样，/debug/requests 按耗时列出（只在调试模式下开放，或设置 DEBUG_REQUESTS_TOKEN 后凭令牌访问）
+- 调用栈由后台线程采样：只采样已运行超过 STACK_SAMPLE_AFTER_MS 的请求所在线程，快请求没有采样开销
+- SQL计时通过替换 sqlite3.connect 的默认连接类实现，请求之外（后台任务线程）只多一次上下文变量读取
+
+其他模块通过 request_profiler.record('ai', 秒数) 或 with request_profiler.timed('extract') 记入当前请求。
+"""
+
+import os
+import sys
+import hmac
+import time
+import sqlite3
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+REQUEST_PROFILING_ENABLED = os.getenv('REQUEST_PROFILING_ENABLED', 'true').lower() != 'false'
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 1000))
+SLOW_REQUEST_HISTORY = int(os.getenv('SLOW_REQUEST_HISTORY', 200))
+# 请求运行超过该时长后开始采样调用栈（默认为慢请求阈值的一半，刚超过阈值的请求也有样本）
+STACK_SAMPLE_AFTER_MS = float(os.getenv('STACK_SAMPLE_AFTER_MS', SLOW_REQUEST_MS / 2))
+STACK_SAMPLE_INTERVAL_MS = float(os.getenv('STACK_SAMPLE_INTERVAL_MS', 50))
+# /debug/requests 的访问令牌（请求头 X-Debug-Token）；未设置时只在调试模式下开放
+DEBUG_REQUESTS_TOKEN = os.getenv('DEBUG_REQUESTS_TOKEN', '')
+MAX_STACK_SAMPLES = 200
+STACK_DEPTH = 25
+# 每个请求最多记录的不同SQL语句数，其余合并到一项
+MAX_QUERY_SHAPES = 100
+SQL_MAX_CHARS = 500
+
+# 分类耗时：AI调用、文件内容提取
+CATEGORIES = ('ai', 'extract')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_profile: contextvars.ContextVar = contextvars.ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """单个请求的计时和SQL记录"""
+
+    def __init__(self, method: str, path: str, route: str):
+        self.method = method
+        self.path = path
+        self.route = route
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.status = 500
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        # SQL语句 -> [执行次数, 总耗时]
+        self.queries: Dict[str, List[float]] = {}
+        self.seconds = dict.fromkeys(CATEGORIES, 0.0)
+        self.calls = dict.fromkeys(CATEGORIES, 0)
+        # 采样线程追加，请求结束时汇总
+        self.stack_samples: List[Tuple[str, ...]] = []
+        # after_request 已登记在响应关闭时结束计时
+        self.handed_off = False
+        self.finished = False
+
+    def add_query(self, sql: str, seconds: float):
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        entry = self.queries.get(sql)
+        if entry is None:
+            if len(self.queries) >= MAX_QUERY_SHAPES:
+                sql = '（其他语句）'
+                entry = self.queries.get(sql)
+            if entry is None:
+                entry = self.queries[sql] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def detail(self) -> Dict[str, Any]:
+        queries = sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True)
+        stacks = Counter(self.stack_samples).most_common(3)
+        return {
+            'method': self.method,
+            'path': self.path,
+            'route': self.route,
+            'status': self.status,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'duration_ms': round(self.duration * 1000, 1),
+            'sql_count': self.sql_count,
+            'sql_ms': round(self.sql_seconds * 1000, 1),
+            **{f'{category}_ms': round(self.seconds[category] * 1000, 1) for category in CATEGORIES},
+            **{f'{category}_calls': self.calls[category] for category in CATEGORIES},
+            'queries': [{'sql': ' '.join(sql.split())[:SQL_MAX_CHARS], 'count': count,
+                         'total_ms': round(total * 1000, 2)} for sql, (count, total) in queries],
+            'stack_samples': len(self.stack_samples),
+            'stacks': [{'samples': count, 'frames': list(frames)} for frames, count in stacks]
+        }
+
+
+class _RouteStats:
+    __slots__ = ('counts', 'count', 'sum', 'max', 'statuses', 'sql_count', 'sql_seconds', 'seconds', 'slow')
+
+    def __init__(self):
+        self.counts = [0] * (len(DURATION_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.statuses: Dict[str, int] = {}
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.seconds = dict.fromkeys(CATEGORIES, 0.0)
+        self.slow = 0
+
+    def observe(self, profile: RequestProfile, slow: bool):
+        duration = profile.duration
+        self.counts[bisect_left(DURATION_BUCKETS, duration)] += 1
+        self.count += 1
+        self.sum += duration
+        self.max = max(self.max, duration)
+        status = f'{profile.status // 100}xx'
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.sql_count += profile.sql_count
+        self.sql_seconds += profile.sql_seconds
+        for category in CATEGORIES:
+            self.seconds[category] += profile.seconds[category]
+        if slow:
+            self.slow += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按分桶估算分位数（返回所在桶的上界），超出最大分桶时返回None"""
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return None
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """记录当前请求中每条语句的执行耗时（不含 fetch）"""
+
+    def execute(self, sql, parameters=()):
+        profile = _current_profile.get()
+        if profile is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            profile.add_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        profile = _current_profile.get()
+        if profile is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            profile.add_query(sql, time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        profile = _current_profile.get()
+        if profile is None:
+            return super().executescript(sql_script)
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            profile.add_query(sql_script, time.perf_counter() - started)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    # Connection.execute 等快捷方法在C实现中直接创建基类游标，不经过 cursor()，需要一起替换
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def install_sqlite_hooks():
+    """sqlite3.connect 默认使用 ProfiledConnection（调用方指定了 factory 时不替换）；重复调用无效"""
+    original = sqlite3.connect
+    if getattr(original, 'request_profiler', False):
+        return
+
+    @wraps(original)
+    def connect(*args, **kwargs):
+        kwargs.setdefault('factory', ProfiledConnection)
+        return original(*args, **kwargs)
+
+    connect.request_profiler = True
+    sqlite3.connect = connect
+
+
+def _stack_frames(frame) -> Tuple[str, ...]:
+    """调用栈，从外到内，最多 STACK_DEPTH 层（保留最内层）"""
+    frames = []
+    while frame is not None and len(frames) < STACK_DEPTH:
+        code = frame.f_code
+        frames.append(f'{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}')
+        frame = frame.f_back
+    return tuple(reversed(frames))
+
+
+class RequestProfiler:
+    """按路由统计请求耗时和资源使用，记录慢请求
+
+    每个进程单独统计；/metrics 由Prometheus按实例抓取后汇总，/debug/requests 查看的是处理该请求的进程。
+    """
+
+    def __init__(self, enabled: bool = REQUEST_PROFILING_ENABLED, slow_ms: float = SLOW_REQUEST_MS):
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000
+        self._lock = threading.Lock()
+        self._routes: Dict[Tuple[str, str], _RouteStats] = {}
+        self._slow = deque(maxlen=SLOW_REQUEST_HISTORY)
+        # 线程ID -> 正在处理的请求，供采样线程读取
+        self._active: Dict[int, RequestProfile] = {}
+        self._sampler_pid: Optional[int] = None
+        self._sampler_lock = threading.Lock()
+
+    def init_app(self, app):
+        """注册请求钩子；应在其他 after_request 钩子（如压缩）之前调用，使统计包含它们的耗时"""
+        if not self.enabled:
+            logger.info("请求性能分析已关闭")
+            return
+        install_sqlite_hooks()
+        from flask import request
+
+        @app.before_request
+        def start_request_profile():
+            self._ensure_sampler()
+            # request 是代理对象，每次属性访问都要查找当前请求，先取出实际对象
+            current = request._get_current_object()
+            rule = current.url_rule.rule if current.url_rule is not None else '<unmatched>'
+            self._begin(RequestProfile(current.method, current.path, rule))
+
+        @app.after_request
+        def finish_request_profile(response):
+            profile = _current_profile.get()
+            if profile is not None and not profile.handed_off:
+                profile.status = response.status_code
+                profile.handed_off = True
+                if response.is_streamed:
+                    # 流式响应在响应体发送完毕（迭代结束）后才结束计时
+                    response.call_on_close(lambda: self._finish(profile))
+                else:
+                    self._finish(profile)
+            return response
+
+        @app.teardown_request
+        def abandon_request_profile(exc):
+            # 未经过 after_request（钩子本身出错）时在这里结束，状态记为500
+            profile = _current_profile.get()
+            if profile is not None and not profile.handed_off:
+                self._finish(profile)
+
+    # ------------------------------------------------------------------
+    # 请求记录
+    # ------------------------------------------------------------------
+
+    def _begin(self, profile: RequestProfile):
+        _current_profile.set(profile)
+        with self._lock:
+            self._active[profile.thread_id] = profile
+
+    def _finish(self, profile: RequestProfile):
+        if profile.finished:
+            return
+        profile.finished = True
+        profile.duration = time.perf_counter() - profile.started
+        if _current_profile.get() is profile:
+            _current_profile.set(None)
+        slow = profile.duration >= self.slow_seconds
+        with self._lock:
+            if self._active.get(profile.thread_id) is profile:
+                del self._active[profile.thread_id]
+            key = (profile.method, profile.route)
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = _RouteStats()
+            stats.observe(profile, slow)
+            if slow:
+                self._slow.append(profile)
+        if slow:
+            self._log_slow(profile)
+
+    @staticmethod
+    def _log_slow(profile: RequestProfile):
+        message = (f"慢请求 {profile.method} {profile.path} {profile.status} {profile.duration * 1000:.0f}ms: "
+                   f"SQL {profile.sql_count}条/{profile.sql_seconds * 1000:.0f}ms, "
+                   f"AI {profile.calls['ai']}次/{profile.seconds['ai'] * 1000:.0f}ms, "
+                   f"文件提取 {profile.seconds['extract'] * 1000:.0f}ms")
+        if profile.queries:
+            sql, (count, total) = max(profile.queries.items(), key=lambda item: item[1][1])
+            message += f"; 最耗时语句 {count}次/{total * 1000:.0f}ms: {' '.join(sql.split())[:200]}"
+        if profile.stack_samples:
+            frames, count = Counter(profile.stack_samples).most_common(1)[0]
+            message += f"; 采样最多的调用栈({count}/{len(profile.stack_samples)}): {' <- '.join(reversed(frames[-5:]))}"
+        logger.warning(message)
+
+    @staticmethod
+    def current() -> Optional[RequestProfile]:
+        return _current_profile.get()
+
+    @staticmethod
+    def record(category: str, seconds: float):
+        """把一次AI调用/文件提取的耗时记入当前请求；不在请求中时忽略"""
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.seconds[category] += seconds
+            profile.calls[category] += 1
+
+    @contextmanager
+    def timed(self, category: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(category, time.perf_counter() - started)
+
+    # ------------------------------------------------------------------
+    # 调用栈采样
+    # ------------------------------------------------------------------
+
+    def _ensure_sampler(self):
+        """按进程启动采样线程；fork出的子进程（gunicorn worker）重新启动自己的线程"""
+        if self._sampler_pid == os.getpid():
+            return
+        with self._sampler_lock:
+            if self._sampler_pid == os.getpid():
+                return
+            threading.Thread(target=self._sample_loop, name='request-stack-sampler', daemon=True).start()
+            self._sampler_pid = os.getpid()
+
+    def _sample_loop(self):
+        interval = STACK_SAMPLE_INTERVAL_MS / 1000
+        sample_after = STACK_SAMPLE_AFTER_MS / 1000
+        while True:
+            time.sleep(interval)
+            try:
+                now = time.perf_counter()
+                with self._lock:
+                    running = [profile for profile in self._active.values() if now - profile.started >= sample_after]
+                if not running:
+                    continue
+                frames = sys._current_frames()
+                for profile in running:
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None and not profile.finished and len(profile.stack_samples) < MAX_STACK_SAMPLES:
+                        profile.stack_samples.append(_stack_frames(frame))
+                del frames
+            except Exception as e:
+                logger.error(f"调用栈采样失败: {e}")
+
+    # ------------------------------------------------------------------
+    # 输出
+    # ------------------------------------------------------------------
+
+    def summary(self, limit: int = 20) -> Dict[str, Any]:
+        """各路由的耗时分布和资源使用（按总耗时降序），最近慢请求中耗时最长的 limit 条，以及正在处理的请求"""
+        now = time.perf_counter()
+        with self._lock:
+            routes = []
+            for (method, route), stats in self._routes.items():
+                count = stats.count
+                routes.append({
+                    'method': method,
+                    'route': route,
+                    'count': count,
+                    'statuses': dict(stats.statuses),
+                    'slow': stats.slow,
+                    'total_seconds': round(stats.sum, 3),
+                    'avg_ms': round(stats.sum / count * 1000, 2),
+                    'p50_ms': _bound_ms(stats.quantile(0.5)),
+                    'p95_ms': _bound_ms(stats.quantile(0.95)),
+                    'p99_ms': _bound_ms(stats.quantile(0.99)),
+                    'max_ms': round(stats.max * 1000, 1),
+                    'sql_per_request': round(stats.sql_count / count, 1),
+                    'sql_ms_avg': round(stats.sql_seconds / count * 1000, 2),
+                    **{f'{category}_ms_avg': round(stats.seconds[category] / count * 1000, 2)
+                       for category in CATEGORIES}
+                })
+            slow = sorted(self._slow, key=lambda profile: profile.duration, reverse=True)[:limit]
+            in_flight = [{'method': profile.method, 'path': profile.path,
+                          'elapsed_ms': round((now - profile.started) * 1000, 1), 'sql_count': profile.sql_count}
+                         for profile in self._active.values()]
+        routes.sort(key=lambda item: item['total_seconds'], reverse=True)
+        return {
+            'enabled': self.enabled,
+            'pid': os.getpid(),
+            'slow_request_ms': self.slow_seconds * 1000,
+            'routes': routes,
+            'slow_requests': [profile.detail() for profile in slow],
+            'in_flight': sorted(in_flight, key=lambda item: item['elapsed_ms'], reverse=True)
+        }
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            snapshot = {key: (list(stats.counts), stats.sum, stats.count, dict(stats.statuses), stats.sql_count,
+                              stats.sql_seconds, dict(stats.seconds), stats.slow)
+                        for key, stats in self._routes.items()}
+        if not snapshot:
+            return ''
+        series = sorted(snapshot.items())
+        labels_of = {key: f'method="{key[0]}",route="{_escape(key[1])}"' for key in snapshot}
+
+        lines = ['# HELP http_requests_total 请求数', '# TYPE http_requests_total counter']
+        for key, (_, _, _, statuses, *_) in series:
+            for status, count in sorted(statuses.items()):
+                lines.append(f'http_requests_total{{{labels_of[key]},status="{status}"}} {count}')
+
+        lines += ['# HELP http_request_duration_seconds 请求耗时', '# TYPE http_request_duration_seconds histogram']
+        for key, (counts, total, count, *_) in series:
+            cumulative = 0
+            for bound, bucket_count in zip([*(f'{bound:g}' for bound in DURATION_BUCKETS), '+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels_of[key]},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels_of[key]}}} {total:g}')
+            lines.append(f'http_request_duration_seconds_count{{{labels_of[key]}}} {count}')
+
+        counters = [
+            ('http_request_sql_queries_total', 'SQL语句条数', lambda value: value[4]),
+            ('http_request_sql_seconds_total', 'SQL语句执行耗时', lambda value: value[5]),
+            ('http_request_ai_seconds_total', '请求中AI调用耗时', lambda value: value[6]['ai']),
+            ('http_request_extract_seconds_total', '请求中文件内容提取耗时', lambda value: value[6]['extract']),
+            ('http_slow_requests_total', f'超过{self.slow_seconds * 1000:g}ms的慢请求数', lambda value: value[7]),
+        ]
+        for name, description, getter in counters:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            for key, value in series:
+                lines.append(f'{name}{{{labels_of[key]}}} {getter(value):g}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._slow.clear()
+
+    @staticmethod
+    def debug_access_allowed(request, debug: bool) -> bool:
+        """慢请求记录包含SQL语句和调用栈：设置了令牌时要求请求头 X-Debug-Token 匹配，否则只在调试模式下允许"""
+        if DEBUG_REQUESTS_TOKEN:
+            return hmac.compare_digest(request.headers.get('X-Debug-Token', ''), DEBUG_REQUESTS_TOKEN)
+        return debug
+
+
+def _bound_ms(bound: Optional[float]) -> Optional[float]:
+    return None if bound is None else round(bound * 1000, 1)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# 创建全局实例
+request_profiler = RequestProfiler()
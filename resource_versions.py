@@ -0,0 +1,186 @@
+"""
+读接口的缓存验证（ETag / If-None-Match）
+
+分组、客户列表和详情、销售prompt、模型列表等接口被前端轮询，每次都完整查询并编码。这里为每类资源维护
+一个版本号（resource_versions 表），由数据库触发器在对应表写入时递增，写接口无需逐个调用失效方法：
+    @app.route('/api/folders')
+    @resource_versions.etag('folders', 'customers')
+
+读接口先用一次主键查询取出版本号组成ETag，请求头 If-None-Match 匹配时直接返回304，不执行查询和序列化；
+否则正常执行并带上ETag和 Cache-Control: private, no-cache（浏览器缓存响应、每次轮询都重新验证）。
+
+- 版本键可引用路由参数：'customer:{customer_id}' 只在该客户、其沟通记录或AI分析变化时递增
+- ETag为弱ETag：版本号相同表示内容语义相同，与是否压缩无关
+- 数据库重建后随机的纪元值会变化，旧ETag不会误匹配
+"""
+
+import os
+import random
+import hashlib
+import sqlite3
+import logging
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional
+
+from flask import request, make_response, current_app
+from config import api_config
+from serialization import prefers_msgpack
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+CACHE_VALIDATION_ENABLED = os.getenv('CACHE_VALIDATION_ENABLED', 'true').lower() != 'false'
+
+EPOCH_KEY = '_epoch'
+
+# 表 -> 行写入时递增的版本键（SQL表达式，{row} 替换为 NEW / OLD）
+VERSIONED_TABLES = {
+    'customers': ("'customers'", "'customer:' || {row}.id"),
+    'communications': ("'customer:' || {row}.customer_id",),
+    'ai_analysis': ("'customer:' || {row}.customer_id",),
+    'folders': ("'folders'",),
+    'sales_prompts': ("'sales_prompts'",),
+    'ai_models': ("'ai_models'",),
+}
+
+# 各事件中可引用的行：UPDATE 可能修改外键（如沟通记录换了客户），新旧两行都要递增
+TRIGGER_ROWS = {'INSERT': ('NEW',), 'UPDATE': ('OLD', 'NEW'), 'DELETE': ('OLD',)}
+
+
+def accept_variant() -> str:
+    """按 Accept 协商格式的接口（negotiated_jsonify）：JSON 和 MessagePack 使用不同的ETag"""
+    return 'msgpack' if prefers_msgpack(request.headers.get('Accept')) else 'json'
+
+
+def _call_view(view, args, kwargs):
+    """执行视图；HEAD 请求按 GET 执行（视图只区分 GET/POST），响应体由 WSGI 层按 HEAD 丢弃"""
+    if request.method != 'HEAD':
+        return view(*args, **kwargs)
+    req = request._get_current_object()
+    req.method = 'GET'
+    try:
+        return view(*args, **kwargs)
+    finally:
+        req.method = 'HEAD'
+
+
+class ResourceVersions:
+    """资源版本号和读接口的条件请求"""
+
+    def __init__(self, enabled: bool = CACHE_VALIDATION_ENABLED):
+        self.enabled = enabled
+        self._table_ready = False
+
+    def init_table(self, conn=None):
+        """创建版本号表，并为 VERSIONED_TABLES 中已存在的表重建触发器"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(api_config.database['sqlite_path'])
+        try:
+            if sqlite3.sqlite_version_info < (3, 24, 0):
+                # 触发器使用 UPSERT（INSERT ... ON CONFLICT DO UPDATE）
+                logger.warning(f"SQLite {sqlite3.sqlite_version} 不支持UPSERT，读接口不使用ETag")
+                self.enabled = False
+                return
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS resource_versions (
+                    key TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute('INSERT OR IGNORE INTO resource_versions (key, version) VALUES (?, ?)',
+                         (EPOCH_KEY, random.getrandbits(48)))
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table, keys in VERSIONED_TABLES.items():
+                if table not in existing:
+                    logger.warning(f"表 {table} 不存在，跳过版本号触发器")
+                    continue
+                for event in TRIGGER_ROWS:
+                    # 每次启动重建，修改 VERSIONED_TABLES 后已有数据库的触发器同步更新
+                    name = f'resource_versions_{table}_{event.lower()}'
+                    conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+                    conn.execute(self._trigger_sql(name, table, event, keys))
+            conn.commit()
+            self._table_ready = True
+        finally:
+            if own_conn:
+                conn.close()
+
+    @staticmethod
+    def _trigger_sql(name: str, table: str, event: str, keys: Iterable[str]) -> str:
+        expressions = []
+        for key in keys:
+            # 不引用行的键（整表版本号）每条语句只递增一次
+            rows = TRIGGER_ROWS[event] if '{row}' in key else TRIGGER_ROWS[event][-1:]
+            expressions.extend(key.format(row=row) for row in rows)
+        statements = ''.join(
+            f"INSERT INTO resource_versions (key, version) VALUES ({expression}, 1) "
+            f"ON CONFLICT(key) DO UPDATE SET version = version + 1;\n"
+            for expression in expressions
+        )
+        return f'CREATE TRIGGER {name} AFTER {event} ON {table} FOR EACH ROW BEGIN\n{statements}END'
+
+    def versions(self, keys: List[str]) -> Dict[str, int]:
+        """读取版本号（包括纪元值），从未写入过的键为0"""
+        keys = [EPOCH_KEY] + keys
+        conn = sqlite3.connect(api_config.database['sqlite_path'])
+        try:
+            if not self._table_ready:
+                self.init_table(conn)
+            placeholders = ', '.join('?' * len(keys))
+            rows = conn.execute(f'SELECT key, version FROM resource_versions WHERE key IN ({placeholders})',
+                                keys).fetchall()
+        finally:
+            conn.close()
+        found = dict(rows)
+        return {key: found.get(key, 0) for key in keys}
+
+    def compute_etag(self, keys: List[str], variant: str = '') -> Optional[str]:
+        """版本号和表示标识的摘要；读取失败时返回None（不使用ETag，正常执行接口）"""
+        try:
+            versions = self.versions(keys)
+        except sqlite3.Error as e:
+            logger.warning(f"读取资源版本号失败: {e}")
+            return None
+        if not self.enabled:
+            return None
+        digest = hashlib.sha1(repr((sorted(versions.items()), variant)).encode('utf-8'))
+        return digest.hexdigest()[:20]
+
+    def etag(self, *keys: str, variant: Optional[Callable[[], str]] = None, vary: Iterable[str] = ()):
+        """读接口装饰器，只处理GET/HEAD
+
+        keys    版本键，可引用路由参数，如 'customer:{customer_id}'
+        variant 同一URL下不同的响应表示（按Accept协商的格式、会话中的设置等），返回值参与ETag
+        vary    响应表示所依据的请求头，200和304响应都带上
+        """
+        vary = tuple(vary)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method not in ('GET', 'HEAD'):
+                    return _call_view(view, args, kwargs)
+                # 先取版本号再执行查询：期间有写入时响应带的是较旧的版本号，下次轮询会重新获取，
+                # 不会出现新版本号配旧内容
+                etag = self.compute_etag([key.format(**kwargs) for key in keys], variant() if variant else '')
+                if etag is None:
+                    return _call_view(view, args, kwargs)
+                if request.if_none_match.contains_weak(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    response = make_response(_call_view(view, args, kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag, weak=True)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                for header in vary:
+                    response.vary.add(header)
+                return response
+            return wrapper
+        return decorator
+
+
+# 创建全局实例
+resource_versions = ResourceVersions()
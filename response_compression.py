@@ -0,0 +1,349 @@
+"""
+动态响应压缩（gzip / brotli / zstd）
+
+客户列表、AI分析结果、导出的CSV/JSON都是高度可压缩的文本（中文内容尤其明显），按 Accept-Encoding
+协商编码后压缩响应体：
+    Flask              response_compression.init_app(app)（after_request）
+    FastAPI/Starlette  app.add_middleware(CompressionMiddleware)（纯ASGI中间件）
+
+- 客户端q值相同时按 COMPRESSION_ENCODINGS 的顺序选择（默认 zstd,br,gzip）；
+  brotli、zstd 需安装 brotli / zstandard，未安装时只用 gzip
+- 只压缩文本类响应（text/*、JSON、XML、MessagePack、NDJSON、SVG），图片、xlsx、zip、PDF 等已压缩格式原样发送
+- 小于 COMPRESSION_MIN_SIZE 字节的响应不压缩（压缩头和CPU开销大于节省的流量）
+- 流式响应（长列表、NDJSON进度、文件下载）边生成边压缩，每块立即刷出，不等全部生成
+- 已带 Content-Encoding（static_delivery 的预压缩文件）、206 分段、Cache-Control: no-transform 的响应不处理；
+  压缩后强ETag改为弱ETag
+- 按路径前缀调整压缩级别：response_compression.configure_route('/api/customers/export', preset='best')
+"""
+
+import os
+import gzip
+import zlib
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from serialization import parse_accept_header
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    from flask import request as flask_request
+except ImportError:
+    # 只运行FastAPI应用时没有Flask，init_app 不会被调用
+    flask_request = None
+
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() != 'false'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_ENCODINGS = [item.strip() for item in os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',')
+                         if item.strip()]
+COMPRESSION_PRESET = os.getenv('COMPRESSION_PRESET', 'default')
+# ASGI应用中大于该大小的响应体在线程池中压缩，不占用事件循环
+COMPRESSION_THREAD_MIN_SIZE = int(os.getenv('COMPRESSION_THREAD_MIN_SIZE', 256 * 1024))
+
+# 各编码的压缩级别：fast 适合实时接口，best 适合导出下载等多花CPU换带宽的场景
+# zstd 1级在客户列表/CSV这类负载上比3级更小也更快（见 benchmarks/bench_compression.py），default 也用1级
+LEVEL_PRESETS = {
+    'fast': {'gzip': 1, 'br': 1, 'zstd': 1},
+    'default': {'gzip': 6, 'br': 4, 'zstd': 1},
+    'best': {'gzip': 9, 'br': 9, 'zstd': 12},
+}
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/x-ndjson',
+    'application/msgpack', 'application/x-msgpack', 'image/svg+xml',
+}
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return False
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+            or mimetype.endswith('+json') or mimetype.endswith('+xml'))
+
+
+def encoding_available(encoding: str) -> bool:
+    return encoding == 'gzip' or (encoding == 'br' and BROTLI_AVAILABLE) or (encoding == 'zstd' and ZSTD_AVAILABLE)
+
+
+def compress_bytes(data: bytes, encoding: str, level: int) -> bytes:
+    """一次性压缩完整的响应体"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class StreamCompressor:
+    """流式响应的增量压缩：compress 返回当前可以发送的数据，finish 返回结尾"""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            # wbits=31：带gzip头
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool = True) -> bytes:
+        """flush=True 时把已输入的数据全部刷出，客户端可以立即解压这一块"""
+        if self.encoding == 'br':
+            output = self._compressor.process(data)
+            return output + self._compressor.flush() if flush else output
+        output = self._compressor.compress(data)
+        if flush:
+            mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK if self.encoding == 'zstd' else zlib.Z_SYNC_FLUSH
+            output += self._compressor.flush(mode)
+        return output
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class ResponseCompression:
+    """压缩配置（编码优先级、最小大小、按路径的压缩级别）及 Flask 集成"""
+
+    def __init__(self, encodings: List[str] = COMPRESSION_ENCODINGS, min_size: int = COMPRESSION_MIN_SIZE,
+                 preset: str = COMPRESSION_PRESET, enabled: bool = COMPRESSION_ENABLED):
+        self.encodings = [encoding for encoding in encodings if encoding_available(encoding)]
+        self.enabled = enabled
+        self.default_options = {'enabled': True, 'levels': LEVEL_PRESETS[preset], 'min_size': min_size,
+                                'files': False}
+        # (路径前缀, 选项)，按前缀长度从长到短匹配
+        self.routes: List[Tuple[str, Dict[str, Any]]] = []
+
+    def configure_route(self, prefix: str, preset: Optional[str] = None, enabled: bool = True,
+                        min_size: Optional[int] = None, files: bool = False):
+        """设置某个路径前缀下的压缩选项
+
+        preset: fast/default/best；enabled=False 不压缩；
+        files=True 时 send_file 发送的文件也边读边压缩（默认跳过文件，静态资源由 static_delivery 预压缩）
+        """
+        options = dict(self.default_options, enabled=enabled, files=files)
+        if preset:
+            options['levels'] = LEVEL_PRESETS[preset]
+        if min_size is not None:
+            options['min_size'] = min_size
+        self.routes = [(p, o) for p, o in self.routes if p != prefix] + [(prefix, options)]
+        self.routes.sort(key=lambda route: len(route[0]), reverse=True)
+
+    def route_options(self, path: str) -> Dict[str, Any]:
+        for prefix, options in self.routes:
+            if path.startswith(prefix):
+                return options
+        return self.default_options
+
+    def choose_encoding(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """客户端接受的编码中q值最高的一个，q值相同时按服务端优先级"""
+        if not accept_encoding or not self.encodings:
+            return None
+        qualities = parse_accept_header(accept_encoding)
+        best, best_quality = None, 0.0
+        for encoding in self.encodings:
+            quality = qualities.get(encoding, qualities.get('*', 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def init_app(self, app):
+        app.after_request(self._compress_flask_response)
+        logger.info(f"响应压缩: {', '.join(self.encodings)}，最小 {self.default_options['min_size']} 字节")
+
+    def _compress_flask_response(self, response):
+        if not self.enabled or flask_request.method == 'HEAD':
+            return response
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        if not is_compressible(response.mimetype):
+            return response
+        options = self.route_options(flask_request.path)
+        if not options['enabled']:
+            return response
+        if response.direct_passthrough and not options['files']:
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'Content-Encoding' in response.headers or 'no-transform' in response.headers.get('Cache-Control', ''):
+            return response
+        encoding = self.choose_encoding(flask_request.headers.get('Accept-Encoding'))
+        if not encoding:
+            return response
+        level = options['levels'][encoding]
+
+        if response.is_streamed or response.direct_passthrough:
+            if response.content_length is not None and response.content_length < options['min_size']:
+                return response
+            body = response.response
+            if hasattr(body, 'close'):
+                response.call_on_close(body.close)
+            # 生成器逐块刷出；文件按块读取，不需要每块刷出
+            response.response = self._iter_compressed(body, encoding, level, flush=not response.direct_passthrough)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+            response.headers.pop('Accept-Ranges', None)
+        else:
+            data = response.get_data()
+            if len(data) < options['min_size']:
+                return response
+            response.set_data(compress_bytes(data, encoding, level))
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    @staticmethod
+    def _iter_compressed(body: Iterable[bytes], encoding: str, level: int, flush: bool) -> Iterator[bytes]:
+        compressor = StreamCompressor(encoding, level)
+        for chunk in body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            output = compressor.compress(chunk, flush=flush)
+            if output:
+                yield output
+        yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """FastAPI/Starlette 的响应压缩（纯ASGI中间件，流式响应逐块压缩）"""
+
+    def __init__(self, app, compression: Optional[ResponseCompression] = None):
+        self.app = app
+        self.compression = compression or response_compression
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.compression.enabled or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+        options = self.compression.route_options(scope['path'])
+        if not options['enabled']:
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = None
+        for name, value in scope['headers']:
+            if name == b'accept-encoding':
+                accept_encoding = value.decode('latin-1')
+                break
+        responder = _CompressionResponder(send, self.compression.choose_encoding(accept_encoding), options)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """拦截响应：收到第一块响应体时决定是否压缩（此时才知道是完整响应还是流式响应）"""
+
+    def __init__(self, send, encoding: Optional[str], options: Dict[str, Any]):
+        self._send = send
+        self.encoding = encoding
+        self.options = options
+        self.start_message = None
+        self.compressor: Optional[StreamCompressor] = None
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.start_message = message
+            return
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+            if message['type'] == 'http.response.body':
+                message = await self._start(start_message, message)
+            else:
+                await self._send(start_message)
+        elif self.compressor is not None and message['type'] == 'http.response.body':
+            more_body = message.get('more_body', False)
+            body = await self._run(self.compressor.compress, message.get('body', b''))
+            if not more_body:
+                body += self.compressor.finish()
+            message = {'type': 'http.response.body', 'body': body, 'more_body': more_body}
+        await self._send(message)
+
+    async def _start(self, start_message, message):
+        """处理响应头和第一块响应体，发送响应头，返回（可能已压缩的）第一块"""
+        headers = _Headers(start_message['headers'])
+        status = start_message['status']
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        eligible = 200 <= status and status not in (204, 206, 304) and is_compressible(headers.get('content-type'))
+        if eligible:
+            headers.add_vary('Accept-Encoding')
+        if (eligible and self.encoding and headers.get('content-encoding') is None
+                and 'no-transform' not in (headers.get('cache-control') or '')):
+            level = self.options['levels'][self.encoding]
+            content_length = headers.get('content-length')
+            if not more_body and len(body) >= self.options['min_size']:
+                body = await self._run(lambda data: compress_bytes(data, self.encoding, level), body)
+                headers.set('content-length', str(len(body)))
+                headers.set('content-encoding', self.encoding)
+                headers.weaken_etag()
+            elif more_body and (content_length is None or int(content_length) >= self.options['min_size']):
+                self.compressor = StreamCompressor(self.encoding, level)
+                body = await self._run(self.compressor.compress, body)
+                headers.remove('content-length')
+                headers.set('content-encoding', self.encoding)
+                headers.weaken_etag()
+
+        await self._send(dict(start_message, headers=headers.raw))
+        return {'type': 'http.response.body', 'body': body, 'more_body': more_body}
+
+    @staticmethod
+    async def _run(func, data: bytes) -> bytes:
+        if len(data) >= COMPRESSION_THREAD_MIN_SIZE:
+            return await asyncio.to_thread(func, data)
+        return func(data)
+
+
+class _Headers:
+    """ASGI原始响应头（[(bytes, bytes)]）的读写"""
+
+    def __init__(self, raw):
+        self.raw = list(raw)
+
+    def get(self, name: str) -> Optional[str]:
+        key = name.encode('latin-1')
+        for header, value in self.raw:
+            if header.lower() == key:
+                return value.decode('latin-1')
+        return None
+
+    def remove(self, name: str):
+        key = name.encode('latin-1')
+        self.raw = [(header, value) for header, value in self.raw if header.lower() != key]
+
+    def set(self, name: str, value: str):
+        self.remove(name)
+        self.raw.append((name.encode('latin-1'), value.encode('latin-1')))
+
+    def add_vary(self, value: str):
+        existing = self.get('vary')
+        if existing is None:
+            self.set('vary', value)
+        elif value.lower() not in [item.strip().lower() for item in existing.split(',')]:
+            self.set('vary', f'{existing}, {value}')
+
+    def weaken_etag(self):
+        etag = self.get('etag')
+        if etag and not etag.startswith('W/'):
+            self.set('etag', f'W/{etag}')
+
+
+# 创建全局实例
+response_compression = ResponseCompression()
@@ -100,6 +100,7 @@ def main():
     print(f"地址: http://{host}:{port}")
     print(f"调试模式: {debug}")
     print(f"前端地址: {api_config.app.get('frontend_url', 'http://localhost:3000')}")
+    print("生产环境请使用多进程服务器: python serve.py")
     print("\n按 Ctrl+C 停止应用")
     print("=" * 50)
     
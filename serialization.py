@@ -0,0 +1,221 @@
+"""
+JSON / MessagePack 序列化
+
+Flask 的 jsonify 和 FastAPI 默认的 JSONResponse 都经过标准库 json，客户列表、沟通记录、获客统计和导出
+这类大负载编码耗时明显。这里统一使用 orjson（未安装时回退到标准库 json），并处理 datetime/Decimal/集合
+以及导出时 pandas/numpy 的数值类型：
+    Flask    init_flask_json(app) 替换 app.json，所有 jsonify 和 request.get_json 自动使用
+    FastAPI  FastAPI(default_response_class=FastJSONResponse)
+
+列表接口使用 negotiated_jsonify（Flask）/ negotiated_response（FastAPI）：
+    - 请求头 Accept 优先 application/msgpack 时返回 MessagePack（需安装 msgpack）
+    - 列表条数达到 JSON_STREAM_MIN_ITEMS 时分批编码、流式发送（0 表示不使用流式）
+"""
+
+import os
+import json
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterator, Optional
+from uuid import UUID
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+# 两个框架的适配部分只在对应框架已安装时定义（FastAPI应用的依赖中没有Flask，反之亦然）
+try:
+    from flask import current_app, request as flask_request
+    from flask.json.provider import JSONProvider
+    FLASK_AVAILABLE = True
+except ImportError:
+    FLASK_AVAILABLE = False
+
+try:
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    STARLETTE_AVAILABLE = True
+except ImportError:
+    STARLETTE_AVAILABLE = False
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+JSON_STREAM_MIN_ITEMS = int(os.getenv('JSON_STREAM_MIN_ITEMS', 5000))
+JSON_STREAM_BATCH_SIZE = int(os.getenv('JSON_STREAM_BATCH_SIZE', 500))
+
+if ORJSON_AVAILABLE:
+    # 非字符串键（如按优先级统计的 {1: 10}）和标准库一样转成字符串；numpy 数组/标量直接编码
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def encode_default(obj: Any) -> Any:
+    """orjson/json/msgpack 不能直接编码的类型"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    # numpy/pandas 标量（导出时 DataFrame.to_dict 得到的 int64、Timestamp 等）
+    if hasattr(obj, 'item'):
+        return obj.item()
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f'无法序列化的类型: {type(obj).__name__}')
+
+
+def dumps(obj: Any, pretty: bool = False) -> bytes:
+    """编码为UTF-8 JSON（中文不转义）；pretty=True 时缩进2格"""
+    if ORJSON_AVAILABLE:
+        option = ORJSON_OPTIONS | orjson.OPT_INDENT_2 if pretty else ORJSON_OPTIONS
+        return orjson.dumps(obj, default=encode_default, option=option)
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, default=encode_default, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, default=encode_default, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: Any) -> Any:
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def packb(obj: Any) -> bytes:
+    """编码为 MessagePack；日期时间和JSON一样编码为ISO字符串"""
+    if not MSGPACK_AVAILABLE:
+        raise RuntimeError('未安装msgpack')
+    return msgpack.packb(obj, default=encode_default, use_bin_type=True)
+
+
+def parse_accept_header(accept: str) -> Dict[str, float]:
+    """解析 Accept / Accept-Encoding 请求头，返回 {媒体类型或编码(小写): q值}"""
+    qualities = {}
+    for part in accept.split(','):
+        media_type, *params = [item.strip() for item in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type:
+            qualities[media_type.lower()] = quality
+    return qualities
+
+
+def prefers_msgpack(accept: Optional[str]) -> bool:
+    """Accept 中明确列出 MessagePack，且优先级不低于JSON"""
+    if not MSGPACK_AVAILABLE or not accept or 'msgpack' not in accept:
+        return False
+    qualities = parse_accept_header(accept)
+    msgpack_quality = max(qualities.get(media_type, 0.0) for media_type in MSGPACK_MIMETYPES)
+    json_quality = next((qualities[media_type] for media_type in (JSON_MIMETYPE, 'application/*', '*/*')
+                         if media_type in qualities), 0.0)
+    return msgpack_quality > 0 and msgpack_quality >= json_quality
+
+
+def should_stream(items: Any) -> bool:
+    return JSON_STREAM_MIN_ITEMS > 0 and isinstance(items, list) and len(items) >= JSON_STREAM_MIN_ITEMS
+
+
+def iter_json(payload: Any, list_key: Optional[str] = None,
+              batch_size: int = JSON_STREAM_BATCH_SIZE) -> Iterator[bytes]:
+    """分批编码列表，拼接结果与 dumps(payload) 相同
+
+    payload 为列表，或者 list_key 指向列表的字典（如 {'customers': [...], 'pagination': {...}}）
+    """
+    items = payload if list_key is None else payload[list_key]
+    head, tail = b'[', b']'
+    if list_key is not None:
+        rest = {key: value for key, value in payload.items() if key != list_key}
+        head = b'{' + dumps(list_key) + b':['
+        # 其余字段编码后去掉开头的 {，接在列表后面
+        tail = b'],' + dumps(rest)[1:] if rest else b']}'
+    yield head
+    for start in range(0, len(items), batch_size):
+        chunk = dumps(items[start:start + batch_size])[1:-1]
+        yield b',' + chunk if start else chunk
+    yield tail
+
+
+if FLASK_AVAILABLE:
+    class FastJSONProvider(JSONProvider):
+        """Flask JSON提供者：jsonify、request.get_json、模板 tojson 都使用 orjson"""
+
+        mimetype = JSON_MIMETYPE
+
+        def dumps(self, obj: Any, **kwargs: Any) -> str:
+            return dumps(obj, pretty=bool(kwargs.get('indent'))).decode('utf-8')
+
+        def loads(self, s: Any, **kwargs: Any) -> Any:
+            return loads(s)
+
+        def response(self, *args: Any, **kwargs: Any):
+            # 直接用编码得到的bytes作为响应体，省去一次 str 编解码
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+    def init_flask_json(app):
+        app.json = FastJSONProvider(app)
+        logger.info(f"JSON序列化: {'orjson' if ORJSON_AVAILABLE else 'json'}，"
+                    f"MessagePack: {'可用' if MSGPACK_AVAILABLE else '未安装'}")
+
+    def negotiated_jsonify(payload: Any, list_key: Optional[str] = None):
+        """列表接口的响应：按 Accept 返回 MessagePack 或 JSON，列表很长时流式编码"""
+        items = payload if list_key is None else payload[list_key]
+        if prefers_msgpack(flask_request.headers.get('Accept')):
+            response = current_app.response_class(packb(payload), mimetype=MSGPACK_MIMETYPE)
+        elif should_stream(items):
+            response = current_app.response_class(iter_json(payload, list_key), mimetype=JSON_MIMETYPE)
+        else:
+            response = current_app.response_class(dumps(payload), mimetype=JSON_MIMETYPE)
+        response.vary.add('Accept')
+        return response
+
+
+if STARLETTE_AVAILABLE:
+    class FastJSONResponse(JSONResponse):
+        """orjson 编码的 JSONResponse，作为 FastAPI 的 default_response_class"""
+
+        def render(self, content: Any) -> bytes:
+            return dumps(content)
+
+    class MsgPackResponse(Response):
+        media_type = MSGPACK_MIMETYPE
+
+        def render(self, content: Any) -> bytes:
+            return packb(content)
+
+    def negotiated_response(request: Request, payload: Any, list_key: Optional[str] = None) -> Response:
+        """列表接口的响应：按 Accept 返回 MessagePack 或 JSON，列表很长时流式编码
+
+        直接返回 Response，跳过 FastAPI 的 jsonable_encoder（逐个对象递归转换，大列表时最耗时），
+        payload 中只能包含 dumps/packb 能编码的类型（dict/list/datetime/Decimal 等，不能是ORM对象）
+        """
+        items = payload if list_key is None else payload[list_key]
+        headers = {'Vary': 'Accept'}
+        if prefers_msgpack(request.headers.get('accept')):
+            return MsgPackResponse(payload, headers=headers)
+        if should_stream(items):
+            # 同步生成器由 Starlette 放到线程池中迭代，编码不占用事件循环
+            return StreamingResponse(iter_json(payload, list_key), media_type=JSON_MIMETYPE, headers=headers)
+        return FastJSONResponse(payload, headers=headers)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生产环境启动脚本
+使用 gunicorn 以多进程 + 多线程方式运行 Flask 应用（app.py 中的 app.run 仅用于开发调试）
+
+    python serve.py                          # 默认: 工作进程数按CPU核数, 每个进程8个线程
+    python serve.py --workers 4 --threads 16 --port 5004
+    python serve.py --https --ipv6           # 与 start_https.py 相同的 HTTPS/IPv6 选项
+    python serve.py --asgi                   # AI接口以协程方式执行（asgi_app.py），其余接口不变
+
+- 应用在主进程中预加载（preload_app），工作进程 fork 后以写时复制方式共享代码和只读数据，
+  预加载后冻结GC，避免垃圾回收触碰共享页面导致复制
+- AI请求主要在等待上游响应，每个工作进程用多个线程并发处理（gthread）；
+  --asgi 使用 uvicorn 工作进程，AI接口等待期间不占用线程，--threads 为执行其余Flask接口的线程数
+- 平滑重启: kill -HUP <主进程PID>，新工作进程就绪后旧进程处理完当前请求再退出；
+  更新代码需要重新加载应用: kill -USR2 <主进程PID> 启动新主进程，确认正常后 kill -TERM 旧主进程
+- 停止: SIGTERM 时工作进程停止接收新连接，最多等待 --graceful-timeout 秒处理完进行中的请求
+"""
+
+import os
+import gc
+import sys
+import logging
+import argparse
+import multiprocessing
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent
+sys.path.insert(0, str(project_root))
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    print("未安装gunicorn: pip install -r requirements_flask.txt")
+    sys.exit(1)
+
+from config import api_config
+
+logger = logging.getLogger('serve')
+
+# 默认并发：进程数按CPU核数（上限8），每个进程的线程数覆盖AI请求的等待时间
+DEFAULT_WORKERS = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+DEFAULT_THREADS = int(os.getenv('WEB_THREADS', 8))
+# AI生成可能持续较长时间；gthread 下该超时只针对无响应的工作进程，不限制单个请求
+DEFAULT_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 120))
+DEFAULT_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+# 每个工作进程处理一定数量的请求后重启，释放可能累积的内存
+DEFAULT_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 2000))
+
+
+class CRMServer(BaseApplication):
+    """嵌入式 gunicorn 应用，配置来自命令行参数而不是 gunicorn.conf.py"""
+
+    def __init__(self, options, asgi=False):
+        self.options = options
+        self.asgi = asgi
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        # preload_app 时只在主进程中执行一次
+        from app import app, init_db
+        init_db()
+        if self.asgi:
+            from asgi_app import application
+            return application
+        return app
+
+
+def when_ready(server):
+    # 预加载完成后冻结现有对象，工作进程中的GC不再扫描（写入）这些共享页面
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"服务已就绪: {server.cfg.workers}个工作进程 x {server.cfg.threads}个线程")
+
+
+def post_fork(server, worker):
+    # 后台任务调度线程不会随 fork 复制，每个工作进程各自启动（任务按数据库记录领取，不会重复执行）
+    from job_queue import job_queue
+    job_queue.start()
+
+
+def worker_exit(server, worker):
+    # 停止领取新任务，等待正在执行的任务完成；超时仍未完成的任务放回队列，由其他工作进程立即接手，
+    # 不会因 max_requests 重启而停留在 running 状态直到心跳超时后重复执行
+    from job_queue import job_queue
+    job_queue.stop(timeout=min(5.0, server.cfg.graceful_timeout / 2))
+
+
+def build_options(args):
+    host = args.host or os.getenv('HOST') or api_config.app.get('host', '0.0.0.0')
+    port = args.port or int(os.getenv('PORT', 0)) or api_config.app.get('port', 5004)
+
+    # IPv6支持：监听 :: 时同时接受IPv4连接
+    if args.ipv6 and host == '0.0.0.0':
+        host = '::'
+    bind = f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+
+    options = {
+        'bind': [bind],
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'preload_app': True,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': 5,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'pidfile': args.pid,
+        'accesslog': '-' if args.access_log else None,
+        'errorlog': '-',
+        'loglevel': 'info',
+        'proc_name': 'ai-crm',
+        'when_ready': when_ready,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+    if args.asgi:
+        options['worker_class'] = 'uvicorn.workers.UvicornWorker'
+
+    # HTTPS支持：未指定证书时与 start_https.py 一样使用自签名证书
+    if args.https:
+        certfile, keyfile = args.certfile, args.keyfile
+        if not (certfile and keyfile):
+            from app import generate_ssl_certificate
+            certfile, keyfile = generate_ssl_certificate()
+        if certfile and keyfile:
+            options.update({'certfile': certfile, 'keyfile': keyfile})
+        else:
+            logger.warning("HTTPS启用失败，回退到HTTP")
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以多进程方式启动AI CRM Flask应用')
+    parser.add_argument('--host', type=str, default=None, help='监听地址')
+    parser.add_argument('--port', type=int, default=None, help='端口号')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='工作进程数')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='每个工作进程的线程数')
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT, help='工作进程无响应超时（秒）')
+    parser.add_argument('--graceful-timeout', type=int, default=DEFAULT_GRACEFUL_TIMEOUT,
+                        help='停止/重启时等待进行中请求的时间（秒）')
+    parser.add_argument('--max-requests', type=int, default=DEFAULT_MAX_REQUESTS,
+                        help='工作进程处理多少请求后重启，0为不重启')
+    parser.add_argument('--asgi', action='store_true',
+                        default=os.getenv('WEB_ASGI', 'false').lower() == 'true',
+                        help='以ASGI方式运行，AI接口异步执行（需要 uvicorn、a2wsgi）')
+    parser.add_argument('--https', action='store_true',
+                        default=os.getenv('ENABLE_HTTPS', 'false').lower() == 'true', help='启用HTTPS')
+    parser.add_argument('--ipv6', action='store_true',
+                        default=os.getenv('ENABLE_IPV6', 'false').lower() == 'true', help='启用IPv6')
+    parser.add_argument('--certfile', default=os.getenv('SSL_CERT_FILE'), help='SSL证书文件')
+    parser.add_argument('--keyfile', default=os.getenv('SSL_KEY_FILE'), help='SSL私钥文件')
+    parser.add_argument('--pid', default=os.getenv('WEB_PIDFILE'), help='主进程PID文件，用于平滑重启')
+    parser.add_argument('--access-log', action='store_true', help='输出访问日志')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.asgi:
+        # asgi_app 按该值设置执行Flask请求的线程数
+        os.environ['WEB_THREADS'] = str(args.threads)
+    CRMServer(build_options(args), asgi=args.asgi).run()
+
+
+if __name__ == '__main__':
+    main()
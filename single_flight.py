@@ -0,0 +1,118 @@
+import copy
+import json
+import asyncio
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Dict, Any, Callable, Awaitable, Hashable
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """根据请求参数计算指纹，参数相同的请求可以合并"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _share(result: Any) -> Any:
+    """返回给等待方的结果副本，避免调用方修改共享的字典或列表"""
+    return copy.copy(result) if isinstance(result, (dict, list)) else result
+
+
+class _FlightStats:
+    """按用途统计发起和被合并的请求数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {'executed': 0, 'coalesced': 0})
+
+    def record(self, label: str, coalesced: bool):
+        with self._lock:
+            self._counts[label]['coalesced' if coalesced else 'executed'] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {label: dict(counts) for label, counts in self._counts.items()}
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """线程版请求合并：相同键的并发调用只执行一次，其余调用等待并共享结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats = _FlightStats()
+
+    def do(self, key: Hashable, func: Callable[[], Any], label: str = 'default') -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        self._stats.record(label, coalesced=not leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return _share(call.result)
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'in_flight': self.in_flight(), 'requests': self._stats.snapshot()}
+
+
+class AsyncSingleFlight:
+    """协程版请求合并，用于FastAPI应用
+
+    领头请求作为独立任务运行，等待方通过 asyncio.shield 等待，
+    某个客户端断开取消时不会影响其他等待同一结果的请求。
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._stats = _FlightStats()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]], label: str = 'default') -> Any:
+        task = self._tasks.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        self._stats.record(label, coalesced=not leader)
+
+        result = await asyncio.shield(task)
+        return result if leader else _share(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'in_flight': len(self._tasks), 'requests': self._stats.snapshot()}
+
+# 创建全局实例
+ai_single_flight = SingleFlight()
+ai_async_single_flight = AsyncSingleFlight()
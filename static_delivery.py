@@ -0,0 +1,190 @@
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+from typing import Dict, Optional
+
+from flask import request, send_from_directory, current_app, Response
+from werkzeug.security import safe_join
+from werkzeug.exceptions import NotFound
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# 发送方式：app 由Flask发送文件；x-accel 交给nginx（X-Accel-Redirect）；x-sendfile 交给Apache/lighttpd
+STATIC_DELIVERY = os.getenv('STATIC_DELIVERY', 'app').lower()
+# nginx 中映射到 static 目录的 internal location
+X_ACCEL_PREFIX = os.getenv('X_ACCEL_PREFIX', '/_protected/static/')
+
+# 启动时计算版本号并预压缩的静态资源目录（相对static目录）
+ASSET_DIRS = ('js', 'css')
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.svg', '.json', '.txt', '.html')
+COMPRESS_MIN_SIZE = 1024
+# 预压缩文件目录（相对static目录），镜像原文件路径，如 .precompressed/js/app.js.br
+PRECOMPRESSED_DIR = '.precompressed'
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# 不带版本号的资源和旧的上传文件：短期缓存，过期后用ETag验证
+DEFAULT_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', 3600))
+
+
+class StaticDelivery:
+    """静态文件和上传文件的发送
+
+    - 静态资源（js/css）按内容计算版本号，url_for('static', ...) 自动带上 ?v=<版本号>，
+      带当前版本号的请求返回 Cache-Control: immutable
+    - 按内容寻址的上传文件（blobs）及其缩略图的URL本身就是内容指纹，同样永久缓存，ETag为内容哈希
+    - 所有文件支持 If-None-Match/If-Modified-Since 返回304，以及Range分段下载（大PDF）
+    - 文本资源启动时预压缩为 gzip/brotli，按 Accept-Encoding 直接发送压缩文件
+    - 可选 X-Accel-Redirect/X-Sendfile 模式，由前置服务器发送文件内容
+    """
+
+    def __init__(self, mode: str = STATIC_DELIVERY):
+        self.mode = mode
+        self.static_folder: Optional[str] = None
+        self.manifest: Dict[str, str] = {}
+
+    def init_app(self, app):
+        """计算静态资源版本号、生成预压缩文件，并接管Flask内置的static路由"""
+        self.static_folder = app.static_folder
+        if self.mode == 'x-sendfile':
+            app.use_x_sendfile = True
+        self.build_assets()
+
+        @app.url_defaults
+        def add_asset_version(endpoint, values):
+            if endpoint == 'static' and 'v' not in values:
+                version = self.manifest.get(values.get('filename', ''))
+                if version:
+                    values['v'] = version
+
+        app.view_functions['static'] = lambda filename: self.send(self.static_folder, filename)
+
+    # ------------------------------------------------------------------
+    # 启动时处理静态资源
+    # ------------------------------------------------------------------
+
+    def build_assets(self):
+        manifest = {}
+        compressed = 0
+        for asset_dir in ASSET_DIRS:
+            base = os.path.join(self.static_folder, asset_dir)
+            for dirpath, _, filenames in os.walk(base):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    relpath = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                    with open(path, 'rb') as f:
+                        content = f.read()
+                    manifest[relpath] = hashlib.sha256(content).hexdigest()[:12]
+                    if name.endswith(COMPRESSIBLE_EXTENSIONS) and len(content) >= COMPRESS_MIN_SIZE:
+                        compressed += self._precompress(path, relpath, content)
+        self.manifest = manifest
+        logger.info(f"静态资源: {len(manifest)} 个文件，新生成预压缩文件 {compressed} 个")
+
+    def _precompress(self, path: str, relpath: str, content: bytes) -> int:
+        """生成 .gz 和 .br 文件；已存在且不旧于原文件时跳过"""
+        encoders = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if BROTLI_AVAILABLE:
+            encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+
+        created = 0
+        mtime = os.path.getmtime(path)
+        for suffix, encode in encoders:
+            target = os.path.join(self.static_folder, PRECOMPRESSED_DIR, relpath + suffix)
+            if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # 多个worker同时启动时先写临时文件再替换
+            temp_path = f"{target}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(encode(content))
+            os.replace(temp_path, target)
+            created += 1
+        return created
+
+    # ------------------------------------------------------------------
+    # 发送文件
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _content_hash(filename: str) -> Optional[str]:
+        """按内容寻址的上传文件（blobs/<前两位>/<SHA-256>.<扩展名>）及其缩略图：返回文件名中的SHA-256"""
+        parts = filename.split('/')
+        if 'blobs' not in parts:
+            return None
+        stem = parts[-1].split('.', 1)[0]
+        if len(stem) == 64 and all(c in '0123456789abcdef' for c in stem):
+            return stem
+        return None
+
+    def _precompressed_variant(self, directory: str, filename: str) -> Optional[tuple]:
+        """客户端接受且已生成预压缩文件时返回 (相对static目录的路径, 编码)"""
+        if not self.static_folder or os.path.abspath(directory) != os.path.abspath(self.static_folder):
+            return None
+        if filename not in self.manifest:
+            return None
+        accepted = request.accept_encodings
+        for suffix, encoding in (('.br', 'br'), ('.gz', 'gzip')):
+            if accepted[encoding]:
+                relpath = f"{PRECOMPRESSED_DIR}/{filename}{suffix}"
+                if os.path.exists(os.path.join(self.static_folder, relpath)):
+                    return relpath, encoding
+        return None
+
+    def send(self, directory: str, filename: str) -> Response:
+        """发送 directory 下的文件，设置缓存头，支持条件请求和Range"""
+        directory = os.path.join(current_app.root_path, directory)
+        if safe_join(directory, filename) is None:
+            raise NotFound()
+
+        content_hash = self._content_hash(filename)
+        versioned = content_hash is not None or (
+            request.args.get('v') is not None and request.args.get('v') == self.manifest.get(filename))
+        max_age = IMMUTABLE_MAX_AGE if versioned else DEFAULT_MAX_AGE
+
+        if self.mode == 'x-accel':
+            response = self._x_accel_response(directory, filename)
+        else:
+            variant = self._precompressed_variant(directory, filename)
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            if variant:
+                relpath, encoding = variant
+                response = send_from_directory(self.static_folder, relpath, mimetype=mimetype,
+                                               download_name=os.path.basename(filename),
+                                               max_age=max_age, conditional=True)
+                response.headers['Content-Encoding'] = encoding
+            else:
+                # 内容寻址的原图直接用内容哈希作为强ETag，多台服务器之间一致；缩略图使用文件的ETag
+                original = content_hash is not None and os.path.basename(filename).count('.') == 1
+                response = send_from_directory(directory, filename, mimetype=mimetype, max_age=max_age,
+                                               conditional=True, etag=content_hash if original else True)
+            if filename in self.manifest:
+                response.vary.add('Accept-Encoding')
+
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        if versioned:
+            response.cache_control.immutable = True
+        return response
+
+    def _x_accel_response(self, directory: str, filename: str) -> Response:
+        """只返回响应头，由nginx发送文件；条件请求、Range和gzip由nginx处理"""
+        path = safe_join(directory, filename)
+        if not os.path.isfile(path):
+            raise NotFound()
+        relpath = os.path.relpath(path, os.path.join(current_app.root_path, 'static')).replace(os.sep, '/')
+        if relpath.startswith('..'):
+            raise NotFound()
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX + relpath
+        return response
+
+# 创建全局实例
+static_delivery = StaticDelivery()
@@ -0,0 +1,148 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from functools import wraps
+from typing import Optional, Tuple
+
+from flask import Request, request, jsonify
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 上传临时文件目录：不能放在 static/ 下（/static/uploads/<path> 会公开提供未完成的上传），
+# 与上传目录在同一文件系统时保存文件只需重命名
+UPLOAD_TEMP_DIR = os.getenv('UPLOAD_TEMP_DIR', 'upload_tmp')
+# 早期版本的临时文件目录，启动时一并清理
+LEGACY_UPLOAD_TEMP_DIR = os.path.join('static', 'uploads', '.tmp')
+# 超过这个时间的 upload_* 临时文件视为进程异常退出后的残留
+UPLOAD_TEMP_MAX_AGE = int(os.getenv('UPLOAD_TEMP_MAX_AGE', 3600))
+# multipart 分隔符和表单字段的额外开销，按 Content-Length 提前拒绝时留出余量
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class HashingUploadStream:
+    """上传文件的落盘流：表单解析器逐块写入时计算SHA-256并检查大小，超限立即中止
+
+    内容直接写入磁盘临时文件，不在内存中缓存整个文件；未被 save_upload 保存的临时文件在关闭时删除。
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix='upload_', dir=UPLOAD_TEMP_DIR)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.max_size = max_size
+        self.size = 0
+        self.persisted = False
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            # 解析中止后表单解析器不会再关闭这个流，这里删除临时文件
+            self.close()
+            raise RequestEntityTooLarge()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.persisted and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush 等交给临时文件
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    """上传文件直接流式写入 HashingUploadStream，大小上限由 upload_limit 按接口设置"""
+
+    max_upload_size: Optional[int] = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadStream(self.max_upload_size)
+
+
+def upload_limit(max_size: int, message: Optional[str] = None):
+    """限制接口的单个上传文件大小
+
+    Content-Length 明显超限时不读取请求体直接拒绝；否则在解析表单时逐块检查，超限即中止。
+    """
+    message = message or f'文件大小超过{max_size // (1024 * 1024)}MB限制'
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.content_length and request.content_length > max_size + MULTIPART_OVERHEAD:
+                return jsonify({'success': False, 'message': message}), 413
+            request.max_upload_size = max_size
+            try:
+                # 在这里解析表单，超限时返回统一的错误信息
+                request.files
+            except RequestEntityTooLarge:
+                logger.warning(f"上传文件超过大小限制: {request.path}")
+                return jsonify({'success': False, 'message': message}), 413
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def save_upload(file: FileStorage, destination: str) -> Tuple[int, str]:
+    """保存上传文件，返回 (字节数, SHA-256)；流式上传的临时文件直接移动到目标位置"""
+    stream = file.stream
+    if isinstance(stream, HashingUploadStream):
+        stream.flush()
+        shutil.move(stream.path, destination)
+        stream.persisted = True
+        # mkstemp 创建的文件只有属主可读，静态文件需要对其他进程（如nginx）可读
+        os.chmod(destination, 0o644)
+        return stream.size, stream.sha256
+
+    # 其他请求类（如测试客户端直接构造的文件）退回到普通保存
+    file.save(destination)
+    digest = hashlib.sha256()
+    size = 0
+    with open(destination, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def sweep_stale_uploads(max_age: int = UPLOAD_TEMP_MAX_AGE) -> int:
+    """启动时删除残留的上传临时文件（工作进程被杀死时 HashingUploadStream 来不及清理），返回删除的文件数
+    
+    只删除修改时间早于 max_age 秒的文件，不影响其他进程正在接收的上传。
+    """
+    removed = 0
+    cutoff = time.time() - max_age
+    for directory in (UPLOAD_TEMP_DIR, LEGACY_UPLOAD_TEMP_DIR):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if not entry.name.startswith('upload_') or not entry.is_file(follow_symlinks=False):
+                continue
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"删除上传临时文件失败: {e}")
+    if removed:
+        logger.info(f"已清理 {removed} 个残留的上传临时文件")
+    return removed
@@ -0,0 +1,365 @@
+import json
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+BUSINESS_CARD_FIELDS = ('name', 'company', 'position', 'phone', 'email', 'wechat', 'address', 'industry')
+
+# 各任务的输出结构（JSON Schema 的常用子集：type/properties/required/items/minimum/maximum/minProperties）
+SCHEMAS = {
+    'customer_analysis': {
+        'type': 'object',
+        'required': ['profile_analysis', 'next_contact_suggestion', 'sales_opportunity', 'success_probability'],
+        'properties': {
+            'profile_analysis': {
+                'type': ['object', 'string'],
+                'properties': {
+                    'content': {'type': 'string'},
+                    'time': {'type': 'string'},
+                    'method': {'type': 'string'},
+                    'topics': {'type': 'array', 'items': {'type': 'string'}},
+                    'opportunities': {'type': 'array', 'items': {'type': 'string'}},
+                    'strategies': {'type': 'array', 'items': {'type': 'string'}},
+                    'competition_analysis': {'type': 'string'}
+                }
+            },
+            'next_contact_suggestion': {'type': 'string'},
+            'sales_opportunity': {'type': 'string'},
+            'success_probability': {'type': 'number', 'minimum': 0}
+        }
+    },
+    # 话术字段随销售情况变化，只要求是对象
+    'sales_script': {
+        'type': 'object'
+    },
+    'business_card': {
+        'type': 'object',
+        'properties': {field: {'type': ['string', 'null']} for field in BUSINESS_CARD_FIELDS}
+    },
+    # 批量名片解析：JSON模式只能返回对象，名片数组放在 cards 字段中，index 对应输入顺序
+    'business_cards': {
+        'type': 'object',
+        'required': ['cards'],
+        'properties': {
+            'cards': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'index': {'type': 'integer', 'minimum': 0},
+                        **{field: {'type': ['string', 'null']} for field in BUSINESS_CARD_FIELDS}
+                    }
+                }
+            }
+        }
+    }
+}
+
+REPROMPT_TEMPLATE = '上面的输出无法解析为符合要求的JSON（{errors}）。请只返回修正后的完整JSON，不要添加任何其他文字。'
+
+
+class StructuredOutputError(ValueError):
+    """AI输出在本地修复后仍无法解析或不符合结构要求"""
+
+    def __init__(self, message: str, errors: Optional[List[str]] = None):
+        super().__init__(message)
+        self.errors = errors or [message]
+
+
+def _strip_code_fences(text: str) -> str:
+    """去掉 ```json ... ``` 代码块标记"""
+    text = text.strip()
+    start = text.find('```')
+    if start == -1:
+        return text
+    body_start = text.find('\n', start)
+    if body_start == -1:
+        return text[start + 3:]
+    end = text.find('```', body_start)
+    return text[body_start + 1:end if end != -1 else len(text)]
+
+
+def _extract_json_text(text: str) -> str:
+    """取出第一个JSON对象或数组（忽略前后的说明文字），截断时返回到末尾为止"""
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        raise StructuredOutputError('输出中没有JSON对象')
+    start = min(starts)
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            depth += 1
+        elif ch in '}]':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _repair_json_text(text: str) -> str:
+    """修复常见缺陷：多余的尾逗号、未闭合的字符串和括号（输出被max_tokens截断）"""
+    out = []
+    stack = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch == '\n':
+                # 字符串中不允许裸换行
+                out[-1] = '\\n'
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+        elif ch in '}]':
+            _drop_trailing_comma(out)
+            if stack:
+                stack.pop()
+        out.append(ch)
+
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    if stack:
+        repaired = ''.join(out).rstrip()
+        # 截断在键名或冒号处时丢弃不完整的键值对
+        if repaired.endswith(':'):
+            repaired += ' null'
+        elif stack[-1] == '}' and repaired.endswith('"'):
+            key_start = repaired.rfind('"', 0, len(repaired) - 1)
+            before = repaired[:key_start].rstrip()
+            if before.endswith((',', '{')):
+                repaired = before
+        out = list(repaired)
+        _drop_trailing_comma(out)
+        out.extend(reversed(stack))
+    return ''.join(out)
+
+
+def _drop_trailing_comma(out: List[str]):
+    i = len(out) - 1
+    while i >= 0 and out[i].isspace():
+        i -= 1
+    if i >= 0 and out[i] == ',':
+        del out[i]
+
+
+_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'boolean': bool,
+    'null': type(None)
+}
+
+
+def _coerce(value: Any, expected: str) -> Tuple[bool, Any]:
+    """把类型相近的值转换成要求的类型，如 "0.6"、"60%" -> 数字"""
+    if expected in ('number', 'integer'):
+        if isinstance(value, bool):
+            return False, value
+        if isinstance(value, (int, float)):
+            return True, int(value) if expected == 'integer' else value
+        if isinstance(value, str):
+            raw = value.strip()
+            try:
+                number = float(raw.rstrip('%')) / 100 if raw.endswith('%') else float(raw)
+            except ValueError:
+                return False, value
+            return True, int(number) if expected == 'integer' else number
+        return False, value
+    if expected == 'string' and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return True, str(value)
+    return isinstance(value, _TYPES[expected]), value
+
+
+def validate(data: Any, schema: Dict[str, Any], path: str = '$') -> Tuple[Any, List[str]]:
+    """按结构校验并做宽松类型转换，返回 (转换后的数据, 错误列表)"""
+    errors = []
+    expected_types = schema.get('type')
+    if expected_types:
+        if isinstance(expected_types, str):
+            expected_types = [expected_types]
+        for expected in expected_types:
+            ok, coerced = _coerce(data, expected)
+            if ok:
+                data = coerced
+                break
+        else:
+            return data, [f"{path}: 应为 {'/'.join(expected_types)}，实际为 {type(data).__name__}"]
+
+    if isinstance(data, dict):
+        for field in schema.get('required', []):
+            if field not in data or data[field] in (None, ''):
+                errors.append(f'{path}.{field}: 缺少必填字段')
+        if len(data) < schema.get('minProperties', 0):
+            errors.append(f'{path}: 字段数不足')
+        for field, field_schema in schema.get('properties', {}).items():
+            if field in data and data[field] is not None:
+                data[field], field_errors = validate(data[field], field_schema, f'{path}.{field}')
+                errors.extend(field_errors)
+    elif isinstance(data, list) and 'items' in schema:
+        for index, item in enumerate(data):
+            data[index], item_errors = validate(item, schema['items'], f'{path}[{index}]')
+            errors.extend(item_errors)
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        if 'minimum' in schema and data < schema['minimum']:
+            errors.append(f"{path}: 不能小于 {schema['minimum']}")
+        if 'maximum' in schema and data > schema['maximum']:
+            errors.append(f"{path}: 不能大于 {schema['maximum']}")
+    return data, errors
+
+
+def parse_json(text: str, schema_name: Optional[str] = None) -> Tuple[Any, bool]:
+    """解析AI输出的JSON，必要时在本地修复；返回 (数据, 是否经过修复)
+
+    解析失败或不符合 SCHEMAS[schema_name] 时抛出 StructuredOutputError。
+    """
+    if not text or not text.strip():
+        raise StructuredOutputError('AI输出为空')
+
+    repaired = False
+    try:
+        data = json.loads(text)
+    except ValueError:
+        candidate = _extract_json_text(_strip_code_fences(text))
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            try:
+                data = json.loads(_repair_json_text(candidate))
+            except ValueError as e:
+                raise StructuredOutputError(f'JSON解析失败: {e}')
+        repaired = True
+
+    if schema_name:
+        data, errors = validate(data, SCHEMAS[schema_name])
+        if errors:
+            raise StructuredOutputError('; '.join(errors[:5]), errors)
+    return data, repaired
+
+
+class StructuredOutput:
+    """结构化AI输出：请求服务商的JSON模式，本地修复并校验，最后才重新请求模型"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {'clean': 0, 'repaired': 0, 'reprompted': 0, 'failed': 0})
+
+    def _record(self, schema_name: str, outcome: str):
+        with self._lock:
+            self._counts[schema_name][outcome] += 1
+
+    def parse(self, text: str, schema_name: str) -> Any:
+        """只做本地解析和修复，不重新请求模型"""
+        try:
+            data, repaired = parse_json(text, schema_name)
+        except StructuredOutputError:
+            self._record(schema_name, 'failed')
+            raise
+        self._record(schema_name, 'repaired' if repaired else 'clean')
+        return data
+
+    def generate(self, schema_name: str, messages: List[Dict[str, str]], model_name: Optional[str] = None,
+                 temperature: float = 0.3, max_tokens: int = 16000, purpose: Optional[str] = None,
+                 max_reprompts: int = 1) -> Dict[str, Any]:
+        """调用AI并返回结构化结果
+
+        返回 {'success', 'data', 'raw', 'repaired', 'reprompts', 'error'}；
+        AI调用成功但输出始终无法解析时 success 为False，raw 保留最后一次原始输出。
+        """
+        from ai_service_manager import ai_service
+
+        model_name = model_name or ai_service.get_default_model()
+        attempts = self._attempts(schema_name, messages, max_reprompts)
+        try:
+            conversation = next(attempts)
+            while True:
+                result = ai_service.call_ai_model(model_name, conversation, temperature=temperature,
+                                                  max_tokens=max_tokens, purpose=purpose or schema_name,
+                                                  json_mode=True)
+                conversation = attempts.send(result)
+        except StopIteration as done:
+            return done.value
+
+    async def agenerate(self, schema_name: str, messages: List[Dict[str, str]], model_name: Optional[str] = None,
+                        temperature: float = 0.3, max_tokens: int = 16000, purpose: Optional[str] = None,
+                        max_reprompts: int = 1) -> Dict[str, Any]:
+        """generate 的异步版本"""
+        from ai_service_manager import ai_service
+
+        model_name = model_name or ai_service.get_default_model()
+        attempts = self._attempts(schema_name, messages, max_reprompts)
+        try:
+            conversation = next(attempts)
+            while True:
+                result = await ai_service.acall_ai_model(model_name, conversation, temperature=temperature,
+                                                         max_tokens=max_tokens, purpose=purpose or schema_name,
+                                                         json_mode=True)
+                conversation = attempts.send(result)
+        except StopIteration as done:
+            return done.value
+
+    def _attempts(self, schema_name: str, messages: List[Dict[str, str]], max_reprompts: int):
+        """请求-解析-重新请求的流程，与AI调用方式（同步/异步）无关
+
+        每次 yield 需要发送给模型的对话，接收调用结果，结束时返回 generate 的结果字典。
+        """
+        conversation = list(messages)
+        raw = ''
+        for attempt in range(max_reprompts + 1):
+            result = yield conversation
+            if not result.get('success'):
+                return {'success': False, 'data': None, 'raw': raw, 'repaired': False,
+                        'reprompts': attempt, 'error': result.get('error')}
+
+            raw = result.get('message', '')
+            try:
+                data, repaired = parse_json(raw, schema_name)
+            except StructuredOutputError as e:
+                logger.warning(f"{schema_name} 输出解析失败（第{attempt + 1}次）: {e}")
+                conversation = list(messages) + [
+                    {'role': 'assistant', 'content': raw},
+                    {'role': 'user', 'content': REPROMPT_TEMPLATE.format(errors='; '.join(e.errors[:5]))}
+                ]
+                error = str(e)
+                continue
+
+            self._record(schema_name, 'reprompted' if attempt else ('repaired' if repaired else 'clean'))
+            return {'success': True, 'data': data, 'raw': raw, 'repaired': repaired,
+                    'reprompts': attempt, 'error': None}
+
+        self._record(schema_name, 'failed')
+        return {'success': False, 'data': None, 'raw': raw, 'repaired': False,
+                'reprompts': max_reprompts, 'error': error}
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+# 创建全局实例
+structured_output = StructuredOutput()
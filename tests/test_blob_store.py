@@ -0,0 +1,116 @@
+"""blob_store：内容寻址存储的去重和引用计数"""
+
+import io
+import os
+import sqlite3
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from blob_store import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # 上传目录和临时目录都是相对路径，与应用一样在工作目录下
+    monkeypatch.chdir(tmp_path)
+    return BlobStore()
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'crm.db'))
+    yield conn
+    conn.close()
+
+
+def upload(data: bytes, filename: str = 'a.png') -> FileStorage:
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+
+def ref_count(conn, file_path):
+    row = conn.execute('SELECT ref_count FROM blobs WHERE file_path = ?', (file_path,)).fetchone()
+    return row[0] if row else None
+
+
+def test_duplicate_upload_increments_ref_count(store, conn):
+    first = store.store(conn, upload(b'same'), 'PNG')
+    second = store.store(conn, upload(b'same'), 'png')
+    conn.commit()
+
+    assert first['deduplicated'] is False
+    assert second['deduplicated'] is True
+    assert second['file_path'] == first['file_path']
+    assert second['url'] == first['url'] == f"/static/uploads/blobs/{first['content_hash'][:2]}/{first['content_hash']}.png"
+    assert ref_count(conn, first['file_path']) == 2
+    assert os.listdir(os.path.dirname(first['file_path'])) == [os.path.basename(first['file_path'])]
+    # 重复内容的临时文件已丢弃
+    assert os.listdir('upload_tmp') == []
+    assert store.stats(conn) == {'blobs': 1, 'references': 2, 'stored_bytes': 4, 'saved_bytes': 4}
+
+
+def test_same_content_with_another_extension_is_a_separate_blob(store, conn):
+    png = store.store(conn, upload(b'same'), 'png')
+    jpg = store.store(conn, upload(b'same'), 'jpg')
+    conn.commit()
+
+    assert png['file_path'] != jpg['file_path']
+    assert ref_count(conn, png['file_path']) == ref_count(conn, jpg['file_path']) == 1
+
+
+def test_file_is_removed_only_after_last_reference(store, conn):
+    path = store.store(conn, upload(b'avatar'), 'png')['file_path']
+    store.store(conn, upload(b'avatar'), 'png')
+    conn.commit()
+
+    assert store.release(conn, path) is None
+    conn.commit()
+    assert ref_count(conn, path) == 1
+    assert os.path.exists(path)
+
+    # 记录中保存的URL形式的路径（带前导斜杠）同样可以释放
+    assert store.release(conn, '/' + path) == path
+    conn.commit()
+    assert ref_count(conn, path) is None
+    assert store.remove(conn, path) is True
+    assert not os.path.exists(path)
+
+
+def test_rolled_back_release_keeps_reference_and_file(store, conn):
+    path = store.store(conn, upload(b'avatar'), 'png')['file_path']
+    conn.commit()
+
+    assert store.release(conn, path) == path
+    conn.rollback()
+
+    assert ref_count(conn, path) == 1
+    assert os.path.exists(path)
+
+
+def test_remove_keeps_file_referenced_again_after_release(store, conn):
+    path = store.store(conn, upload(b'avatar'), 'png')['file_path']
+    conn.commit()
+    assert store.release(conn, path) == path
+    conn.commit()
+
+    # 提交和删除之间另一个请求上传了相同内容
+    reupload = store.store(conn, upload(b'avatar'), 'png')
+    conn.commit()
+
+    assert reupload['file_path'] == path
+    assert store.remove(conn, path) is False
+    assert os.path.exists(path)
+    assert ref_count(conn, path) == 1
+
+
+def test_release_of_files_outside_the_blob_table(store, conn):
+    os.makedirs(os.path.join('static', 'uploads'))
+    legacy = os.path.join('static', 'uploads', 'avatar_20240101.png')
+    open(legacy, 'wb').close()
+
+    # 按时间戳命名的旧上传文件没有共享，直接删除
+    assert store.release(conn, legacy) == legacy
+    # blob目录下没有引用记录的文件、上传目录外的路径和空值都不删除
+    assert store.release(conn, os.path.join(store.root, 'ab', 'abc.png')) is None
+    assert store.release(conn, 'https://example.com/avatar.png') is None
+    assert store.release(conn, None) is None
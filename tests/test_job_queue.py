@@ -0,0 +1,184 @@
+"""job_queue：重试退避、停止时重新入队和中断任务的恢复"""
+
+import time
+import sqlite3
+import threading
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue, PermanentJobError, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / 'jobs.sqlite'))
+    queue.executor = 'thread'
+    # 不启动调度线程，由测试逐步领取和执行
+    queue.workers = 0
+    yield queue
+    queue.stop(timeout=1)
+
+
+def run_next(queue):
+    job = queue._claim_next()
+    assert job is not None
+    queue._execute(job)
+    return job
+
+
+def make_due(queue, job_id):
+    conn = sqlite3.connect(queue.db_path)
+    conn.execute('UPDATE jobs SET run_after = 0 WHERE id = ?', (job_id,))
+    conn.commit()
+    conn.close()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, '等待超时'
+        time.sleep(0.02)
+
+
+def test_failed_job_is_retried_with_exponential_backoff(queue):
+    calls = []
+
+    @queue.handler('flaky', max_attempts=3, backoff_seconds=10)
+    def flaky(payload, context):
+        calls.append(context.attempt)
+        if len(calls) < 3:
+            raise RuntimeError(f'第{len(calls)}次失败')
+        return {'value': payload['value']}
+
+    job_id = queue.enqueue('flaky', {'value': 42})
+
+    for attempt, delay in ((1, 10), (2, 20)):
+        before = time.time()
+        run_next(queue)
+        job = queue.get_job(job_id)
+        assert (job['status'], job['attempts'], job['error']) == (STATUS_QUEUED, attempt, f'第{attempt}次失败')
+        run_after = time.mktime(time.strptime(job['run_after'][:19], '%Y-%m-%dT%H:%M:%S'))
+        assert before + delay - 1 <= run_after <= time.time() + delay
+        # 退避时间未到，不会被领取
+        assert queue._claim_next() is None
+        make_due(queue, job_id)
+
+    run_next(queue)
+    job = queue.get_job(job_id, include_result=True)
+    assert (job['status'], job['attempts'], job['result']) == (STATUS_SUCCEEDED, 3, {'value': 42})
+    assert calls == [1, 2, 3]
+
+
+def test_job_fails_after_max_attempts(queue):
+    @queue.handler('broken', max_attempts=2, backoff_seconds=0)
+    def broken(payload, context):
+        raise RuntimeError('boom')
+
+    job_id = queue.enqueue('broken')
+    run_next(queue)
+    run_next(queue)
+
+    job = queue.get_job(job_id)
+    assert (job['status'], job['attempts'], job['error']) == (STATUS_FAILED, 2, 'boom')
+    assert queue._claim_next() is None
+
+
+def test_permanent_error_is_not_retried(queue):
+    @queue.handler('invalid', max_attempts=5, backoff_seconds=0)
+    def invalid(payload, context):
+        raise PermanentJobError('参数错误')
+
+    job_id = queue.enqueue('invalid')
+    run_next(queue)
+
+    job = queue.get_job(job_id)
+    assert (job['status'], job['attempts'], job['error']) == (STATUS_FAILED, 1, '参数错误')
+
+
+def test_stop_requeues_running_job_and_refunds_the_attempt(queue):
+    started, release = threading.Event(), threading.Event()
+
+    @queue.handler('slow', max_attempts=1)
+    def slow(payload, context):
+        started.set()
+        release.wait(5)
+        return {'stale': True}
+
+    queue.workers = 1
+    job_id = queue.enqueue('slow')
+    assert started.wait(5)
+
+    queue.stop(timeout=0.1)
+    job = queue.get_job(job_id)
+    assert (job['status'], job['attempts'], job['error']) == (STATUS_QUEUED, 0, '执行进程已停止，任务重新入队')
+
+    # 被打断的执行随后完成，不会改写已放回队列的任务
+    release.set()
+    wait_for(lambda: not queue._running)
+    job = queue.get_job(job_id, include_result=True)
+    assert (job['status'], job['result']) == (STATUS_QUEUED, None)
+
+    # 退还的次数让 max_attempts=1 的任务仍可以再执行一次
+    queue.workers = 0
+    run_next(queue)
+    job = queue.get_job(job_id, include_result=True)
+    assert (job['status'], job['attempts'], job['result']) == (STATUS_SUCCEEDED, 1, {'stale': True})
+
+
+def test_stale_execution_cannot_finish_a_reclaimed_job(queue):
+    @queue.handler('report')
+    def report(payload, context):
+        return {}
+
+    job_id = queue.enqueue('report')
+    stale = queue._claim_next()
+    queue._running[job_id] = stale
+    queue._requeue_running()
+    queue._running.clear()
+
+    current = queue._claim_next()
+    # 退还次数后两次领取的 attempts 相同，只能靠租约区分
+    assert current['attempts'] == stale['attempts'] == 1
+    assert current['lease_id'] != stale['lease_id']
+
+    queue._finish_succeeded(stale, {'from': 'stale'})
+    assert queue.get_job(job_id)['status'] == STATUS_RUNNING
+
+    queue._finish_succeeded(current, {'from': 'current'})
+    job = queue.get_job(job_id, include_result=True)
+    assert (job['status'], job['result']) == (STATUS_SUCCEEDED, {'from': 'current'})
+
+
+def test_stale_running_jobs_are_recovered(queue, monkeypatch):
+    @queue.handler('crashed', max_attempts=2)
+    def crashed(payload, context):
+        return {}
+
+    retryable = queue.enqueue('crashed')
+    exhausted = queue.enqueue('crashed', max_attempts=1)
+    queue._claim_next()
+    queue._claim_next()
+
+    # 心跳超时视为所在进程已退出
+    monkeypatch.setattr(job_queue, 'STALE_SECONDS', -1)
+    queue._recover_stale_jobs()
+
+    job = queue.get_job(retryable)
+    assert (job['status'], job['attempts'], job['error']) == (STATUS_QUEUED, 1, '执行进程已退出，任务重新入队')
+    job = queue.get_job(exhausted)
+    assert (job['status'], job['error']) == (STATUS_FAILED, '执行进程已退出，重试次数已用完')
+
+
+def test_only_queued_jobs_can_be_cancelled(queue):
+    @queue.handler('noop')
+    def noop(payload, context):
+        return {}
+
+    queued = queue.enqueue('noop')
+    running = queue.enqueue('noop')
+
+    assert queue.cancel(queued) is True
+    assert queue._claim_next()['id'] == running
+    assert queue.cancel(running) is False
+    assert queue.get_job(running)['status'] == STATUS_RUNNING
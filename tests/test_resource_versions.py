@@ -0,0 +1,83 @@
+"""resource_versions：读接口的ETag和条件请求"""
+
+import sqlite3
+
+import pytest
+from flask import Flask, jsonify, request
+
+# 需要部署时提供的 config.py
+pytest.importorskip('config')
+
+import resource_versions as rv
+from resource_versions import ResourceVersions
+
+
+@pytest.fixture
+def versions(tmp_path, monkeypatch):
+    monkeypatch.setitem(rv.api_config.database, 'sqlite_path', str(tmp_path / 'crm.db'))
+    return ResourceVersions(enabled=True)
+
+
+@pytest.fixture
+def client(versions):
+    app = Flask(__name__)
+
+    # 与应用中的视图一样只区分 GET 和 POST
+    @app.route('/api/customers', methods=['GET', 'POST'])
+    @versions.etag('customers')
+    def customers():
+        if request.method == 'GET':
+            return jsonify({'customers': [{'id': 1, 'name': '张三'}]})
+        elif request.method == 'POST':
+            return jsonify({'success': True}), 201
+
+    return app.test_client()
+
+
+def bump(key):
+    conn = sqlite3.connect(rv.api_config.database['sqlite_path'])
+    conn.execute('UPDATE resource_versions SET version = version + 1 WHERE key = ?', (key,))
+    conn.execute('INSERT OR IGNORE INTO resource_versions (key, version) VALUES (?, 1)', (key,))
+    conn.commit()
+    conn.close()
+
+
+def test_matching_etag_returns_304_until_the_version_changes(versions, client):
+    response = client.get('/api/customers')
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+    assert etag.startswith('W/')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    cached = client.get('/api/customers', headers={'If-None-Match': etag})
+    assert (cached.status_code, cached.data, cached.headers['ETag']) == (304, b'', etag)
+
+    bump('customers')
+    changed = client.get('/api/customers', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_head_is_served_like_get_without_a_body(client):
+    get = client.get('/api/customers')
+    head = client.head('/api/customers')
+
+    assert (head.status_code, head.data) == (200, b'')
+    assert head.headers['ETag'] == get.headers['ETag']
+    assert head.headers['Content-Length'] == get.headers['Content-Length']
+
+    cached = client.head('/api/customers', headers={'If-None-Match': get.headers['ETag']})
+    assert cached.status_code == 304
+
+
+def test_head_without_etags(versions, client):
+    versions.enabled = False
+    head = client.head('/api/customers')
+    assert (head.status_code, head.data) == (200, b'')
+    assert 'ETag' not in head.headers
+
+
+def test_other_methods_bypass_etags(client):
+    response = client.post('/api/customers')
+    assert response.status_code == 201
+    assert 'ETag' not in response.headers
@@ -0,0 +1,146 @@
+"""structured_output：AI输出的本地修复、结构校验和重新请求"""
+
+import json
+import sys
+import types
+
+import pytest
+
+from structured_output import StructuredOutput, StructuredOutputError, parse_json
+
+
+def test_clean_json_is_not_marked_repaired():
+    data, repaired = parse_json('{"name": "张三", "phone": null}', 'business_card')
+    assert data == {'name': '张三', 'phone': None}
+    assert repaired is False
+
+
+def test_code_fence_and_surrounding_text_are_stripped():
+    text = '好的，解析结果如下：\n```json\n{"name": "张三", "company": "ACME"}\n```\n如有问题请告诉我。'
+    data, repaired = parse_json(text, 'business_card')
+    assert data == {'name': '张三', 'company': 'ACME'}
+    assert repaired is True
+
+
+def test_first_object_is_extracted_with_braces_inside_strings():
+    data, repaired = parse_json('结果: {"name": "a}b", "company": "{x}"} 其他说明 {"name": "c"}')
+    assert data == {'name': 'a}b', 'company': '{x}'}
+    assert repaired is True
+
+
+def test_trailing_commas_are_removed():
+    data, _ = parse_json('{"cards": [{"index": 0, "name": "a",}, {"index": 1,},],}', 'business_cards')
+    assert data == {'cards': [{'index': 0, 'name': 'a'}, {'index': 1}]}
+
+
+def test_bare_newline_inside_string_is_escaped():
+    data, repaired = parse_json('{"address": "北京市\n海淀区"} ')
+    assert data == {'address': '北京市\n海淀区'}
+    assert repaired is True
+
+
+@pytest.mark.parametrize('text, expected', [
+    # 截断在字符串中间：补全引号和括号
+    ('{"cards": [{"index": 0, "name": "张', {'cards': [{'index': 0, 'name': '张'}]}),
+    # 截断在冒号后：值补为 null
+    ('{"cards": [{"index": 0, "name":', {'cards': [{'index': 0, 'name': None}]}),
+    # 截断在键名处：丢弃不完整的键
+    ('{"cards": [{"index": 0, "na', {'cards': [{'index': 0}]}),
+    # 截断在逗号后
+    ('{"cards": [{"index": 0}, ', {'cards': [{'index': 0}]}),
+    # 截断在转义符处
+    ('{"cards": [{"index": 0, "name": "a\\', {'cards': [{'index': 0, 'name': 'a'}]}),
+])
+def test_truncated_output_is_closed(text, expected):
+    data, repaired = parse_json(text, 'business_cards')
+    assert data == expected
+    assert repaired is True
+
+
+def test_loose_types_are_coerced():
+    text = json.dumps({'profile_analysis': '稳定', 'next_contact_suggestion': '下周回访',
+                       'sales_opportunity': '续约', 'success_probability': '60%'})
+    data, _ = parse_json(text, 'customer_analysis')
+    assert data['success_probability'] == pytest.approx(0.6)
+
+    data, _ = parse_json('{"cards": [{"index": "2", "phone": 13800000000}]}', 'business_cards')
+    assert data['cards'] == [{'index': 2, 'phone': '13800000000'}]
+
+
+def test_schema_errors_are_reported():
+    with pytest.raises(StructuredOutputError) as exc_info:
+        parse_json('{"profile_analysis": "x", "success_probability": -1}', 'customer_analysis')
+    errors = exc_info.value.errors
+    assert '$.next_contact_suggestion: 缺少必填字段' in errors
+    assert '$.sales_opportunity: 缺少必填字段' in errors
+    assert '$.success_probability: 不能小于 0' in errors
+
+
+@pytest.mark.parametrize('text', ['', '   ', '抱歉，我无法识别这张名片。'])
+def test_output_without_json_is_rejected(text):
+    with pytest.raises(StructuredOutputError):
+        parse_json(text, 'business_card')
+
+
+class FakeAIService:
+    """按顺序返回预设输出，记录每次发送的对话"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.conversations = []
+
+    def get_default_model(self):
+        return 'fake'
+
+    def call_ai_model(self, model_name, messages, **kwargs):
+        assert kwargs['json_mode'] is True
+        self.conversations.append(messages)
+        return self.replies.pop(0)
+
+
+@pytest.fixture
+def fake_ai(monkeypatch):
+    def install(*replies):
+        service = FakeAIService(replies)
+        monkeypatch.setitem(sys.modules, 'ai_service_manager', types.SimpleNamespace(ai_service=service))
+        return service
+    return install
+
+
+def test_generate_reprompts_with_errors_after_local_repair_fails(fake_ai):
+    service = fake_ai({'success': True, 'message': '无法解析'},
+                      {'success': True, 'message': '{"cards": []}'})
+    output = StructuredOutput()
+    messages = [{'role': 'user', 'content': '解析名片'}]
+
+    result = output.generate('business_cards', messages)
+
+    assert result['success'] is True
+    assert result['data'] == {'cards': []}
+    assert result['reprompts'] == 1
+    retry = service.conversations[1]
+    assert retry[:2] == messages + [{'role': 'assistant', 'content': '无法解析'}]
+    assert '输出中没有JSON对象' in retry[2]['content']
+    assert output.stats() == {'business_cards': {'clean': 0, 'repaired': 0, 'reprompted': 1, 'failed': 0}}
+
+
+def test_generate_gives_up_after_max_reprompts(fake_ai):
+    fake_ai({'success': True, 'message': '{}'}, {'success': True, 'message': '{"cards": "x"}'})
+    output = StructuredOutput()
+
+    result = output.generate('business_cards', [{'role': 'user', 'content': 'x'}], max_reprompts=1)
+
+    assert result['success'] is False
+    assert result['raw'] == '{"cards": "x"}'
+    assert '$.cards: 应为 array' in result['error']
+    assert output.stats()['business_cards']['failed'] == 1
+
+
+def test_generate_returns_ai_errors_without_reprompting(fake_ai):
+    service = fake_ai({'success': False, 'error': '限流'})
+
+    result = StructuredOutput().generate('business_card', [{'role': 'user', 'content': 'x'}])
+
+    assert result == {'success': False, 'data': None, 'raw': '', 'repaired': False,
+                      'reprompts': 0, 'error': '限流'}
+    assert len(service.conversations) == 1